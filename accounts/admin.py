@@ -1,6 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, PCMember, PCTransaction
+from django.http import StreamingHttpResponse
+
+from . import pc_ledger, statements
+from .models import User, PCMember, PCTransaction, PCTransactionLine, PCCommissionRate, PCLedgerEntry
 
 @admin.register(User)
 class UserAdmin(BaseUserAdmin):
@@ -27,10 +30,11 @@ class UserAdmin(BaseUserAdmin):
 class PCMemberAdmin(admin.ModelAdmin):
     """Admin for PC Members"""
     
-    list_display = ['pc_code', 'name', 'member_type', 'commission_percentage', 'total_commission_earned', 'total_referrals', 'is_active']
+    list_display = ['pc_code', 'name', 'member_type', 'commission_percentage', 'total_commission_earned', 'due_amount', 'total_referrals', 'is_active']
     list_filter = ['member_type', 'is_active', 'created_at']
     search_fields = ['pc_code', 'name', 'phone', 'email']
-    readonly_fields = ['pc_code', 'total_commission_earned', 'total_referrals', 'created_at', 'updated_at']
+    readonly_fields = ['pc_code', 'total_commission_earned', 'due_amount', 'total_referrals', 'created_at', 'updated_at']
+    actions = ['settle_dues', 'download_statements']
     
     fieldsets = (
         ('Member Information', {
@@ -40,7 +44,7 @@ class PCMemberAdmin(admin.ModelAdmin):
             'fields': ('commission_percentage',)
         }),
         ('Statistics', {
-            'fields': ('total_commission_earned', 'total_referrals')
+            'fields': ('total_commission_earned', 'due_amount', 'total_referrals')
         }),
         ('Status', {
             'fields': ('is_active', 'notes')
@@ -55,6 +59,35 @@ class PCMemberAdmin(admin.ModelAdmin):
         if not change:  # If creating new
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
+    
+    def settle_dues(self, request, queryset):
+        settled = pc_ledger.settle(queryset.values_list('pk', flat=True), paid_by=request.user)
+        self.message_user(
+            request,
+            f"৳{settled['amount']:.2f} paid to {settled['members']} member(s) "
+            f"({settled['transactions']} transactions marked as paid)."
+        )
+    settle_dues.short_description = 'Pay all dues of selected members'
+    
+    def download_statements(self, request, queryset):
+        period = statements.last_month()
+        response = StreamingHttpResponse(
+            statements.stream_zip(period, 'html', queryset.values_list('pk', flat=True)),
+            content_type='application/zip',
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="pc-statements-{period.year}-{period.month:02d}.zip"'
+        )
+        return response
+    download_statements.short_description = "Download last month's statements of selected members"
+
+
+class PCTransactionLineInline(admin.TabularInline):
+    model = PCTransactionLine
+    extra = 0
+    can_delete = False
+    fields = ['lab_test', 'test_type', 'amount', 'commission_percentage', 'commission_amount']
+    readonly_fields = fields
 
 
 @admin.register(PCTransaction)
@@ -64,21 +97,23 @@ class PCTransactionAdmin(admin.ModelAdmin):
     list_display = ['transaction_number', 'pc_member', 'transaction_date', 'total_amount', 'commission_amount', 'admin_amount', 'is_paid_to_member']
     list_filter = ['transaction_date', 'is_paid_to_member', 'pc_member__member_type']
     search_fields = ['transaction_number', 'pc_member__pc_code', 'pc_member__name']
-    readonly_fields = ['transaction_number', 'commission_amount', 'admin_amount', 'transaction_date']
+    readonly_fields = ['transaction_number', 'commission_amount', 'admin_amount', 'transaction_date',
+                       'is_paid_to_member', 'paid_at', 'payout']
     date_hierarchy = 'transaction_date'
+    inlines = [PCTransactionLineInline]
     
     fieldsets = (
         ('Transaction Information', {
             'fields': ('transaction_number', 'pc_member', 'transaction_date')
         }),
         ('Patient/Appointment', {
-            'fields': ('patient', 'appointment')
+            'fields': ('patient', 'appointment', 'lab_order')
         }),
         ('Amounts', {
             'fields': ('total_amount', 'commission_percentage', 'commission_amount', 'admin_amount')
         }),
         ('Payment Status', {
-            'fields': ('is_paid_to_member', 'paid_at')
+            'fields': ('is_paid_to_member', 'paid_at', 'payout')
         }),
         ('Metadata', {
             'fields': ('recorded_by', 'notes'),
@@ -86,8 +121,59 @@ class PCTransactionAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_readonly_fields(self, request, obj=None):
+        # A bill's commission is owed to the member it was accrued to
+        if obj is not None:
+            return self.readonly_fields + ['pc_member']
+        return self.readonly_fields
+    
     def save_model(self, request, obj, form, change):
+        previous = None
         if not change:  # If creating new
             obj.recorded_by = request.user
+        elif {'total_amount', 'commission_percentage'} & set(form.changed_data):
+            # Recomputed from the new figures on save, the difference
+            # recorded in the member's ledger
+            previous = PCTransaction.objects.values_list('commission_amount', flat=True).get(pk=obj.pk)
+            obj.commission_amount = obj.admin_amount = None
         super().save_model(request, obj, form, change)
+        if previous is not None:
+            pc_ledger.adjust(obj, previous, created_by=request.user)
+    
+    def delete_model(self, request, obj):
+        pc_ledger.cancel(PCTransaction.objects.filter(pk=obj.pk), created_by=request.user)
+    
+    def delete_queryset(self, request, queryset):
+        pc_ledger.cancel(queryset, created_by=request.user)
+
+
+@admin.register(PCLedgerEntry)
+class PCLedgerEntryAdmin(admin.ModelAdmin):
+    """Read-only view of the commission ledger"""
+    list_display = ['pc_member', 'kind', 'amount', 'pc_transaction', 'note', 'created_by', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['pc_member__pc_code', 'pc_member__name', 'pc_transaction__transaction_number', 'note']
+    list_select_related = ['pc_member', 'pc_transaction', 'created_by']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(PCCommissionRate)
+class PCCommissionRateAdmin(admin.ModelAdmin):
+    """Admin for the (member type x test type) commission rates"""
+    
+    list_display = ['member_type', 'test_type', 'commission_percentage']
+    list_filter = ['member_type', 'test_type']
+    search_fields = ['member_type', 'test_type']
+    
+    def has_delete_permission(self, request, obj=None):
+        """Rates are updated, not deleted"""
+        return False
 
@@ -0,0 +1,29 @@
+"""
+Deployment checks (``manage.py check --deploy``)
+"""
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+# Backends whose entries live in one process only
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """The default cache must be shared by the workers
+
+    It holds the versions that invalidate the cached dashboards and public
+    directory pages, and the lab worklist counters; with a per-process cache
+    a write only reaches the worker that made it.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [Warning(
+        f'The default cache ({backend}) is not shared between worker processes.',
+        hint='Set REDIS_URL so every worker uses the same Redis cache (see CACHES in the settings).',
+        id='accounts.W001',
+    )]
@@ -1,36 +1,168 @@
-from django.db import models
-from django.contrib import admin
-
-class PCCommissionRate(models.Model):
-    MEMBER_TYPE_CHOICES = [
-        ('GENERAL', 'General Member'),
-        ('LIFETIME', 'Lifetime Member'),
-        ('INVESTOR', 'Investor Member'),
-    ]
-    
-    TEST_TYPE_CHOICES = [
-        ('NORMAL', 'Normal Test'),
-        ('DIGITAL', 'Digital Test'),
-    ]
-    
-    member_type = models.CharField(max_length=20, choices=MEMBER_TYPE_CHOICES)
-    test_type = models.CharField(max_length=20, choices=TEST_TYPE_CHOICES)
-    commission_percentage = models.DecimalField(
-        max_digits=5,
-        decimal_places=2,
-        help_text="Commission percentage (e.g., 30 for 30%)"
-    )
-    
-    class Meta:
-        unique_together = ['member_type', 'test_type']
-        verbose_name = "PC Commission Rate"
-        verbose_name_plural = "PC Commission Rates"
-    
-    def __str__(self):
-        return f"{self.get_member_type_display()} - {self.get_test_type_display()}: {self.commission_percentage}%"
-
-@admin.register(PCCommissionRate)
-class PCCommissionRateAdmin(admin.ModelAdmin):
-    list_display = ['member_type', 'test_type', 'commission_percentage']
-    list_filter = ['member_type', 'test_type']
-    search_fields = ['member_type', 'test_type']
\ No newline at end of file
+"""
+PC commission
+
+What a referring PC member earns on a bill is computed here and only here:
+
+- rates come from the (member type x test type) matrix of
+  ``PCCommissionRate`` rows, kept per process and re-read when the rows'
+  version - their count and latest ``updated_at``, one aggregate every
+  process sees alike - changes; a pair without a row falls back to the
+  member's own
+  ``normal_test_commission`` / ``digital_test_commission``
+- ``split(member, tests, charged)`` spreads the charged amount (after any
+  discount) over the tests by price and takes each test's commission in
+  ``Decimal``, rounded to the paisa; rounding leftovers go to the last test's
+  share and to the admin
+- ``record(member, split, ...)`` saves the bill's ``PCTransaction`` and its
+  per-test ``PCTransactionLine`` rows with one ``bulk_create``; a lab order
+  earns its commission once, a second ``record`` for it raises
+  ``CommissionError``
+
+Billing an order runs the same handful of queries whatever its number of
+tests. Services without tests use ``split_amount(charged, rate)``.
+"""
+import threading
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from . import dashboard_cache
+from lab.models import LabOrder
+
+from .models import PCCommissionRate, PCTransaction, PCTransactionLine
+
+CENT = Decimal('0.01')
+HUNDRED = Decimal('100')
+
+# ``rate`` is the percentage the whole bill works out to
+Split = namedtuple('Split', 'charged commission admin rate lines')
+Line = namedtuple('Line', 'test test_type amount rate commission')
+
+
+class CommissionError(ValueError):
+    """The commission can't be recorded"""
+
+
+def money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+class RateMatrix:
+    """{(member_type, test_type): percentage} of the saved rates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rates = None
+        self._version = None
+
+    def get(self):
+        # From the database, not a cache - a rate saved by another worker
+        # must change it here too
+        version = PCCommissionRate.objects.aggregate(count=Count('id'), modified=Max('updated_at'))
+        with self._lock:
+            if self._rates is None or version != self._version:
+                self._rates = {
+                    (member_type, test_type): percentage
+                    for member_type, test_type, percentage in PCCommissionRate.objects.values_list(
+                        'member_type', 'test_type', 'commission_percentage'
+                    )
+                }
+                self._version = version
+            return self._rates
+
+    def clear(self):
+        with self._lock:
+            self._rates = None
+
+
+matrix = RateMatrix()
+
+
+def rates_changed():
+    """Drop this process's matrix - the others see the new version"""
+    matrix.clear()
+
+
+def test_rate(member, test_type, rates=None):
+    """Commission percentage of ``member`` on a test of ``test_type``"""
+    rates = matrix.get() if rates is None else rates
+    rate = rates.get((member.member_type, test_type))
+    if rate is None:
+        rate = member.digital_test_commission if test_type == 'DIGITAL' else member.normal_test_commission
+    return Decimal(rate)
+
+
+def split_amount(charged, rate):
+    """A plain ``rate`` percent of ``charged`` - for services without tests"""
+    charged = money(charged)
+    commission = money(charged * Decimal(rate) / HUNDRED)
+    return Split(charged, commission, charged - commission, money(rate), [])
+
+
+def split(member, tests, charged=None):
+    """Commission of ``member`` on a bill of ``tests`` (``LabTest``s)
+
+    ``charged`` is what the patient paid for them, the sum of the prices
+    when not given.
+    """
+    tests = list(tests)
+    prices = [Decimal(test.price) for test in tests]
+    listed = sum(prices, Decimal('0'))
+    charged = listed if charged is None else money(charged)
+    rates = matrix.get()
+
+    lines = []
+    allotted = Decimal('0')
+    for index, (test, price) in enumerate(zip(tests, prices)):
+        if index == len(tests) - 1:
+            amount = charged - allotted
+        else:
+            amount = money(charged * price / listed) if listed else Decimal('0')
+        allotted += amount
+        rate = test_rate(member, test.test_type, rates)
+        lines.append(Line(test, test.test_type, amount, rate, money(amount * rate / HUNDRED)))
+
+    commission = sum((line.commission for line in lines), Decimal('0'))
+    rate = money(commission * HUNDRED / charged) if charged else Decimal('0')
+    return Split(charged, commission, charged - commission, rate, lines)
+
+
+def record(member, split, recorded_by=None, patient=None, lab_order=None, appointment=None, notes=''):
+    """Save a split as the member's ``PCTransaction`` with its lines; returns it
+
+    Raises ``CommissionError`` when ``lab_order`` already has a commission.
+    """
+    with transaction.atomic():
+        if lab_order is not None:
+            # The order's row is locked so two bills of it can't both pass the check
+            list(LabOrder.objects.select_for_update().filter(pk=lab_order.pk).values_list('pk'))
+            if PCTransaction.objects.filter(lab_order=lab_order).exists():
+                raise CommissionError(f'Commission for lab order {lab_order.order_number} was already recorded')
+        pc_transaction = PCTransaction.objects.create(
+            pc_member=member,
+            patient=patient,
+            appointment=appointment,
+            lab_order=lab_order,
+            total_amount=split.charged,
+            commission_percentage=split.rate,
+            commission_amount=split.commission,
+            admin_amount=split.admin,
+            recorded_by=recorded_by,
+            notes=notes,
+        )
+        PCTransactionLine.objects.bulk_create([
+            PCTransactionLine(
+                transaction=pc_transaction,
+                lab_test=line.test,
+                test_type=line.test_type,
+                amount=line.amount,
+                commission_percentage=line.rate,
+                commission_amount=line.commission,
+            )
+            for line in split.lines
+        ])
+        # The lines are bulk-created and the balances moved with F() - no post_save
+        dashboard_cache.invalidate_on_commit('accounts.PCTransaction', 'accounts.PCMember')
+    return pc_transaction
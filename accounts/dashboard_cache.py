@@ -0,0 +1,101 @@
+"""
+Cached role dashboard contexts
+
+Each role dashboard depends on a handful of models (its tags). Every tag has
+a version token in the cache; a dashboard's context is cached under a key
+built from the versions of its tags, so saving or deleting any tagged model
+(``accounts.signals``) moves the dashboards that read it to a new key while
+the others keep being served from cache.
+
+The versions must live in a cache every worker shares (Redis in production,
+see ``CACHES``) - a per-process cache only invalidates the worker that made
+the write. Writes that send no ``post_save`` (bulk creates, ``F()`` updates)
+call ``invalidate_on_commit`` themselves.
+
+Contexts are pickled by the cache backend, which evaluates their querysets
+once when the context is stored. ``DASHBOARD_CACHE_TIMEOUT`` bounds how long
+a context lives for figures that change without a write (e.g. "last 7 days").
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Dashboard -> models (``app_label.ModelName``) whose writes invalidate it
+DASHBOARD_DEPENDENCIES = {
+    'receptionist': (
+        'appointments.Appointment', 'appointments.Prescription', 'finance.Income',
+        'lab.LabOrder', 'patients.Patient', 'pharmacy.PharmacySale', 'survey.FeedbackSurvey',
+    ),
+    'pharmacy': (
+        'appointments.Prescription', 'pharmacy.Drug', 'pharmacy.PharmacySale', 'pharmacy.SaleItem',
+        'pharmacy.DrugForecast', 'pharmacy.PurchaseInvoice', 'pharmacy.StockAdjustment',
+    ),
+    'canteen': (
+        'survey.CanteenItem', 'survey.CanteenSale', 'survey.FeedbackSurvey',
+    ),
+    'lab_assistant': (
+        'appointments.Appointment', 'lab.LabBill', 'lab.LabTest',
+    ),
+    'pc': (
+        'accounts.PCMember', 'accounts.PCTransaction',
+    ),
+}
+
+TAG_PREFIX = 'dashboard_tag'
+CONTEXT_PREFIX = 'dashboard_context'
+
+
+def tagged_models():
+    """All model labels some dashboard depends on"""
+    return sorted({label for labels in DASHBOARD_DEPENDENCIES.values() for label in labels})
+
+
+def tag_key(label):
+    return f'{TAG_PREFIX}:{label.lower()}'
+
+
+def invalidate(*labels):
+    """Give the tags a new version - dashboards reading them rebuild next view"""
+    cache.set_many({tag_key(label): uuid.uuid4().hex for label in labels}, None)
+
+
+def invalidate_on_commit(*labels):
+    """``invalidate`` once the current transaction commits"""
+    transaction.on_commit(lambda: invalidate(*labels))
+
+
+def tag_versions(labels):
+    """Current version token of each tag, creating missing ones"""
+    keys = [tag_key(label) for label in labels]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        # Another process may have added the tag first
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, '') for key in keys]
+
+
+def context_key(dashboard, variant, today):
+    versions = tag_versions(DASHBOARD_DEPENDENCIES[dashboard])
+    digest = hashlib.md5('|'.join(versions).encode('utf-8')).hexdigest()
+    return f'{CONTEXT_PREFIX}:{dashboard}:{variant}:{today:%Y%m%d}:{digest}'
+
+
+def get_context(dashboard, build, variant, today):
+    """Cached ``build()`` result for a dashboard
+
+    ``variant`` separates contexts that differ per viewer - the user's role,
+    or the user when the dashboard shows their own figures.
+    """
+    key = context_key(dashboard, variant, today)
+    context = cache.get(key)
+    if context is None:
+        context = build()
+        cache.set(key, context, settings.DASHBOARD_CACHE_TIMEOUT)
+    return context
@@ -0,0 +1,144 @@
+"""
+Admin dashboard metrics
+
+Every figure on the admin dashboard comes from one conditional-aggregation
+query per model (``Sum(..., filter=Q(...))``/``Count(..., filter=Q(...))``)
+instead of one query per number. The result is cached per period for a
+period-dependent time and served both to the page and to the JSON endpoint
+the page uses to refresh itself.
+"""
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from appointments.models import Appointment
+from finance.models import FinanceDailyRollup, Investor
+from lab.models import LabOrder
+from patients.models import Patient
+from pharmacy.models import Drug, PharmacySale
+from survey.models import CanteenSale
+
+
+PERIODS = ('today', 'week', 'month', 'year')
+
+# Seconds a period's metrics may be served from cache - short periods change
+# fastest and are looked at most
+CACHE_TIMEOUTS = {
+    'today': 60,
+    'week': 300,
+    'month': 600,
+    'year': 1800,
+}
+
+CACHE_PREFIX = 'admin_dashboard_metrics'
+
+INCOME_SOURCES = {
+    'appointment_income': 'CONSULTATION',
+    'lab_income': 'LAB_TEST',
+    'pharmacy_income': 'PHARMACY',
+    'canteen_income': 'CANTEEN',
+}
+
+
+def period_range(period, today):
+    """(start_date, end_date) of a dashboard period; unknown periods mean today"""
+    if period == 'week':
+        start_date = today - timedelta(days=today.weekday())
+        return start_date, start_date + timedelta(days=6)
+    if period == 'month':
+        start_date = today.replace(day=1)
+        next_month = (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return start_date, next_month - timedelta(days=1)
+    if period == 'year':
+        return today.replace(month=1, day=1), today.replace(month=12, day=31)
+    return today, today
+
+
+def money(field, condition=None):
+    return Coalesce(
+        Sum(field, filter=condition), Value(0),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    )
+
+
+def compute(start_date, end_date):
+    """All dashboard metrics for the date range - one query per model"""
+    date_range = [start_date, end_date]
+    User = get_user_model()
+
+    income, expense = Q(kind=FinanceDailyRollup.KIND_INCOME), Q(kind=FinanceDailyRollup.KIND_EXPENSE)
+    finance = FinanceDailyRollup.objects.filter(date__range=date_range).aggregate(
+        total_income=money('amount', income),
+        total_expenses=money('amount', expense),
+        **{name: money('amount', income & Q(source=source)) for name, source in INCOME_SOURCES.items()}
+    )
+
+    patients = Patient.objects.aggregate(
+        total_patients=Count('id'),
+        new_patients_period=Count('id', filter=Q(registered_at__date__range=date_range)),
+    )
+
+    appointments = Appointment.objects.filter(appointment_date__range=date_range).aggregate(
+        period_appointments=Count('id'),
+        completed_appointments=Count('id', filter=Q(status='completed')),
+    )
+
+    staff = User.objects.filter(is_active=True).aggregate(
+        total_staff=Count('id'),
+        doctors_count=Count('id', filter=Q(role='DOCTOR')),
+        nurses_count=Count('id', filter=Q(role='NURSE')),
+    )
+
+    lab = LabOrder.objects.aggregate(
+        lab_orders=Count('id', filter=Q(ordered_at__date__range=date_range)),
+        pending_lab_orders=Count('id', filter=Q(status='pending')),
+        outstanding_lab_payments=money('total_amount', Q(is_paid=False)),
+    )
+
+    pharmacy = PharmacySale.objects.aggregate(
+        pharmacy_sales=Count('id', filter=Q(sale_date__date__range=date_range)),
+        outstanding_pharmacy_payments=money('total_amount', Q(amount_paid__lt=F('total_amount'))),
+    )
+
+    canteen = CanteenSale.objects.filter(sale_date__date__range=date_range).aggregate(
+        canteen_orders=Count('id'),
+    )
+
+    drugs = Drug.objects.aggregate(
+        low_stock_count=Count('id', filter=Q(quantity_in_stock__lte=F('reorder_level'))),
+    )
+
+    investors = Investor.objects.aggregate(
+        total_investment=money('investment_amount'),
+        active_investors=Count('id', filter=Q(is_active=True)),
+    )
+
+    return {
+        **finance, **patients, **appointments, **staff, **lab,
+        **pharmacy, **canteen, **drugs, **investors,
+    }
+
+
+def cache_key(period, start_date, end_date):
+    return f'{CACHE_PREFIX}:{period}:{start_date:%Y%m%d}:{end_date:%Y%m%d}'
+
+
+def get_metrics(period, today):
+    """Cached metrics for a dashboard period
+
+    Returns (period, start_date, end_date, metrics); unknown periods fall
+    back to today.
+    """
+    if period not in PERIODS:
+        period = 'today'
+    start_date, end_date = period_range(period, today)
+    key = cache_key(period, start_date, end_date)
+
+    metrics = cache.get(key)
+    if metrics is None:
+        metrics = compute(start_date, end_date)
+        cache.set(key, metrics, CACHE_TIMEOUTS.get(period, CACHE_TIMEOUTS['today']))
+    return period, start_date, end_date, metrics
@@ -0,0 +1,115 @@
+"""
+Load test of the public PC member directory pages
+
+Run: python manage.py benchmark_public_directory --requests 5000
+     python manage.py benchmark_public_directory --page lifetime
+
+Calls Django's WSGI application (middleware included) in this one process,
+one request after another, so the rate is what a single worker sustains
+without the web server's own overhead:
+
+- uncached: the page cache is invalidated before every request, as the view
+  rendered before caching (a twentieth of ``--requests``, it's slow)
+- cached: plain GETs served from the page cache
+- 304: GETs revalidating with ``If-None-Match``
+
+Members are whatever the database holds; ``--members`` adds throwaway ones
+first (rolled back afterwards).
+"""
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts import public_directory
+from accounts.models import PCMember
+
+PAGES = {
+    'general': ('GENERAL', 'accounts:public_general_members'),
+    'lifetime': ('LIFETIME', 'accounts:public_lifetime_members'),
+    'investor': ('PREMIUM', 'accounts:public_investor_members'),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure requests/s of the public PC member pages on one worker'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--page', choices=sorted(PAGES), default='general')
+        parser.add_argument('--members', type=int, default=0, help='Throwaway members to add first')
+
+    def handle(self, *args, **options):
+        member_type, url_name = PAGES[options['page']]
+        # As the test client does - the connection holds the transaction that
+        # is rolled back and mustn't be closed around each request
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            with transaction.atomic():
+                PCMember.objects.bulk_create([
+                    PCMember(pc_code=f'B{index:05d}', name=f'Benchmark Member {index}', phone='0', member_type=member_type)
+                    for index in range(options['members'])
+                ])
+                self.run(reverse(url_name), member_type, options['requests'])
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+
+    @staticmethod
+    def get(application, url, **headers):
+        """(status code, headers, body) of a GET through the WSGI application"""
+        environ = {'PATH_INFO': url, **headers}
+        setup_testing_defaults(environ)
+        started = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            started['status'] = int(status.split()[0])
+            started['headers'] = dict(response_headers)
+
+        result = application(environ, start_response)
+        try:
+            body = b''.join(result)
+        finally:
+            result.close()
+        return started['status'], started['headers'], body
+
+    def run(self, url, member_type, count):
+        application = WSGIHandler()
+        _, headers, body = self.get(application, url)
+        self.stdout.write(f'{url}: {len(body)} bytes, ETag {headers["ETag"]}\n')
+        self.stdout.write(f'{"mode":>10}  {"req/s":>10}  {"ms/req":>8}  {"queries/req":>11}')
+
+        def uncached():
+            public_directory.invalidate(member_type)
+            return self.get(application, url)
+
+        modes = [
+            ('uncached', uncached, 200, max(count // 20, 1)),
+            ('cached', lambda: self.get(application, url), 200, count),
+            ('304', lambda: self.get(application, url, HTTP_IF_NONE_MATCH=etag), 304, count),
+        ]
+        for name, request, status, count in modes:
+            etag = self.get(application, url)[1]['ETag']
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                for _ in range(count):
+                    response = request()
+                elapsed = time.perf_counter() - started
+            if response[0] != status:
+                self.stderr.write(f'{name}: expected {status}, got {response[0]}')
+            self.stdout.write(
+                f'{name:>10}  {count / elapsed:10.0f}  {elapsed * 1000 / count:8.3f}  {len(queries) / count:11.1f}'
+            )
@@ -0,0 +1,96 @@
+"""
+Concurrency benchmark for the document number allocator
+
+Run: python manage.py benchmark_sequences --writers 50 --per-writer 40
+
+Each writer thread opens its own database connection and allocates numbers
+from a throw-away prefix. The report shows collisions (must be zero), gaps and
+latency percentiles, plus the first/last 10% of allocations so a growing
+table shows up as a latency drift.
+"""
+import statistics
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.models import DocumentSequence
+from accounts.sequences import next_value
+
+
+class Command(BaseCommand):
+    help = 'Benchmark document number allocation with parallel writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=50)
+        parser.add_argument('--per-writer', type=int, default=40)
+        parser.add_argument('--key', default='BENCH')
+
+    def handle(self, *args, **options):
+        writers = options['writers']
+        per_writer = options['per_writer']
+        key = options['key']
+
+        DocumentSequence.objects.filter(key=key).delete()
+
+        values = []
+        timings = []
+        errors = []
+        lock = threading.Lock()
+        start_gate = threading.Barrier(writers)
+
+        def writer():
+            local_values, local_timings = [], []
+            try:
+                start_gate.wait()
+                for _ in range(per_writer):
+                    started = time.perf_counter()
+                    local_values.append(next_value(key))
+                    local_timings.append((started, time.perf_counter() - started))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+            with lock:
+                values.extend(local_values)
+                timings.extend(local_timings)
+
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        wall_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - wall_start
+
+        DocumentSequence.objects.filter(key=key).delete()
+
+        collisions = sum(count - 1 for count in Counter(values).values() if count > 1)
+        gaps = (max(values) - len(set(values))) if values else 0
+
+        # Latency in allocation order, so drift over time is visible
+        latencies = [elapsed * 1000 for _, elapsed in sorted(timings)]
+        decile = max(len(latencies) // 10, 1)
+
+        self.stdout.write(f'Writers:        {writers} x {per_writer}')
+        self.stdout.write(f'Allocated:      {len(values)} in {wall_time:.2f}s '
+                          f'({len(values) / wall_time:.0f}/s)')
+        self.stdout.write(f'Errors:         {len(errors)}')
+        self.stdout.write(f'Collisions:     {collisions}')
+        self.stdout.write(f'Gaps:           {gaps}')
+        if latencies:
+            quantiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(f'Latency p50:    {quantiles[49]:.2f} ms')
+            self.stdout.write(f'Latency p95:    {quantiles[94]:.2f} ms')
+            self.stdout.write(f'Latency p99:    {quantiles[98]:.2f} ms')
+            self.stdout.write(f'First 10% mean: {statistics.mean(latencies[:decile]):.2f} ms')
+            self.stdout.write(f'Last 10% mean:  {statistics.mean(latencies[-decile:]):.2f} ms')
+
+        if errors:
+            self.stdout.write(self.style.WARNING(f'First error: {errors[0]!r}'))
+        if collisions:
+            self.stdout.write(self.style.ERROR('Duplicate numbers were handed out!'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No collisions'))
@@ -0,0 +1,54 @@
+"""
+Write the monthly PC member statements
+
+Run: python manage.py pc_statements
+     python manage.py pc_statements --month 2026-09 --format csv --archive
+     python manage.py pc_statements --workers 1
+
+Meant for a cron on the first of the month; writes last month's statements
+by default. See accounts.statements.
+"""
+import time
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import statements
+
+
+class Command(BaseCommand):
+    help = "Generate every PC member's commission statement for a month"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM, last month by default')
+        parser.add_argument('--format', choices=sorted(statements.FORMATS), default='html')
+        parser.add_argument('--output', help='Directory to write to (PC_STATEMENT_DIR/<YYYY-MM> by default)')
+        parser.add_argument('--archive', action='store_true',
+                            help='Zip the statements into one archive instead of loose files')
+        parser.add_argument('--workers', type=int,
+                            help='Processes to spread the members over (CPU count by default)')
+
+    def handle(self, *args, **options):
+        if options['month']:
+            try:
+                first = datetime.strptime(options['month'], '%Y-%m')
+            except ValueError:
+                raise CommandError('--month must be YYYY-MM')
+            period = statements.month_period(first.year, first.month)
+        else:
+            period = statements.last_month()
+
+        started = time.perf_counter()
+        summary = statements.generate(
+            period,
+            fmt=options['format'],
+            directory=options['output'],
+            archive=options['archive'],
+            workers=options['workers'],
+        )
+        self.stdout.write(
+            f"{summary['members']} statement(s), {summary['transactions']} bill(s), "
+            f"৳{summary['commission']} commission - {summary['workers']} worker(s), "
+            f"{time.perf_counter() - started:.1f}s"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Written to {summary['path']}"))
@@ -0,0 +1,39 @@
+"""
+Check PC member balances against the commission ledger
+
+Run: python manage.py verify_pc_ledger
+     python manage.py verify_pc_ledger --check
+
+Meant for a nightly cron. Balances drift from the ledger only when they are
+written around it (raw SQL, QuerySet.update on PCMember) or were already off
+before the ledger existed. By default drifted balances are reset to the
+ledger sums; --check only reports them.
+"""
+from django.core.management.base import BaseCommand
+
+from accounts import pc_ledger
+
+
+class Command(BaseCommand):
+    help = 'Recompute PC member balances from the PCLedgerEntry ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report mismatching members, change nothing')
+
+    def handle(self, *args, **options):
+        mismatches = pc_ledger.verify(fix=not options['check'])
+        for row in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f"{row['pc_code']} {row['name']}: "
+                f"due {row['due_amount']} (ledger {row['ledger_due']}), "
+                f"earned {row['total_commission_earned']} (ledger {row['ledger_earned']}), "
+                f"referrals {row['total_referrals']} (ledger {row['ledger_referrals']})"
+            ))
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('PC balances match the ledger'))
+        elif options['check']:
+            self.stdout.write(self.style.ERROR(f'{len(mismatches)} mismatching member(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Reset {len(mismatches)} member(s) to the ledger'))
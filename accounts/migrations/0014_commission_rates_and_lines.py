@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:33
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_documentsequence'),
+        ('lab', '0003_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pctransaction',
+            name='lab_order',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pc_transactions', to='lab.laborder'),
+        ),
+        migrations.AlterField(
+            model_name='pctransaction',
+            name='admin_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Amount going to admin (remaining after commission)', max_digits=10),
+        ),
+        migrations.AlterField(
+            model_name='pctransaction',
+            name='commission_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Commission amount (percentage of total)', max_digits=10),
+        ),
+        migrations.CreateModel(
+            name='PCCommissionRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_type', models.CharField(choices=[('GENERAL', 'General Member'), ('LIFETIME', 'Lifetime Member'), ('PREMIUM', 'Premium Member')], max_length=20)),
+                ('test_type', models.CharField(choices=[('NORMAL', 'Normal Test'), ('DIGITAL', 'Digital Test')], max_length=20)),
+                ('commission_percentage', models.DecimalField(decimal_places=2, help_text='Commission percentage (e.g., 30 for 30%)', max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+            ],
+            options={
+                'verbose_name': 'PC Commission Rate',
+                'verbose_name_plural': 'PC Commission Rates',
+                'unique_together': {('member_type', 'test_type')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PCTransactionLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_type', models.CharField(max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, help_text="The test's share of the charged total", max_digits=10)),
+                ('commission_percentage', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('commission_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('lab_test', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='lab.labtest')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='accounts.pctransaction')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """An accrual per existing bill and one payout per member for the bills already paid
+
+    Balances that were already off (lost updates) are left for
+    ``manage.py verify_pc_ledger`` to report and reset.
+    """
+    from django.db.models import Count, Max, OuterRef, Subquery, Sum
+
+    PCTransaction = apps.get_model('accounts', 'PCTransaction')
+    PCLedgerEntry = apps.get_model('accounts', 'PCLedgerEntry')
+
+    PCLedgerEntry.objects.bulk_create([
+        PCLedgerEntry(
+            pc_member_id=row['pc_member_id'], kind='ACCRUAL', amount=row['commission_amount'],
+            pc_transaction_id=row['id'], created_by_id=row['recorded_by_id'],
+        )
+        for row in PCTransaction.objects.values('id', 'pc_member_id', 'commission_amount', 'recorded_by_id').iterator()
+    ], batch_size=500)
+
+    paid = PCTransaction.objects.filter(is_paid_to_member=True)
+    for row in paid.values('pc_member_id').annotate(
+        total=Sum('commission_amount'), n=Count('id'), last=Max('paid_at')
+    ).order_by():
+        payout = PCLedgerEntry.objects.create(
+            pc_member_id=row['pc_member_id'], kind='PAYOUT', amount=-row['total'],
+            note=f"{row['n']} commission(s) paid before the ledger",
+        )
+        paid.filter(pc_member_id=row['pc_member_id']).update(payout=payout)
+        if row['last']:
+            PCLedgerEntry.objects.filter(pk=payout.pk).update(created_at=row['last'])
+
+    # auto_now_add stamped the accruals with today
+    PCLedgerEntry.objects.filter(kind='ACCRUAL').update(created_at=Subquery(
+        PCTransaction.objects.filter(pk=OuterRef('pc_transaction_id')).values('transaction_date')
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_commission_rates_and_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PCLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('ACCRUAL', 'Commission Accrued'), ('ADJUSTMENT', 'Commission Adjusted'), ('CANCELLATION', 'Bill Cancelled'), ('PAYOUT', 'Paid to Member')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, help_text='Positive when more becomes due, negative for payouts and cancellations', max_digits=12)),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('pc_member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='accounts.pcmember')),
+                ('pc_transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='accounts.pctransaction')),
+            ],
+            options={
+                'verbose_name': 'PC Ledger Entry',
+                'verbose_name_plural': 'PC Ledger Entries',
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='pctransaction',
+            name='payout',
+            field=models.ForeignKey(blank=True, help_text='Ledger payout that settled this commission', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='settled_transactions', to='accounts.pcledgerentry'),
+        ),
+        migrations.AddIndex(
+            model_name='pcledgerentry',
+            index=models.Index(fields=['pc_member', 'created_at'], name='accounts_pc_pc_memb_deb017_idx'),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
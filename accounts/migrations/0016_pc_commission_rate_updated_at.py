@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_pc_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pccommissionrate',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import models, transaction
 from django.conf import settings
 from decimal import Decimal
 
@@ -145,10 +146,21 @@ class PCMember(models.Model):
             models.Index(fields=['member_type']),
         ]
     
+    # Kept in step with the PCLedgerEntry rows by accounts.pc_ledger
+    BALANCE_FIELDS = ('total_commission_earned', 'due_amount', 'total_referrals')
+    
     def __str__(self):
         return f"{self.pc_code} - {self.name} ({self.get_member_type_display()})"
     
     def save(self, *args, **kwargs):
+        # The balances are moved by accounts.pc_ledger with F() updates; an
+        # edit of a member loaded earlier mustn't write them back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.BALANCE_FIELDS
+            ]
+        
         if not self.pc_code:
             # Generate 6-digit PC code based on member type
             # Format: [Type Digit][5-digit Sequential Number]
@@ -221,6 +233,13 @@ class PCTransaction(models.Model):
         null=True,
         blank=True
     )
+    lab_order = models.ForeignKey(
+        'lab.LabOrder',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='pc_transactions'
+    )
     
     # Transaction details
     transaction_date = models.DateTimeField(auto_now_add=True)
@@ -237,11 +256,13 @@ class PCTransaction(models.Model):
     commission_amount = models.DecimalField(
         max_digits=10,
         decimal_places=2,
+        blank=True,
         help_text="Commission amount (percentage of total)"
     )
     admin_amount = models.DecimalField(
         max_digits=10,
         decimal_places=2,
+        blank=True,
         help_text="Amount going to admin (remaining after commission)"
     )
     
@@ -259,6 +280,14 @@ class PCTransaction(models.Model):
         help_text="Has commission been paid to PC member?"
     )
     paid_at = models.DateTimeField(null=True, blank=True)
+    payout = models.ForeignKey(
+        'PCLedgerEntry',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='settled_transactions',
+        help_text="Ledger payout that settled this commission"
+    )
     
     # Notes
     notes = models.TextField(blank=True)
@@ -276,38 +305,160 @@ class PCTransaction(models.Model):
     def save(self, *args, **kwargs):
         if not self.transaction_number:
             from django.utils import timezone
+            from .sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_txn = PCTransaction.objects.filter(
-                transaction_number__startswith=f'PC{date_str}'
-            ).order_by('transaction_number').last()
-            
-            if last_txn:
-                last_number = int(last_txn.transaction_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.transaction_number = f'PC{date_str}{new_number:04d}'
+            self.transaction_number = next_document_number(
+                PCTransaction, 'transaction_number', f'PC{date_str}'
+            )
         
-        # Calculate commission based on test type
-        if hasattr(self, 'lab_order') and self.lab_order:
-            test_type = self.lab_order.test.test_type
-            if test_type == 'DIGITAL':
-                self.commission_percentage = self.pc_member.digital_test_commission
-            else:  # NORMAL
-                self.commission_percentage = self.pc_member.normal_test_commission
-        
-        # Calculate commission and admin amounts
-        self.commission_amount = (self.total_amount * self.commission_percentage) / 100
-        self.admin_amount = self.total_amount - self.commission_amount
+        # Bills split per test by accounts.commission come with their
+        # amounts; a plain percentage of the total otherwise
+        if self.commission_amount is None:
+            from .commission import split_amount
+            split = split_amount(self.total_amount, self.commission_percentage)
+            self.commission_amount = split.commission
+            self.admin_amount = split.admin
+        elif self.admin_amount is None:
+            self.admin_amount = self.total_amount - self.commission_amount
         
         is_new = self.pk is None
         
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # New commissions accrue to the member's ledger and balance
+            if is_new:
+                from .pc_ledger import accrue
+                accrue(self)
+
+
+class PCTransactionLine(models.Model):
+    """One test of a commissioned lab bill"""
+    
+    transaction = models.ForeignKey(PCTransaction, on_delete=models.CASCADE, related_name='lines')
+    lab_test = models.ForeignKey('lab.LabTest', on_delete=models.SET_NULL, null=True, blank=True)
+    test_type = models.CharField(max_length=20)
+    amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        help_text="The test's share of the charged total"
+    )
+    commission_percentage = models.DecimalField(max_digits=5, decimal_places=2)
+    commission_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f"{self.transaction.transaction_number} - {self.test_type} - ৳{self.commission_amount}"
+
+
+class PCLedgerEntry(models.Model):
+    """Append-only commission ledger - one row per accrual or payout of a PC member
+    
+    ``PCMember.due_amount`` is the sum of a member's entries,
+    ``total_commission_earned`` the sum of its payouts and ``total_referrals``
+    its accruals less cancellations, kept in step by ``accounts.pc_ledger`` in the
+    same transaction.
+    """
+    
+    KIND_ACCRUAL = 'ACCRUAL'
+    KIND_ADJUSTMENT = 'ADJUSTMENT'
+    KIND_CANCELLATION = 'CANCELLATION'
+    KIND_PAYOUT = 'PAYOUT'
+    KIND_CHOICES = [
+        (KIND_ACCRUAL, 'Commission Accrued'),
+        (KIND_ADJUSTMENT, 'Commission Adjusted'),
+        (KIND_CANCELLATION, 'Bill Cancelled'),
+        (KIND_PAYOUT, 'Paid to Member'),
+    ]
+    
+    pc_member = models.ForeignKey(PCMember, on_delete=models.CASCADE, related_name='ledger_entries')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        help_text="Positive when more becomes due, negative for payouts and cancellations"
+    )
+    
+    # Source of the entry - the accrued bill; payouts list theirs as
+    # PCTransaction.payout
+    pc_transaction = models.ForeignKey(
+        PCTransaction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='ledger_entries'
+    )
+    note = models.CharField(max_length=200, blank=True)
+    
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['pc_member', 'created_at']),
+        ]
+        verbose_name = "PC Ledger Entry"
+        verbose_name_plural = "PC Ledger Entries"
+    
+    def __str__(self):
+        return f"{self.pc_member.pc_code} - {self.kind} (৳{self.amount})"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only; record a new entry instead")
         super().save(*args, **kwargs)
-        
-        # Update PC member totals (only for new transactions)
-        if is_new:
-            self.pc_member.due_amount += self.commission_amount
-            self.pc_member.total_referrals += 1
-            self.pc_member.save()
 
+
+class PCCommissionRate(models.Model):
+    """Commission rates for different PC member types and test types
+    
+    Read through ``accounts.commission``, which keeps them per process until
+    their version (count, latest ``updated_at``) changes.
+    """
+    
+    TEST_TYPE_CHOICES = [
+        ('NORMAL', 'Normal Test'),
+        ('DIGITAL', 'Digital Test'),
+    ]
+    
+    member_type = models.CharField(max_length=20, choices=PCMember.MEMBER_TYPE_CHOICES)
+    test_type = models.CharField(max_length=20, choices=TEST_TYPE_CHOICES)
+    commission_percentage = models.DecimalField(
+        max_digits=5,
+        decimal_places=2,
+        validators=[MinValueValidator(0), MaxValueValidator(100)],
+        help_text="Commission percentage (e.g., 30 for 30%)"
+    )
+    # Part of the matrix version accounts.commission checks
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ['member_type', 'test_type']
+        verbose_name = "PC Commission Rate"
+        verbose_name_plural = "PC Commission Rates"
+    
+    def __str__(self):
+        return f"{self.get_member_type_display()} - {self.get_test_type_display()}: {self.commission_percentage}%"
+
+
+class DocumentSequence(models.Model):
+    """Counter row backing a document number prefix (e.g. INC20251115)"""
+    
+    key = models.CharField(max_length=50, unique=True)
+    last_value = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['key']
+    
+    def __str__(self):
+        return f"{self.key}: {self.last_value}"
@@ -0,0 +1,246 @@
+"""
+PC commission ledger
+
+Every change to what a PC member is owed is a ``PCLedgerEntry`` row, and the
+member's ``due_amount`` / ``total_commission_earned`` / ``total_referrals``
+are moved by the same amounts with one CASE/``F()`` UPDATE in the same
+transaction. Two bills referred by one member at once therefore queue on the
+member's row lock instead of overwriting each other's read-modify-write:
+
+- ``accrue(pc_transaction)`` - a new bill's commission becomes due
+  (``PCTransaction.save`` calls it)
+- ``adjust(pc_transaction, previous)`` - an unpaid bill's commission was
+  recomputed
+- ``cancel(transactions)`` - bills deleted; what they still owed is taken back
+- ``settle(members)`` - pays out everything due: one PAYOUT entry per member,
+  its bills marked paid and the balances moved, all in one transaction and
+  a few queries per ``SETTLE_BATCH`` members whatever the number of bills
+
+``verify()`` (``manage.py verify_pc_ledger``) compares the balances with the
+ledger sums in one grouped query, and can reset drifted ones.
+"""
+from collections import namedtuple
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import dashboard_cache
+from .models import PCLedgerEntry, PCMember, PCTransaction
+
+# Members settled per round of queries - keeps the CASE expressions well
+# under the database's parameter limits
+SETTLE_BATCH = 500
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+# What an entry moves a member's balances by
+Delta = namedtuple('Delta', 'due earned referrals')
+
+
+def _move(deltas):
+    """Move members' balances by ``{member id: Delta}`` - one UPDATE"""
+    if not deltas:
+        return
+
+    def by_member(field, output_field):
+        return Case(
+            *[When(pk=pk, then=Value(getattr(delta, field))) for pk, delta in deltas.items()],
+            default=Value(0),
+            output_field=output_field,
+        )
+
+    PCMember.objects.filter(pk__in=deltas).update(
+        due_amount=F('due_amount') + by_member('due', MONEY),
+        total_commission_earned=F('total_commission_earned') + by_member('earned', MONEY),
+        total_referrals=F('total_referrals') + by_member('referrals', IntegerField()),
+    )
+    # An UPDATE sends no post_save
+    dashboard_cache.invalidate_on_commit('accounts.PCMember')
+
+
+def _add(deltas, pk, delta):
+    current = deltas.get(pk, Delta(0, 0, 0))
+    deltas[pk] = Delta(*(a + b for a, b in zip(current, delta)))
+
+
+def accrue(pc_transaction):
+    """Make a new bill's commission due to its member; returns the entry"""
+    with transaction.atomic():
+        # The member's row first, so a concurrent settle() waits for this bill
+        _move({pc_transaction.pc_member_id: Delta(pc_transaction.commission_amount, 0, 1)})
+        return PCLedgerEntry.objects.create(
+            pc_member_id=pc_transaction.pc_member_id,
+            kind=PCLedgerEntry.KIND_ACCRUAL,
+            amount=pc_transaction.commission_amount,
+            pc_transaction=pc_transaction,
+            created_by_id=pc_transaction.recorded_by_id,
+        )
+
+
+def adjust(pc_transaction, previous, created_by=None):
+    """Record a change of a bill's commission from ``previous``
+
+    A paid bill was settled at its old amount and is left alone. Returns the
+    entry, or None when there was nothing to record.
+    """
+    difference = pc_transaction.commission_amount - previous
+    if not difference or pc_transaction.is_paid_to_member:
+        return None
+    with transaction.atomic():
+        _move({pc_transaction.pc_member_id: Delta(difference, 0, 0)})
+        return PCLedgerEntry.objects.create(
+            pc_member_id=pc_transaction.pc_member_id,
+            kind=PCLedgerEntry.KIND_ADJUSTMENT,
+            amount=difference,
+            pc_transaction=pc_transaction,
+            note=f'Commission changed from {previous}',
+            created_by=created_by,
+        )
+
+
+def cancel(transactions, created_by=None):
+    """Delete bills (a ``PCTransaction`` queryset), taking back what they owed
+
+    Each loses its referral; an unpaid one's commission stops being due, a
+    paid one's stays paid. Returns the number of bills deleted.
+    """
+    with transaction.atomic():
+        rows = list(transactions.select_for_update().values(
+            'pk', 'pc_member', 'transaction_number', 'commission_amount', 'is_paid_to_member'
+        ))
+        deltas = {}
+        entries = []
+        for row in rows:
+            amount = 0 if row['is_paid_to_member'] else -row['commission_amount']
+            _add(deltas, row['pc_member'], Delta(amount, 0, -1))
+            entries.append(PCLedgerEntry(
+                pc_member_id=row['pc_member'],
+                kind=PCLedgerEntry.KIND_CANCELLATION,
+                amount=amount,
+                note=f"{row['transaction_number']} deleted",
+                created_by=created_by,
+            ))
+        _move(deltas)
+        PCLedgerEntry.objects.bulk_create(entries)
+        PCTransaction.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+    return len(rows)
+
+
+def settle(members=None, paid_by=None):
+    """Pay PC members everything due on their unpaid bills
+
+    ``members`` (instances or ids) limits it to them; everyone is settled
+    otherwise. One transaction: the members' rows are locked, so bills being
+    recorded meanwhile either make it into this payout or wait for the next.
+    Returns a dict of ``members``, ``transactions`` and ``amount`` settled,
+    and the ``payouts`` entries.
+    """
+    unpaid = PCTransaction.objects.filter(is_paid_to_member=False)
+    owed = PCMember.objects.filter(pk__in=unpaid.values('pc_member'))
+    if members is not None:
+        owed = owed.filter(pk__in=[getattr(member, 'pk', member) for member in members])
+
+    summary = {'members': 0, 'transactions': 0, 'amount': 0, 'payouts': []}
+    with transaction.atomic():
+        member_ids = list(owed.select_for_update().order_by('pk').values_list('pk', flat=True))
+        paid_at = timezone.now()
+        for start in range(0, len(member_ids), SETTLE_BATCH):
+            batch = unpaid.filter(pc_member__in=member_ids[start:start + SETTLE_BATCH])
+            dues = list(
+                batch.values('pc_member').annotate(amount=Sum('commission_amount'), count=Count('id'))
+                .order_by('pc_member')
+            )
+            payouts = PCLedgerEntry.objects.bulk_create([
+                PCLedgerEntry(
+                    pc_member_id=row['pc_member'],
+                    kind=PCLedgerEntry.KIND_PAYOUT,
+                    amount=-row['amount'],
+                    note=f"{row['count']} commission(s) paid",
+                    created_by=paid_by,
+                )
+                for row in dues
+            ])
+            batch.update(
+                is_paid_to_member=True,
+                paid_at=paid_at,
+                payout=Case(*[When(pc_member=payout.pc_member_id, then=Value(payout.pk)) for payout in payouts]),
+            )
+            _move({payout.pc_member_id: Delta(payout.amount, -payout.amount, 0) for payout in payouts})
+
+            summary['members'] += len(dues)
+            summary['transactions'] += sum(row['count'] for row in dues)
+            summary['amount'] += sum(row['amount'] for row in dues)
+            summary['payouts'].extend(payouts)
+        if member_ids:
+            dashboard_cache.invalidate_on_commit('accounts.PCTransaction')
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Verification
+# ---------------------------------------------------------------------------
+
+def _payouts(prefix=''):
+    return Q(**{f'{prefix}kind': PCLedgerEntry.KIND_PAYOUT})
+
+
+def _referral_change(prefix=''):
+    return Case(
+        When(**{f'{prefix}kind': PCLedgerEntry.KIND_ACCRUAL}, then=Value(1)),
+        When(**{f'{prefix}kind': PCLedgerEntry.KIND_CANCELLATION}, then=Value(-1)),
+        default=Value(0),
+    )
+
+
+def ledger_balances():
+    """The ledger's due, earned and referrals of a member, for a PCMember query"""
+    return {
+        'ledger_due': Coalesce(Sum('ledger_entries__amount'), Value(0), output_field=MONEY),
+        'ledger_earned': Coalesce(
+            Sum(-F('ledger_entries__amount'), filter=_payouts('ledger_entries__'), output_field=MONEY),
+            Value(0), output_field=MONEY,
+        ),
+        'ledger_referrals': Coalesce(Sum(_referral_change('ledger_entries__')), Value(0)),
+    }
+
+
+def verify(fix=False):
+    """Members whose balances disagree with their ledger - one grouped query
+
+    Returns a list of dicts (id, pc_code, name and each balance beside its
+    ``ledger_`` sum). With ``fix`` the balances are reset to the ledger sums
+    in a single UPDATE.
+    """
+    mismatches = list(
+        PCMember.objects.order_by()
+        .annotate(**ledger_balances())
+        .filter(
+            ~Q(due_amount=F('ledger_due'))
+            | ~Q(total_commission_earned=F('ledger_earned'))
+            | ~Q(total_referrals=F('ledger_referrals'))
+        )
+        .values(
+            'id', 'pc_code', 'name', 'due_amount', 'ledger_due', 'total_commission_earned', 'ledger_earned',
+            'total_referrals', 'ledger_referrals',
+        )
+        .order_by('pc_code')
+    )
+    if fix and mismatches:
+        def ledger_sum(expression, filter=None):
+            entries = PCLedgerEntry.objects.filter(pc_member=OuterRef('pk'))
+            if filter is not None:
+                entries = entries.filter(filter)
+            return Coalesce(
+                Subquery(entries.order_by().values('pc_member').annotate(total=Sum(expression)).values('total')),
+                Value(0),
+            )
+
+        PCMember.objects.filter(pk__in=[row['id'] for row in mismatches]).update(
+            due_amount=ledger_sum('amount'),
+            total_commission_earned=ledger_sum(-F('amount'), _payouts()),
+            total_referrals=ledger_sum(_referral_change()),
+        )
+        dashboard_cache.invalidate_on_commit('accounts.PCMember')
+    return mismatches
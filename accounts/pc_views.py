@@ -8,6 +8,8 @@ from django.db.models import Sum, Count, Q
 from django.utils import timezone
 from datetime import timedelta
 from .models import PCMember, PCTransaction
+from diagcenter.instrumentation import query_budget
+from . import commission, dashboard_cache, pc_ledger
 from patients.models import Patient
 from appointments.models import Appointment
 
@@ -221,7 +223,7 @@ def pc_transaction_create(request):
     
     if request.method == 'POST':
         pc_code = request.POST.get('pc_code')
-        total_amount = float(request.POST.get('total_amount', 0))
+        total_amount = request.POST.get('total_amount') or '0'
         patient_id = request.POST.get('patient_id', '')
         appointment_id = request.POST.get('appointment_id', '')
         notes = request.POST.get('notes', '')
@@ -238,14 +240,13 @@ def pc_transaction_create(request):
         appointment = Appointment.objects.filter(id=appointment_id).first() if appointment_id else None
         
         # Create transaction
-        transaction = PCTransaction.objects.create(
-            pc_member=member,
+        transaction = commission.record(
+            member,
+            commission.split_amount(total_amount, member.commission_percentage),
+            recorded_by=request.user,
             patient=patient,
             appointment=appointment,
-            total_amount=total_amount,
-            commission_percentage=member.commission_percentage,
-            recorded_by=request.user,
-            notes=notes
+            notes=notes,
         )
         
         messages.success(request, 
@@ -262,14 +263,8 @@ def pc_transaction_create(request):
     return render(request, 'accounts/pc_transaction_create.html', context)
 
 
-@login_required
-def pc_dashboard(request):
-    """PC System Dashboard (Admin only)"""
-    if not request.user.is_admin:
-        messages.error(request, "Access denied. Admin only.")
-        return redirect('accounts:dashboard')
-    
-    today = timezone.now().date()
+def _pc_dashboard_context(today):
+    """Context of pc_dashboard - cached by dashboard_cache"""
     this_month_start = today.replace(day=1)
     
     # Overall statistics
@@ -346,7 +341,22 @@ def pc_dashboard(request):
         'lifetime_rates': lifetime_rates,
         'premium_rates': premium_rates,
     }
+    return context
+
+
+@login_required
+@query_budget(27)
+def pc_dashboard(request):
+    """PC System Dashboard (Admin only)"""
+    if not request.user.is_admin:
+        messages.error(request, "Access denied. Admin only.")
+        return redirect('accounts:dashboard')
     
+    today = timezone.now().date()
+    context = dashboard_cache.get_context(
+        'pc', lambda: _pc_dashboard_context(today),
+        variant=request.user.role, today=today,
+    )
     return render(request, 'accounts/pc_dashboard.html', context)
 
 
@@ -395,34 +405,16 @@ def pc_mark_paid(request, pc_code):
     
     member = get_object_or_404(PCMember, pc_code=pc_code)
     
-    # Check if there's any due amount
-    if member.due_amount <= 0:
+    # Pays out the unpaid bills and moves the balances in one transaction
+    settled = pc_ledger.settle([member], paid_by=request.user)
+    if not settled['transactions']:
         messages.info(request, f'No unpaid commissions for {member.name}.')
         return redirect('accounts:pc_member_list', member_type=member.member_type)
     
-    # Get all unpaid transactions
-    unpaid_transactions = PCTransaction.objects.filter(
-        pc_member=member,
-        is_paid_to_member=False
-    )
-    
-    unpaid_count = unpaid_transactions.count()
-    due_amount = float(member.due_amount)
-    
-    # Mark all as paid
-    unpaid_transactions.update(
-        is_paid_to_member=True,
-        paid_at=timezone.now()
-    )
-    
-    # Move due amount to total earned
-    member.total_commission_earned += member.due_amount
-    member.due_amount = 0
-    member.save()
-    
     messages.success(
         request, 
-        f'Payment confirmed! ৳{due_amount:.2f} paid to {member.name} ({unpaid_count} transactions marked as paid).'
+        f"Payment confirmed! ৳{settled['amount']:.2f} paid to {member.name} "
+        f"({settled['transactions']} transactions marked as paid)."
     )
     
     # Redirect back to the member list of the same type
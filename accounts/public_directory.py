@@ -0,0 +1,103 @@
+"""
+Cached public PC member directory pages
+
+The general/lifetime/investor member pages are public and shared widely, so
+``cached_page(member_type)`` serves them from a full-page cache:
+
+- each member type has a version in the shared cache - a token and the time
+  it was made - which a saved or deleted ``PCMember`` replaces
+  (``accounts.signals``, once committed)
+- the rendered page is cached under the member type with the token it was
+  rendered for; a page whose token isn't current is rendered again
+- responses carry the token as ``ETag`` and its time as ``Last-Modified``, so
+  browsers and proxies revalidate with ``If-None-Match`` /
+  ``If-Modified-Since`` and get a 304 answered from the version alone
+
+The versions and pages must be in the cache every worker shares (Redis in
+production): with a per-process cache a save only invalidates the worker that
+made it, and each worker hands out its own ETags (``check --deploy`` warns,
+``accounts.checks``).
+
+A 304 costs one cache read, a cached page two, and neither touches the
+database. Searches (``?search=``) aren't cached and go to the view as before.
+"""
+import time
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+MEMBER_TYPES = ('GENERAL', 'LIFETIME', 'PREMIUM')
+
+VERSION_PREFIX = 'public_directory:version'
+PAGE_PREFIX = 'public_directory:page'
+
+
+def version_key(member_type):
+    return f'{VERSION_PREFIX}:{member_type}'
+
+
+def page_key(member_type):
+    return f'{PAGE_PREFIX}:{member_type}'
+
+
+def _new_version():
+    # Last-Modified has whole seconds
+    return {'token': uuid.uuid4().hex, 'modified': int(time.time())}
+
+
+def invalidate(*member_types):
+    """Give the member types' pages a new version (all of them by default)"""
+    cache.set_many({version_key(member_type): _new_version() for member_type in member_types or MEMBER_TYPES}, None)
+
+
+def current_version(member_type):
+    """The member type's version, creating it if missing"""
+    version = cache.get(version_key(member_type))
+    if version is None:
+        cache.add(version_key(member_type), _new_version(), None)
+        # Another process may have added it first
+        version = cache.get(version_key(member_type))
+    return version
+
+
+def _with_validators(response, version):
+    response['ETag'] = quote_etag(version['token'])
+    response['Last-Modified'] = http_date(version['modified'])
+    patch_cache_control(response, public=True, max_age=settings.PUBLIC_DIRECTORY_MAX_AGE)
+    return response
+
+
+def cached_page(member_type):
+    """Serve a directory view from the page cache, answering conditional GETs"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.GET:
+                return view(request, *args, **kwargs)
+
+            version = current_version(member_type)
+            etag = quote_etag(version['token'])
+
+            not_modified = get_conditional_response(request, etag=etag, last_modified=version['modified'])
+            if not_modified is not None:
+                return _with_validators(not_modified, version)
+
+            page = cache.get(page_key(member_type))
+            if page is None or page['token'] != version['token']:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                page = {
+                    'token': version['token'],
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                }
+                cache.set(page_key(member_type), page, settings.PUBLIC_DIRECTORY_CACHE_TIMEOUT)
+            return _with_validators(HttpResponse(page['content'], content_type=page['content_type']), version)
+        return wrapper
+    return decorator
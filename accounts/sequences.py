@@ -0,0 +1,63 @@
+"""
+Document number allocation
+
+Every ``*_number`` field in the system is a prefix (type + date) followed by a
+running counter, e.g. ``INC202511150042``. Instead of scanning the table for
+the last number on each insert, the counter lives in a ``DocumentSequence`` row
+per prefix that is bumped with a single atomic UPDATE, so concurrent workers
+never hand out the same number.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+
+from .models import DocumentSequence
+
+
+def next_value(key, seed=None):
+    """Atomically increment the counter for ``key`` and return the new value.
+    
+    ``seed`` is an optional callable returning the highest value already in
+    use; it is only consulted the first time a key is seen.
+    """
+    with transaction.atomic():
+        updated = DocumentSequence.objects.filter(key=key).update(
+            last_value=F('last_value') + 1
+        )
+        if not updated:
+            start = seed() if seed else 0
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(key=key, last_value=start + 1)
+                return start + 1
+            except IntegrityError:
+                # Another worker created the row first - increment theirs
+                DocumentSequence.objects.filter(key=key).update(
+                    last_value=F('last_value') + 1
+                )
+        return DocumentSequence.objects.values_list('last_value', flat=True).get(key=key)
+
+
+def highest_issued(model, field, prefix):
+    """Return the numeric suffix of the highest ``field`` value starting with ``prefix``"""
+    last = model.objects.filter(
+        **{f'{field}__startswith': prefix}
+    ).order_by(Length(field), field).values_list(field, flat=True).last()
+    
+    suffix = last[len(prefix):] if last else ''
+    return int(suffix) if suffix.isdigit() else 0
+
+
+def next_document_number(model, field, prefix, width=4):
+    """Allocate the next document number for ``prefix``.
+    
+    Numbers are zero padded to ``width`` digits and simply grow wider once the
+    counter passes 10**width - 1, so a busy day never wraps around.
+    """
+    value = next_value(prefix, seed=lambda: highest_issued(model, field, prefix))
+    return f'{prefix}{value:0{width}d}'
+
+
+def advance_to(key, value):
+    """Move the counter for ``key`` forward to at least ``value`` (never backwards)"""
+    DocumentSequence.objects.filter(key=key, last_value__lt=value).update(last_value=value)
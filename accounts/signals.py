@@ -0,0 +1,43 @@
+"""
+Invalidate cached role dashboards, public directory pages and the commission
+rate matrix when the models they read change
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from . import commission, dashboard_cache, public_directory
+from .models import PCCommissionRate, PCMember
+
+
+def invalidate_dashboards(sender, raw=False, **kwargs):
+    if raw:
+        return
+    label = sender._meta.label
+    # Only once committed - a dashboard rebuilt before then still reads the
+    # old rows and must cache them under the old version
+    transaction.on_commit(lambda: dashboard_cache.invalidate(label))
+
+
+for label in dashboard_cache.tagged_models():
+    model = apps.get_model(label)
+    post_save.connect(invalidate_dashboards, sender=model, dispatch_uid=f'dashboard_cache:save:{label}')
+    post_delete.connect(invalidate_dashboards, sender=model, dispatch_uid=f'dashboard_cache:delete:{label}')
+
+
+@receiver(post_save, sender=PCCommissionRate, dispatch_uid='commission:rate_saved')
+@receiver(post_delete, sender=PCCommissionRate, dispatch_uid='commission:rate_deleted')
+def invalidate_commission_rates(sender, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(commission.rates_changed)
+
+
+@receiver(post_save, sender=PCMember, dispatch_uid='public_directory:member_saved')
+@receiver(post_delete, sender=PCMember, dispatch_uid='public_directory:member_deleted')
+def invalidate_public_directory(sender, raw=False, **kwargs):
+    if raw:
+        return
+    # Every type - the member may have changed type
+    transaction.on_commit(public_directory.invalidate)
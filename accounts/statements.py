@@ -0,0 +1,282 @@
+"""
+Monthly PC member statements
+
+A statement lists a member's bills of one month with what each earned them,
+and the month's totals. All of them are generated in one pass:
+
+- the month's ``PCTransaction`` rows are read with a single query ordered by
+  member, through ``.iterator(chunk_size=STATEMENT_CHUNK_SIZE)``, and split
+  per member with ``groupby`` - each statement is written out as its rows
+  arrive, so memory stays flat however busy the month was
+- statements are HTML or CSV, written one file per member under
+  ``PC_STATEMENT_DIR/<year>-<month>/`` (and optionally zipped into one
+  archive), or streamed as a zip straight to the browser by the admin action
+- with ``POOL_MIN_MEMBERS`` members or more, ``generate`` hands contiguous
+  ranges of members to a process pool; each worker runs the same single
+  ordered query over its range
+
+``manage.py pc_statements`` runs it for a month (the last one by default).
+"""
+import csv
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.html import escape
+
+from diagcenter.streaming import Echo, ZipSink
+
+from .models import PCMember, PCTransaction
+
+STATEMENT_CHUNK_SIZE = 2000
+
+# Fewer members than this are written in-process
+POOL_MIN_MEMBERS = 200
+
+COLUMNS = [
+    ('Date', 'transaction_date'),
+    ('Bill', 'transaction_number'),
+    ('Patient', 'patient_name'),
+    ('Billed', 'total_amount'),
+    ('Rate %', 'commission_percentage'),
+    ('Commission', 'commission_amount'),
+    ('Paid', 'paid_at'),
+]
+
+Period = namedtuple('Period', 'year month start end')
+
+
+def month_period(year, month):
+    """The ``Period`` of a calendar month, in local time"""
+    start = timezone.make_aware(datetime(year, month, 1))
+    end = timezone.make_aware(datetime(year + month // 12, month % 12 + 1, 1))
+    return Period(year, month, start, end)
+
+
+def last_month(today=None):
+    today = today or timezone.localdate()
+    return month_period(today.year - (today.month == 1), (today.month - 2) % 12 + 1)
+
+
+def transactions(period, first_member=None, last_member=None):
+    """The period's bills as dicts, ordered by member - one query, read in chunks"""
+    bills = PCTransaction.objects.filter(transaction_date__gte=period.start, transaction_date__lt=period.end)
+    if first_member is not None:
+        bills = bills.filter(pc_member_id__gte=first_member)
+    if last_member is not None:
+        bills = bills.filter(pc_member_id__lte=last_member)
+    rows = bills.order_by('pc_member_id', 'transaction_date', 'id').values(
+        'pc_member_id', 'transaction_date', 'transaction_number', 'patient__first_name', 'patient__last_name',
+        'total_amount', 'commission_percentage', 'commission_amount', 'is_paid_to_member', 'paid_at',
+    )
+    for row in rows.iterator(chunk_size=STATEMENT_CHUNK_SIZE):
+        row['patient_name'] = f"{row['patient__first_name'] or ''} {row['patient__last_name'] or ''}".strip()
+        row['transaction_date'] = timezone.localtime(row['transaction_date'])
+        if row['paid_at']:
+            row['paid_at'] = timezone.localtime(row['paid_at'])
+        yield row
+
+
+def by_member(period, member_ids=None, first_member=None, last_member=None):
+    """(member, rows) for each member with bills in the period
+
+    ``member_ids`` limits it to those members. Members are read in one query,
+    bills through ``transactions``.
+    """
+    members = PCMember.objects.only('pc_code', 'name', 'member_type', 'due_amount')
+    if member_ids is not None:
+        members = members.filter(pk__in=member_ids)
+    if first_member is not None:
+        members = members.filter(pk__gte=first_member)
+    if last_member is not None:
+        members = members.filter(pk__lte=last_member)
+    members = members.in_bulk()
+
+    for member_id, rows in groupby(transactions(period, first_member, last_member), key=itemgetter('pc_member_id')):
+        if member_id in members:
+            yield members[member_id], rows
+
+
+class Totals:
+    """Running totals of a statement's bills"""
+
+    def __init__(self):
+        self.bills = 0
+        self.billed = self.commission = self.paid = Decimal('0')
+
+    def add(self, row):
+        self.bills += 1
+        self.billed += row['total_amount']
+        self.commission += row['commission_amount']
+        if row['is_paid_to_member']:
+            self.paid += row['commission_amount']
+
+    @property
+    def unpaid(self):
+        return self.commission - self.paid
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    return value
+
+
+def csv_statement(member, rows, period, totals):
+    """CSV lines of a statement; fills ``totals`` as the rows go by"""
+    writer = csv.writer(Echo())
+    yield writer.writerow([f'Statement {period.year}-{period.month:02d}', member.pc_code, member.name])
+    yield writer.writerow([header for header, _ in COLUMNS])
+    for row in rows:
+        totals.add(row)
+        yield writer.writerow([_cell(row[field]) for _, field in COLUMNS])
+    yield writer.writerow(['Bills', totals.bills, '', totals.billed, '', totals.commission, ''])
+    yield writer.writerow(['Paid', '', '', '', '', totals.paid, ''])
+    yield writer.writerow(['Unpaid', '', '', '', '', totals.unpaid, ''])
+    yield writer.writerow(['Due today', '', '', '', '', member.due_amount, ''])
+
+
+def html_statement(member, rows, period, totals):
+    """HTML of a statement, a table row at a time; fills ``totals``"""
+    title = escape(f'{member.pc_code} - {member.name} - {period.year}-{period.month:02d}')
+    yield (
+        f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Statement {title}</title>'
+        '<style>body{font-family:sans-serif}table{border-collapse:collapse;width:100%}'
+        'th,td{border:1px solid #ccc;padding:4px 8px}td.n{text-align:right}</style></head><body>'
+        f'<h1>Commission statement</h1><p>{title} ({escape(member.get_member_type_display())})</p>'
+        '<table><thead><tr>'
+        + ''.join(f'<th>{header}</th>' for header, _ in COLUMNS)
+        + '</tr></thead><tbody>'
+    )
+    numeric = {'total_amount', 'commission_percentage', 'commission_amount'}
+    for row in rows:
+        totals.add(row)
+        yield '<tr>' + ''.join(
+            f'<td class="n">{row[field]}</td>' if field in numeric else f'<td>{escape(_cell(row[field]))}</td>'
+            for _, field in COLUMNS
+        ) + '</tr>'
+    yield (
+        '</tbody></table><table><tbody>'
+        f'<tr><th>Bills</th><td class="n">{totals.bills}</td></tr>'
+        f'<tr><th>Billed</th><td class="n">৳{totals.billed}</td></tr>'
+        f'<tr><th>Commission</th><td class="n">৳{totals.commission}</td></tr>'
+        f'<tr><th>Paid</th><td class="n">৳{totals.paid}</td></tr>'
+        f'<tr><th>Unpaid</th><td class="n">৳{totals.unpaid}</td></tr>'
+        f'<tr><th>Due today</th><td class="n">৳{member.due_amount}</td></tr>'
+        '</tbody></table></body></html>'
+    )
+
+
+# format -> (writer, content type, file extension)
+FORMATS = {
+    'html': (html_statement, 'text/html', 'html'),
+    'csv': (csv_statement, 'text/csv', 'csv'),
+}
+
+
+def filename(member, period, fmt):
+    return f'{member.pc_code}-{period.year}-{period.month:02d}.{FORMATS[fmt][2]}'
+
+
+def write_files(period, fmt, directory, member_ids=None, first_member=None, last_member=None):
+    """Write the statements of a range of members as files; returns a summary"""
+    writer = FORMATS[fmt][0]
+    summary = {'members': 0, 'transactions': 0, 'commission': Decimal('0')}
+    for member, rows in by_member(period, member_ids, first_member, last_member):
+        totals = Totals()
+        with open(Path(directory) / filename(member, period, fmt), 'w', encoding='utf-8', newline='') as statement:
+            for chunk in writer(member, rows, period, totals):
+                statement.write(chunk)
+        summary['members'] += 1
+        summary['transactions'] += totals.bills
+        summary['commission'] += totals.commission
+    return summary
+
+
+def stream_zip(period, fmt, member_ids=None):
+    """A zip of the statements as bytes chunks, for a streaming response"""
+    writer = FORMATS[fmt][0]
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for member, rows in by_member(period, member_ids):
+            with archive.open(filename(member, period, fmt), 'w') as statement:
+                for chunk in writer(member, rows, period, Totals()):
+                    statement.write(chunk.encode())
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _init_worker():
+    # Spawned workers start without Django; forked ones already have it and
+    # open their own database connection on first use
+    import django
+    django.setup()
+
+
+def _write_range(args):
+    return write_files(*args)
+
+
+def _ranges(ids, parts):
+    """Split sorted ids into at most ``parts`` contiguous (first, last) ranges"""
+    size = -(-len(ids) // parts)
+    return [(ids[start], ids[min(start + size, len(ids)) - 1]) for start in range(0, len(ids), size)]
+
+
+def generate(period, fmt='html', directory=None, archive=False, workers=None, member_ids=None):
+    """Write the period's statements; returns a summary with where they went
+
+    Files go to ``directory`` (``PC_STATEMENT_DIR/<year>-<month>`` by
+    default); with ``archive`` they are zipped into ``<directory>.zip``
+    instead. ``workers`` caps the process pool, which is only used from
+    ``POOL_MIN_MEMBERS`` members.
+    """
+    directory = Path(directory or Path(settings.PC_STATEMENT_DIR) / f'{period.year}-{period.month:02d}')
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    # An archive holds just this run's statements
+    target = Path(tempfile.mkdtemp(dir=directory.parent)) if archive else directory
+    target.mkdir(exist_ok=True)
+
+    bills = PCTransaction.objects.filter(transaction_date__gte=period.start, transaction_date__lt=period.end)
+    if member_ids is not None:
+        bills = bills.filter(pc_member__in=member_ids)
+    ids = list(bills.order_by('pc_member_id').values_list('pc_member_id', flat=True).distinct())
+
+    workers = min(workers or os.cpu_count() or 1, -(-len(ids) // POOL_MIN_MEMBERS) or 1)
+    if workers > 1:
+        # Forked workers mustn't share the parent's connection
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            summaries = list(pool.map(_write_range, [
+                (period, fmt, target, member_ids, first, last) for first, last in _ranges(ids, workers)
+            ]))
+    else:
+        summaries = [write_files(period, fmt, target, member_ids)]
+
+    summary = {
+        'members': sum(part['members'] for part in summaries),
+        'transactions': sum(part['transactions'] for part in summaries),
+        'commission': sum((part['commission'] for part in summaries), Decimal('0')),
+        'workers': workers,
+        'path': directory,
+    }
+    if archive:
+        summary['path'] = directory.with_suffix('.zip')
+        with zipfile.ZipFile(summary['path'], 'w', zipfile.ZIP_DEFLATED) as zipped:
+            for path in sorted(target.iterdir()):
+                zipped.write(path, path.name)
+        shutil.rmtree(target)
+    return summary
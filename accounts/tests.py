@@ -1,3 +1,671 @@
-from django.test import TestCase
+"""
+Tests for shared accounts services
+"""
+import csv
+import io
+import tempfile
+import threading
+import zipfile
+from datetime import date, timedelta
+from pathlib import Path
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from diagcenter.instrumentation import (
+    InstrumentationMiddleware, QueryBudgetExceeded, QueryRecorder, Sample, ViewStats, query_budget, view_stats,
+)
+from finance.models import Expense, Income
+from patients.models import Patient
+from lab.models import LabBill, LabOrder, LabTest
+from survey.models import CanteenSale
+from . import commission, dashboard_cache, dashboard_metrics, pc_ledger, public_directory, statements
+from .models import DocumentSequence, PCCommissionRate, PCLedgerEntry, PCMember, PCTransaction
+from .sequences import next_value, next_document_number
+
+
+User = get_user_model()
+
+
+class DocumentSequenceTestCase(TestCase):
+    """Test the document number allocator"""
+
+    def test_next_value_increments(self):
+        """Test counter starts at 1 and increments per call"""
+        self.assertEqual(next_value('TEST'), 1)
+        self.assertEqual(next_value('TEST'), 2)
+        self.assertEqual(next_value('OTHER'), 1)
+        self.assertEqual(DocumentSequence.objects.get(key='TEST').last_value, 2)
+
+    def test_seeded_from_existing_numbers(self):
+        """Test a new prefix continues after numbers issued by the old scan"""
+        prefix = f"INC{timezone.now().strftime('%Y%m%d')}"
+        Income.objects.bulk_create([
+            Income(income_number=f'{prefix}0007', source='OTHER', amount=Decimal('1'), date=date.today()),
+            Income(income_number=f'{prefix}0012', source='OTHER', amount=Decimal('1'), date=date.today()),
+        ])
+
+        income = Income.objects.create(source='OTHER', amount=Decimal('10'), date=date.today())
+        self.assertEqual(income.income_number, f'{prefix}0013')
+
+    def test_number_grows_past_9999(self):
+        """Test numbers widen instead of wrapping after 9999"""
+        DocumentSequence.objects.create(key='RX20250101', last_value=9999)
+        self.assertEqual(next_document_number(Income, 'income_number', 'RX20250101'), 'RX2025010110000')
+
+    def test_models_use_sequence(self):
+        """Test model saves allocate sequential numbers"""
+        first = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth=date(1990, 1, 1),
+            gender='M', phone='01700000001', address='Nazipur', city='Nazipur',
+            emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+        )
+        second = Patient.objects.create(
+            first_name='Karim', last_name='Uddin', date_of_birth=date(1991, 1, 1),
+            gender='M', phone='01700000002', address='Nazipur', city='Nazipur',
+            emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+        )
+        year = timezone.now().year
+        self.assertEqual(first.patient_id, f'PAT{year}0001')
+        self.assertEqual(second.patient_id, f'PAT{year}0002')
+
+
+class DocumentSequenceConcurrencyTestCase(TransactionTestCase):
+    """Test parallel writers never receive the same number"""
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_parallel_writers_get_unique_values(self):
+        values = []
+        lock = threading.Lock()
+
+        def writer():
+            try:
+                local = [next_value('PARALLEL') for _ in range(10)]
+                with lock:
+                    values.extend(local)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=writer) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(values), list(range(1, 201)))
+
+
+class DashboardMetricsTestCase(TestCase):
+    """Test the admin dashboard metrics layer and its query budget"""
+
+    # One conditional aggregate per model: finance rollup, patients,
+    # appointments, staff, lab orders, pharmacy sales, canteen, drugs, investors
+    QUERY_BUDGET = 9
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_user(username='admin1', password='testpass123', role='ADMIN')
+        self.today = timezone.now().date()
+        Income.objects.create(source='LAB_TEST', amount=Decimal('300'), date=self.today)
+        Income.objects.create(source='CONSULTATION', amount=Decimal('500'), date=self.today)
+        Expense.objects.create(expense_type='RENT', amount=Decimal('200'), date=self.today, description='Rent')
+
+    def test_metrics(self):
+        start, end = dashboard_metrics.period_range('today', self.today)
+        metrics = dashboard_metrics.compute(start, end)
+        self.assertEqual(metrics['total_income'], Decimal('800'))
+        self.assertEqual(metrics['lab_income'], Decimal('300'))
+        self.assertEqual(metrics['appointment_income'], Decimal('500'))
+        self.assertEqual(metrics['total_expenses'], Decimal('200'))
+        self.assertEqual(metrics['total_staff'], 1)
+
+    def test_query_budget(self):
+        """Test the metrics take one query per model, and none once cached"""
+        start, end = dashboard_metrics.period_range('month', self.today)
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            dashboard_metrics.compute(start, end)
+
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            dashboard_metrics.get_metrics('week', self.today)
+        with self.assertNumQueries(0):
+            dashboard_metrics.get_metrics('week', self.today)
+
+    def test_unknown_period_is_today(self):
+        period, start, end, _ = dashboard_metrics.get_metrics('forever', self.today)
+        self.assertEqual((period, start, end), ('today', self.today, self.today))
+
+    def test_json_endpoint(self):
+        url = reverse('accounts:admin_dashboard_metrics')
+        self.client.force_login(self.admin)
+        response = self.client.get(url, {'period': 'today'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(response.json()['metrics']['total_income']), Decimal('800'))
+
+        staff = User.objects.create_user(username='reception1', password='testpass123', role='RECEPTIONIST')
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_dashboard_renders_from_metrics(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('accounts:admin_dashboard'), {'period': 'today'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_income'], Decimal('800'))
+        self.assertEqual(response.context['profit'], Decimal('600'))
+
+
+class DashboardCacheTestCase(TestCase):
+    """Test role dashboards are served from cache until a dependency changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='lab1', password='testpass123', role='LAB')
+        self.client.force_login(self.user)
+        self.url = reverse('accounts:lab_assistant_dashboard')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth=date(1990, 1, 1),
+            gender='M', phone='01700000001', address='Nazipur', city='Nazipur',
+            emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+        )
+
+    def add_bill(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            LabBill.objects.create(patient=self.patient, total_amount=Decimal('500'))
+
+    def test_served_from_cache(self):
+        self.add_bill()
+        self.assertEqual(self.client.get(self.url).context['pending_count'], 1)
+
+        # Only the session and user lookups
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['pending_count'], 1)
+
+    def test_dependency_write_invalidates(self):
+        self.client.get(self.url)
+        self.add_bill()
+        self.assertEqual(self.client.get(self.url).context['pending_count'], 1)
+
+    def test_unrelated_write_keeps_cache(self):
+        self.client.get(self.url)
+        key = dashboard_cache.context_key('lab_assistant', self.user.role, timezone.now().date())
+        with self.captureOnCommitCallbacks(execute=True):
+            CanteenSale.objects.create(customer_name='Walk-in', total_amount=Decimal('50'))
+        self.assertEqual(
+            dashboard_cache.context_key('lab_assistant', self.user.role, timezone.now().date()), key
+        )
+        self.assertIsNotNone(cache.get(key))
+
+    def test_update_writes_invalidate(self):
+        """Test stock moved with F() updates (no post_save) still invalidates"""
+        from pharmacy import stock
+        from pharmacy.models import Drug, StockMovement
+
+        drug = Drug.objects.create(
+            drug_code='DSH001', generic_name='Paracetamol', brand_name='Napa', form='TABLET', strength='500mg',
+            manufacturer='Beximco', unit_price=Decimal('1.00'), selling_price=Decimal('2.00'),
+        )
+        key = dashboard_cache.context_key('pharmacy', 'PHARMACIST', timezone.now().date())
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.record_movement(drug.pk, 10, StockMovement.KIND_ADJUSTMENT)
+        self.assertNotEqual(dashboard_cache.context_key('pharmacy', 'PHARMACIST', timezone.now().date()), key)
+
+    def test_per_user_receptionist_context(self):
+        """Test the receptionist dashboard is cached per user"""
+        other = User.objects.create_user(username='reception2', password='testpass123', role='RECEPTIONIST')
+        with self.captureOnCommitCallbacks(execute=True):
+            Income.objects.create(
+                source='CONSULTATION', amount=Decimal('300'), date=timezone.now().date(), recorded_by=self.user,
+            )
+
+        url = reverse('accounts:receptionist_dashboard')
+        self.assertEqual(self.client.get(url).context['my_collections_total'], Decimal('300'))
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).context['my_collections_total'], 0)
+
+
+class InstrumentationTestCase(TestCase):
+    """Test the instrumentation middleware, its report and query budgets"""
+
+    def setUp(self):
+        cache.clear()
+        view_stats.clear()
+        self.admin = User.objects.create_user(username='admin1', password='testpass123', role='ADMIN')
+
+    def test_server_timing_and_report(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('accounts:admin_dashboard'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+
+        report = self.client.get(reverse('accounts:admin_instrumentation')).json()
+        views = {item['view']: item for item in report['views']}
+        dashboard = views['accounts:admin_dashboard']
+        self.assertEqual(dashboard['requests'], 1)
+        self.assertGreater(dashboard['queries']['max'], 0)
+        self.assertEqual(sum(dashboard['histogram'].values()), 1)
+        self.assertGreater(dashboard['response_bytes']['max'], 0)
+
+    def test_report_is_admin_only(self):
+        staff = User.objects.create_user(username='reception1', password='testpass123', role='RECEPTIONIST')
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get(reverse('accounts:admin_instrumentation')).status_code, 403)
+
+    def test_repeated_queries(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for user_id in (1, 2, 3):
+                list(User.objects.filter(pk=user_id))
+            list(Patient.objects.all())
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(list(recorder.repeated().values()), [3])
+
+    def test_repeated_queries_roll_with_the_window(self):
+        """Test signatures are only kept for the requests still in the window"""
+        stats = ViewStats(window=2)
+        for index in range(3):
+            # IN lists of a new length each time give a new signature
+            stats.record('view', Sample(1, 3, 1, 0, 200), {f'IN ({", ".join(["%s"] * (index + 1))})': 3})
+        repeated = stats.report()[0]['repeated_queries']
+        self.assertEqual({entry['sql'] for entry in repeated}, {'IN (%s, %s)', 'IN (%s, %s, %s)'})
+        self.assertEqual(len(stats._repeated['view']), 2)
+
+    def test_query_budget_exceeded(self):
+        @query_budget(1)
+        def view(request):
+            list(User.objects.all())
+            list(Patient.objects.all())
+            return HttpResponse('ok')
+
+        request = RequestFactory().get('/')
+        middleware = InstrumentationMiddleware(lambda request: view(request))
+        middleware.process_view(request, view, (), {})
+        with self.assertRaises(QueryBudgetExceeded):
+            middleware(request)
+
+    def test_dashboards_within_budget(self):
+        """Test each budgeted dashboard renders from a cold cache"""
+        for role, url in (
+            ('ADMIN', 'accounts:admin_dashboard'),
+            ('ADMIN', 'accounts:admin_dashboard_metrics'),
+            ('ADMIN', 'accounts:pc_dashboard'),
+            ('RECEPTIONIST', 'accounts:receptionist_dashboard'),
+            ('LAB', 'accounts:lab_assistant_dashboard'),
+        ):
+            with self.subTest(url=url):
+                cache.clear()
+                user = User.objects.create_user(username=f'{url}-user', password='testpass123', role=role)
+                self.client.force_login(user)
+                self.assertEqual(self.client.get(reverse(url)).status_code, 200)
+
+
+class CommissionTestCase(TestCase):
+    """Test commission splits, the cached rate matrix and lab billing"""
+
+    def setUp(self):
+        cache.clear()
+        commission.matrix.clear()
+        self.reception = User.objects.create_user(username='reception1', password='testpass123', role='RECEPTIONIST')
+        self.member = PCMember.objects.create(
+            name='Dr. Referrer', phone='01700000009', member_type='LIFETIME',
+            normal_test_commission=Decimal('20.00'), digital_test_commission=Decimal('25.00'),
+        )
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth=date(1990, 1, 1),
+            gender='M', phone='01700000001', address='Nazipur', city='Nazipur',
+            emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+        )
+
+    def make_tests(self, count, price='333.33'):
+        return [
+            LabTest.objects.create(
+                test_code=f'T{index}', test_name=f'Test {index}', category='BLOOD', price=Decimal(price),
+                test_type='DIGITAL' if index % 2 else 'NORMAL', sample_type='Blood', turnaround_time='Same day',
+            )
+            for index in range(count)
+        ]
+
+    def test_split_spreads_discount_and_balances(self):
+        tests = self.make_tests(3)
+        split = commission.split(self.member, tests, Decimal('899.99'))
+
+        self.assertEqual(sum(line.amount for line in split.lines), Decimal('899.99'))
+        self.assertEqual([line.rate for line in split.lines], [Decimal('20.00'), Decimal('25.00'), Decimal('20.00')])
+        self.assertEqual(split.commission, sum(line.commission for line in split.lines))
+        self.assertEqual(split.commission + split.admin, Decimal('899.99'))
+        self.assertEqual(split.lines[0].commission, Decimal('60.00'))
+
+    def test_rate_matrix_overrides_member_rates_and_is_cached(self):
+        tests = self.make_tests(2)
+        commission.split(self.member, tests)
+        # Only the version check
+        with CaptureQueriesContext(connection) as queries:
+            commission.split(self.member, tests)
+        self.assertEqual(len(queries), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PCCommissionRate.objects.create(member_type='LIFETIME', test_type='DIGITAL', commission_percentage=30)
+        split = commission.split(self.member, tests)
+        self.assertEqual([line.rate for line in split.lines], [Decimal('20.00'), Decimal('30')])
+
+    def test_rate_changed_by_another_process(self):
+        """Test a rate written elsewhere - no signal here, cache untouched - is picked up"""
+        tests = self.make_tests(2)
+        rate = PCCommissionRate.objects.create(member_type='LIFETIME', test_type='DIGITAL', commission_percentage=30)
+        self.assertEqual(commission.split(self.member, tests).lines[1].rate, Decimal('30'))
+
+        PCCommissionRate.objects.filter(pk=rate.pk).update(commission_percentage=35, updated_at=timezone.now())
+        self.assertEqual(commission.split(self.member, tests).lines[1].rate, Decimal('35'))
+
+        PCCommissionRate.objects.filter(pk=rate.pk).delete()
+        self.assertEqual(commission.split(self.member, tests).lines[1].rate, Decimal('25.00'))
+
+    def bill(self, tests):
+        order = LabOrder.objects.create(
+            patient=self.patient, ordered_by=self.reception, total_amount=sum(test.price for test in tests)
+        )
+        order.tests.set(tests)
+        self.client.force_login(self.reception)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('accounts:reception_billing_lab', args=[order.pk]),
+                {'pc_code': self.member.pc_code, 'discount_type': 'percentage', 'discount_value': '10'},
+            )
+        self.assertRedirects(response, reverse('lab:order_detail', args=[order.pk]), fetch_redirect_response=False)
+        return order, len(queries)
+
+    def test_billing_records_lines_in_constant_queries(self):
+        tests = self.make_tests(20)
+        # First bill of the day seeds the document number sequences
+        self.bill(tests[:1])
+        order, small = self.bill(tests[:2])
+        order, large = self.bill(tests)
+        self.assertEqual(large, small)
+
+        pc_transaction = PCTransaction.objects.get(lab_order=order)
+        self.assertEqual(pc_transaction.total_amount, Decimal('5999.94'))
+        self.assertEqual(pc_transaction.lines.count(), 20)
+        self.assertEqual(
+            pc_transaction.commission_amount,
+            sum(line.commission_amount for line in pc_transaction.lines.all()),
+        )
+        self.assertEqual(
+            Income.objects.filter(source='LAB_TEST').latest('id').amount, pc_transaction.admin_amount
+        )
+
+
+    def test_lab_order_commission_recorded_once(self):
+        """Test billing an order twice records no second commission, income or payment"""
+        tests = self.make_tests(2)
+        order, _ = self.bill(tests)
+        member = PCMember.objects.get(pk=self.member.pk)
+
+        response = self.client.post(
+            reverse('accounts:reception_billing_lab', args=[order.pk]), {'pc_code': self.member.pc_code},
+        )
+        self.assertRedirects(
+            response, reverse('accounts:reception_billing_lab', args=[order.pk]), fetch_redirect_response=False
+        )
+        self.assertEqual(PCTransaction.objects.filter(lab_order=order).count(), 1)
+        self.assertEqual(Income.objects.filter(source='LAB_TEST').count(), 1)
+        self.assertEqual(PCMember.objects.get(pk=self.member.pk).due_amount, member.due_amount)
+
+        with self.assertRaises(commission.CommissionError):
+            commission.record(self.member, commission.split(self.member, tests), lab_order=order)
+
+class PCLedgerTestCase(TestCase):
+    """Test the commission ledger, settlement and balance verification"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin1', password='testpass123', role='ADMIN')
+        self.members = [
+            PCMember.objects.create(name=f'Dr. Referrer {index}', phone=f'0170000001{index}', member_type=member_type)
+            for index, member_type in enumerate(['GENERAL', 'LIFETIME', 'PREMIUM'])
+        ]
+
+    def bill(self, member, amount='1000', rate='10'):
+        return PCTransaction.objects.create(
+            pc_member=member, total_amount=Decimal(amount), commission_percentage=Decimal(rate),
+        )
+
+    def test_accruals_from_stale_instances_are_not_lost(self):
+        member = self.members[0]
+        stale = PCMember.objects.get(pk=member.pk)
+        self.bill(member)
+        self.bill(stale, '500')
+        # Editing a member loaded before the bills keeps their balance
+        stale.name = 'Dr. Renamed'
+        stale.save()
+
+        member.refresh_from_db()
+        self.assertEqual(member.name, 'Dr. Renamed')
+        self.assertEqual(member.due_amount, Decimal('150.00'))
+        self.assertEqual(member.total_referrals, 2)
+        self.assertEqual(member.ledger_entries.filter(kind=PCLedgerEntry.KIND_ACCRUAL).count(), 2)
+        self.assertEqual(pc_ledger.verify(), [])
+
+    def test_settle_pays_every_member_in_constant_queries(self):
+        for member in self.members[:2]:
+            for _ in range(5):
+                self.bill(member)
+        self.bill(self.members[2])
+
+        with CaptureQueriesContext(connection) as queries:
+            settled = pc_ledger.settle(paid_by=self.admin)
+        self.assertEqual(settled['members'], 3)
+        self.assertEqual(settled['transactions'], 11)
+        self.assertEqual(settled['amount'], Decimal('1100.00'))
+
+        # Lock, group, payouts, mark paid, balances (plus the savepoint)
+        many = len(queries)
+        for member in self.members:
+            self.bill(member)
+        with CaptureQueriesContext(connection) as queries:
+            pc_ledger.settle(paid_by=self.admin)
+        self.assertEqual(len(queries), many)
+
+        self.assertFalse(PCTransaction.objects.filter(is_paid_to_member=False).exists())
+        member = PCMember.objects.get(pk=self.members[0].pk)
+        self.assertEqual(member.due_amount, 0)
+        self.assertEqual(member.total_commission_earned, Decimal('600.00'))
+        payout = member.ledger_entries.filter(kind=PCLedgerEntry.KIND_PAYOUT).earliest('id')
+        self.assertEqual(payout.amount, Decimal('-500.00'))
+        self.assertEqual(payout.settled_transactions.count(), 5)
+        self.assertEqual(pc_ledger.verify(), [])
+
+    def test_settle_only_selected_members(self):
+        self.bill(self.members[0])
+        self.bill(self.members[1])
+        settled = pc_ledger.settle([self.members[0]])
+        self.assertEqual(settled['transactions'], 1)
+        self.assertEqual(PCMember.objects.get(pk=self.members[1].pk).due_amount, Decimal('100.00'))
+
+    def test_mark_paid_view_settles_member(self):
+        member = self.members[0]
+        self.bill(member)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('accounts:pc_mark_paid', args=[member.pc_code]))
+        self.assertRedirects(
+            response, reverse('accounts:pc_member_list', args=[member.member_type]), fetch_redirect_response=False
+        )
+        member.refresh_from_db()
+        self.assertEqual((member.due_amount, member.total_commission_earned), (0, Decimal('100.00')))
+
+    def test_cancel_and_adjust_keep_ledger_in_step(self):
+        paid = self.bill(self.members[0])
+        pc_ledger.settle([self.members[0]])
+        unpaid = self.bill(self.members[0], '2000')
+        changed = self.bill(self.members[0])
+
+        previous = changed.commission_amount
+        changed.commission_amount = Decimal('150.00')
+        changed.save()
+        pc_ledger.adjust(changed, previous)
+        pc_ledger.cancel(PCTransaction.objects.filter(pk__in=[paid.pk, unpaid.pk]))
+
+        member = PCMember.objects.get(pk=self.members[0].pk)
+        self.assertEqual(member.due_amount, Decimal('150.00'))
+        self.assertEqual(member.total_commission_earned, Decimal('100.00'))
+        self.assertEqual(member.total_referrals, 1)
+        self.assertEqual(pc_ledger.verify(), [])
+
+    def test_verify_reports_and_resets_drift(self):
+        self.bill(self.members[0])
+        PCMember.objects.filter(pk=self.members[0].pk).update(due_amount=Decimal('5.00'), total_referrals=7)
+
+        with CaptureQueriesContext(connection) as queries:
+            mismatches = pc_ledger.verify()
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(mismatches), 1)
+        self.assertEqual(mismatches[0]['ledger_due'], Decimal('100.00'))
+        self.assertEqual(mismatches[0]['ledger_referrals'], 1)
+
+        pc_ledger.verify(fix=True)
+        member = PCMember.objects.get(pk=self.members[0].pk)
+        self.assertEqual((member.due_amount, member.total_referrals), (Decimal('100.00'), 1))
+        self.assertEqual(pc_ledger.verify(), [])
+
+
+class StatementTestCase(TestCase):
+    """Test the monthly PC member statements"""
+
+    def setUp(self):
+        # The admin action's month
+        self.period = statements.last_month()
+        self.label = f'{self.period.year}-{self.period.month:02d}'
+        self.members = [
+            PCMember.objects.create(name=f'Dr. Referrer {index}', phone=f'0170000002{index}', member_type=member_type)
+            for index, member_type in enumerate(['GENERAL', 'LIFETIME', 'PREMIUM'])
+        ]
+        for index, member in enumerate(self.members):
+            for day in range(index + 1):
+                self.bill(member, self.period.start + timedelta(days=day))
+        # Outside the month
+        self.bill(self.members[0], self.period.end)
+        pc_ledger.settle([self.members[2]])
+
+    def bill(self, member, when):
+        pc_transaction = PCTransaction.objects.create(
+            pc_member=member, total_amount=Decimal('1000'), commission_percentage=Decimal('10'),
+        )
+        PCTransaction.objects.filter(pk=pc_transaction.pk).update(transaction_date=when)
+
+    def test_one_query_for_all_members(self):
+        with CaptureQueriesContext(connection) as queries:
+            grouped = [(member.pc_code, len(list(rows))) for member, rows in statements.by_member(self.period)]
+        # Members, then the month's bills in one ordered query
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(grouped, [(member.pc_code, index + 1) for index, member in enumerate(self.members)])
+
+    def test_generate_writes_a_statement_per_member(self):
+        with tempfile.TemporaryDirectory() as directory:
+            summary = statements.generate(self.period, fmt='csv', directory=directory, workers=1)
+            self.assertEqual((summary['members'], summary['transactions']), (3, 6))
+            self.assertEqual(summary['commission'], Decimal('600.00'))
+
+            member = self.members[2]
+            with open(Path(directory) / f'{member.pc_code}-{self.label}.csv', newline='') as statement:
+                rows = list(csv.reader(statement))
+        self.assertEqual(len(rows), 2 + 3 + 4)
+        self.assertEqual(rows[-4][1:6], ['3', '', '3000.00', '', '300.00'])
+        self.assertEqual(rows[-3][5], '300.00')
+        self.assertEqual(rows[-2][5], '0.00')
+
+    def test_generate_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            summary = statements.generate(
+                self.period, directory=Path(directory) / self.label, archive=True, workers=1
+            )
+            with zipfile.ZipFile(summary['path']) as archive:
+                names = archive.namelist()
+                html = archive.read(names[0]).decode()
+            self.assertEqual([path.name for path in Path(directory).iterdir()], [f'{self.label}.zip'])
+        self.assertEqual(names, [f'{member.pc_code}-{self.label}.html' for member in self.members])
+        self.assertIn('Dr. Referrer 0', html)
+
+    def test_admin_action_streams_zip(self):
+        admin = User.objects.create_superuser('root', 'root@example.com', 'testpass123', role='ADMIN')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:accounts_pcmember_changelist'), {
+            'action': 'download_statements', '_selected_action': [self.members[1].pk],
+        })
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f'{self.members[1].pc_code}-{self.label}.html'])
+
+
+class PublicDirectoryTestCase(TestCase):
+    """Test the cached public PC member pages and their conditional GETs"""
+
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('accounts:public_lifetime_members')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member = PCMember.objects.create(name='Dr. Lifetime', phone='01700000031', member_type='LIFETIME')
+
+    def test_page_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        self.assertContains(first, 'Dr. Lifetime')
+        self.assertTrue(first['ETag'])
+        self.assertTrue(first['Last-Modified'])
+
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_conditional_get_answers_304_without_queries(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], first['ETag'])
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_member_save_invalidates_page(self):
+        first = self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.member.name = 'Dr. Renamed'
+            self.member.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Dr. Renamed')
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+    def test_version_shared_through_cache(self):
+        """Test a save in another worker - only its cache write seen here - revalidates"""
+        first = self.client.get(self.url)
+        PCMember.objects.filter(pk=self.member.pk).update(name='Dr. Elsewhere')
+        # What the other worker's signal wrote to the shared cache
+        public_directory.invalidate('LIFETIME')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Dr. Elsewhere')
+        self.assertEqual(self.client.get(self.url)['ETag'], response['ETag'])
+
+    def test_deploy_check_wants_shared_cache(self):
+        from .checks import check_shared_cache
+
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with self.settings(CACHES=locmem):
+            self.assertEqual([warning.id for warning in check_shared_cache(None)], ['accounts.W001'])
+        with self.settings(CACHES=redis):
+            self.assertEqual(check_shared_cache(None), [])
+
+    def test_search_is_not_cached(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url, {'search': 'nobody'})
+        self.assertNotContains(response, 'Dr. Lifetime')
+        self.assertFalse(response.has_header('ETag'))
@@ -10,6 +10,8 @@ urlpatterns = [
     path('pc-member/<str:pc_code>/commission/', views.manage_pc_commission, name='manage_pc_commission'),
     path('pc-rates/update/<str:member_type>/', views.update_default_rates, name='update_default_rates'),
     path('admin-dashboard/', views.admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/metrics/', views.admin_dashboard_metrics, name='admin_dashboard_metrics'),
+    path('admin-dashboard/instrumentation/', views.admin_instrumentation, name='admin_instrumentation'),
     path('admin-finance/', views.admin_finance_dashboard, name='admin_finance'),
     path('admin-finance/add-expense/', views.quick_add_expense, name='quick_add_expense'),
     path('doctor-dashboard/', views.doctor_dashboard, name='doctor_dashboard'),
@@ -3,7 +3,7 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Count, Sum, Q, F, Avg
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
@@ -14,6 +14,8 @@ from pharmacy.models import Drug, PharmacySale, SaleItem
 from finance.models import Income, Expense, Investor
 from survey.models import CanteenSale, CanteenItem, FeedbackSurvey
 from .models import PCMember, PCTransaction
+from diagcenter.instrumentation import query_budget
+from . import commission, dashboard_cache, dashboard_metrics, public_directory
 
 def landing_page(request):
     """Public landing page for the hospital website"""
@@ -121,128 +123,48 @@ def update_default_rates(request, member_type):
     return redirect('accounts:pc_dashboard')
 
 @login_required
+@query_budget(14)
 def admin_dashboard(request):
     """Enhanced Admin dashboard with comprehensive management features"""
-    from datetime import timedelta
-    from django.db.models.functions import TruncDate, TruncWeek, TruncMonth, TruncYear
-    from django.contrib.auth import get_user_model
-    from django.db.models import Avg
-    
-    User = get_user_model()
-    
     # Get filter period from request (default: today)
-    period = request.GET.get('period', 'today')
-    today = timezone.now().date()
-    
-    # Calculate date ranges
-    if period == 'today':
-        start_date = today
-        end_date = today
-    elif period == 'week':
-        start_date = today - timedelta(days=today.weekday())
-        end_date = start_date + timedelta(days=6)
-    elif period == 'month':
-        start_date = today.replace(day=1)
-        next_month = (start_date.replace(day=28) + timedelta(days=4)).replace(day=1)
-        end_date = next_month - timedelta(days=1)
-    elif period == 'year':
-        start_date = today.replace(month=1, day=1)
-        end_date = today.replace(month=12, day=31)
-    else:
-        start_date = today
-        end_date = today
+    period, start_date, end_date, metrics = dashboard_metrics.get_metrics(
+        request.GET.get('period', 'today'), timezone.now().date()
+    )
     
     # Financial calculations
-    income = Income.objects.filter(
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
-    
-    expenses = Expense.objects.filter(
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Sum('amount')
-    )['total'] or 0
+    income = metrics['total_income']
+    expenses = metrics['total_expenses']
     
     profit = income - expenses
     profit_margin = (profit / income * 100) if income > 0 else 0
     
     # Sales breakdown by department
-    appointment_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='CONSULTATION'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    lab_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='LAB_TEST'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    pharmacy_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='PHARMACY'
-    ).aggregate(total=Sum('amount'))['total'] or 0
-    
-    canteen_income = Income.objects.filter(
-        date__range=[start_date, end_date],
-        source='CANTEEN'
-    ).aggregate(total=Sum('amount'))['total'] or 0
+    appointment_income = metrics['appointment_income']
+    lab_income = metrics['lab_income']
+    pharmacy_income = metrics['pharmacy_income']
+    canteen_income = metrics['canteen_income']
     
     # Patient and appointment statistics
-    total_patients = Patient.objects.count()
-    new_patients_period = Patient.objects.filter(
-        registered_at__date__range=[start_date, end_date]
-    ).count()
-    
-    period_appointments = Appointment.objects.filter(
-        appointment_date__range=[start_date, end_date]
-    ).count()
-    
-    completed_appointments = Appointment.objects.filter(
-        appointment_date__range=[start_date, end_date],
-        status='completed'
-    ).count()
+    period_appointments = metrics['period_appointments']
     
     # Staff statistics
-    total_staff = User.objects.filter(is_active=True).count()
-    doctors_count = User.objects.filter(role='DOCTOR', is_active=True).count()
-    nurses_count = User.objects.filter(role='NURSE', is_active=True).count()
-    other_staff = total_staff - doctors_count - nurses_count
+    other_staff = metrics['total_staff'] - metrics['doctors_count'] - metrics['nurses_count']
     
     # Department performance
     departments_performance = {
         'appointments': {'revenue': appointment_income, 'count': period_appointments},
-        'lab': {'revenue': lab_income, 'orders': LabOrder.objects.filter(
-            ordered_at__date__range=[start_date, end_date]
-        ).count()},
-        'pharmacy': {'revenue': pharmacy_income, 'sales': PharmacySale.objects.filter(
-            sale_date__date__range=[start_date, end_date]
-        ).count()},
-        'canteen': {'revenue': canteen_income, 'orders': CanteenSale.objects.filter(
-            sale_date__date__range=[start_date, end_date]
-        ).count()}
+        'lab': {'revenue': lab_income, 'orders': metrics['lab_orders']},
+        'pharmacy': {'revenue': pharmacy_income, 'sales': metrics['pharmacy_sales']},
+        'canteen': {'revenue': canteen_income, 'orders': metrics['canteen_orders']}
     }
     
     # Average transaction values
     avg_appointment_fee = (appointment_income / period_appointments) if period_appointments > 0 else 0
-    avg_lab_order = (lab_income / departments_performance['lab']['orders']) if departments_performance['lab']['orders'] > 0 else 0
-    avg_pharmacy_sale = (pharmacy_income / departments_performance['pharmacy']['sales']) if departments_performance['pharmacy']['sales'] > 0 else 0
+    avg_lab_order = (lab_income / metrics['lab_orders']) if metrics['lab_orders'] > 0 else 0
+    avg_pharmacy_sale = (pharmacy_income / metrics['pharmacy_sales']) if metrics['pharmacy_sales'] > 0 else 0
     
     # Investors and funding
     investors = Investor.objects.all()
-    total_investment = investors.aggregate(Sum('investment_amount'))['investment_amount__sum'] or 0
-    active_investors = investors.filter(is_active=True).count()
-    
-    # Outstanding payments and dues
-    outstanding_lab_payments = LabOrder.objects.filter(
-        is_paid=False
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    
-    # PharmacySale doesn't have is_paid field, so we calculate unpaid sales
-    outstanding_pharmacy_payments = PharmacySale.objects.filter(
-        amount_paid__lt=F('total_amount')
-    ).aggregate(Sum('total_amount'))['total_amount__sum'] or 0
     
     # Recent transactions (last 15 for better overview)
     recent_income = Income.objects.filter(
@@ -257,7 +179,7 @@ def admin_dashboard(request):
     system_alerts = []
     
     # Check for low stock in pharmacy
-    low_stock_count = Drug.objects.filter(quantity_in_stock__lte=F('reorder_level')).count()
+    low_stock_count = metrics['low_stock_count']
     if low_stock_count > 0:
         system_alerts.append({
             'type': 'warning',
@@ -266,7 +188,7 @@ def admin_dashboard(request):
         })
     
     # Check for pending lab orders
-    pending_lab_orders = LabOrder.objects.filter(status='pending').count()
+    pending_lab_orders = metrics['pending_lab_orders']
     if pending_lab_orders > 5:
         system_alerts.append({
             'type': 'info',
@@ -286,23 +208,23 @@ def admin_dashboard(request):
         'lab_income': lab_income,
         'pharmacy_income': pharmacy_income,
         'canteen_income': canteen_income,
-        'total_patients': total_patients,
-        'new_patients_period': new_patients_period,
+        'total_patients': metrics['total_patients'],
+        'new_patients_period': metrics['new_patients_period'],
         'period_appointments': period_appointments,
-        'completed_appointments': completed_appointments,
-        'total_staff': total_staff,
-        'doctors_count': doctors_count,
-        'nurses_count': nurses_count,
+        'completed_appointments': metrics['completed_appointments'],
+        'total_staff': metrics['total_staff'],
+        'doctors_count': metrics['doctors_count'],
+        'nurses_count': metrics['nurses_count'],
         'other_staff': other_staff,
         'departments_performance': departments_performance,
         'avg_appointment_fee': avg_appointment_fee,
         'avg_lab_order': avg_lab_order,
         'avg_pharmacy_sale': avg_pharmacy_sale,
         'investors': investors,
-        'total_investment': total_investment,
-        'active_investors': active_investors,
-        'outstanding_lab_payments': outstanding_lab_payments,
-        'outstanding_pharmacy_payments': outstanding_pharmacy_payments,
+        'total_investment': metrics['total_investment'],
+        'active_investors': metrics['active_investors'],
+        'outstanding_lab_payments': metrics['outstanding_lab_payments'],
+        'outstanding_pharmacy_payments': metrics['outstanding_pharmacy_payments'],
         'recent_income': recent_income,
         'recent_expenses': recent_expenses,
         'system_alerts': system_alerts,
@@ -311,6 +233,42 @@ def admin_dashboard(request):
     return render(request, 'accounts/admin_dashboard.html', context)
 
 
+@login_required
+@query_budget(11)
+def admin_dashboard_metrics(request):
+    """JSON metrics for the admin dashboard, so the page can refresh them in place"""
+    from django.http import JsonResponse
+    
+    if not request.user.is_admin:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    period, start_date, end_date, metrics = dashboard_metrics.get_metrics(
+        request.GET.get('period', 'today'), timezone.now().date()
+    )
+    return JsonResponse({
+        'period': period,
+        'start_date': start_date,
+        'end_date': end_date,
+        'metrics': metrics,
+    })
+
+
+@login_required
+def admin_instrumentation(request):
+    """Per-view timings, query counts and repeated queries recorded by the
+    instrumentation middleware in this worker process"""
+    from django.http import JsonResponse
+    from diagcenter.instrumentation import HISTOGRAM_LABELS, view_stats
+    
+    if not request.user.is_admin:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    return JsonResponse({
+        'histogram_ms': HISTOGRAM_LABELS,
+        'views': view_stats.report(),
+    })
+
+
 @login_required
 def doctor_dashboard(request):
     """Doctor dashboard with appointment dates as cards"""
@@ -424,11 +382,8 @@ def old_doctor_dashboard_code():
     return render(request, 'accounts/doctor_dashboard.html', context)
 
 
-@login_required
-def receptionist_dashboard(request):
-    """Enhanced Receptionist dashboard with comprehensive patient and payment management"""
-    today = timezone.now().date()
-    
+def _receptionist_dashboard_context(user, today):
+    """Context of receptionist_dashboard - cached by dashboard_cache"""
     # Today's appointments statistics
     today_appointments = Appointment.objects.filter(
         appointment_date=today
@@ -482,7 +437,7 @@ def receptionist_dashboard(request):
     my_collections = Income.objects.filter(
         date=today,
         source='CONSULTATION',
-        recorded_by=request.user
+        recorded_by=user
     ).aggregate(
         total=Sum('amount'),
         count=Count('id')
@@ -565,7 +520,18 @@ def receptionist_dashboard(request):
         'next_appointments': next_appointments,
         'pending_feedback': pending_feedback,
     }
-    
+    return context
+
+
+@login_required
+@query_budget(21)
+def receptionist_dashboard(request):
+    """Enhanced Receptionist dashboard with comprehensive patient and payment management"""
+    today = timezone.now().date()
+    context = dashboard_cache.get_context(
+        'receptionist', lambda: _receptionist_dashboard_context(request.user, today),
+        variant=f'user:{request.user.pk}', today=today,
+    )
     return render(request, 'accounts/receptionist_dashboard.html', context)
 
 
@@ -585,15 +551,12 @@ def lab_dashboard(request):
     return render(request, 'accounts/lab_dashboard.html', context)
 
 
-@login_required
-def pharmacy_dashboard(request):
-    """Enhanced Pharmacy dashboard with comprehensive inventory and sales management"""
+def _pharmacy_dashboard_context(today):
+    """Context of pharmacy_dashboard - cached by dashboard_cache"""
     from pharmacy.models import Drug, PharmacySale, SaleItem
     from django.db.models import F, ExpressionWrapper, DateField
     from datetime import date, timedelta
     
-    today = timezone.now().date()
-    
     # Inventory statistics
     low_stock_drugs = Drug.objects.filter(
         quantity_in_stock__lte=F('reorder_level')
@@ -643,16 +606,17 @@ def pharmacy_dashboard(request):
     # Top selling drugs (this week)
     top_selling_drugs = SaleItem.objects.filter(
         sale__sale_date__date__gte=week_start
-    ).values('drug__name').annotate(
+    ).values('drug__brand_name').annotate(
         total_quantity=Sum('quantity'),
         total_revenue=Sum(F('quantity') * F('unit_price'))
     ).order_by('-total_quantity')[:5]
     
-    # Reorder suggestions based on usage patterns
-    reorder_suggestions = Drug.objects.filter(
-        quantity_in_stock__lt=F('reorder_level') * 2,
-        quantity_in_stock__gt=0
-    ).order_by('quantity_in_stock')[:10]
+    # Reorder suggestions from the nightly sales forecast (forecast_reorders)
+    from pharmacy.models import DrugForecast
+    reorder_suggestions = DrugForecast.objects.filter(
+        suggested_order__gt=0,
+        drug__is_active=True
+    ).select_related('drug')[:10]
     
     # Payment status summary - PharmacySale doesn't have is_paid, calculate unpaid
     pending_payments = PharmacySale.objects.filter(
@@ -674,16 +638,23 @@ def pharmacy_dashboard(request):
         'reorder_suggestions': reorder_suggestions,
         'pending_payments': pending_payments,
     }
-    
-    return render(request, 'accounts/pharmacy_dashboard.html', context)
+    return context
 
 
 @login_required
-def canteen_dashboard(request):
-    """Enhanced Canteen dashboard with comprehensive order and inventory management"""
-    from survey.models import CanteenSale, CanteenOrder, CanteenMenuItem, CanteenOrderItem
-    
+def pharmacy_dashboard(request):
+    """Enhanced Pharmacy dashboard with comprehensive inventory and sales management"""
     today = timezone.now().date()
+    context = dashboard_cache.get_context(
+        'pharmacy', lambda: _pharmacy_dashboard_context(today),
+        variant=request.user.role, today=today,
+    )
+    return render(request, 'accounts/pharmacy_dashboard.html', context)
+
+
+def _canteen_dashboard_context(today):
+    """Context of canteen_dashboard - cached by dashboard_cache"""
+    from survey.models import CanteenSale, CanteenOrder, CanteenMenuItem, CanteenOrderItem
     
     # Order statistics
     today_orders = CanteenOrder.objects.filter(order_date__date=today).count()
@@ -778,7 +749,17 @@ def canteen_dashboard(request):
         'payment_methods': payment_methods,
         'top_customers': top_customers,
     }
-    
+    return context
+
+
+@login_required
+def canteen_dashboard(request):
+    """Enhanced Canteen dashboard with comprehensive order and inventory management"""
+    today = timezone.now().date()
+    context = dashboard_cache.get_context(
+        'canteen', lambda: _canteen_dashboard_context(today),
+        variant=request.user.role, today=today,
+    )
     return render(request, 'accounts/canteen_dashboard.html', context)
 
 
@@ -990,7 +971,7 @@ def pharmacy_management(request):
     
     # Get period filter
     period = request.GET.get('period', 'today')
-    today = timezone.now().date()
+    today = timezone.localdate()
     
     # Calculate date ranges
     if period == 'today':
@@ -1031,10 +1012,11 @@ def pharmacy_management(request):
         quantity_in_stock__lte=F('reorder_level')
     ).count()
     
-    # Calculate total stock value
-    drugs = Drug.objects.filter(is_active=True)
-    total_stock_buy_value = sum(d.stock_value_buy for d in drugs)
-    total_stock_sell_value = sum(d.stock_value_sell for d in drugs)
+    # Total stock value, aggregated over the batches in stock
+    from pharmacy import stock
+    stock_value = stock.stock_value()
+    total_stock_buy_value = stock_value['cost']
+    total_stock_sell_value = stock_value['retail']
     
     # Recent sales
     recent_sales = PharmacySale.objects.select_related('served_by').order_by('-sale_date')[:10]
@@ -1045,15 +1027,13 @@ def pharmacy_management(request):
         quantity_in_stock__lte=F('reorder_level')
     ).order_by('quantity_in_stock')[:10]
     
-    # Top selling drugs
-    from pharmacy.models import SaleItem
-    top_drugs = SaleItem.objects.filter(
-        sale__sale_date__date__range=[start_date, end_date]
-    ).values('drug__brand_name').annotate(
-        total_qty=Sum('quantity'),
-        total_amount=Sum('total_price'),
-        total_profit=Sum('profit')
-    ).order_by('-total_qty')[:10]
+    # Profit analytics, read from the per-day sales cube
+    from pharmacy import analytics
+    top_drugs = analytics.top_drugs(start_date, end_date, order_by='profit')
+    line_totals = analytics.totals(start_date, end_date)
+    trend_start = (today.replace(day=1) - timedelta(days=150)).replace(day=1)
+    category_trend = analytics.category_margins(trend_start, today, period='month')
+    slow_movers = analytics.slow_movers(days=90, today=today, limit=10)
     
     context = {
         'period': period,
@@ -1078,6 +1058,9 @@ def pharmacy_management(request):
         'recent_sales': recent_sales,
         'low_stock_items': low_stock_items,
         'top_drugs': top_drugs,
+        'line_margin': line_totals['margin'],
+        'category_trend': category_trend,
+        'slow_movers': slow_movers,
     }
     
     return render(request, 'accounts/pharmacy_management.html', context)
@@ -1241,6 +1224,7 @@ def add_stock(request):
                 supplier=request.POST.get('supplier', ''),
                 invoice_number=request.POST.get('invoice_number', ''),
                 batch_number=request.POST.get('batch_number', ''),
+                expiry_date=request.POST.get('expiry_date') or None,
                 adjusted_by=request.user,
             )
             messages.success(request, f"Stock adjustment added successfully! Expense created: ৳{adjustment.quantity * adjustment.unit_cost}")
@@ -1514,6 +1498,7 @@ def admin_finance_dashboard(request):
         return redirect('accounts:dashboard')
     
     from finance.models import Income, Expense
+    from finance import rollups
     from accounts.models import PCTransaction
     from datetime import timedelta
     from django.db.models import Sum, Count
@@ -1552,28 +1537,18 @@ def admin_finance_dashboard(request):
         end_date = today
         period_name = 'Today'
     
-    # Total Income (Gross)
-    income_data = Income.objects.filter(
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Sum('amount'),
-        count=Count('id')
-    )
-    gross_income = income_data['total'] or 0
+    # Totals from the daily finance rollup
+    figures = rollups.totals(start_date, end_date)
+    gross_income = figures['income']
     
     # Income by source
-    income_by_source = Income.objects.filter(
-        date__range=[start_date, end_date]
-    ).values('source').annotate(
-        total=Sum('amount'),
-        count=Count('id')
-    )
+    income_by_source = rollups.breakdown(rollups.INCOME, 'source', start_date, end_date)
     
     income_sources = {}
     income_counts = {}
     for item in income_by_source:
         income_sources[item['source']] = item['total']
-        income_counts[item['source']] = item['count']
+        income_counts[item['source']] = item['records']
     
     # Fill in missing sources with 0
     for source in ['CONSULTATION', 'LAB_TEST', 'PHARMACY', 'CANTEEN', 'OTHER']:
@@ -1598,30 +1573,19 @@ def admin_finance_dashboard(request):
     net_income = gross_income + admin_revenue_from_pc
     
     # Regular Expenses
-    expense_data = Expense.objects.filter(
-        date__range=[start_date, end_date]
-    ).aggregate(
-        total=Sum('amount'),
-        count=Count('id')
-    )
-    regular_expenses = expense_data['total'] or 0
+    regular_expenses = figures['expense']
     
     # Total Expenses (Regular + PC Commission)
     total_expenses = regular_expenses + pc_commission_expense
     
     # Expenses by type
-    expenses_by_type = Expense.objects.filter(
-        date__range=[start_date, end_date]
-    ).values('expense_type').annotate(
-        total=Sum('amount'),
-        count=Count('id')
-    )
+    expenses_by_type = rollups.breakdown(rollups.EXPENSE, 'source', start_date, end_date)
     
     expense_types = {}
     expense_counts = {}
     for item in expenses_by_type:
-        expense_types[item['expense_type']] = item['total']
-        expense_counts[item['expense_type']] = item['count']
+        expense_types[item['source']] = item['total']
+        expense_counts[item['source']] = item['records']
     
     # Add PC Commission as expense type
     if pc_commission_expense > 0:
@@ -1730,102 +1694,63 @@ def reception_billing_lab(request, order_id):
         discount_value = request.POST.get('discount_value', '0')
         
         try:
-            discount_value = float(discount_value) if discount_value else 0
-            original_amount = float(lab_order.total_amount)
+            discount_value = Decimal(discount_value or '0')
+            original_amount = lab_order.total_amount
             
             # Calculate discount
             if discount_type == 'percentage' and discount_value > 0:
-                discount_amount = original_amount * (discount_value / 100)
+                discount_amount = commission.money(original_amount * discount_value / 100)
             elif discount_type == 'amount' and discount_value > 0:
                 discount_amount = discount_value
             else:
-                discount_amount = 0
+                discount_amount = Decimal('0')
             
             final_amount = original_amount - discount_amount
             
-            # PC Code processing
-            pc_member = None
-            commission_amount = 0
-            admin_amount = 0
-            
-            if pc_code:
-                try:
-                    from .models import PCMember, PCTransaction
-                    pc_member = PCMember.objects.get(pc_code=pc_code, is_active=True)
-                    
-                    # Get test types in the order
-                    from .models_commission import PCCommissionRate
-                    from lab.models import LabTest
-                    
-                    # Calculate commission for each test type separately
-                    commission_amount = 0
-                    admin_amount = final_amount
-                    
-                    # Group tests by type and calculate commission
-                    for test in lab_order.tests.all():
-                        test_amount = float(test.price)
-                        test_share = test_amount / float(lab_order.total_amount)
-                        test_final_amount = final_amount * test_share
-                        
-                        try:
-                            # Get commission rate for this member type and test type
-                            commission_rate = PCCommissionRate.objects.get(
-                                member_type=pc_member.member_type,
-                                test_type=test.test_type
-                            )
-                            test_commission = test_final_amount * (float(commission_rate.commission_percentage) / 100)
-                            commission_amount += test_commission
-                            admin_amount -= test_commission
-                        except PCCommissionRate.DoesNotExist:
-                            # Use default commission rate if specific rate not found
-                            default_commission = float(pc_member.commission_percentage)
-                            test_commission = test_final_amount * (default_commission / 100)
-                            commission_amount += test_commission
-                            admin_amount -= test_commission
-                    
-                    # Create PC Transaction
-                    pc_transaction = PCTransaction.objects.create(
-                        pc_member=pc_member,
-                        patient=lab_order.patient,
-                        total_amount=final_amount,
-                        commission_percentage=Decimal(str((commission_amount / final_amount * 100) if final_amount > 0 else 0)),
-                        commission_amount=commission_amount,
-                        admin_amount=admin_amount,
-                        recorded_by=request.user,
-                        notes=f'Lab Order {lab_order.order_number}'
-                    )
-                    
-                    # Update PC Member stats
-                    pc_member.due_amount += commission_amount
-                    pc_member.total_referrals += 1
-                    pc_member.save()
-                    
-                    messages.success(request, f'✅ PC Code applied: {pc_code} | Commission: ৳{commission_amount:.2f}')
-                except PCMember.DoesNotExist:
-                    messages.warning(request, f'⚠️ Invalid PC Code: {pc_code}')
+            # PC Code processing - the commission is split per test
+            commission_amount = Decimal('0')
+            admin_amount = final_amount
+            pc_member = PCMember.objects.filter(pc_code=pc_code, is_active=True).first() if pc_code else None
             
-            # Record income - only admin's share if PC code was used
             from finance.models import Income
             from django.utils import timezone
             
-            # If PC code was used, only record admin's portion
-            income_amount = admin_amount if pc_code and commission_amount > 0 else final_amount
-            income_desc = f'Lab Order {lab_order.order_number} - {lab_order.patient.get_full_name()}'
-            if pc_code and commission_amount > 0:
-                income_desc += f' (Admin share after PC commission: ৳{commission_amount:.2f} to {pc_code})'
-            
-            Income.objects.create(
-                source='LAB_TEST',
-                amount=income_amount,
-                date=timezone.now().date(),
-                description=income_desc,
-                recorded_by=request.user
-            )
-            
-            # Mark as paid
-            lab_order.is_paid = True
-            lab_order.save()
+            # Commission, income and payment together - all or nothing
+            with transaction.atomic():
+                if pc_member:
+                    split = commission.split(pc_member, lab_order.tests.all(), final_amount)
+                    commission.record(
+                        pc_member,
+                        split,
+                        recorded_by=request.user,
+                        patient=lab_order.patient,
+                        lab_order=lab_order,
+                        notes=f'Lab Order {lab_order.order_number}',
+                    )
+                    commission_amount, admin_amount = split.commission, split.admin
+                
+                # Record income - only admin's share if PC code was used
+                income_amount = admin_amount if pc_code and commission_amount > 0 else final_amount
+                income_desc = f'Lab Order {lab_order.order_number} - {lab_order.patient.get_full_name()}'
+                if pc_code and commission_amount > 0:
+                    income_desc += f' (Admin share after PC commission: ৳{commission_amount:.2f} to {pc_code})'
+                
+                Income.objects.create(
+                    source='LAB_TEST',
+                    amount=income_amount,
+                    date=timezone.now().date(),
+                    description=income_desc,
+                    recorded_by=request.user
+                )
+                
+                # Mark as paid
+                lab_order.is_paid = True
+                lab_order.save()
             
+            if pc_member:
+                messages.success(request, f'✅ PC Code applied: {pc_code} | Commission: ৳{commission_amount:.2f}')
+            elif pc_code:
+                messages.warning(request, f'⚠️ Invalid PC Code: {pc_code}')
             messages.success(request, f'✅ Payment received: ৳{final_amount:.2f} (Original: ৳{original_amount:.2f}, Discount: ৳{discount_amount:.2f})')
             
             return redirect('lab:order_detail', pk=lab_order.id)
@@ -1835,7 +1760,6 @@ def reception_billing_lab(request, order_id):
             return redirect('accounts:reception_billing_lab', order_id=order_id)
     
     # GET request
-    from .models import PCMember
     pc_members = PCMember.objects.filter(is_active=True).order_by('pc_code')
     
     return render(request, 'accounts/reception_billing_lab.html', {
@@ -1902,13 +1826,10 @@ def reception_billing_appointment(request, appointment_id):
 
 # ===== LAB ASSISTANT VIEWS =====
 
-@login_required
-def lab_assistant_dashboard(request):
-    """Lab assistant dashboard - see all appointments/serials and create lab bills"""
+def _lab_assistant_dashboard_context(today):
+    """Context of lab_assistant_dashboard - cached by dashboard_cache"""
     from lab.models import LabBill, LabTest
     
-    today = timezone.now().date()
-    
     # Get today's appointments (serials)
     appointments = Appointment.objects.filter(
         appointment_date=today,
@@ -1918,7 +1839,7 @@ def lab_assistant_dashboard(request):
     # Pending lab bills (not paid yet)
     pending_bills = LabBill.objects.filter(
         payment_status='PENDING'
-    ).select_related('patient', 'appointment').order_by('-created_at')[:20]
+    ).select_related('patient', 'appointment').prefetch_related('tests').order_by('-created_at')[:20]
     
     # Today's completed bills
     today_bills = LabBill.objects.filter(
@@ -1947,7 +1868,18 @@ def lab_assistant_dashboard(request):
         'pending_amount': pending_amount,
         'available_tests': available_tests,
     }
-    
+    return context
+
+
+@login_required
+@query_budget(14)
+def lab_assistant_dashboard(request):
+    """Lab assistant dashboard - see all appointments/serials and create lab bills"""
+    today = timezone.now().date()
+    context = dashboard_cache.get_context(
+        'lab_assistant', lambda: _lab_assistant_dashboard_context(today),
+        variant=request.user.role, today=today,
+    )
     return render(request, 'accounts/lab_assistant_dashboard.html', context)
 
 
@@ -2111,6 +2043,7 @@ def collect_lab_payment(request, bill_id):
 # PUBLIC PC MEMBER DIRECTORY PAGES
 # ============================================
 
+@public_directory.cached_page('GENERAL')
 def public_general_members(request):
     """Public page showing all general PC members with search"""
     search_query = request.GET.get('search', '').strip()
@@ -2135,6 +2068,7 @@ def public_general_members(request):
     })
 
 
+@public_directory.cached_page('LIFETIME')
 def public_lifetime_members(request):
     """Public page showing all lifetime PC members with search"""
     search_query = request.GET.get('search', '').strip()
@@ -2159,6 +2093,7 @@ def public_lifetime_members(request):
     })
 
 
+@public_directory.cached_page('PREMIUM')
 def public_investor_members(request):
     """Public page showing all premium/investor PC members with search"""
     search_query = request.GET.get('search', '').strip()
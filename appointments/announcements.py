@@ -0,0 +1,118 @@
+"""
+Announcement audio stitched from cached MP3 clips
+
+An announcement is a fixed sequence of clips (see ``tts.announcement_segments``).
+MP3 is a stream of self-contained frames, so clips rendered by the same engine
+can be played back-to-back by concatenating their frames - after stripping any
+ID3 tags - without decoding or re-encoding. Clip bytes are held in memory as
+``memoryview`` slices and handed to the response as-is.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from .tts import TTSError, announcement_segments, tts_store
+
+
+def mp3_frames(data):
+    """Return a memoryview of the MPEG frames in an MP3 file, without ID3 tags"""
+    view = memoryview(data)
+    start, end = 0, len(view)
+
+    # ID3v2 header: "ID3", version (2), flags (1), syncsafe size (4)
+    if end >= 10 and view[:3] == b'ID3':
+        size = 0
+        for byte in view[6:10]:
+            size = (size << 7) | (byte & 0x7F)
+        start = 10 + size
+        if view[5] & 0x10:
+            start += 10  # footer present
+
+    # ID3v1 trailer: last 128 bytes start with "TAG"
+    if end - start >= 128 and view[end - 128:end - 125] == b'TAG':
+        end -= 128
+
+    return view[start:end]
+
+
+class ClipCache:
+    """In-memory LRU of clip frames
+
+    Keyed by path and inode: the store replaces files atomically, so a
+    re-rendered clip gets a new inode, while hits only touch the mtime.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._clips = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def frames(self, cached, audio):
+        """MP3 frames of a clip, ``audio`` being its open file"""
+        stat = os.fstat(audio.fileno())
+        key = (str(cached.path), stat.st_ino, stat.st_size)
+        with self._lock:
+            frames = self._clips.get(key)
+            if frames is not None:
+                self._clips.move_to_end(key)
+                return frames
+
+        frames = mp3_frames(audio.read())
+        with self._lock:
+            if key not in self._clips:
+                self._clips[key] = frames
+                self._size += len(frames)
+                while self._size > self.max_bytes and len(self._clips) > 1:
+                    _, dropped = self._clips.popitem(last=False)
+                    self._size -= len(dropped)
+        return frames
+
+    def clear(self):
+        with self._lock:
+            self._clips.clear()
+            self._size = 0
+
+
+clip_cache = ClipCache()
+
+
+class Announcement:
+    """Stitched audio for one call"""
+
+    content_type = 'audio/mpeg'
+
+    def __init__(self, parts, etags, preferred):
+        self.parts = parts
+        self.preferred = preferred
+        self.etag = '"%s"' % hashlib.sha256('|'.join(etags).encode('utf-8')).hexdigest()[:32]
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        return iter(self.parts)
+
+
+def compose(serial_number, patient_name, room_number, doctor_name='', store=None):
+    """Build the announcement from cached clips, synthesizing only missing ones
+
+    Raises ``TTSError`` when a clip can't be rendered or isn't MP3 (an offline
+    fallback engine), in which case the display falls back to per-segment
+    playback.
+    """
+    store = store or tts_store
+    segments = announcement_segments(serial_number, patient_name, room_number, doctor_name)
+
+    parts, etags, preferred = [], [], True
+    for text in segments:
+        cached, audio = store.open(text)
+        with audio:
+            if cached.content_type != Announcement.content_type:
+                raise TTSError(f'{cached.engine.name} audio can not be concatenated')
+            parts.append(clip_cache.frames(cached, audio))
+        etags.append(cached.etag)
+        preferred = preferred and cached.preferred
+
+    return Announcement(parts, etags, preferred)
@@ -1,10 +1,18 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
+
+from lab import worklist
+
+from .queue_state import queue_state
 
 class QueueConsumer(AsyncWebsocketConsumer):
-    """WebSocket consumer for real-time queue updates"""
+    """WebSocket consumer for real-time queue updates
+
+    On connect the tablet gets a full ``queue_update`` snapshot; afterwards it
+    receives versioned ``queue_delta`` messages built by the in-process queue
+    state engine from the changes broadcast by ``appointments.signals``.
+    """
     
     async def connect(self):
         self.doctor_id = self.scope['url_route']['kwargs'].get('doctor_id', 'all')
@@ -15,15 +23,13 @@ class QueueConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        queue_state.subscribe(self.doctor_id)
+        self.subscribed = True
         
         await self.accept()
         
         # Send current queue status
-        queue_data = await self.get_queue_data()
-        await self.send(text_data=json.dumps({
-            'type': 'queue_update',
-            'queue': queue_data
-        }))
+        await self.send(text_data=await self.get_queue_snapshot())
     
     async def disconnect(self, close_code):
         # Leave room group
@@ -31,6 +37,9 @@ class QueueConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        if getattr(self, 'subscribed', False):
+            queue_state.unsubscribe(self.doctor_id)
+            self.subscribed = False
     
     async def receive(self, text_data):
         """Receive message from WebSocket"""
@@ -43,12 +52,8 @@ class QueueConsumer(AsyncWebsocketConsumer):
             await self.call_next_patient(appointment_id)
         
         elif message_type == 'refresh_queue':
-            # Refresh queue data
-            queue_data = await self.get_queue_data()
-            await self.send(text_data=json.dumps({
-                'type': 'queue_update',
-                'queue': queue_data
-            }))
+            # Resend the current snapshot - served from memory once loaded
+            await self.send(text_data=await self.get_queue_snapshot())
     
     async def queue_update(self, event):
         """Receive queue update from room group"""
@@ -57,6 +62,12 @@ class QueueConsumer(AsyncWebsocketConsumer):
             'queue': event['queue']
         }))
     
+    async def queue_change(self, event):
+        """Receive an appointment change and forward the resulting delta"""
+        text = queue_state.apply(event['change'], self.doctor_id, event['change_id'])
+        if text:
+            await self.send(text_data=text)
+    
     async def patient_called(self, event):
         """Receive patient called event"""
         await self.send(text_data=json.dumps({
@@ -67,41 +78,9 @@ class QueueConsumer(AsyncWebsocketConsumer):
         }))
     
     @database_sync_to_async
-    def get_queue_data(self):
-        """Get current queue data from database"""
-        from appointments.models import Appointment
-        from django.db.models import Q
-        
-        today = timezone.now().date()
-        
-        # Build query
-        query = Q(appointment_date=today) & (
-            Q(status='WAITING') | Q(status='CALLED') | Q(status='IN_PROGRESS')
-        )
-        
-        if self.doctor_id != 'all':
-            query &= Q(doctor_id=self.doctor_id)
-        
-        appointments = Appointment.objects.filter(query).select_related(
-            'patient', 'doctor'
-        ).order_by('serial_number')
-        
-        queue_list = []
-        for apt in appointments:
-            queue_list.append({
-                'id': apt.id,
-                'appointment_number': apt.appointment_number,
-                'serial_number': apt.serial_number,
-                'patient_name': apt.patient.get_full_name(),
-                'patient_id': apt.patient.patient_id,
-                'doctor_name': apt.doctor.get_full_name(),
-                'status': apt.status,
-                'check_in_time': apt.check_in_time.isoformat() if apt.check_in_time else None,
-                'called_time': apt.called_time.isoformat() if apt.called_time else None,
-                'room_number': apt.room_number,
-            })
-        
-        return queue_list
+    def get_queue_snapshot(self):
+        """Get the encoded queue snapshot, loading it from the database on first use"""
+        return queue_state.snapshot(self.doctor_id)
     
     @database_sync_to_async
     def call_next_patient(self, appointment_id):
@@ -177,3 +156,48 @@ class DisplayMonitorConsumer(AsyncWebsocketConsumer):
             'type': 'queue_update',
             'message': 'Queue updated'
         }))
+
+
+class LabWorklistConsumer(AsyncWebsocketConsumer):
+    """WebSocket consumer for the lab worklist screens
+
+    On connect the screen gets a ``worklist_counts`` snapshot; afterwards it
+    receives a ``worklist_change`` for every committed lab order change, with
+    the counts after it (``lab.worklist``), instead of reloading the page.
+    """
+
+    group_name = worklist.GROUP
+
+    async def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept()
+        await self.send_counts()
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def receive(self, text_data):
+        """Receive message from WebSocket"""
+        data = json.loads(text_data)
+        if data.get('type') == 'refresh_counts':
+            await self.send_counts()
+
+    async def worklist_change(self, event):
+        """Forward an order change - encoded once by the sender for every screen"""
+        await self.send(text_data=event['text'])
+
+    async def send_counts(self):
+        await self.send(text_data=json.dumps({
+            'type': 'worklist_counts',
+            'counts': await self.get_counts(),
+        }))
+
+    @database_sync_to_async
+    def get_counts(self):
+        """Status counts - from the cache, one query when they need rebuilding"""
+        return worklist.counts()
@@ -147,7 +147,6 @@ class QuickAppointmentForm(forms.Form):
         """Create or get patient and create appointment with payment tracking"""
         from finance.models import Income
         from django.utils import timezone
-        from django.db.models import Max
         from datetime import date
         
         full_name = self.cleaned_data['full_name']
@@ -196,23 +195,14 @@ class QuickAppointmentForm(forms.Form):
         # Get today's date
         today = timezone.now().date()
         
-        # Get next serial number for today and this doctor
-        last_serial = Appointment.objects.filter(
-            doctor=doctor,
-            appointment_date=today
-        ).aggregate(Max('serial_number'))['serial_number__max'] or 0
-        
-        next_serial = last_serial + 1
-        
-        # Create appointment
+        # Create appointment - serial number is assigned atomically on save
         appointment = Appointment.objects.create(
             patient=patient,
             doctor=doctor,
             appointment_date=today,
             appointment_time=timezone.now().time(),
-            serial_number=next_serial,
             reason=reason,
-            status='WAITING',
+            status='waiting',
             created_by=created_by
         )
         
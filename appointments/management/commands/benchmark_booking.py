@@ -0,0 +1,108 @@
+"""
+Load test for queue serial assignment
+
+Run: python manage.py benchmark_booking --appointments 1000 --workers 25
+
+Books appointments for a single throw-away doctor from many threads at once
+(like receptionists and the public booking page hitting the same doctor) and
+checks the resulting serials are exactly 1..N with no duplicates or gaps.
+All rows created by the run are removed afterwards.
+"""
+import statistics
+import threading
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.models import User, DocumentSequence
+from appointments.models import Appointment
+from patients.models import Patient
+
+
+class Command(BaseCommand):
+    help = 'Book appointments concurrently for one doctor and verify serials are gapless'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--appointments', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=25)
+
+    def handle(self, *args, **options):
+        total = options['appointments']
+        workers = options['workers']
+        booking_date = date(2099, 1, 1)
+
+        doctor = User.objects.create_user(
+            username=f'bench_doctor_{int(time.time())}',
+            password=None,
+            role='DOCTOR',
+        )
+        patient = Patient.objects.create(
+            first_name='Bench', last_name='Patient', date_of_birth=date(1990, 1, 1),
+            gender='O', phone='00000000000', address='Benchmark', city='',
+            emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+        )
+
+        timings = []
+        errors = []
+        lock = threading.Lock()
+        remaining = iter(range(total))
+
+        def worker():
+            local_timings = []
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            break
+                    started = time.perf_counter()
+                    try:
+                        Appointment.objects.create(
+                            patient=patient,
+                            doctor=doctor,
+                            appointment_date=booking_date,
+                            status='waiting',
+                        )
+                    except Exception as exc:
+                        errors.append(exc)
+                    local_timings.append(time.perf_counter() - started)
+            finally:
+                connection.close()
+            with lock:
+                timings.extend(local_timings)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        wall_start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall_time = time.perf_counter() - wall_start
+
+        serials = list(Appointment.objects.filter(
+            doctor=doctor, appointment_date=booking_date
+        ).order_by('serial_number').values_list('serial_number', flat=True))
+        gapless = serials == list(range(1, len(serials) + 1))
+
+        # Clean up everything the run created
+        doctor.delete()
+        patient.delete()
+        DocumentSequence.objects.filter(
+            key=Appointment.serial_sequence_key(doctor.pk, booking_date)
+        ).delete()
+
+        self.stdout.write(f'Workers:      {workers}')
+        self.stdout.write(f'Booked:       {len(serials)} / {total} in {wall_time:.2f}s')
+        self.stdout.write(f'Errors:       {len(errors)}')
+        if timings:
+            latencies = sorted(t * 1000 for t in timings)
+            self.stdout.write(f'Latency p50:  {statistics.median(latencies):.2f} ms')
+            self.stdout.write(f'Latency max:  {latencies[-1]:.2f} ms')
+        if errors:
+            self.stdout.write(self.style.WARNING(f'First error: {errors[0]!r}'))
+
+        if gapless and len(serials) == total:
+            self.stdout.write(self.style.SUCCESS(f'Serials 1..{total} are gapless and unique'))
+        else:
+            self.stdout.write(self.style.ERROR('Serials have gaps or are missing bookings'))
@@ -0,0 +1,114 @@
+"""
+Fan-out benchmark for the display monitor WebSocket
+
+Run: python manage.py benchmark_display_fanout --connections 1,10,100 --rounds 50
+     REDIS_URL=redis://127.0.0.1:6379/0 python manage.py benchmark_display_fanout
+
+Opens N ``DisplayMonitorConsumer`` connections on the configured channel layer
+and sends ``patient_called`` the way ``call_patient``/``call_next_patient`` do
+- ``async_to_sync(group_send)`` from a worker thread. Latency is measured from
+the call until the message reaches each screen; the report shows the median
+screen and the slowest screen per call.
+"""
+import asyncio
+import contextlib
+import io
+import statistics
+import time
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from appointments.consumers import DisplayMonitorConsumer
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark call-to-screen latency for 1/10/100 display monitors'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', default='1,10,100',
+                            help='Comma separated connection counts')
+        parser.add_argument('--rounds', type=int, default=50)
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='Seconds to wait for a screen to receive a call')
+
+    def handle(self, *args, **options):
+        counts = [int(count) for count in options['connections'].split(',')]
+        backend = settings.CHANNEL_LAYERS['default']['BACKEND']
+        self.stdout.write(f'Channel layer: {backend}')
+
+        for count in counts:
+            # The consumer logs every connect/message - keep it out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = asyncio.run(self.run_fanout(count, options['rounds'], options['timeout']))
+            self.report(count, *result)
+
+    async def run_fanout(self, count, rounds, timeout):
+        application = DisplayMonitorConsumer.as_asgi()
+        communicators = [WebsocketCommunicator(application, '/ws/display/') for _ in range(count)]
+        for communicator in communicators:
+            connected, _ = await communicator.connect()
+            if not connected:
+                raise RuntimeError('Display monitor refused the connection')
+
+        channel_layer = get_channel_layer()
+
+        def call_patient(serial):
+            # Same path as the sync views under gunicorn
+            async_to_sync(channel_layer.group_send)('display_monitor', {
+                'type': 'patient_called',
+                'patient_name': 'Benchmark Patient',
+                'queue_number': serial,
+                'serial_number': serial,
+                'doctor_name': 'Benchmark Doctor',
+                'room_number': '1',
+            })
+
+        async def screen(communicator, started):
+            await communicator.receive_from(timeout=timeout)
+            return time.perf_counter() - started
+
+        medians, slowest, lost = [], [], 0
+        try:
+            for serial in range(1, rounds + 1):
+                started = time.perf_counter()
+                sent = sync_to_async(call_patient, thread_sensitive=False)(serial)
+                results = await asyncio.gather(
+                    sent,
+                    *(screen(communicator, started) for communicator in communicators),
+                    return_exceptions=True,
+                )
+                latencies = [r * 1000 for r in results[1:] if isinstance(r, float)]
+                lost += count - len(latencies)
+                if latencies:
+                    medians.append(statistics.median(latencies))
+                    slowest.append(max(latencies))
+        finally:
+            for communicator in communicators:
+                await communicator.disconnect()
+            if hasattr(channel_layer, 'close_pools'):
+                await channel_layer.close_pools()
+
+        return medians, slowest, lost
+
+    def report(self, count, medians, slowest, lost):
+        self.stdout.write(f'\n{count} display monitor(s)')
+        if not medians:
+            self.stdout.write(self.style.ERROR('  No call reached any screen'))
+            return
+        self.stdout.write(f'  Median screen p50: {statistics.median(medians):.2f} ms')
+        self.stdout.write(f'  Slowest screen p50: {statistics.median(slowest):.2f} ms')
+        self.stdout.write(f'  Slowest screen p95: {percentile(slowest, 95):.2f} ms')
+        self.stdout.write(f'  Slowest screen max: {max(slowest):.2f} ms')
+        if lost:
+            self.stdout.write(self.style.WARNING(f'  Lost deliveries: {lost}'))
+        else:
+            self.stdout.write(self.style.SUCCESS('  All screens received every call'))
@@ -0,0 +1,41 @@
+"""
+Pre-render announcement audio for a day's queue
+
+Run: python manage.py prewarm_tts            (today)
+     python manage.py prewarm_tts --date 2025-11-15
+     python manage.py prewarm_tts --library  (once: number words ০-৯৯৯)
+
+Synthesizes every clip the display monitor announcement is stitched from -
+the intro, serial number words, patient and doctor names and room phrases -
+into the TTS store, so calling a patient never waits on gTTS. Meant for cron
+before the clinic opens; new bookings are prewarmed in the background as they
+are created.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from appointments.tts import library_phrases, prewarm, queue_phrases
+
+
+class Command(BaseCommand):
+    help = "Synthesize announcement audio for today's queue"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=date.fromisoformat, default=None,
+                            help='Queue date (YYYY-MM-DD), default today')
+        parser.add_argument('--library', action='store_true',
+                            help='Also render the fixed clip library (number words)')
+
+    def handle(self, *args, **options):
+        day = options['date'] or timezone.now().date()
+        phrases = queue_phrases(day)
+        if options['library']:
+            phrases = sorted(set(phrases) | set(library_phrases()))
+        cached, failed = prewarm(phrases)
+
+        self.stdout.write(f'Phrases for {day}: {len(phrases)}')
+        self.stdout.write(self.style.SUCCESS(f'Cached: {cached}'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Failed: {failed}'))
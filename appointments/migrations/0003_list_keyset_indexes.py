@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_appointment_is_online_booking_and_more'),
+        ('patients', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['-appointment_date', 'serial_number', 'id'], name='appointment_list_keyset'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['created_at', 'id'], name='prescription_created_id'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from patients.models import Patient
 
@@ -14,6 +14,12 @@ class Appointment(models.Model):
         ('no_show', 'No Show'),
     ]
     
+    # Statuses that keep a patient on the live queue
+    QUEUE_STATUSES = ['waiting', 'called', 'in_consultation']
+    
+    # Attempts at auto-assigning a serial before giving up on a unique conflict
+    SERIAL_RETRIES = 3
+    
     # Appointment details
     appointment_number = models.CharField(max_length=20, unique=True, editable=False)
     patient = models.ForeignKey(Patient, on_delete=models.CASCADE, related_name='appointments')
@@ -81,6 +87,8 @@ class Appointment(models.Model):
         indexes = [
             models.Index(fields=['appointment_date', 'doctor', 'status']),
             models.Index(fields=['appointment_number']),
+            # Keyset pages of the appointment list (diagcenter.pagination)
+            models.Index(fields=['-appointment_date', 'serial_number', 'id'], name='appointment_list_keyset'),
         ]
     
     def __str__(self):
@@ -90,29 +98,44 @@ class Appointment(models.Model):
         if not self.appointment_number:
             # Generate appointment number: APT + date + sequential
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = self.appointment_date.strftime('%Y%m%d')
-            last_apt = Appointment.objects.filter(
-                appointment_number__startswith=f'APT{date_str}'
-            ).order_by('appointment_number').last()
-            
-            if last_apt:
-                last_number = int(last_apt.appointment_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.appointment_number = f'APT{date_str}{new_number:04d}'
+            self.appointment_number = next_document_number(
+                Appointment, 'appointment_number', f'APT{date_str}'
+            )
         
-        # Auto-assign serial number if not set
-        if not self.serial_number:
-            last_serial = Appointment.objects.filter(
-                doctor=self.doctor,
-                appointment_date=self.appointment_date
-            ).aggregate(models.Max('serial_number'))['serial_number__max']
-            
-            self.serial_number = (last_serial or 0) + 1
+        if self.serial_number:
+            super().save(*args, **kwargs)
+            return
         
-        super().save(*args, **kwargs)
+        # Auto-assign serial number from the per-doctor/day queue counter.
+        # The counter bump and the insert share one transaction, so a failed
+        # insert rolls the counter back and serials stay gapless.
+        from accounts.sequences import next_value, advance_to
+        key = self.serial_sequence_key(self.doctor_id, self.appointment_date)
+        
+        for attempt in range(self.SERIAL_RETRIES):
+            try:
+                with transaction.atomic():
+                    self.serial_number = next_value(key, seed=self._highest_serial)
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                # Counter fell behind a manually numbered row - resync and retry
+                self.serial_number = None
+                if attempt == self.SERIAL_RETRIES - 1:
+                    raise
+                advance_to(key, self._highest_serial())
+    
+    @staticmethod
+    def serial_sequence_key(doctor_id, appointment_date):
+        return f"SERIAL{doctor_id}-{appointment_date.strftime('%Y%m%d')}"
+    
+    def _highest_serial(self):
+        return Appointment.objects.filter(
+            doctor_id=self.doctor_id,
+            appointment_date=self.appointment_date
+        ).aggregate(models.Max('serial_number'))['serial_number__max'] or 0
     
     def call_next(self):
         """Mark this appointment as called"""
@@ -183,6 +206,10 @@ class Prescription(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pages of the pharmacy prescription queue (diagcenter.pagination)
+            models.Index(fields=['created_at', 'id'], name='prescription_created_id'),
+        ]
     
     def __str__(self):
         return f"{self.prescription_number} - {self.patient.get_full_name()}"
@@ -190,18 +217,11 @@ class Prescription(models.Model):
     def save(self, *args, **kwargs):
         if not self.prescription_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_rx = Prescription.objects.filter(
-                prescription_number__startswith=f'RX{date_str}'
-            ).order_by('prescription_number').last()
-            
-            if last_rx:
-                last_number = int(last_rx.prescription_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.prescription_number = f'RX{date_str}{new_number:04d}'
+            self.prescription_number = next_document_number(
+                Prescription, 'prescription_number', f'RX{date_str}'
+            )
         
         super().save(*args, **kwargs)
 
@@ -0,0 +1,230 @@
+"""
+In-process queue state for the live queue WebSocket
+
+Each process that serves ``QueueConsumer`` connections keeps the active queue
+per (doctor, date) in memory. The queue is loaded from the database once, when
+the first tablet for that doctor connects, and is afterwards kept current by
+applying the change messages that ``appointments.signals`` broadcasts on every
+``Appointment`` save/delete.
+
+Changes only reach a process through its subscribed consumers, so consumers
+``subscribe``/``unsubscribe`` and a doctor's queues are dropped when the
+process's last tablet for that doctor leaves - the next one loads afresh.
+
+Every connected tablet in a process receives the same change message, so the
+resulting delta is serialized once and the encoded text is reused for all of
+them.
+"""
+import json
+import threading
+from collections import Counter, OrderedDict
+
+from django.utils import timezone
+
+
+def serialize_appointment(appointment):
+    """Queue entry sent to the tablets for one appointment"""
+    return {
+        'id': appointment.id,
+        'appointment_number': appointment.appointment_number,
+        'serial_number': appointment.serial_number,
+        'patient_name': appointment.patient.get_full_name(),
+        'patient_id': appointment.patient.patient_id,
+        'doctor_id': appointment.doctor_id,
+        'doctor_name': appointment.doctor.get_full_name(),
+        'status': appointment.status,
+        'check_in_time': appointment.check_in_time.isoformat() if appointment.check_in_time else None,
+        'called_time': appointment.called_time.isoformat() if appointment.called_time else None,
+        'room_number': appointment.room_number,
+    }
+
+
+def build_change(appointment, deleted=False):
+    """Change message broadcast to the queue groups after a save/delete"""
+    return {
+        'appointment_id': appointment.id,
+        'doctor_id': appointment.doctor_id,
+        'date': appointment.appointment_date.isoformat(),
+        'deleted': deleted,
+        'appointment': serialize_appointment(appointment),
+    }
+
+
+class QueueStateEngine:
+    """Versioned queue snapshots keyed by (doctor key, ISO date)
+
+    The doctor key is the doctor id as a string, or ``'all'`` for the combined
+    queue, matching the ``doctor_id`` URL kwarg of ``QueueConsumer``.
+    """
+
+    # Encoded deltas remembered so every consumer in the process reuses them
+    ENCODED_CACHE_SIZE = 512
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._encoded = OrderedDict()
+        self._subscribers = Counter()
+
+    def reset(self):
+        with self._lock:
+            self._queues.clear()
+            self._encoded.clear()
+            self._subscribers.clear()
+
+    def subscribe(self, doctor_key):
+        """A consumer of the doctor key's group connected in this process"""
+        with self._lock:
+            self._subscribers[str(doctor_key)] += 1
+
+    def unsubscribe(self, doctor_key):
+        """A consumer left; the last one takes the doctor key's queues with it"""
+        doctor_key = str(doctor_key)
+        with self._lock:
+            self._subscribers[doctor_key] -= 1
+            if self._subscribers[doctor_key] > 0:
+                return
+            del self._subscribers[doctor_key]
+            # No longer receiving its changes - it would go stale
+            for key in [key for key in self._queues if key[0] == doctor_key]:
+                del self._queues[key]
+
+    def snapshot(self, doctor_key, day=None):
+        """Return the encoded snapshot message, loading it from the DB if needed"""
+        day = (day or timezone.now().date()).isoformat()
+        key = (str(doctor_key), day)
+
+        while True:
+            with self._lock:
+                queue = self._queues.get(key)
+                if queue is None:
+                    # Registered before loading so changes arriving meanwhile
+                    # are kept for it instead of dropped
+                    self._prune(timezone.now().date().isoformat())
+                    queue = self._queues[key] = {'loading': threading.Event(), 'pending': []}
+                    break
+                loading = queue.get('loading')
+            if loading is None:
+                return self._encode(queue)
+            # Another connection is loading it - wait and use its result
+            loading.wait()
+
+        try:
+            loaded = self._load(*key)
+        except BaseException:
+            with self._lock:
+                if self._queues.get(key) is queue:
+                    del self._queues[key]
+            queue['loading'].set()
+            raise
+
+        with self._lock:
+            for change in queue['pending']:
+                self._apply_to(loaded, change)
+            # Not kept when its last subscriber left while it loaded
+            if self._queues.get(key) is queue:
+                self._queues[key] = loaded
+        queue['loading'].set()
+        return self._encode(loaded)
+
+    def _encode(self, queue):
+        with self._lock:
+            if queue['encoded'] is None:
+                queue['encoded'] = json.dumps({
+                    'type': 'queue_update',
+                    'version': queue['version'],
+                    'queue': sorted(queue['entries'].values(), key=lambda e: e['serial_number']),
+                })
+            return queue['encoded']
+
+    def apply(self, change, doctor_key, change_id):
+        """Apply a change message to the doctor's queue and return the encoded delta
+
+        Returns ``None`` when the queue isn't loaded in this process or the
+        change doesn't affect it. A change for a queue that is still loading
+        is applied to it once loaded.
+        """
+        doctor_key = str(doctor_key)
+        cache_key = (change_id, doctor_key)
+
+        with self._lock:
+            if cache_key in self._encoded:
+                return self._encoded[cache_key]
+
+            encoded = self._apply_locked(change, doctor_key)
+            self._encoded[cache_key] = encoded
+            while len(self._encoded) > self.ENCODED_CACHE_SIZE:
+                self._encoded.popitem(last=False)
+            return encoded
+
+    def _apply_locked(self, change, doctor_key):
+        if doctor_key not in ('all', str(change['doctor_id'])):
+            return None
+
+        queue = self._queues.get((doctor_key, change['date']))
+        if queue is None:
+            return None
+        if 'loading' in queue:
+            # Replayed onto the queue once loaded - nobody has its snapshot yet
+            queue['pending'].append(change)
+            return None
+        return self._apply_to(queue, change)
+
+    def _apply_to(self, queue, change):
+        from .models import Appointment
+
+        entries = queue['entries']
+        entry = change['appointment']
+        appointment_id = change['appointment_id']
+        previous = entries.get(appointment_id)
+
+        if change['deleted'] or entry['status'] not in Appointment.QUEUE_STATUSES:
+            if previous is None:
+                return None
+            del entries[appointment_id]
+            op = 'removed'
+        elif previous is None:
+            op = 'added'
+        elif previous['status'] != entry['status']:
+            op = 'status_changed'
+        elif previous == entry:
+            return None
+        else:
+            op = 'updated'
+
+        if op != 'removed':
+            entries[appointment_id] = entry
+
+        queue['version'] += 1
+        queue['encoded'] = None
+        return json.dumps({
+            'type': 'queue_delta',
+            'op': op,
+            'version': queue['version'],
+            'appointment': entry,
+        })
+
+    def _load(self, doctor_key, day):
+        from .models import Appointment
+
+        appointments = Appointment.objects.filter(
+            appointment_date=day,
+            status__in=Appointment.QUEUE_STATUSES,
+        ).select_related('patient', 'doctor')
+
+        if doctor_key != 'all':
+            appointments = appointments.filter(doctor_id=doctor_key)
+
+        return {
+            'version': 0,
+            'encoded': None,
+            'entries': {apt.id: serialize_appointment(apt) for apt in appointments},
+        }
+
+    def _prune(self, today):
+        """Forget queues of past days"""
+        for key in [key for key in self._queues if key[1] < today]:
+            del self._queues[key]
+
+
+queue_state = QueueStateEngine()
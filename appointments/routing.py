@@ -5,4 +5,5 @@ websocket_urlpatterns = [
     re_path(r'ws/queue/(?P<doctor_id>\w+)/$', consumers.QueueConsumer.as_asgi()),
     re_path(r'ws/display/$', consumers.DisplayMonitorConsumer.as_asgi()),
     re_path(r'ws/display-monitor/$', consumers.DisplayMonitorConsumer.as_asgi()),
+    re_path(r'ws/lab/worklist/$', consumers.LabWorklistConsumer.as_asgi()),
 ]
@@ -0,0 +1,53 @@
+"""
+Broadcast appointment changes to the live queue WebSocket groups
+"""
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Appointment
+from .queue_state import build_change
+from .tts import appointment_phrases, prewarm_in_background
+
+
+def broadcast_queue_change(change):
+    """Send one change message to the doctor's queue group and the combined group"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+
+    event = {
+        'type': 'queue.change',
+        'change_id': uuid.uuid4().hex,
+        'change': change,
+    }
+    for group in (f"queue_{change['doctor_id']}", 'queue_all'):
+        try:
+            async_to_sync(channel_layer.group_send)(group, event)
+        except Exception as e:
+            print(f"❌ Queue broadcast error: {e}")
+
+
+@receiver(post_save, sender=Appointment)
+def appointment_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    # Serialize now, broadcast only once the row is actually committed
+    change = build_change(instance)
+    transaction.on_commit(lambda: broadcast_queue_change(change))
+
+    if kwargs.get('created') and settings.TTS_PREWARM_ON_BOOKING:
+        # Have the announcement audio ready before the patient is called
+        phrases = appointment_phrases(instance)
+        transaction.on_commit(lambda: prewarm_in_background(phrases))
+
+
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, **kwargs):
+    change = build_change(instance, deleted=True)
+    transaction.on_commit(lambda: broadcast_queue_change(change))
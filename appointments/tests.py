@@ -1,3 +1,499 @@
-from django.test import TestCase
+"""
+Tests for appointment queue serial assignment, live queue state, announcement
+audio and the appointment list
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date
+from unittest import mock
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from patients.models import Patient
+from .announcements import clip_cache, compose, mp3_frames
+from .consumers import DisplayMonitorConsumer
+from .routing import websocket_urlpatterns
+from .models import Appointment
+from .queue_state import build_change, queue_state
+from .tts import TTSError, TTSStore, announcement_segments, number_phrase, room_phrase
+
+User = get_user_model()
+
+
+def make_patient(phone='01700000001'):
+    return Patient.objects.create(
+        first_name='Rahim', last_name='Uddin', date_of_birth=date(1990, 1, 1),
+        gender='M', phone=phone, address='Nazipur', city='Nazipur',
+        emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+    )
+
+
+class SerialNumberTestCase(TestCase):
+    """Test per-doctor/day serial assignment"""
+
+    def setUp(self):
+        self.doctor = User.objects.create_user(username='doctor1', password='testpass123', role='DOCTOR')
+        self.other_doctor = User.objects.create_user(username='doctor2', password='testpass123', role='DOCTOR')
+        self.patient = make_patient()
+        self.today = date(2025, 11, 15)
+
+    def book(self, doctor=None, appointment_date=None, **kwargs):
+        return Appointment.objects.create(
+            patient=self.patient,
+            doctor=doctor or self.doctor,
+            appointment_date=appointment_date or self.today,
+            **kwargs
+        )
+
+    def test_serials_increment_per_doctor_and_day(self):
+        """Test each doctor/day pair has its own queue"""
+        self.assertEqual(self.book().serial_number, 1)
+        self.assertEqual(self.book().serial_number, 2)
+        self.assertEqual(self.book(doctor=self.other_doctor).serial_number, 1)
+        self.assertEqual(self.book(appointment_date=date(2025, 11, 16)).serial_number, 1)
+
+    def test_counter_seeded_from_existing_serials(self):
+        """Test the queue continues after serials written before the counter existed"""
+        self.book(serial_number=5)
+        self.assertEqual(self.book().serial_number, 6)
+
+    def test_retry_when_counter_falls_behind(self):
+        """Test a manually numbered row makes the counter resync instead of failing"""
+        self.assertEqual(self.book().serial_number, 1)
+        self.book(serial_number=2)
+        self.assertEqual(self.book().serial_number, 3)
+
+    def test_explicit_serial_is_kept(self):
+        """Test an explicit serial bypasses the counter"""
+        self.assertEqual(self.book(serial_number=42).serial_number, 42)
+
+
+class AppointmentListTestCase(TestCase):
+    """Test the appointment list pages newest day first, by serial within a day"""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='reception', password='testpass123', role='ADMIN')
+        self.doctors = [
+            User.objects.create_user(username=f'doctor{index}', password='testpass123', role='DOCTOR')
+            for index in range(2)
+        ]
+        self.patient = make_patient()
+        self.client.force_login(self.admin)
+
+    def test_pages_follow_the_list_order(self):
+        for day in range(1, 4):
+            for doctor in self.doctors:
+                for _ in range(5):
+                    Appointment.objects.create(
+                        patient=self.patient, doctor=doctor, appointment_date=date(2025, 11, day)
+                    )
+        expected = list(
+            Appointment.objects.order_by('-appointment_date', 'serial_number', 'id').values_list('pk', flat=True)
+        )
+
+        seen, params = [], {}
+        while True:
+            response = self.client.get(reverse('appointments:appointment_list'), params)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            seen.extend(appointment.pk for appointment in page)
+            if not page.has_next:
+                break
+            params = {'after': page.next_cursor}
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(
+            reverse('appointments:appointment_list'), {'doctor': self.doctors[1].pk, 'date': '2025-11-02'}
+        )
+        self.assertEqual(len(response.context['page_obj']), 5)
+
+    def test_malformed_filters_are_ignored(self):
+        Appointment.objects.create(patient=self.patient, doctor=self.doctors[0], appointment_date=date(2025, 11, 1))
+        for params in ({'date': 'tomorrow'}, {'date': '2025-02-30'}, {'doctor': 'abc'}, {'doctor': '-1'}):
+            response = self.client.get(reverse('appointments:appointment_list'), params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['page_obj']), 1)
+
+
+class SerialNumberConcurrencyTestCase(TransactionTestCase):
+    """Test concurrent bookings for one doctor produce gapless serials"""
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_concurrent_bookings_are_gapless(self):
+        doctor = User.objects.create_user(username='doctor1', password='testpass123', role='DOCTOR')
+        patient = make_patient()
+        booking_date = date(2025, 11, 15)
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(40):
+                    Appointment.objects.create(
+                        patient=patient, doctor=doctor, appointment_date=booking_date
+                    )
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(25)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        serials = list(Appointment.objects.filter(doctor=doctor).order_by(
+            'serial_number'
+        ).values_list('serial_number', flat=True))
+        self.assertEqual(errors, [])
+        self.assertEqual(serials, list(range(1, 1001)))
+
+
+class QueueStateEngineTestCase(TestCase):
+    """Test the in-process queue snapshots and deltas"""
+
+    def setUp(self):
+        queue_state.reset()
+        self.doctor = User.objects.create_user(username='doctor1', password='testpass123', role='DOCTOR')
+        self.patient = make_patient()
+        self.today = timezone.now().date()
+
+    def tearDown(self):
+        queue_state.reset()
+
+    def book(self, **kwargs):
+        return Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=self.today, **kwargs
+        )
+
+    def apply(self, appointment, change_id, deleted=False):
+        return queue_state.apply(build_change(appointment, deleted), self.doctor.id, change_id)
+
+    def test_snapshot_contains_active_appointments_only(self):
+        """Test the snapshot lists waiting/called/in-consultation patients in serial order"""
+        second = self.book(status='called', serial_number=9)
+        first = self.book(status='waiting', serial_number=3)
+        self.book(status='completed')
+
+        message = json.loads(queue_state.snapshot(self.doctor.id, self.today))
+        self.assertEqual(message['type'], 'queue_update')
+        self.assertEqual(message['version'], 0)
+        self.assertEqual([entry['id'] for entry in message['queue']], [first.id, second.id])
+
+    def test_warm_snapshot_does_not_query(self):
+        """Test a loaded queue is served from memory"""
+        self.book()
+        queue_state.snapshot(self.doctor.id, self.today)
+        with self.assertNumQueries(0):
+            queue_state.snapshot(self.doctor.id, self.today)
+            queue_state.snapshot(self.doctor.id, self.today)
+
+    def test_deltas(self):
+        """Test changes produce versioned added/status_changed/removed deltas"""
+        queue_state.snapshot(self.doctor.id, self.today)
+
+        appointment = self.book()
+        added = json.loads(self.apply(appointment, 'c1'))
+        self.assertEqual((added['type'], added['op'], added['version']), ('queue_delta', 'added', 1))
+
+        appointment.status = 'called'
+        appointment.save()
+        changed = json.loads(self.apply(appointment, 'c2'))
+        self.assertEqual((changed['op'], changed['version']), ('status_changed', 2))
+        self.assertEqual(changed['appointment']['status'], 'called')
+
+        appointment.status = 'completed'
+        appointment.save()
+        removed = json.loads(self.apply(appointment, 'c3'))
+        self.assertEqual((removed['op'], removed['version']), ('removed', 3))
+
+        snapshot = json.loads(queue_state.snapshot(self.doctor.id, self.today))
+        self.assertEqual((snapshot['version'], snapshot['queue']), (3, []))
+
+    def test_change_during_load_not_lost(self):
+        """Test a change arriving while the queue loads is part of the snapshot"""
+        load = queue_state._load
+        late = self.book(status='waiting', serial_number=5)
+
+        def load_then_change(*key):
+            # The appointment changes after the load read it, before it's registered
+            loaded = load(*key)
+            late.status = 'called'
+            self.assertIsNone(self.apply(late, 'c1'))
+            return loaded
+
+        with mock.patch.object(queue_state, '_load', side_effect=load_then_change):
+            message = json.loads(queue_state.snapshot(self.doctor.id, self.today))
+        self.assertEqual([entry['status'] for entry in message['queue']], ['called'])
+
+        appointment = self.book()
+        self.assertEqual(json.loads(self.apply(appointment, 'c2'))['op'], 'added')
+
+    async def test_queue_dropped_with_last_subscriber(self):
+        """Test a reconnect after a change missed while nobody was connected sees it"""
+        appointment = await database_sync_to_async(self.book)(status='waiting', serial_number=1)
+        application = URLRouter(websocket_urlpatterns)
+
+        async def connect():
+            communicator = WebsocketCommunicator(application, f'/ws/queue/{self.doctor.id}/')
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            return communicator, await communicator.receive_json_from()
+
+        communicator, message = await connect()
+        self.assertEqual([entry['status'] for entry in message['queue']], ['waiting'])
+        await communicator.disconnect()
+
+        # Broadcast while this process had no consumer in the doctor's group
+        appointment.status = 'called'
+        await database_sync_to_async(appointment.save)()
+
+        communicator, message = await connect()
+        self.assertEqual([entry['status'] for entry in message['queue']], ['called'])
+        await communicator.disconnect()
+
+    def test_delta_encoded_once_per_change(self):
+        """Test every consumer of one change gets the same encoded text"""
+        queue_state.snapshot(self.doctor.id, self.today)
+        appointment = self.book()
+
+        with mock.patch('appointments.queue_state.json.dumps', wraps=json.dumps) as dumps:
+            first = self.apply(appointment, 'c1')
+            second = self.apply(appointment, 'c1')
+
+        self.assertIs(first, second)
+        self.assertEqual(dumps.call_count, 1)
+
+    def test_change_ignored_when_queue_not_loaded(self):
+        """Test processes without a connected tablet keep no state"""
+        self.assertIsNone(self.apply(self.book(), 'c1'))
+
+    def test_save_broadcasts_after_commit(self):
+        """Test saving an appointment sends a change to the doctor and combined groups"""
+        with mock.patch('appointments.signals.get_channel_layer') as get_layer:
+            get_layer.return_value.group_send = mock.AsyncMock()
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment = self.book()
+
+        group_send = get_layer.return_value.group_send
+        groups = [call.args[0] for call in group_send.call_args_list]
+        self.assertEqual(groups, [f'queue_{self.doctor.id}', 'queue_all'])
+        event = group_send.call_args.args[1]
+        self.assertEqual(event['type'], 'queue.change')
+        self.assertEqual(event['change']['appointment_id'], appointment.id)
+
+
+class DisplayMonitorConsumerTestCase(TestCase):
+    """Test call broadcasts reach every connected display monitor"""
+
+    async def test_patient_called_fans_out(self):
+        communicators = [
+            WebsocketCommunicator(DisplayMonitorConsumer.as_asgi(), '/ws/display/') for _ in range(3)
+        ]
+        for communicator in communicators:
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+        await get_channel_layer().group_send('display_monitor', {
+            'type': 'patient_called',
+            'patient_name': 'Rahim Uddin',
+            'queue_number': 7,
+            'doctor_name': 'Dr. Karim',
+            'room_number': '2',
+        })
+
+        for communicator in communicators:
+            message = await communicator.receive_json_from()
+            self.assertEqual((message['type'], message['serial_number']), ('patient_called', 7))
+            await communicator.disconnect()
+
+
+class FakeEngine:
+    extension = 'mp3'
+    content_type = 'audio/mpeg'
+
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+        self.calls = []
+
+    def synthesize(self, text):
+        self.calls.append(text)
+        if self.fail:
+            raise OSError('unreachable')
+        return f'{self.name}:{text}'.encode('utf-8')
+
+
+class TTSStoreTestCase(TestCase):
+    """Test the on-disk announcement audio cache"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.primary = FakeEngine('primary')
+        self.fallback = FakeEngine('fallback')
+        self.store = TTSStore(self.tmp.name, max_bytes=10_000, engines=[self.primary, self.fallback])
+
+    def test_synthesized_once_per_normalized_text(self):
+        """Test whitespace variants of a phrase share one cached file"""
+        first = self.store.get('সিরিয়াল  নম্বর ১')
+        second = self.store.get(' সিরিয়াল নম্বর ১ ')
+
+        self.assertEqual(self.primary.calls, ['সিরিয়াল নম্বর ১'])
+        self.assertEqual((first.path, first.etag), (second.path, second.etag))
+        self.assertTrue(second.preferred)
+
+    def test_fallback_engine_when_preferred_fails(self):
+        """Test the offline engine is used and later replaced by the preferred one"""
+        self.primary.fail = True
+        cached = self.store.get('রোগী')
+        self.assertEqual((cached.engine, cached.preferred), (self.fallback, False))
+
+        # While the preferred engine is marked down, the fallback audio is reused
+        self.store.get('রোগী')
+        self.assertEqual(len(self.primary.calls), 1)
+        self.assertEqual(len(self.fallback.calls), 1)
+
+        self.primary.fail = False
+        self.store._preferred_down_until = 0
+        upgraded = self.store.get('রোগী')
+        self.assertTrue(upgraded.preferred)
+        self.assertFalse(cached.path.exists())
+
+    def test_error_when_no_engine_works(self):
+        self.primary.fail = self.fallback.fail = True
+        with self.assertRaises(TTSError):
+            self.store.get('রোগী')
+
+    def test_least_recently_used_evicted(self):
+        """Test the store trims the oldest-used files to fit the size budget"""
+        self.store = TTSStore(self.tmp.name, max_bytes=60, engines=[self.primary])
+        old = self.store.get('a' * 20)
+        new = self.store.get('b' * 20)
+        os.utime(old.path, (1, 1))
+        self.store.get('c' * 20)
+
+        self.assertFalse(old.path.exists())
+        self.assertTrue(new.path.exists())
+
+    def test_open_survives_concurrent_eviction(self):
+        """Test a file evicted between lookup and open is synthesized again"""
+        get = self.store.get
+
+        def get_then_evict(text):
+            cached = get(text)
+            if len(self.primary.calls) == 1:
+                # Another process trims the store right after the lookup
+                cached.path.unlink()
+            return cached
+
+        with mock.patch.object(self.store, 'get', side_effect=get_then_evict):
+            cached, audio = self.store.open('রোগী')
+        with audio:
+            self.assertEqual(audio.read(), 'primary:রোগী'.encode('utf-8'))
+        self.assertEqual(len(self.primary.calls), 2)
+
+    def test_eviction_skips_files_removed_meanwhile(self):
+        self.store = TTSStore(self.tmp.name, max_bytes=60, engines=[self.primary])
+        self.store.get('a' * 20)
+        entries = list(os.scandir(self.tmp.name))
+        os.unlink(entries[0].path)
+        with mock.patch('appointments.tts.os.scandir', return_value=iter(entries)):
+            self.store._evict()
+
+    def test_announcement_phrases(self):
+        """Test prewarmed phrases match the display monitor's text"""
+        self.assertEqual(number_phrase(12), '১২')
+        self.assertEqual(room_phrase('Room 3'), 'অনুগ্রহ করে রুম ৩ এ আসুন')
+        self.assertEqual(room_phrase(''), 'অনুগ্রহ করে রুম এ আসুন')
+
+    def test_view_caching_headers(self):
+        """Test the audio endpoint serves immutable audio and honours If-None-Match"""
+        url = reverse('appointments:bengali_tts')
+        with mock.patch('appointments.views.tts_store', self.store):
+            response = self.client.get(url, {'text': 'রোগী'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), 'primary:রোগী'.encode('utf-8'))
+            self.assertIn('immutable', response['Cache-Control'])
+
+            revalidated = self.client.get(url, {'text': 'রোগী'}, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(revalidated.status_code, 304)
+            self.assertEqual(len(self.primary.calls), 1)
+
+
+class AnnouncementTestCase(TestCase):
+    """Test announcements stitched from cached MP3 clips"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(clip_cache.clear)
+        self.engine = FakeEngine('primary')
+        self.store = TTSStore(self.tmp.name, engines=[self.engine])
+
+    def test_id3_tags_stripped(self):
+        """Test only MPEG frames are kept from a tagged clip"""
+        id3v2 = b'ID3\x04\x00\x00\x00\x00\x00\x05' + b'xxxxx'
+        id3v1 = b'TAG' + b'\x00' * 125
+        self.assertEqual(bytes(mp3_frames(id3v2 + b'\xff\xfbFRAMES' + id3v1)), b'\xff\xfbFRAMES')
+        self.assertEqual(bytes(mp3_frames(b'\xff\xfbFRAMES')), b'\xff\xfbFRAMES')
+
+    def test_clips_concatenated_in_order(self):
+        """Test the announcement is the segment clips back to back"""
+        announcement = compose(12, 'Rahim Uddin', 'Room 3', 'Dr. Karim', store=self.store)
+        segments = announcement_segments(12, 'Rahim Uddin', 'Room 3', 'Dr. Karim')
+
+        self.assertEqual(segments[-3:], ['Rahim Uddin', 'Karim', room_phrase('Room 3')])
+        self.assertEqual(
+            b''.join(announcement),
+            b''.join(f'primary:{text}'.encode('utf-8') for text in segments),
+        )
+        self.assertEqual(len(announcement), len(b''.join(announcement)))
+        self.assertTrue(announcement.preferred)
+
+    def test_only_new_name_synthesized(self):
+        """Test a repeat call with a known name renders nothing and is fast"""
+        compose(1, 'Rahim Uddin', '3', store=self.store)
+        self.engine.calls.clear()
+
+        compose(2, 'Karim Uddin', '3', store=self.store)
+        self.assertEqual(self.engine.calls, [number_phrase(2), 'Karim Uddin'])
+
+        self.engine.calls.clear()
+        started = time.perf_counter()
+        compose(2, 'Karim Uddin', '3', store=self.store)
+        self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertEqual(self.engine.calls, [])
+
+    def test_non_mp3_clip_rejected(self):
+        """Test fallback-engine audio makes the display speak segments instead"""
+        self.engine.content_type = 'audio/wav'
+        with self.assertRaises(TTSError):
+            compose(1, 'Rahim Uddin', '3', store=self.store)
+
+    def test_view(self):
+        url = reverse('appointments:announcement_audio')
+        with mock.patch('appointments.announcements.tts_store', self.store):
+            response = self.client.get(url, {'serial': 5, 'name': 'Rahim Uddin', 'room': '3'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'audio/mpeg')
+            self.assertEqual(int(response['Content-Length']), len(b''.join(response.streaming_content)))
+
+            revalidated = self.client.get(
+                url, {'serial': 5, 'name': 'Rahim Uddin', 'room': '3'},
+                HTTP_IF_NONE_MATCH=response['ETag'],
+            )
+            self.assertEqual(revalidated.status_code, 304)
+
+        self.assertEqual(self.client.get(url).status_code, 400)
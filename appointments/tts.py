@@ -0,0 +1,366 @@
+"""
+Cached Bengali announcement audio
+
+``bengali_tts`` used to call gTTS over the network on every request. Audio is
+now synthesized once per normalized text and kept on disk under
+``TTS_CACHE_DIR``; the oldest-used files are evicted once the directory grows
+past ``TTS_CACHE_MAX_BYTES``.
+
+Engines are configured by dotted path in ``TTS_ENGINES`` and tried in order.
+Audio from the first (preferred) engine never changes for a given text, so it
+is served as immutable; audio from a fallback engine is served with a short
+lifetime and replaced once the preferred engine is reachable again.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+
+BENGALI_DIGITS = '০১২৩৪৫৬৭৮৯'
+
+# Fixed segments of the display monitor announcement
+NEXT_PATIENT_PHRASE = 'পরবর্তী রোগী'
+SERIAL_PHRASE = 'সিরিয়াল নম্বর'
+
+# Serials with a pre-rendered number clip (the rest are synthesized on demand)
+NUMBER_LIBRARY = range(0, 1000)
+
+
+class TTSError(Exception):
+    """No configured engine could synthesize the text"""
+
+
+class GTTSEngine:
+    """Google Translate TTS - natural Bengali voice, needs network access"""
+
+    name = 'gtts'
+    extension = 'mp3'
+    content_type = 'audio/mpeg'
+
+    def synthesize(self, text):
+        from gtts import gTTS
+
+        audio_fp = BytesIO()
+        gTTS(text=text, lang='bn', slow=False).write_to_fp(audio_fp)
+        return audio_fp.getvalue()
+
+
+class Pyttsx3Engine:
+    """Offline system voice (espeak/SAPI) used when gTTS is unreachable"""
+
+    name = 'pyttsx3'
+    extension = 'wav'
+    content_type = 'audio/wav'
+
+    # The pyttsx3 driver is not thread safe
+    _lock = threading.Lock()
+
+    def synthesize(self, text):
+        import pyttsx3
+
+        fd, path = tempfile.mkstemp(suffix=f'.{self.extension}')
+        os.close(fd)
+        try:
+            with self._lock:
+                engine = pyttsx3.init()
+                engine.save_to_file(text, path)
+                engine.runAndWait()
+            audio = Path(path).read_bytes()
+        finally:
+            os.unlink(path)
+        if not audio:
+            raise TTSError('pyttsx3 produced no audio')
+        return audio
+
+
+def normalize_text(text):
+    """Cache key form of an announcement - NFC, single spaces, trimmed"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text or '')).strip()
+
+
+def to_bengali_digits(value):
+    return re.sub(r'\d', lambda m: BENGALI_DIGITS[int(m.group())], str(value))
+
+
+def number_phrase(number):
+    """Number word clip - gTTS reads Bengali digits as the number"""
+    return to_bengali_digits(number)
+
+
+def doctor_phrase(doctor_name):
+    """Doctor name as the display monitor shows it, without an English title"""
+    return re.sub(r'^(Dr\.?|DR\.?)\s*', '', doctor_name or '', flags=re.IGNORECASE).strip()
+
+
+def room_phrase(room_number):
+    """Same text the display monitor speaks for the room"""
+    room = str(room_number or '').strip()
+    room = re.sub(r'\broom\b', 'রুম', room, flags=re.IGNORECASE) if room else 'রুম'
+    return f'অনুগ্রহ করে {to_bengali_digits(room)} এ আসুন'
+
+
+class CachedAudio:
+    """An audio file in the store"""
+
+    def __init__(self, path, key, engine, preferred):
+        self.path = path
+        self.key = key
+        self.engine = engine
+        self.preferred = preferred
+
+    @property
+    def etag(self):
+        return f'"{self.key}-{self.engine.name}"'
+
+    @property
+    def content_type(self):
+        return self.engine.content_type
+
+
+class TTSStore:
+    """On-disk audio cache keyed by normalized text, LRU-evicted by size"""
+
+    # Seconds to stay on the fallback engine after the preferred one fails
+    RETRY_PREFERRED_AFTER = 60
+
+    def __init__(self, directory=None, max_bytes=None, engines=None):
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._engines = engines
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._preferred_down_until = 0
+
+    @cached_property
+    def directory(self):
+        directory = Path(self._directory or settings.TTS_CACHE_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    @cached_property
+    def max_bytes(self):
+        return self._max_bytes or settings.TTS_CACHE_MAX_BYTES
+
+    @cached_property
+    def engines(self):
+        if self._engines is not None:
+            return self._engines
+        return [import_string(path)() for path in settings.TTS_ENGINES]
+
+    @staticmethod
+    def key(text):
+        return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()[:32]
+
+    def _path(self, key, engine):
+        return self.directory / f'{key}-{engine.name}.{engine.extension}'
+
+    def lookup(self, text):
+        """Return the cached audio for the text, or None"""
+        key = self.key(text)
+        for index, engine in enumerate(self.engines):
+            path = self._path(key, engine)
+            if path.exists():
+                return CachedAudio(path, key, engine, preferred=index == 0)
+        return None
+
+    def get(self, text):
+        """Return cached audio for the text, synthesizing it on a miss
+
+        Fallback audio is only reused while the preferred engine is marked
+        down, so it gets replaced once gTTS is reachable again.
+        """
+        text = normalize_text(text)
+        if not text:
+            raise TTSError('No text to synthesize')
+
+        cached = self._usable(self.lookup(text))
+        if cached is not None:
+            return cached
+
+        key = self.key(text)
+        # One synthesis per text at a time - concurrent callers wait for it
+        with self._lock_for(key):
+            cached = self._usable(self.lookup(text))
+            if cached is not None:
+                return cached
+            return self._synthesize(text, key)
+
+    def open(self, text):
+        """Cached audio for the text and its file, opened for reading
+
+        The file is opened here because another request or process may evict
+        it right after ``get()``; an open handle keeps it readable, and a file
+        gone before it was opened is synthesized again.
+        """
+        for _ in range(3):
+            cached = self.get(text)
+            try:
+                return cached, open(cached.path, 'rb')
+            except FileNotFoundError:
+                continue
+        raise TTSError('Audio was evicted before it could be read')
+
+    def _usable(self, cached):
+        if cached is None or not (cached.preferred or self._preferred_down()):
+            return None
+        self._touch(cached.path)
+        return cached
+
+    def _preferred_down(self):
+        return time.monotonic() < self._preferred_down_until
+
+    def _synthesize(self, text, key):
+        errors = []
+        for index, engine in enumerate(self.engines):
+            path = self._path(key, engine)
+            if index == 0 and self._preferred_down():
+                errors.append(f'{engine.name}: unavailable')
+                continue
+            if index > 0 and path.exists():
+                self._touch(path)
+                return CachedAudio(path, key, engine, preferred=False)
+
+            try:
+                audio = engine.synthesize(text)
+            except Exception as exc:
+                errors.append(f'{engine.name}: {exc}')
+                if index == 0:
+                    # Don't make every request wait for a network timeout
+                    self._preferred_down_until = time.monotonic() + self.RETRY_PREFERRED_AFTER
+                continue
+
+            self._write(path, audio)
+            if index == 0:
+                # Drop the fallback audio for this text
+                for other in self.engines[1:]:
+                    self._path(key, other).unlink(missing_ok=True)
+            self._evict()
+            return CachedAudio(path, key, engine, preferred=index == 0)
+
+        raise TTSError('; '.join(errors) or 'No TTS engine configured')
+
+    def _lock_for(self, key):
+        with self._locks_guard:
+            if len(self._locks) > 1000:
+                self._locks.clear()
+            return self._locks.setdefault(key, threading.Lock())
+
+    def _write(self, path, audio):
+        # Write-then-rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(audio)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """Delete least recently used files until the store fits max_bytes"""
+        files = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another process meanwhile
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+
+tts_store = TTSStore()
+
+# Background synthesis - one worker so prewarming never competes with itself
+_prewarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tts-prewarm')
+
+
+def announcement_segments(serial_number, patient_name, room_number, doctor_name=''):
+    """Clip texts of one announcement, in playback order
+
+    Everything except the patient name comes from a small fixed library, so
+    a call only ever synthesizes a name that was never announced before.
+    """
+    patient_name = normalize_text(patient_name) or 'রোগী'
+    segments = [NEXT_PATIENT_PHRASE]
+    if serial_number not in (None, ''):
+        segments += [SERIAL_PHRASE, number_phrase(serial_number)]
+    segments += [patient_name, patient_name]
+    doctor = doctor_phrase(doctor_name)
+    if doctor:
+        segments.append(doctor)
+    segments.append(room_phrase(room_number or 'Consultation Room'))
+    return segments
+
+
+def appointment_phrases(appointment):
+    """Announcement clips the display monitor will need for an appointment"""
+    return announcement_segments(
+        appointment.serial_number,
+        appointment.patient.get_full_name(),
+        appointment.room_number,
+        appointment.doctor.get_full_name(),
+    )
+
+
+def library_phrases():
+    """Fixed clips shared by every announcement - intro and number words"""
+    return [NEXT_PATIENT_PHRASE, SERIAL_PHRASE] + [number_phrase(n) for n in NUMBER_LIBRARY]
+
+
+def queue_phrases(day):
+    """All announcement clips for the given day's queue"""
+    from .models import Appointment
+
+    phrases = {NEXT_PATIENT_PHRASE, SERIAL_PHRASE}
+    appointments = Appointment.objects.filter(
+        appointment_date=day,
+        status__in=Appointment.QUEUE_STATUSES,
+    ).select_related('patient', 'doctor')
+    for appointment in appointments:
+        phrases.update(appointment_phrases(appointment))
+    return sorted(phrases)
+
+
+def prewarm(texts, store=None):
+    """Synthesize the texts that aren't cached yet; returns (cached, failed)"""
+    store = store or tts_store
+    cached = failed = 0
+    for text in texts:
+        try:
+            store.get(text)
+            cached += 1
+        except TTSError:
+            failed += 1
+    return cached, failed
+
+
+def prewarm_in_background(texts):
+    """Queue texts for synthesis without blocking the caller"""
+    return _prewarm_executor.submit(prewarm, list(texts))
@@ -10,6 +10,7 @@ urlpatterns = [
     path('booking-success/', views.booking_success, name='booking_success'),
     path('monitor/', views.display_monitor, name='display_monitor'),
     path('tts/bengali/', views.bengali_tts, name='bengali_tts'),
+    path('tts/announcement/', views.announcement_audio, name='announcement_audio'),
     
     # Staff-only URLs (login required)
     path('create/', views.appointment_create, name='appointment_create'),
@@ -1,16 +1,20 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.db import transaction
+from django.db.models import Count, Prefetch, Q
+from django.http import JsonResponse, FileResponse, HttpResponseNotModified, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Max
+from django.utils.dateparse import parse_date
 from django.views.decorators.http import require_GET
-from io import BytesIO
-from gtts import gTTS
 from .models import Appointment, Prescription, Medicine
 from .forms import QuickAppointmentForm
+from .announcements import compose
+from .tts import TTSError, normalize_text, tts_store
 from patients.models import Patient
 from accounts.models import User
+from diagcenter.instrumentation import query_budget
+from diagcenter.pagination import keyset_page
 
 def public_booking(request):
     """Public appointment booking page (no login required)"""
@@ -59,28 +63,16 @@ def public_booking(request):
                 # Get doctor
                 doctor = form.cleaned_data['doctor']
                 
-                # Get next serial number for today
-                last_serial = Appointment.objects.filter(
-                    doctor=doctor,
-                    appointment_date=today
-                ).aggregate(Max('serial_number'))['serial_number__max']
-                
-                next_serial = (last_serial or 0) + 1
-                
-                # Generate appointment number
-                appointment_number = f"APT-{today.strftime('%Y%m%d')}-{doctor.id}-{next_serial:03d}"
-                
-                # Create appointment
+                # Create appointment - number and serial are assigned atomically on save
                 appointment = Appointment.objects.create(
-                    appointment_number=appointment_number,
                     patient=patient,
                     doctor=doctor,
-                    serial_number=next_serial,
                     appointment_date=today,
                     status='waiting',
                     reason=form.cleaned_data.get('reason', ''),
                     created_by=None  # Public booking
                 )
+                next_serial = appointment.serial_number
                 
                 messages.success(
                     request,
@@ -103,10 +95,47 @@ def public_booking(request):
     return render(request, 'appointments/public_booking.html', {'form': form})
 
 @login_required
+@query_budget(10)
 def appointment_list(request):
-    """List all appointments"""
-    appointments = Appointment.objects.all().select_related('patient', 'doctor').order_by('-appointment_date', 'serial_number')
-    return render(request, 'appointments/appointment_list.html', {'appointments': appointments})
+    """List appointments, newest day first - keyset paged"""
+    appointments = Appointment.objects.select_related('patient', 'doctor').only(
+        'serial_number', 'appointment_date', 'appointment_time', 'reason', 'status',
+        'patient__patient_id', 'patient__first_name', 'patient__last_name',
+        'doctor__first_name', 'doctor__last_name', 'doctor__specialization',
+    ).prefetch_related(Prefetch('prescriptions', queryset=Prescription.objects.only('id', 'appointment')))
+    
+    query = request.GET.get('search', '').strip()
+    if query:
+        appointments = appointments.filter(
+            Q(patient__first_name__icontains=query) | Q(patient__last_name__icontains=query)
+            | Q(patient__patient_id__icontains=query) | Q(appointment_number__icontains=query)
+        )
+    # Malformed filters are ignored rather than handed to the ORM
+    try:
+        day = parse_date(request.GET.get('date', ''))
+    except ValueError:
+        day = None
+    if day:
+        appointments = appointments.filter(appointment_date=day)
+    doctor = request.GET.get('doctor', '')
+    if doctor.isdigit():
+        appointments = appointments.filter(doctor_id=int(doctor))
+    if request.GET.get('status'):
+        appointments = appointments.filter(status=request.GET['status'])
+    
+    page = keyset_page(appointments, ('-appointment_date', 'serial_number', 'id'), request, per_page=25)
+    
+    stats = Appointment.objects.filter(appointment_date=timezone.localdate()).aggregate(
+        today_total=Count('id'),
+        **{status: Count('id', filter=Q(status=status)) for status in ('waiting', 'in_consultation', 'completed')}
+    )
+    return render(request, 'appointments/appointment_list.html', {
+        'appointments': page,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+        'stats': stats,
+        'doctors': User.objects.filter(role='DOCTOR', is_active=True).only('first_name', 'last_name'),
+    })
 
 @login_required
 def appointment_create(request):
@@ -235,7 +264,7 @@ def queue_display(request):
     
     appointments = Appointment.objects.filter(
         appointment_date=today,
-        status__in=['WAITING', 'CALLED', 'IN_PROGRESS']
+        status__in=Appointment.QUEUE_STATUSES
     ).select_related('patient', 'doctor').order_by('serial_number')
     
     return render(request, 'appointments/queue_display.html', {'appointments': appointments})
@@ -247,31 +276,66 @@ def display_monitor(request):
 
 @require_GET
 def bengali_tts(request):
-    """Generate Bengali speech audio for the given text using Google TTS."""
-    text = request.GET.get('text', '').strip()
+    """Serve Bengali speech audio for the given text from the TTS store."""
+    text = normalize_text(request.GET.get('text', ''))
 
     if not text:
         return JsonResponse({'error': 'Missing text parameter'}, status=400)
 
     try:
-        tts = gTTS(text=text, lang='bn', slow=False)
-        audio_fp = BytesIO()
-        tts.write_to_fp(audio_fp)
-        audio_fp.seek(0)
+        cached, audio = tts_store.open(text)
+    except TTSError as exc:
+        return JsonResponse({'error': str(exc)}, status=503)
+
+    if cached.preferred:
+        # Same text always gives the same audio - let browsers keep it
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=300'
+
+    if cached.etag in request.headers.get('If-None-Match', ''):
+        audio.close()
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(audio, content_type=cached.content_type)
+        response['Content-Disposition'] = f'inline; filename="announcement.{cached.engine.extension}"'
+    response['ETag'] = cached.etag
+    response['Cache-Control'] = cache_control
+    return response
+
+@require_GET
+def announcement_audio(request):
+    """Serve one patient call as a single MP3 stitched from cached clips."""
+    name = normalize_text(request.GET.get('name', ''))
+
+    if not name:
+        return JsonResponse({'error': 'Missing name parameter'}, status=400)
+
+    try:
+        announcement = compose(
+            request.GET.get('serial', ''),
+            name,
+            request.GET.get('room', ''),
+            request.GET.get('doctor', ''),
+        )
+    except TTSError as exc:
+        return JsonResponse({'error': str(exc)}, status=503)
 
-        response = HttpResponse(audio_fp.read(), content_type='audio/mpeg')
+    if announcement.etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+    else:
+        response = StreamingHttpResponse(announcement, content_type=announcement.content_type)
+        response['Content-Length'] = len(announcement)
         response['Content-Disposition'] = 'inline; filename="announcement.mp3"'
-        response['Cache-Control'] = 'no-store, no-cache, must-revalidate'
-        response['Pragma'] = 'no-cache'
-        return response
-    except Exception as exc:
-        return JsonResponse({'error': str(exc)}, status=500)
+    response['ETag'] = announcement.etag
+    response['Cache-Control'] = (
+        'public, max-age=31536000, immutable' if announcement.preferred else 'public, max-age=300'
+    )
+    return response
 
 @login_required
 def prescription_create(request, appointment_id):
     """Create or edit prescription - Doctors can write comprehensive prescriptions"""
-    from datetime import datetime
-    
     appointment = get_object_or_404(Appointment, pk=appointment_id)
     
     # Check if prescription already exists
@@ -351,22 +415,8 @@ def prescription_create(request, appointment_id):
                     investigation=investigation,
                     advice=advice,
                 )
-                
-                # Generate prescription number
-                today = datetime.now()
-                prefix = f"RX{today.strftime('%Y%m%d')}"
-                last_prescription = Prescription.objects.filter(
-                    prescription_number__startswith=prefix
-                ).order_by('prescription_number').last()
-                
-                if last_prescription:
-                    last_number = int(last_prescription.prescription_number[-4:])
-                    new_number = last_number + 1
-                else:
-                    new_number = 1
-                
-                prescription.prescription_number = f"{prefix}{new_number:04d}"
-                
+
+                # Prescription number is allocated in Prescription.save()
                 if follow_up_date:
                     prescription.follow_up_date = follow_up_date
             
@@ -388,10 +438,15 @@ def prescription_create(request, appointment_id):
                         instructions=medicine_instructions[i].strip() if i < len(medicine_instructions) else '',
                     )
             
+            # Match the medicines to drugs now so the pharmacy queue opens with the cart filled
+            from pharmacy import dispensing
+            prescription_id = prescription.pk
+            transaction.on_commit(lambda: dispensing.build_cart(prescription_id))
+            
             # Check if "Send to Reception" button was clicked
             if 'send_to_reception' in request.POST:
                 # Update appointment status
-                appointment.status = 'COMPLETED'
+                appointment.status = 'completed'
                 appointment.save()
                 messages.success(request, f'✅ Prescription saved & sent to reception! Rx No: {prescription.prescription_number}')
                 return redirect('accounts:doctor_dashboard')
@@ -582,25 +637,16 @@ def online_booking(request):
                 patient.gender = gender
                 patient.save()
             
-            # Get next serial number
-            last_serial = Appointment.objects.filter(
-                doctor=doctor,
-                appointment_date=today
-            ).aggregate(Max('serial_number'))['serial_number__max']
-            
-            next_serial = (last_serial or 0) + 1
-            
             # Get consultation fee
             try:
                 consultation_fee = float(doctor.consultation_fee)
             except:
                 consultation_fee = 500.00
             
-            # Create online appointment
+            # Create online appointment - serial number is assigned atomically on save
             appointment = Appointment.objects.create(
                 patient=patient,
                 doctor=doctor,
-                serial_number=next_serial,
                 appointment_date=today,
                 appointment_type='online',
                 is_online_booking=True,
@@ -613,7 +659,7 @@ def online_booking(request):
             
             # Store booking details in session for success page
             request.session['booking_success'] = {
-                'serial_number': next_serial,
+                'serial_number': appointment.serial_number,
                 'patient_name': patient_name,
                 'phone': phone,
                 'doctor_name': doctor.get_full_name(),
@@ -0,0 +1,212 @@
+"""
+Per-view request instrumentation
+
+``InstrumentationMiddleware`` records for every request, keyed by URL name:
+wall time, SQL query count and time, repeated query signatures (the same SQL
+run several times in one request - usually an N+1 loop) and response size.
+Each response gets a ``Server-Timing`` header, and the last
+``INSTRUMENTATION_WINDOW`` requests per view are kept in memory for the
+admin report (``accounts:admin_instrumentation``). Figures are per process -
+every gunicorn worker keeps its own.
+
+Views declare how many queries they may run with ``@query_budget(n)``. Going
+over is logged, and raises ``QueryBudgetExceeded`` when
+``QUERY_BUDGET_STRICT`` is set (the default under ``manage.py test``) so the
+test that rendered the view fails.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Upper edges (ms) of the wall time histogram buckets; the last bucket is open
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+HISTOGRAM_LABELS = [f'<={edge}' for edge in HISTOGRAM_BUCKETS] + [f'>{HISTOGRAM_BUCKETS[-1]}']
+
+# A signature run this many times in one request is reported as N+1
+REPEATED_QUERY_THRESHOLD = 3
+
+
+class QueryBudgetExceeded(Exception):
+    """A view ran more queries than its declared budget"""
+
+
+def query_budget(limit):
+    """Declare the most queries a view may run, e.g. ``@query_budget(12)``
+
+    Session and user lookups made by middleware count towards the budget.
+    """
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+
+class QueryRecorder:
+    """``execute_wrapper`` collecting the SQL run during a request"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.signatures = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            # Parameters are placeholders, so a loop repeats the same text
+            self.signatures[sql] += 1
+
+    def repeated(self):
+        return {sql: n for sql, n in self.signatures.items() if n >= REPEATED_QUERY_THRESHOLD}
+
+
+class Sample:
+    __slots__ = ('wall_ms', 'queries', 'sql_ms', 'size', 'status')
+
+    def __init__(self, wall_ms, queries, sql_ms, size, status):
+        self.wall_ms = wall_ms
+        self.queries = queries
+        self.sql_ms = sql_ms
+        self.size = size
+        self.status = status
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)] if values else 0
+
+
+class ViewStats:
+    """Rolling per-view samples and repeated query signatures"""
+
+    def __init__(self, window=None):
+        self._window = window
+        self._samples = defaultdict(self._new_window)
+        # Repeated signatures of the requests in the window, and their sum
+        self._repeated_window = defaultdict(self._new_window)
+        self._repeated = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def _new_window(self):
+        return deque(maxlen=self._window or settings.INSTRUMENTATION_WINDOW)
+
+    def record(self, view, sample, repeated):
+        with self._lock:
+            self._samples[view].append(sample)
+            window = self._repeated_window[view]
+            if len(window) == window.maxlen:
+                # Leaves the window with its sample - drops signatures at zero
+                self._repeated[view] -= Counter(window[0])
+            window.append(repeated)
+            self._repeated[view].update(repeated)
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+            self._repeated_window.clear()
+            self._repeated.clear()
+
+    def report(self):
+        """Summary per view, slowest p95 first"""
+        with self._lock:
+            snapshot = {view: list(samples) for view, samples in self._samples.items()}
+            repeated = {view: counter.most_common(5) for view, counter in self._repeated.items()}
+
+        views = []
+        for view, samples in snapshot.items():
+            wall = [s.wall_ms for s in samples]
+            histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+            for value in wall:
+                histogram[bisect_left(HISTOGRAM_BUCKETS, value)] += 1
+            views.append({
+                'view': view,
+                'requests': len(samples),
+                'wall_ms': {
+                    'p50': round(percentile(wall, 50), 2),
+                    'p95': round(percentile(wall, 95), 2),
+                    'max': round(max(wall), 2),
+                },
+                'histogram': dict(zip(HISTOGRAM_LABELS, histogram)),
+                'queries': {
+                    'avg': round(sum(s.queries for s in samples) / len(samples), 1),
+                    'max': max(s.queries for s in samples),
+                },
+                'sql_ms': {
+                    'avg': round(sum(s.sql_ms for s in samples) / len(samples), 2),
+                    'p95': round(percentile([s.sql_ms for s in samples], 95), 2),
+                },
+                'response_bytes': {
+                    'avg': int(sum(s.size for s in samples) / len(samples)),
+                    'max': max(s.size for s in samples),
+                },
+                'errors': sum(1 for s in samples if s.status >= 500),
+                'repeated_queries': [{'sql': sql, 'count': n} for sql, n in repeated.get(view, [])],
+            })
+        views.sort(key=lambda item: item['wall_ms']['p95'], reverse=True)
+        return views
+
+
+view_stats = ViewStats()
+
+
+def response_size(response):
+    if response.streaming:
+        return int(response.get('Content-Length') or 0)
+    return len(response.content)
+
+
+class InstrumentationMiddleware:
+    """Time each request and count its queries - keep it first in MIDDLEWARE"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+        sql_ms = recorder.duration * 1000
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else '<unresolved>'
+        repeated = recorder.repeated()
+        view_stats.record(
+            view, Sample(wall_ms, recorder.count, sql_ms, response_size(response), response.status_code), repeated
+        )
+
+        response['Server-Timing'] = (
+            f'app;dur={wall_ms:.1f}, db;dur={sql_ms:.1f};desc="{recorder.count} queries"'
+        )
+
+        if wall_ms > settings.INSTRUMENTATION_SLOW_REQUEST_MS:
+            logger.warning('Slow request %s %s: %.0f ms, %d queries', request.method, view, wall_ms, recorder.count)
+        for sql, n in repeated.items():
+            logger.info('Repeated query in %s (%d times): %s', view, n, sql[:200])
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and recorder.count > budget:
+            message = f'{view} ran {recorder.count} queries, budget is {budget}'
+            if settings.QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = getattr(view_func, 'query_budget', None)
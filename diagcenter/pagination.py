@@ -0,0 +1,201 @@
+"""
+Keyset pagination for the list views
+
+An OFFSET page makes the database read and throw away every row before it,
+and Django's paginator runs a ``COUNT(*)`` over the filtered table on every
+request, so both get slower as the table grows. A keyset (seek) page carries
+on from the last row shown instead::
+
+    WHERE (date, id) < (:date, :id) ORDER BY date DESC, id DESC LIMIT 21
+
+which reads the page's rows off an index at any depth:
+
+- the ``keyset`` is the ordering, e.g. ``('-date', '-id')`` - non-null
+  columns of the model ending in a unique one, covered by an index in that
+  order
+- ``keyset_page(queryset, keyset, request)`` returns a ``KeysetPage`` for
+  function views; ``KeysetPaginationMixin`` plugs it into ``ListView``
+- pages link with opaque ``?after=`` / ``?before=`` cursors (the key of the
+  last / first row shown), so there are no page numbers and no "last page";
+  ``templates/includes/keyset_pagination.html`` renders the links
+- the total isn't counted unless a template reads ``page.count``, which is
+  ``estimate_count`` - a ``COUNT(*)`` cached for ``LIST_COUNT_CACHE_SECONDS``,
+  or the planner's row estimate for a whole table on PostgreSQL
+"""
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+from decimal import Decimal
+from functools import cached_property
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+
+COUNT_CACHE_PREFIX = 'list_count:'
+
+
+class KeysetPage:
+    """One page of rows, with cursors to the pages on either side"""
+
+    def __init__(self, object_list, queryset, keyset, has_next, has_previous, per_page):
+        self.object_list = object_list
+        self.queryset = queryset
+        self.keyset = keyset
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.per_page = per_page
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.queryset.model, self.keyset, self.object_list[-1]) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.queryset.model, self.keyset, self.object_list[0]) if self.has_previous else None
+
+    @cached_property
+    def count(self):
+        """Rows over all pages - estimated, and only queried when read"""
+        return estimate_count(self.queryset)
+
+
+def _keys(model, keyset):
+    """[(field, descending)] for a keyset like ``('-date', '-id')``"""
+    return [(model._meta.get_field(key.lstrip('-')), key.startswith('-')) for key in keyset]
+
+
+def _dump(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        # datetime.isoformat() keeps the microseconds and offset
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def encode_cursor(model, keyset, row):
+    """The opaque cursor of a row (a model instance or a ``values()`` dict)"""
+    values = [
+        _dump(row[field.name] if isinstance(row, dict) else getattr(row, field.attname))
+        for field, _ in _keys(model, keyset)
+    ]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(model, keyset, cursor):
+    """Key values of a cursor; raises ``Http404`` for a cursor that isn't one"""
+    keys = _keys(model, keyset)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(keys):
+            raise ValueError(cursor)
+        return [field.to_python(value) for (field, _), value in zip(keys, values)]
+    except (ValueError, TypeError, binascii.Error, ValidationError):
+        raise Http404('Invalid page cursor')
+
+
+def seek(keyset, values, forward=True):
+    """The filter selecting rows after (or before) the key ``values`` in ``keyset`` order
+
+    ``(a, b) > (x, y)`` spelled as ``a >= x AND (a > x OR (a = x AND b > y))``,
+    with each comparison flipped for a descending key. The redundant ``a >= x``
+    is what lets the database range-scan the index instead of testing the OR
+    on every row.
+    """
+    lookups = ['lt' if key.startswith('-') == forward else 'gt' for key in keyset]
+    names = [key.lstrip('-') for key in keyset]
+    condition = Q()
+    for index, (name, lookup, value) in enumerate(zip(names, lookups, values)):
+        condition |= Q(**dict(zip(names[:index], values[:index])), **{f'{name}__{lookup}': value})
+    return Q(**{f'{names[0]}__{lookups[0]}e': values[0]}) & condition
+
+
+def _reverse(keyset):
+    return [key[1:] if key.startswith('-') else f'-{key}' for key in keyset]
+
+
+def keyset_page(queryset, keyset, request, per_page=20):
+    """The page of ``queryset`` the request's ``after`` / ``before`` cursor points at
+
+    Without a cursor it's the first page. One query (plus any
+    ``prefetch_related``).
+    """
+    model = queryset.model
+    after, before = request.GET.get('after'), request.GET.get('before')
+
+    if before and not after:
+        rows = list(
+            queryset.filter(seek(keyset, decode_cursor(model, keyset, before), forward=False))
+            .order_by(*_reverse(keyset))[:per_page + 1]
+        )
+        has_previous = len(rows) > per_page
+        rows = rows[:per_page][::-1]
+        has_next = True
+    else:
+        page = queryset.order_by(*keyset)
+        if after:
+            page = page.filter(seek(keyset, decode_cursor(model, keyset, after)))
+        rows = list(page[:per_page + 1])
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_previous = bool(after)
+
+    return KeysetPage(rows, queryset, keyset, has_next, has_previous, per_page)
+
+
+def estimate_count(queryset):
+    """Rows in ``queryset``, good enough for "about N records"
+
+    A whole PostgreSQL table is read from the planner's statistics
+    (``pg_class.reltuples``); anything else is counted and the count cached
+    for ``LIST_COUNT_CACHE_SECONDS``.
+    """
+    model = queryset.model
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 until the table is first analyzed
+        if row and row[0] >= 0:
+            return int(row[0])
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    key = COUNT_CACHE_PREFIX + hashlib.md5(f'{queryset.db}:{sql}:{params!r}'.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.order_by().count()
+        cache.set(key, count, settings.LIST_COUNT_CACHE_SECONDS)
+    return count
+
+
+class KeysetPaginationMixin:
+    """``ListView`` paging by ``keyset`` (see module docs) instead of page numbers
+
+    The template gets ``page_obj`` (a ``KeysetPage``), ``is_paginated`` and
+    the page's rows as the object list; ``paginator`` is None.
+    """
+    keyset = ('-id',)
+    paginate_by = 20
+
+    def paginate_queryset(self, queryset, page_size):
+        page = keyset_page(queryset, self.keyset, self.request, page_size)
+        return None, page, page.object_list, page.has_other_pages()
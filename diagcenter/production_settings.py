@@ -126,6 +126,12 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # Slow requests and query budget overruns; repeated queries are INFO
+        'diagcenter.instrumentation': {
+            'handlers': ['file'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     },
 }
 
@@ -139,11 +145,29 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@nazipuruhs.com')
 
-# Cache Configuration (Optional - for better performance)
+# Channel layer - Redis, so call broadcasts from gunicorn workers reach the
+# display monitors connected to Daphne
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {
+            'hosts': [REDIS_URL],
+            'prefix': 'diagcenter',
+            'expiry': 10,
+            'capacity': 500,
+            'group_expiry': 86400,
+        },
+    },
+}
+
+# Cache Configuration - shared by every gunicorn worker (see settings.CACHES);
+# a per-process cache would only invalidate the worker that made a write
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'diagcenter',
     }
 }
 
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -88,6 +90,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "diagcenter.instrumentation.InstrumentationMiddleware",  # Timing, keep first
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",  # CORS
@@ -121,22 +124,46 @@ WSGI_APPLICATION = "diagcenter.wsgi.application"
 ASGI_APPLICATION = "diagcenter.asgi.application"
 
 # Channels configuration
-# Use in-memory channel layer for development (no Redis needed)
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-    },
-}
+# Production sets REDIS_URL (e.g. redis://127.0.0.1:6379/0) so the gunicorn
+# workers that call patients and the Daphne processes holding the display
+# WebSockets share one channel layer. Without it - and always under
+# `manage.py test` - the in-memory layer is used (no Redis needed).
+TESTING = sys.argv[1:2] == ['test']
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL and not TESTING:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+                "prefix": "diagcenter",
+                # Messages to a screen that went away are dropped after 10s
+                "expiry": 10,
+                "capacity": 500,
+                "group_expiry": 86400,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        },
+    }
 
-# For production with Redis, uncomment below:
-# CHANNEL_LAYERS = {
-#     "default": {
-#         "BACKEND": "channels_redis.core.RedisChannelLayer",
-#         "CONFIG": {
-#             "hosts": [("127.0.0.1", 6379)],
-#         },
-#     },
-# }
+# The cache holds versions and counters every worker must agree on (dashboard
+# tags, commission rates, public directory pages, lab worklist counts), so with
+# several workers it has to be shared - Redis, like the channel layer. Without
+# REDIS_URL the default per-process cache is used, fine for one runserver.
+if REDIS_URL and not TESTING:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+            "KEY_PREFIX": "diagcenter",
+        },
+    }
 
 
 # Database
@@ -191,6 +218,48 @@ STATIC_ROOT = BASE_DIR / "staticfiles"
 MEDIA_URL = "media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# Announcement audio (appointments.tts)
+# Engines are tried in order; the first is the preferred voice, the rest are
+# offline fallbacks used when it is unreachable.
+TTS_ENGINES = [
+    "appointments.tts.GTTSEngine",
+    "appointments.tts.Pyttsx3Engine",
+]
+TTS_CACHE_DIR = BASE_DIR / "media" / "tts"
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200 MB
+# Synthesize a patient's name/serial phrases in the background when booked
+TTS_PREWARM_ON_BOOKING = not TESTING
+
+# Upper bound on how long a role dashboard context is served from cache;
+# writes to the models it reads invalidate it sooner (accounts.dashboard_cache)
+DASHBOARD_CACHE_TIMEOUT = 300
+
+# Full rebuild interval of the per-process drug search index (pharmacy.search)
+DRUG_SEARCH_REBUILD_SECONDS = 600
+
+# Public PC member directory pages (accounts.public_directory): how long a
+# rendered page is kept (a PCMember write replaces it sooner) and how long
+# browsers may reuse it before revalidating
+PUBLIC_DIRECTORY_CACHE_TIMEOUT = 24 * 60 * 60
+PUBLIC_DIRECTORY_MAX_AGE = 60
+
+# Upper bound on how long the lab worklist status counters (lab.worklist) are
+# trusted before one aggregate query recounts them
+LAB_WORKLIST_COUNT_TIMEOUT = 600
+
+# Where manage.py pc_statements writes the monthly PC member statements
+# (accounts.statements) - outside MEDIA_ROOT, they aren't public
+PC_STATEMENT_DIR = BASE_DIR / "pc_statements"
+
+# How long a list view's row count is cached (diagcenter.pagination)
+LIST_COUNT_CACHE_SECONDS = 300
+
+# Request instrumentation (diagcenter.instrumentation)
+INSTRUMENTATION_WINDOW = 500  # Requests kept per view for the admin report
+INSTRUMENTATION_SLOW_REQUEST_MS = 500
+# Fail the request when a view goes over its @query_budget
+QUERY_BUDGET_STRICT = TESTING
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
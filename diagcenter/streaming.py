@@ -0,0 +1,34 @@
+"""
+Helpers for streaming generated files
+
+``Echo`` lets ``csv.writer`` hand each formatted row back instead of writing
+it, and ``ZipSink`` lets ``zipfile`` write an archive in pieces - both for
+responses and files produced row by row without holding them in memory
+(pharmacy stock exports, PC member statements).
+"""
+
+
+class Echo:
+    """File-like object handing back what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+class ZipSink:
+    """Unseekable file zipfile writes into; ``drain()`` hands over the bytes so far"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
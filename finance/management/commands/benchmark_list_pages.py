@@ -0,0 +1,119 @@
+"""
+Compare OFFSET and keyset pages of the income list at depth
+
+Run: python manage.py benchmark_list_pages --rows 1000000 --pages 1,100,10000,last
+
+Inserts ``--rows`` throwaway incomes spread over the last years (inside a
+transaction that is rolled back, so the database is left as it was), then
+times the list's query at each page depth both ways:
+
+- offset: Django's ``Paginator`` as the list used it - a ``COUNT(*)`` and
+  ``LIMIT 20 OFFSET n``
+- keyset: ``diagcenter.pagination.keyset_page`` continuing from the cursor of
+  the previous page's last row
+
+and the row count both ways (``COUNT(*)`` vs the cached ``estimate_count``).
+"""
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.utils import timezone
+
+from diagcenter.pagination import encode_cursor, estimate_count, keyset_page
+from finance.models import Income
+from finance.views import IncomeListView
+
+KEYSET = IncomeListView.keyset
+PER_PAGE = IncomeListView.paginate_by
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark OFFSET vs keyset pagination of the income list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--days', type=int, default=3 * 365, help='Days the rows are spread over')
+        parser.add_argument('--pages', default='1,100,10000,last', help='Comma separated page numbers or "last"')
+        parser.add_argument('--rounds', type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.insert(options['rows'], options['days'])
+                if connection.vendor in ('sqlite', 'postgresql'):
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                self.compare(options['pages'], options['rounds'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def insert(self, rows, days):
+        today = timezone.localdate()
+        started = time.perf_counter()
+        batch = []
+        for index in range(rows):
+            batch.append(Income(
+                income_number=f'BENCH{index:09d}', source='OTHER', amount=Decimal(random.randint(100, 5000)),
+                date=today - timedelta(days=random.randrange(days)), description='Benchmark',
+            ))
+            if len(batch) == 10_000:
+                Income.objects.bulk_create(batch)
+                batch = []
+        Income.objects.bulk_create(batch)
+        self.stdout.write(f'Inserted {rows} incomes in {time.perf_counter() - started:.1f}s')
+
+    def compare(self, pages, rounds):
+        queryset = self.list_view().get_queryset()
+        total = Income.objects.count()
+        last = max((total + PER_PAGE - 1) // PER_PAGE, 1)
+        factory = RequestFactory()
+
+        self.stdout.write(f'\n{"page":>10}  {"offset ms":>10}  {"keyset ms":>10}')
+        for page in pages.split(','):
+            number = last if page == 'last' else min(int(page), last)
+
+            def offset():
+                list(Paginator(queryset.order_by(*KEYSET), PER_PAGE).page(number).object_list)
+
+            # The cursor the previous page would have linked to, found once untimed
+            request = factory.get('/')
+            if number > 1:
+                previous = queryset.order_by(*KEYSET)[(number - 1) * PER_PAGE - 1]
+                request = factory.get('/', {'after': encode_cursor(Income, KEYSET, previous)})
+
+            offset_ms = self.measure(offset, rounds)
+            keyset_ms = self.measure(lambda: keyset_page(queryset, KEYSET, request, PER_PAGE), rounds)
+            self.stdout.write(f'{number:>10}  {offset_ms:10.2f}  {keyset_ms:10.2f}')
+
+        count_ms = self.measure(lambda: queryset.count(), rounds)
+        estimate_count(queryset)
+        estimate_ms = self.measure(lambda: estimate_count(queryset), rounds)
+        self.stdout.write(f'\nCOUNT(*):          {count_ms:10.2f} ms')
+        self.stdout.write(f'estimate_count():  {estimate_ms:10.2f} ms (cached)')
+
+    @staticmethod
+    def list_view():
+        view = IncomeListView()
+        view.request = RequestFactory().get('/')
+        return view
+
+    @staticmethod
+    def measure(run, rounds):
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            run()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
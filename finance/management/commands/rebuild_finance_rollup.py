@@ -0,0 +1,64 @@
+"""
+Rebuild the daily finance rollup from Income/Expense
+
+Run: python manage.py rebuild_finance_rollup
+     python manage.py rebuild_finance_rollup --from 2025-01-01 --to 2025-01-31
+
+Needed after bulk imports or QuerySet.update() calls, which bypass the
+signals that keep FinanceDailyRollup current. --check only reports days whose
+rollup disagrees with the source tables.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from finance import rollups
+from finance.models import Expense, FinanceDailyRollup, Income
+
+
+class Command(BaseCommand):
+    help = 'Recompute FinanceDailyRollup from Income and Expense records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, default=None)
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, default=None)
+        parser.add_argument('--check', action='store_true',
+                            help='Only report mismatching days, change nothing')
+
+    def handle(self, *args, **options):
+        date_from, date_to = options['date_from'], options['date_to']
+
+        if options['check']:
+            mismatches = self.check_days(date_from, date_to)
+            for day, kind, expected, actual in mismatches:
+                self.stdout.write(self.style.WARNING(
+                    f'{day} {kind}: records {expected} != rollup {actual}'
+                ))
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'{len(mismatches)} mismatching day(s)'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Rollup matches records'))
+            return
+
+        written = rollups.rebuild(date_from=date_from, date_to=date_to)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} rollup row(s)'))
+
+    def check_days(self, date_from, date_to):
+        def by_day(queryset, kind_filter=None):
+            if date_from:
+                queryset = queryset.filter(date__gte=date_from)
+            if date_to:
+                queryset = queryset.filter(date__lte=date_to)
+            if kind_filter:
+                queryset = queryset.filter(kind=kind_filter)
+            return dict(queryset.values('date').annotate(total=Sum('amount')).values_list('date', 'total'))
+
+        mismatches = []
+        for kind, model in ((rollups.INCOME, Income), (rollups.EXPENSE, Expense)):
+            expected = by_day(model.objects.order_by())
+            actual = by_day(FinanceDailyRollup.objects.order_by(), kind)
+            for day in sorted(set(expected) | set(actual)):
+                if (expected.get(day) or 0) != (actual.get(day) or 0):
+                    mismatches.append((day, kind, expected.get(day) or 0, actual.get(day) or 0))
+        return mismatches
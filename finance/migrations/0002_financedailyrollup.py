@@ -0,0 +1,71 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:25
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Build the rollup from existing records (same as rebuild_finance_rollup)"""
+    from django.db.models import Count, Q, Sum
+
+    Income = apps.get_model('finance', 'Income')
+    Expense = apps.get_model('finance', 'Expense')
+    FinanceDailyRollup = apps.get_model('finance', 'FinanceDailyRollup')
+
+    rows = [
+        FinanceDailyRollup(
+            date=row['date'], kind='INCOME', source=row['source'],
+            department_id=row['department_id'], income_category_id=row['category_id'],
+            amount=row['total'], count=row['n'],
+        )
+        for row in Income.objects.values('date', 'source', 'department_id', 'category_id')
+        .annotate(total=Sum('amount'), n=Count('id')).order_by()
+    ]
+    pending = Q(is_approved=False)
+    rows += [
+        FinanceDailyRollup(
+            date=row['date'], kind='EXPENSE', source=row['expense_type'],
+            department_id=row['department_id'], expense_category_id=row['category_id'],
+            amount=row['total'], count=row['n'],
+            pending_amount=row['pending_total'] or 0, pending_count=row['pending_n'],
+        )
+        for row in Expense.objects.values('date', 'expense_type', 'department_id', 'category_id')
+        .annotate(
+            total=Sum('amount'), n=Count('id'),
+            pending_total=Sum('amount', filter=pending), pending_n=Count('id', filter=pending),
+        ).order_by()
+    ]
+    FinanceDailyRollup.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinanceDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('kind', models.CharField(choices=[('INCOME', 'Income'), ('EXPENSE', 'Expense')], max_length=10)),
+                ('source', models.CharField(help_text='Income source or expense type', max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('pending_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('department', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='finance.department')),
+                ('expense_category', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='finance.expensecategory')),
+                ('income_category', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='finance.incomecategory')),
+            ],
+            options={
+                'ordering': ['-date', 'kind', 'source'],
+                'indexes': [models.Index(fields=['kind', 'date'], name='finance_rollup_kind_date')],
+                'constraints': [models.UniqueConstraint(models.F('date'), models.F('kind'), models.F('source'), django.db.models.functions.comparison.Coalesce('department', 0), django.db.models.functions.comparison.Coalesce('income_category', 0), django.db.models.functions.comparison.Coalesce('expense_category', 0), name='finance_rollup_unique_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
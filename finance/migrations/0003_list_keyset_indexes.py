@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_financedailyrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='expense',
+            index=models.Index(fields=['date', 'id'], name='finance_expense_date_id'),
+        ),
+        migrations.AddIndex(
+            model_name='income',
+            index=models.Index(fields=['date', 'id'], name='finance_income_date_id'),
+        ),
+    ]
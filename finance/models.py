@@ -1,5 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.db.models.functions import Coalesce
 
 class Department(models.Model):
     """Departments in the diagnostic center"""
@@ -75,6 +76,10 @@ class Income(models.Model):
     
     class Meta:
         ordering = ['-date', '-recorded_at']
+        indexes = [
+            # Keyset pages of the income list (diagcenter.pagination)
+            models.Index(fields=['date', 'id'], name='finance_income_date_id'),
+        ]
     
     def __str__(self):
         return f"{self.income_number} - {self.source} - {self.amount}"
@@ -82,20 +87,19 @@ class Income(models.Model):
     def save(self, *args, **kwargs):
         if not self.income_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_income = Income.objects.filter(
-                income_number__startswith=f'INC{date_str}'
-            ).order_by('income_number').last()
-            
-            if last_income:
-                last_number = int(last_income.income_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.income_number = f'INC{date_str}{new_number:04d}'
+            self.income_number = next_document_number(
+                Income, 'income_number', f'INC{date_str}'
+            )
         
-        super().save(*args, **kwargs)
+        # With the FinanceDailyRollup update its signals make
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
 
 class ExpenseCategory(models.Model):
@@ -164,6 +168,10 @@ class Expense(models.Model):
     
     class Meta:
         ordering = ['-date', '-recorded_at']
+        indexes = [
+            # Keyset pages of the expense list (diagcenter.pagination)
+            models.Index(fields=['date', 'id'], name='finance_expense_date_id'),
+        ]
     
     def __str__(self):
         return f"{self.expense_number} - {self.expense_type} - {self.amount}"
@@ -171,20 +179,19 @@ class Expense(models.Model):
     def save(self, *args, **kwargs):
         if not self.expense_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_expense = Expense.objects.filter(
-                expense_number__startswith=f'EXP{date_str}'
-            ).order_by('expense_number').last()
-            
-            if last_expense:
-                last_number = int(last_expense.expense_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.expense_number = f'EXP{date_str}{new_number:04d}'
+            self.expense_number = next_document_number(
+                Expense, 'expense_number', f'EXP{date_str}'
+            )
         
-        super().save(*args, **kwargs)
+        # With the FinanceDailyRollup update its signals make
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            return super().delete(*args, **kwargs)
 
 
 class Investor(models.Model):
@@ -250,18 +257,11 @@ class InvestorPayout(models.Model):
     def save(self, *args, **kwargs):
         if not self.payout_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_payout = InvestorPayout.objects.filter(
-                payout_number__startswith=f'PAY{date_str}'
-            ).order_by('payout_number').last()
-            
-            if last_payout:
-                last_number = int(last_payout.payout_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.payout_number = f'PAY{date_str}{new_number:04d}'
+            self.payout_number = next_document_number(
+                InvestorPayout, 'payout_number', f'PAY{date_str}'
+            )
         
         super().save(*args, **kwargs)
 
@@ -288,3 +288,61 @@ class ConsultationFee(models.Model):
     
     def __str__(self):
         return f"{self.doctor.get_full_name()} - {self.fee_amount}"
+
+
+class FinanceDailyRollup(models.Model):
+    """Per-day income/expense totals maintained by finance.rollups
+
+    One row per (date, kind, source/expense type, department, category).
+    Rows are updated incrementally when an Income/Expense is saved or
+    deleted; `manage.py rebuild_finance_rollup` recomputes them from scratch.
+    """
+
+    KIND_INCOME = 'INCOME'
+    KIND_EXPENSE = 'EXPENSE'
+    KIND_CHOICES = [
+        (KIND_INCOME, 'Income'),
+        (KIND_EXPENSE, 'Expense'),
+    ]
+
+    date = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    source = models.CharField(max_length=20, help_text="Income source or expense type")
+    # No DB constraint - a deleted department/category leaves its rows to be
+    # re-bucketed by finance.rollups instead of failing the delete
+    department = models.ForeignKey(
+        Department, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+'
+    )
+    income_category = models.ForeignKey(
+        IncomeCategory, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+'
+    )
+    expense_category = models.ForeignKey(
+        ExpenseCategory, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+'
+    )
+
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    # Not yet approved expenses
+    pending_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pending_count = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date', 'kind', 'source']
+        constraints = [
+            models.UniqueConstraint(
+                'date', 'kind', 'source',
+                Coalesce('department', 0),
+                Coalesce('income_category', 0),
+                Coalesce('expense_category', 0),
+                name='finance_rollup_unique_bucket',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['kind', 'date'], name='finance_rollup_kind_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.kind} {self.source} - {self.amount}"
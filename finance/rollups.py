@@ -0,0 +1,239 @@
+"""
+Daily income/expense rollups
+
+``FinanceDailyRollup`` holds per-day totals so dashboards and reports read a
+handful of rows per day instead of scanning every Income/Expense. Rows are
+kept current by the signals in ``finance.signals``: each save subtracts the
+record's previous contribution and adds the new one with ``F()`` updates, in
+the same transaction as the save itself.
+
+Bulk writes (``QuerySet.update``/``bulk_create``) bypass signals - run
+``manage.py rebuild_finance_rollup`` after those.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Expense, FinanceDailyRollup, Income
+
+
+INCOME = FinanceDailyRollup.KIND_INCOME
+EXPENSE = FinanceDailyRollup.KIND_EXPENSE
+
+ZERO = Decimal('0')
+
+# Fields read back before a save to know what the row contributed
+INCOME_FIELDS = ('date', 'source', 'department_id', 'category_id', 'amount')
+EXPENSE_FIELDS = ('date', 'expense_type', 'department_id', 'category_id', 'amount', 'is_approved')
+
+VALUE_FIELDS = ('amount', 'count', 'pending_amount', 'pending_count')
+
+
+def contribution(kind, row):
+    """(bucket, deltas) that one Income/Expense row adds to the rollup
+
+    ``row`` is a dict with the INCOME_FIELDS/EXPENSE_FIELDS keys.
+    """
+    amount = Decimal(str(row['amount'] or 0))
+    if kind == INCOME:
+        bucket = {
+            'date': row['date'],
+            'kind': INCOME,
+            'source': row['source'],
+            'department_id': row['department_id'],
+            'income_category_id': row['category_id'],
+            'expense_category_id': None,
+        }
+        pending = False
+    else:
+        bucket = {
+            'date': row['date'],
+            'kind': EXPENSE,
+            'source': row['expense_type'],
+            'department_id': row['department_id'],
+            'income_category_id': None,
+            'expense_category_id': row['category_id'],
+        }
+        pending = not row['is_approved']
+
+    deltas = {
+        'amount': amount,
+        'count': 1,
+        'pending_amount': amount if pending else ZERO,
+        'pending_count': 1 if pending else 0,
+    }
+    return bucket, deltas
+
+
+def instance_row(kind, instance):
+    fields = INCOME_FIELDS if kind == INCOME else EXPENSE_FIELDS
+    return {field: getattr(instance, field) for field in fields}
+
+
+def stored_row(kind, pk):
+    """The row as currently stored, or None for a new record"""
+    model, fields = (Income, INCOME_FIELDS) if kind == INCOME else (Expense, EXPENSE_FIELDS)
+    return model.objects.filter(pk=pk).values(*fields).first()
+
+
+def apply(bucket, deltas, sign=1):
+    """Add (or with sign=-1 subtract) deltas to the bucket's row"""
+    updates = {field: F(field) + sign * deltas[field] for field in VALUE_FIELDS}
+    if FinanceDailyRollup.objects.filter(**bucket).update(**updates):
+        return
+
+    try:
+        with transaction.atomic():
+            FinanceDailyRollup.objects.create(
+                **bucket, **{field: sign * deltas[field] for field in VALUE_FIELDS}
+            )
+    except IntegrityError:
+        # Another transaction created the bucket first
+        FinanceDailyRollup.objects.filter(**bucket).update(**updates)
+
+
+def record_change(kind, previous, current):
+    """Move a record's contribution from its previous row to its current one
+
+    Either side may be None (create/delete).
+    """
+    old = contribution(kind, previous) if previous else None
+    new = contribution(kind, current) if current else None
+
+    if old and new and old[0] == new[0]:
+        deltas = {field: new[1][field] - old[1][field] for field in VALUE_FIELDS}
+        if any(deltas.values()):
+            apply(new[0], deltas)
+        return
+
+    if old:
+        apply(old[0], old[1], sign=-1)
+    if new:
+        apply(new[0], new[1])
+
+
+def rebuild(date_from=None, date_to=None, dates=None):
+    """Recompute rollup rows from Income/Expense
+
+    Limited to ``dates`` or the ``date_from``..``date_to`` range when given.
+    Returns the number of rows written.
+    """
+    date_filter = Q()
+    if dates is not None:
+        date_filter &= Q(date__in=list(dates))
+    if date_from:
+        date_filter &= Q(date__gte=date_from)
+    if date_to:
+        date_filter &= Q(date__lte=date_to)
+
+    income_rows = Income.objects.filter(date_filter).values(
+        'date', 'source', 'department_id', 'category_id'
+    ).annotate(total=Sum('amount'), n=Count('id')).order_by()
+
+    pending = Q(is_approved=False)
+    expense_rows = Expense.objects.filter(date_filter).values(
+        'date', 'expense_type', 'department_id', 'category_id'
+    ).annotate(
+        total=Sum('amount'),
+        n=Count('id'),
+        pending_total=Coalesce(Sum('amount', filter=pending), Value(ZERO), output_field=DecimalField()),
+        pending_n=Count('id', filter=pending),
+    ).order_by()
+
+    rollups = [
+        FinanceDailyRollup(
+            date=row['date'], kind=INCOME, source=row['source'],
+            department_id=row['department_id'], income_category_id=row['category_id'],
+            amount=row['total'], count=row['n'],
+        )
+        for row in income_rows.iterator()
+    ]
+    rollups += [
+        FinanceDailyRollup(
+            date=row['date'], kind=EXPENSE, source=row['expense_type'],
+            department_id=row['department_id'], expense_category_id=row['category_id'],
+            amount=row['total'], count=row['n'],
+            pending_amount=row['pending_total'], pending_count=row['pending_n'],
+        )
+        for row in expense_rows.iterator()
+    ]
+
+    with transaction.atomic():
+        FinanceDailyRollup.objects.filter(date_filter).delete()
+        FinanceDailyRollup.objects.bulk_create(rollups, batch_size=500)
+    return len(rollups)
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def _sum(field, condition=None):
+    """Sum of a rollup column, 0 instead of NULL when nothing matches"""
+    if field in ('count', 'pending_count'):
+        output_field = IntegerField()
+    else:
+        output_field = DecimalField(max_digits=14, decimal_places=2)
+    return Coalesce(Sum(field, filter=condition), Value(0), output_field=output_field)
+
+
+def totals(date_from=None, date_to=None):
+    """Income and expense totals for a date range - one query"""
+    rows = FinanceDailyRollup.objects.all()
+    if date_from:
+        rows = rows.filter(date__gte=date_from)
+    if date_to:
+        rows = rows.filter(date__lte=date_to)
+
+    income, expense = Q(kind=INCOME), Q(kind=EXPENSE)
+    return rows.aggregate(
+        income=_sum('amount', income),
+        income_count=_sum('count', income),
+        expense=_sum('amount', expense),
+        expense_count=_sum('count', expense),
+    )
+
+
+def summary(kind, today, days=7):
+    """Today/month/all-time/pending figures plus a daily series - one query
+
+    ``series`` is a list of (date, amount) for the last ``days`` days.
+    """
+    month_start = today.replace(day=1)
+    series_dates = [today - timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+
+    aggregates = {
+        'today_amount': _sum('amount', Q(date=today)),
+        'today_count': _sum('count', Q(date=today)),
+        'month_amount': _sum('amount', Q(date__gte=month_start)),
+        'month_count': _sum('count', Q(date__gte=month_start)),
+        'total_amount': _sum('amount'),
+        'total_count': _sum('count'),
+        'pending_amount': _sum('pending_amount'),
+        'pending_count': _sum('pending_count'),
+    }
+    for index, day in enumerate(series_dates):
+        aggregates[f'day_{index}'] = _sum('amount', Q(date=day))
+
+    result = FinanceDailyRollup.objects.filter(kind=kind).aggregate(**aggregates)
+    result['series'] = [(day, result.pop(f'day_{index}')) for index, day in enumerate(series_dates)]
+    return result
+
+
+def breakdown(kind, field, date_from=None, date_to=None):
+    """Totals grouped by a rollup field (e.g. 'source', 'expense_category__name')
+
+    Each item has ``total`` and ``records``; largest first, groups without
+    any record are left out.
+    """
+    rows = FinanceDailyRollup.objects.filter(kind=kind)
+    if date_from:
+        rows = rows.filter(date__gte=date_from)
+    if date_to:
+        rows = rows.filter(date__lte=date_to)
+    return rows.values(field).annotate(
+        total=Sum('amount'), records=Sum('count')
+    ).filter(records__gt=0).order_by('-total')
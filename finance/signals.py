@@ -0,0 +1,61 @@
+"""
+Keep FinanceDailyRollup in step with Income/Expense writes
+"""
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import rollups
+from .models import Income, Expense, Department, IncomeCategory, ExpenseCategory, FinanceDailyRollup
+
+
+KINDS = {Income: rollups.INCOME, Expense: rollups.EXPENSE}
+
+
+@receiver(pre_save, sender=Income)
+@receiver(pre_save, sender=Expense)
+def remember_previous_values(sender, instance, raw=False, **kwargs):
+    # What the stored row contributes now, before this save changes it
+    if raw or instance.pk is None:
+        instance._rollup_previous = None
+    else:
+        instance._rollup_previous = rollups.stored_row(KINDS[sender], instance.pk)
+
+
+@receiver(post_save, sender=Income)
+@receiver(post_save, sender=Expense)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    kind = KINDS[sender]
+    rollups.record_change(
+        kind,
+        getattr(instance, '_rollup_previous', None),
+        rollups.instance_row(kind, instance),
+    )
+    instance._rollup_previous = None
+
+
+@receiver(post_delete, sender=Income)
+@receiver(post_delete, sender=Expense)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    kind = KINDS[sender]
+    rollups.record_change(kind, rollups.instance_row(kind, instance), None)
+
+
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=IncomeCategory)
+@receiver(post_delete, sender=ExpenseCategory)
+def rebucket_after_lookup_delete(sender, instance, **kwargs):
+    # Records were moved to "no department/category" by SET_NULL without
+    # signals - recompute the days that referenced the deleted row
+    field = {
+        Department: 'department',
+        IncomeCategory: 'income_category',
+        ExpenseCategory: 'expense_category',
+    }[sender]
+    dates = set(FinanceDailyRollup.objects.filter(
+        **{f'{field}_id': instance.pk}
+    ).values_list('date', flat=True))
+    if dates:
+        transaction.on_commit(lambda: rollups.rebuild(dates=dates))
@@ -1,3 +1,215 @@
+"""
+Tests for the daily finance rollup
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import rollups
+from .models import Department, Expense, ExpenseCategory, FinanceDailyRollup, Income
+
+User = get_user_model()
+
+
+class FinanceDailyRollupTestCase(TestCase):
+    """Test the rollup follows Income/Expense writes"""
+
+    def setUp(self):
+        self.day = date(2025, 11, 15)
+        self.lab = Department.objects.create(name='Laboratory', code='LAB')
+
+    def income(self, amount, **kwargs):
+        kwargs.setdefault('source', 'LAB_TEST')
+        kwargs.setdefault('date', self.day)
+        return Income.objects.create(amount=Decimal(amount), **kwargs)
+
+    def expense(self, amount, **kwargs):
+        kwargs.setdefault('expense_type', 'SUPPLIES')
+        kwargs.setdefault('date', self.day)
+        kwargs.setdefault('description', 'Reagents')
+        return Expense.objects.create(amount=Decimal(amount), **kwargs)
+
+    def assertMatchesRebuild(self):
+        """Incremental rows must equal a full recompute"""
+        fields = ('date', 'kind', 'source', 'department_id', 'income_category_id',
+                  'expense_category_id', 'amount', 'count', 'pending_amount', 'pending_count')
+        incremental = set(FinanceDailyRollup.objects.filter(count__gt=0).values_list(*fields))
+        rollups.rebuild()
+        self.assertEqual(incremental, set(FinanceDailyRollup.objects.values_list(*fields)))
+
+    def test_saves_add_to_daily_totals(self):
+        self.income('100.00')
+        self.income('50.50', department=self.lab)
+        self.expense('30.00')
+
+        figures = rollups.totals(self.day, self.day)
+        self.assertEqual(figures['income'], Decimal('150.50'))
+        self.assertEqual(figures['income_count'], 2)
+        self.assertEqual(figures['expense'], Decimal('30.00'))
+        self.assertMatchesRebuild()
+
+    def test_failed_rollup_write_rolls_back_the_record(self):
+        """Test a record and its rollup change are saved or deleted together"""
+        income = self.income('100.00')
+        with mock.patch.object(rollups, 'record_change', side_effect=RuntimeError('rollup write failed')):
+            with self.assertRaises(RuntimeError):
+                self.income('50.00')
+            income.amount = Decimal('70.00')
+            with self.assertRaises(RuntimeError):
+                income.save()
+            with self.assertRaises(RuntimeError):
+                self.expense('30.00')
+            with self.assertRaises(RuntimeError):
+                income.delete()
+
+        self.assertEqual(Income.objects.get().amount, Decimal('100.00'))
+        self.assertFalse(Expense.objects.exists())
+        self.assertMatchesRebuild()
+
+    def test_edit_moves_contribution(self):
+        """Test changing amount, source and date moves the record between buckets"""
+        income = self.income('100.00')
+        income.amount = Decimal('120.00')
+        income.save()
+        income.source = 'PHARMACY'
+        income.date = self.day + timedelta(days=1)
+        income.save()
+
+        self.assertEqual(rollups.totals(self.day, self.day)['income'], Decimal('0'))
+        next_day = rollups.totals(self.day + timedelta(days=1))
+        self.assertEqual((next_day['income'], next_day['income_count']), (Decimal('120.00'), 1))
+        self.assertMatchesRebuild()
+
+    def test_delete_subtracts(self):
+        self.income('100.00')
+        self.income('40.00').delete()
+        self.assertEqual(rollups.totals()['income'], Decimal('100.00'))
+        self.assertMatchesRebuild()
+
+    def test_pending_expenses_follow_approval(self):
+        expense = self.expense('75.00', category=ExpenseCategory.objects.create(name='Lab'))
+        stats = rollups.summary(rollups.EXPENSE, self.day)
+        self.assertEqual((stats['pending_amount'], stats['pending_count']), (Decimal('75.00'), 1))
+
+        expense.is_approved = True
+        expense.save()
+        stats = rollups.summary(rollups.EXPENSE, self.day)
+        self.assertEqual((stats['pending_amount'], stats['pending_count']), (Decimal('0'), 0))
+        self.assertEqual(stats['today_amount'], Decimal('75.00'))
+        self.assertMatchesRebuild()
+
+    def test_deleted_department_rebucketed(self):
+        self.income('10.00', department=self.lab)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lab.delete()
+        self.assertFalse(FinanceDailyRollup.objects.filter(department_id__isnull=False).exists())
+        self.assertEqual(rollups.totals()['income'], Decimal('10.00'))
+
+    def test_summary_series(self):
+        self.income('10.00', date=self.day - timedelta(days=2))
+        self.income('5.00')
+        stats = rollups.summary(rollups.INCOME, self.day)
+        self.assertEqual(len(stats['series']), 7)
+        self.assertEqual(stats['series'][-1], (self.day, Decimal('5.00')))
+        self.assertEqual(stats['series'][-3], (self.day - timedelta(days=2), Decimal('10.00')))
+        self.assertEqual(stats['month_amount'], Decimal('15.00'))
+
+
+class FinanceDashboardQueryTestCase(TestCase):
+    """Test the list dashboards don't scale queries with data"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='accountant', password='testpass123', role='ADMIN')
+        self.client.force_login(self.user)
+
+    def count_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_independent_of_history(self):
+        today = timezone.now().date()
+        Income.objects.create(source='OTHER', amount=Decimal('1'), date=today)
+        Expense.objects.create(expense_type='OTHER', amount=Decimal('1'), date=today, description='x')
+        self.count_queries('finance:income_list')  # warm the session
+        income_before = self.count_queries('finance:income_list')
+        expense_before = self.count_queries('finance:expense_list')
+
+        for offset in range(1, 40):
+            day = today - timedelta(days=offset)
+            Income.objects.create(source='LAB_TEST', amount=Decimal('5'), date=day)
+            Expense.objects.create(expense_type='RENT', amount=Decimal('5'), date=day, description='x')
+
+        self.assertEqual(self.count_queries('finance:income_list'), income_before)
+        self.assertEqual(self.count_queries('finance:expense_list'), expense_before)
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Test the income list pages by keyset cursors"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='accountant', password='testpass123', role='ADMIN')
+        self.client.force_login(self.user)
+        self.day = date(2025, 11, 15)
+        # Several incomes a day, so pages split between rows of the same date
+        self.incomes = [
+            Income.objects.create(source='OTHER', amount=Decimal(index + 1), date=self.day - timedelta(days=index // 3))
+            for index in range(47)
+        ]
+        self.expected = [income.pk for income in sorted(self.incomes, key=lambda income: (income.date, income.pk),
+                                                        reverse=True)]
+
+    def get_page(self, **params):
+        response = self.client.get(reverse('finance:income_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj']
+
+    def test_walks_every_row_once_in_order(self):
+        seen, params = [], {}
+        while True:
+            page = self.get_page(**params)
+            seen.extend(income.pk for income in page)
+            if not page.has_next:
+                break
+            params = {'after': page.next_cursor}
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_cursor_returns_the_page_before(self):
+        first = self.get_page()
+        second = self.get_page(after=first.next_cursor)
+        self.assertTrue(second.has_previous)
+        back = self.get_page(before=second.previous_cursor)
+        self.assertEqual([income.pk for income in back], [income.pk for income in first])
+        self.assertFalse(back.has_previous)
+        self.assertTrue(back.has_next)
+
+    def test_filters_apply_to_every_page(self):
+        date_from = (self.day - timedelta(days=9)).isoformat()
+        page = self.get_page(date_from=date_from)
+        response = self.client.get(reverse('finance:income_list'), {'date_from': date_from, 'after': page.next_cursor})
+        self.assertContains(response, f'date_from={date_from}')
+        rows = list(response.context['page_obj']) + list(page)
+        self.assertEqual(len(rows), 30)
+        self.assertTrue(all(income.date >= self.day - timedelta(days=9) for income in rows))
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(reverse('finance:income_list'), {'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
 
-# Create your tests here.
+    def test_deep_page_costs_the_same_queries_as_the_first(self):
+        first = self.get_page()
+        third_cursor = self.get_page(after=first.next_cursor).next_cursor
+        with CaptureQueriesContext(connection) as first_queries:
+            self.get_page()
+        with CaptureQueriesContext(connection) as third_queries:
+            third = self.get_page(after=third_cursor)
+        self.assertFalse(third.has_next)
+        self.assertEqual(len(third_queries), len(first_queries))
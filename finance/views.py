@@ -16,19 +16,26 @@ from .models import (
     Department, Investor, InvestorPayout, ConsultationFee
 )
 from .forms import IncomeForm, ExpenseForm, InvoiceForm
+from . import rollups
+from diagcenter.pagination import KeysetPaginationMixin
 
 
 # ========== INCOME VIEWS ==========
 
-class IncomeListView(LoginRequiredMixin, ListView):
+class IncomeListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """List all income records with filtering"""
     model = Income
     template_name = 'finance/income_list.html'
     context_object_name = 'income_list'
     paginate_by = 20
+    keyset = ('-date', '-id')
     
     def get_queryset(self):
-        queryset = Income.objects.select_related('category', 'department', 'recorded_by')
+        # Only the columns the list shows
+        queryset = Income.objects.select_related('category', 'recorded_by').only(
+            'income_number', 'reference_number', 'date', 'recorded_at', 'source', 'description',
+            'payment_method', 'amount', 'category__name', 'recorded_by__first_name', 'recorded_by__last_name',
+        )
         
         # Filters
         date_from = self.request.GET.get('date_from')
@@ -52,33 +59,26 @@ class IncomeListView(LoginRequiredMixin, ListView):
         today = timezone.now().date()
         this_month_start = today.replace(day=1)
         
-        # Statistics
-        context['today_income'] = Income.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
-        context['today_count'] = Income.objects.filter(date=today).count()
+        # Statistics - read from the daily rollup
+        stats = rollups.summary(rollups.INCOME, today)
+        context['today_income'] = stats['today_amount']
+        context['today_count'] = stats['today_count']
         
-        context['month_income'] = Income.objects.filter(date__gte=this_month_start).aggregate(Sum('amount'))['amount__sum'] or 0
-        context['month_count'] = Income.objects.filter(date__gte=this_month_start).count()
+        context['month_income'] = stats['month_amount']
+        context['month_count'] = stats['month_count']
         
-        context['total_income'] = Income.objects.aggregate(Sum('amount'))['amount__sum'] or 0
+        context['total_income'] = stats['total_amount']
         
         # Average income
-        total_count = Income.objects.count()
+        total_count = stats['total_count']
         context['avg_income'] = (context['total_income'] / total_count) if total_count > 0 else 0
         
         # Chart data - Last 7 days
-        chart_labels = []
-        chart_data = []
-        for i in range(6, -1, -1):
-            date = today - timedelta(days=i)
-            chart_labels.append(date.strftime('%d %b'))
-            daily_income = Income.objects.filter(date=date).aggregate(Sum('amount'))['amount__sum'] or 0
-            chart_data.append(float(daily_income))
-        
-        context['chart_labels'] = json.dumps(chart_labels)
-        context['chart_data'] = json.dumps(chart_data)
+        context['chart_labels'] = json.dumps([date.strftime('%d %b') for date, _ in stats['series']])
+        context['chart_data'] = json.dumps([float(amount) for _, amount in stats['series']])
         
         # Income by source
-        source_data = Income.objects.values('source').annotate(total=Sum('amount')).order_by('-total')
+        source_data = rollups.breakdown(rollups.INCOME, 'source')
         context['source_labels'] = json.dumps([item['source'] for item in source_data])
         context['source_data'] = json.dumps([float(item['total']) for item in source_data])
         
@@ -111,15 +111,20 @@ class IncomeCreateView(LoginRequiredMixin, CreateView):
 
 # ========== EXPENSE VIEWS ==========
 
-class ExpenseListView(LoginRequiredMixin, ListView):
+class ExpenseListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """List all expenses with filtering"""
     model = Expense
     template_name = 'finance/expense_list.html'
     context_object_name = 'expense_list'
     paginate_by = 20
+    keyset = ('-date', '-id')
     
     def get_queryset(self):
-        queryset = Expense.objects.select_related('category', 'department', 'recorded_by', 'approved_by')
+        # Only the columns the list shows
+        queryset = Expense.objects.select_related('category', 'department', 'approved_by').only(
+            'expense_number', 'date', 'recorded_at', 'description', 'amount',
+            'category__name', 'department__name', 'approved_by__first_name', 'approved_by__last_name',
+        )
         
         # Filters
         date_from = self.request.GET.get('date_from')
@@ -149,37 +154,30 @@ class ExpenseListView(LoginRequiredMixin, ListView):
         today = timezone.now().date()
         this_month_start = today.replace(day=1)
         
-        # Statistics
-        context['today_expenses'] = Expense.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
-        context['today_count'] = Expense.objects.filter(date=today).count()
+        # Statistics - read from the daily rollup
+        stats = rollups.summary(rollups.EXPENSE, today)
+        context['today_expenses'] = stats['today_amount']
+        context['today_count'] = stats['today_count']
         
-        context['month_expenses'] = Expense.objects.filter(date__gte=this_month_start).aggregate(Sum('amount'))['amount__sum'] or 0
-        context['month_count'] = Expense.objects.filter(date__gte=this_month_start).count()
+        context['month_expenses'] = stats['month_amount']
+        context['month_count'] = stats['month_count']
         
-        context['pending_expenses'] = Expense.objects.filter(is_approved=False).aggregate(Sum('amount'))['amount__sum'] or 0
-        context['pending_count'] = Expense.objects.filter(is_approved=False).count()
+        context['pending_expenses'] = stats['pending_amount']
+        context['pending_count'] = stats['pending_count']
         
-        context['total_expenses'] = Expense.objects.aggregate(Sum('amount'))['amount__sum'] or 0
+        context['total_expenses'] = stats['total_amount']
         
         # Budget usage (example: 100000 per month)
         monthly_budget = 100000
         context['budget_usage_percent'] = min(100, (float(context['month_expenses']) / monthly_budget) * 100) if monthly_budget > 0 else 0
         
         # Chart data
-        chart_labels = []
-        chart_data = []
-        for i in range(6, -1, -1):
-            date = today - timedelta(days=i)
-            chart_labels.append(date.strftime('%d %b'))
-            daily_expense = Expense.objects.filter(date=date).aggregate(Sum('amount'))['amount__sum'] or 0
-            chart_data.append(float(daily_expense))
-        
-        context['chart_labels'] = json.dumps(chart_labels)
-        context['chart_data'] = json.dumps(chart_data)
+        context['chart_labels'] = json.dumps([date.strftime('%d %b') for date, _ in stats['series']])
+        context['chart_data'] = json.dumps([float(amount) for _, amount in stats['series']])
         
         # Category breakdown
-        category_data = Expense.objects.values('category__name').annotate(total=Sum('amount')).order_by('-total')[:5]
-        context['category_labels'] = json.dumps([item['category__name'] or 'Uncategorized' for item in category_data])
+        category_data = rollups.breakdown(rollups.EXPENSE, 'expense_category__name')[:5]
+        context['category_labels'] = json.dumps([item['expense_category__name'] or 'Uncategorized' for item in category_data])
         context['category_data'] = json.dumps([float(item['total']) for item in category_data])
         
         # Page total
@@ -305,8 +303,9 @@ def finance_dashboard(request):
     today = timezone.now().date()
     this_month = today.replace(day=1)
     
-    total_income = Income.objects.aggregate(Sum('amount'))['amount__sum'] or 0
-    total_expense = Expense.objects.aggregate(Sum('amount'))['amount__sum'] or 0
+    figures = rollups.totals()
+    total_income = figures['income']
+    total_expense = figures['expense']
     
     return render(request, 'finance/finance_dashboard.html', {
         'total_income': total_income,
@@ -357,8 +356,9 @@ def financial_reports(request):
 def daily_report(request):
     """Daily financial report"""
     today = timezone.now().date()
-    income = Income.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
-    expense = Expense.objects.filter(date=today).aggregate(Sum('amount'))['amount__sum'] or 0
+    figures = rollups.totals(today, today)
+    income = figures['income']
+    expense = figures['expense']
     
     return render(request, 'finance/daily_report.html', {
         'date': today,
@@ -373,8 +373,9 @@ def weekly_report(request):
     today = timezone.now().date()
     week_start = today - timedelta(days=today.weekday())
     
-    income = Income.objects.filter(date__gte=week_start).aggregate(Sum('amount'))['amount__sum'] or 0
-    expense = Expense.objects.filter(date__gte=week_start).aggregate(Sum('amount'))['amount__sum'] or 0
+    figures = rollups.totals(week_start)
+    income = figures['income']
+    expense = figures['expense']
     
     return render(request, 'finance/weekly_report.html', {
         'week_start': week_start,
@@ -389,8 +390,9 @@ def monthly_report(request):
     today = timezone.now().date()
     month_start = today.replace(day=1)
     
-    income = Income.objects.filter(date__gte=month_start).aggregate(Sum('amount'))['amount__sum'] or 0
-    expense = Expense.objects.filter(date__gte=month_start).aggregate(Sum('amount'))['amount__sum'] or 0
+    figures = rollups.totals(month_start)
+    income = figures['income']
+    expense = figures['expense']
     
     return render(request, 'finance/monthly_report.html', {
         'month': today.strftime('%B %Y'),
@@ -405,8 +407,9 @@ def yearly_report(request):
     today = timezone.now().date()
     year_start = today.replace(month=1, day=1)
     
-    income = Income.objects.filter(date__gte=year_start).aggregate(Sum('amount'))['amount__sum'] or 0
-    expense = Expense.objects.filter(date__gte=year_start).aggregate(Sum('amount'))['amount__sum'] or 0
+    figures = rollups.totals(year_start)
+    income = figures['income']
+    expense = figures['expense']
     
     return render(request, 'finance/yearly_report.html', {
         'year': today.year,
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0013_documentsequence'),
+        ('appointments', '0003_list_keyset_indexes'),
+        ('lab', '0002_remove_laborder_pc_member_laborder_pc_code'),
+        ('patients', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='laborder',
+            index=models.Index(fields=['ordered_at', 'id'], name='lab_order_ordered_id'),
+        ),
+    ]
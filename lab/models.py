@@ -121,6 +121,10 @@ class LabOrder(models.Model):
     
     class Meta:
         ordering = ['-ordered_at']
+        indexes = [
+            # Keyset pages of the order list (diagcenter.pagination)
+            models.Index(fields=['ordered_at', 'id'], name='lab_order_ordered_id'),
+        ]
     
     def __str__(self):
         return f"{self.order_number} - {self.patient.get_full_name()}"
@@ -128,18 +132,11 @@ class LabOrder(models.Model):
     def save(self, *args, **kwargs):
         if not self.order_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_order = LabOrder.objects.filter(
-                order_number__startswith=f'LAB{date_str}'
-            ).order_by('order_number').last()
-            
-            if last_order:
-                last_number = int(last_order.order_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.order_number = f'LAB{date_str}{new_number:04d}'
+            self.order_number = next_document_number(
+                LabOrder, 'order_number', f'LAB{date_str}'
+            )
         
         super().save(*args, **kwargs)
     
@@ -266,18 +263,11 @@ class LabBill(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.bill_number:
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_bill = LabBill.objects.filter(
-                bill_number__startswith=f'LB{date_str}'
-            ).order_by('bill_number').last()
-            
-            if last_bill:
-                last_number = int(last_bill.bill_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.bill_number = f'LB{date_str}{new_number:04d}'
+            self.bill_number = next_document_number(
+                LabBill, 'bill_number', f'LB{date_str}'
+            )
         
         super().save(*args, **kwargs)
     
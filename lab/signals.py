@@ -0,0 +1,34 @@
+"""
+Keep the lab worklist counts and screens in step with lab order changes
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import worklist
+from .models import LabOrder
+
+
+@receiver(pre_save, sender=LabOrder, dispatch_uid='lab_worklist:order_saving')
+@receiver(pre_delete, sender=LabOrder, dispatch_uid='lab_worklist:order_deleting')
+def remember_worklist_row(sender, instance, raw=False, **kwargs):
+    # What the stored order counts towards, before it changes
+    if raw or instance.pk is None:
+        instance._worklist_row = None
+    else:
+        instance._worklist_row = worklist.stored_row(instance.pk)
+
+
+@receiver(post_save, sender=LabOrder, dispatch_uid='lab_worklist:order_saved')
+def order_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_worklist_row', None)
+    # Only once committed - a rolled back change mustn't move the counts
+    transaction.on_commit(lambda: worklist.record_change(instance, previous))
+
+
+@receiver(post_delete, sender=LabOrder, dispatch_uid='lab_worklist:order_deleted')
+def order_deleted(sender, instance, **kwargs):
+    previous = getattr(instance, '_worklist_row', None)
+    transaction.on_commit(lambda: worklist.record_change(instance, previous, deleted=True))
@@ -1,13 +1,23 @@
 """
 Comprehensive tests for Lab module views and endpoints
 """
+import json
+from unittest import mock
+
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from datetime import timedelta
 
+from . import worklist
 from .models import LabTest, LabOrder, LabResult
+from appointments.consumers import LabWorklistConsumer
 from patients.models import Patient
 
 User = get_user_model()
@@ -292,3 +302,122 @@ class LabOrderWorkflowTestCase(TestCase):
         )
         self.assertEqual(response.status_code, 200)
 
+
+class LabWorklistTestCase(TestCase):
+    """Test the worklist counts are kept in the cache and changes are pushed"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='labtech', password='testpass123')
+        self.patient = Patient.objects.create(
+            patient_id='P001', first_name='John', last_name='Doe', date_of_birth='1990-01-01',
+            gender='MALE', phone='1234567890',
+        )
+
+    def order(self, **fields):
+        fields.setdefault('status', 'ORDERED')
+        with self.captureOnCommitCallbacks(execute=True):
+            return LabOrder.objects.create(patient=self.patient, ordered_by=self.user, total_amount=500, **fields)
+
+    def save(self, order, status):
+        order.status = status
+        with self.captureOnCommitCallbacks(execute=True):
+            order.save()
+
+    def assertCountsMatchDatabase(self):
+        counts = worklist.counts()
+        cache.clear()
+        self.assertEqual(counts, worklist.counts())
+
+    def test_counts_served_from_cache(self):
+        """Test counts are recounted in one query, then read without the database"""
+        self.order()
+        self.order(priority=True)
+        cache.clear()
+        with self.assertNumQueries(1):
+            counts = worklist.counts()
+        self.assertEqual((counts['ordered'], counts['urgent'], counts['total']), (2, 1, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(worklist.counts(), counts)
+
+    def test_status_changes_move_counters(self):
+        """Test saves and deletes move the cached counters as a recount would"""
+        worklist.counts()
+        order = self.order(priority=True)
+        other = self.order()
+        self.save(order, 'SAMPLE_COLLECTED')
+        self.save(order, 'IN_PROGRESS')
+        self.save(order, 'COMPLETED')
+        self.save(other, 'CANCELLED')
+
+        counts = worklist.counts()
+        self.assertEqual(
+            [counts[counter] for counter in worklist.COUNTERS],
+            # ordered, collected, progress, completed, urgent, total
+            [0, 0, 0, 1, 0, 2],
+        )
+        self.assertCountsMatchDatabase()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(worklist.counts()['total'], 1)
+        self.assertCountsMatchDatabase()
+
+    def test_status_change_moves_counters_without_recount(self):
+        """Test a change moves the shared counters with incr, not a COUNT query"""
+        order = self.order()
+        worklist.counts()
+        with CaptureQueriesContext(connection) as queries, mock.patch('lab.worklist.broadcast') as broadcast:
+            self.save(order, 'SAMPLE_COLLECTED')
+        self.assertFalse([query['sql'] for query in queries if 'COUNT' in query['sql'].upper()])
+        counts = broadcast.call_args.args[0]['counts']
+        self.assertEqual((counts['ordered'], counts['collected'], counts['total']), (0, 1, 1))
+        self.assertCountsMatchDatabase()
+
+    def test_change_broadcast_after_commit(self):
+        """Test a committed status change is sent once to the lab_worklist group"""
+        order = self.order()
+        with mock.patch('lab.worklist.get_channel_layer') as get_layer:
+            get_layer.return_value.group_send = mock.AsyncMock()
+            self.save(order, 'SAMPLE_COLLECTED')
+            # Saving without a status change has nothing to push
+            with self.captureOnCommitCallbacks(execute=True):
+                order.save()
+
+        group_send = get_layer.return_value.group_send
+        self.assertEqual(group_send.call_count, 1)
+        group, event = group_send.call_args.args
+        self.assertEqual((group, event['type']), ('lab_worklist', 'worklist.change'))
+        message = json.loads(event['text'])
+        self.assertEqual(
+            (message['order']['id'], message['order']['previous_status'], message['order']['status']),
+            (order.id, 'ORDERED', 'SAMPLE_COLLECTED'),
+        )
+        self.assertEqual(message['counts']['collected'], 1)
+
+    def test_order_card(self):
+        """Test the card endpoint renders one order for the screen to swap in"""
+        order = self.order()
+        self.client.login(username='labtech', password='testpass123')
+        response = self.client.get(reverse('lab:order_card', kwargs={'pk': order.pk}))
+        self.assertContains(response, f'data-order-id="{order.pk}"')
+
+    async def test_consumer_forwards_changes(self):
+        """Test a connected screen gets the counts, then every change as sent"""
+        communicator = WebsocketCommunicator(LabWorklistConsumer.as_asgi(), '/ws/lab/worklist/')
+        communicator.scope['user'] = self.user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        message = await communicator.receive_json_from()
+        self.assertEqual((message['type'], message['counts']['total']), ('worklist_counts', 0))
+
+        text = json.dumps({'type': 'worklist_change', 'order': {'id': 1}, 'counts': {}})
+        await get_channel_layer().group_send(worklist.GROUP, {'type': 'worklist.change', 'text': text})
+        self.assertEqual(await communicator.receive_from(), text)
+        await communicator.disconnect()
+
+    async def test_consumer_rejects_anonymous(self):
+        """Test the worklist isn't pushed to screens that aren't logged in"""
+        communicator = WebsocketCommunicator(LabWorklistConsumer.as_asgi(), '/ws/lab/worklist/')
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
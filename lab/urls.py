@@ -12,6 +12,7 @@ urlpatterns = [
     path('order/create/', views.lab_order_create, name='order_create'),
     path('order/<int:pk>/', views.lab_order_detail, name='order_detail'),
     path('order/<int:pk>/details/', views.lab_order_detail, name='order_details'),  # AJAX
+    path('order/<int:pk>/card/', views.lab_order_card, name='order_card'),  # AJAX, worklist screen
     path('order/<int:pk>/print-voucher/', views.print_lab_voucher, name='print_voucher'),
     path('order/<int:pk>/collect-sample/', views.collect_sample, name='collect_sample'),
     path('order/<int:pk>/start-testing/', views.start_testing, name='start_testing'),
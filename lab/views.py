@@ -2,7 +2,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Prefetch, Q
 from django.utils import timezone
 from django.http import JsonResponse, HttpResponse
 from django.views.generic import ListView, CreateView, UpdateView, DetailView
@@ -10,19 +10,24 @@ from django.urls import reverse_lazy
 from datetime import timedelta
 import json
 
+from . import worklist
 from .models import LabTest, LabOrder, LabResult
 from .forms import LabTestForm
 from patients.models import Patient
+from accounts import commission
+from accounts.models import PCMember
+from diagcenter.pagination import KeysetPaginationMixin, keyset_page
 
 
 # ========== LAB ORDER VIEWS ==========
 
-class LabOrderListView(LoginRequiredMixin, ListView):
+class LabOrderListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """List all lab orders with status filtering"""
     model = LabOrder
     template_name = 'lab/lab_order_list.html'
     context_object_name = 'order_list'
     paginate_by = 15
+    keyset = ('-ordered_at', '-id')
     
     def get_queryset(self):
         queryset = LabOrder.objects.select_related(
@@ -38,25 +43,15 @@ class LabOrderListView(LoginRequiredMixin, ListView):
         if self.request.GET.get('priority'):
             queryset = queryset.filter(priority=True)
         
-        return queryset.order_by('-ordered_at')
+        return queryset
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Status counts
-        context['ordered_count'] = LabOrder.objects.filter(status='ORDERED').count()
-        context['collected_count'] = LabOrder.objects.filter(status='SAMPLE_COLLECTED').count()
-        context['progress_count'] = LabOrder.objects.filter(status='IN_PROGRESS').count()
-        
-        # Completed today
-        today = timezone.now().date()
-        context['completed_count'] = LabOrder.objects.filter(
-            status='COMPLETED',
-            ordered_at__date=today
-        ).count()
-        
-        context['urgent_count'] = LabOrder.objects.filter(priority=True).exclude(status='COMPLETED').count()
-        context['total_count'] = LabOrder.objects.count()
+        # Status counts - kept in the cache by lab.worklist, not recounted
+        counts = worklist.counts()
+        for counter in worklist.COUNTERS:
+            context[f'{counter}_count'] = counts[counter]
         
         return context
 
@@ -66,7 +61,10 @@ def lab_order_list(request):
     """List lab orders - Simple view with history and print voucher option"""
     from django.utils import timezone
     
-    orders = LabOrder.objects.all().select_related('patient', 'ordered_by').prefetch_related('tests').order_by('-ordered_at')
+    orders = LabOrder.objects.select_related('patient').only(
+        'order_number', 'ordered_at', 'total_amount', 'status',
+        'patient__first_name', 'patient__last_name', 'patient__patient_id', 'patient__phone',
+    ).prefetch_related(Prefetch('tests', queryset=LabTest.objects.only('test_name')))
     
     # Filter by date if provided
     date_filter = request.GET.get('date')
@@ -78,8 +76,11 @@ def lab_order_list(request):
     if status_filter:
         orders = orders.filter(status=status_filter)
     
+    page = keyset_page(orders, ('-ordered_at', '-id'), request, per_page=25)
     context = {
-        'order_list': orders[:100],  # Limit to recent 100 orders
+        'order_list': page,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
         'today': timezone.now().date(),
     }
     return render(request, 'lab/lab_order_list_simple.html', context)
@@ -129,34 +130,19 @@ def lab_order_create(request):
             
             # Handle PC commission if PC code provided
             if pc_code:
-                try:
-                    from accounts.models import PCMember, PCTransaction
-                    pc_member = PCMember.objects.get(pc_code=pc_code, is_active=True)
-                    
-                    # Calculate commission based on test types
-                    commission_amount = 0
-                    for test in tests:
-                        if test.test_type == 'NORMAL':
-                            commission_amount += (test.price * pc_member.normal_test_commission / 100)
-                        else:  # DIGITAL
-                            commission_amount += (test.price * pc_member.digital_test_commission / 100)
-                    
-                    admin_amount = total_amount - commission_amount
-                    
-                    # Create PC transaction
-                    PCTransaction.objects.create(
-                        pc_member=pc_member,
-                        transaction_type='LAB_TEST',
-                        amount=total_amount,
-                        commission_amount=commission_amount,
-                        admin_amount=admin_amount,
-                        description=f'Lab Order {lab_order.order_number}',
-                        lab_order=lab_order
+                pc_member = PCMember.objects.filter(pc_code=pc_code, is_active=True).first()
+                # If PC code invalid, continue without commission
+                if pc_member:
+                    commission.record(
+                        pc_member,
+                        commission.split(pc_member, tests),
+                        recorded_by=request.user,
+                        patient=patient,
+                        lab_order=lab_order,
+                        notes=f'Lab Order {lab_order.order_number}',
                     )
                     lab_order.pc_code = pc_member
-                    lab_order.save()
-                except:
-                    pass  # If PC code invalid, continue without commission
+                    lab_order.save(update_fields=['pc_code'])
             
             messages.success(request, f'Lab order created successfully! Order #: {lab_order.order_number}')
             # Redirect to print voucher
@@ -181,6 +167,15 @@ def lab_order_detail(request, pk):
     return render(request, 'lab/lab_order_detail.html', {'order': order})
 
 
+@login_required
+def lab_order_card(request, pk):
+    """One order's worklist card - fetched by the screen when the order changes"""
+    order = get_object_or_404(
+        LabOrder.objects.select_related('patient', 'ordered_by').prefetch_related('tests'), pk=pk
+    )
+    return render(request, 'lab/includes/lab_order_card.html', {'order': order})
+
+
 @login_required
 def print_lab_voucher(request, pk):
     """Print lab test bill voucher"""
@@ -200,7 +195,8 @@ def collect_sample(request, pk):
         order.sample_collected_by = request.user
         order.save()
         
-        messages.success(request, f'Sample collected for order {order.order_number}')
+        # No flash message - the screen shows the change from the lab_worklist
+        # group instead of reloading, so it would only turn up on a later page
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=400)
 
@@ -213,7 +209,6 @@ def start_testing(request, pk):
         order.status = 'IN_PROGRESS'
         order.save()
         
-        messages.success(request, f'Testing started for order {order.order_number}')
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=400)
 
@@ -229,7 +224,6 @@ def cancel_order(request, pk):
         order.status = 'CANCELLED'
         order.save()
         
-        messages.success(request, f'Order {order.order_number} cancelled')
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=400)
 
@@ -299,16 +293,13 @@ def lab_test_list(request):
 @login_required
 def lab_dashboard(request):
     """Lab dashboard"""
-    today = timezone.now().date()
+    counts = worklist.counts()
     
     context = {
-        'pending_orders': LabOrder.objects.filter(status='ORDERED').count(),
-        'in_progress': LabOrder.objects.filter(status='IN_PROGRESS').count(),
-        'completed_today': LabOrder.objects.filter(
-            status='COMPLETED',
-            ordered_at__date=today
-        ).count(),
-        'total_orders': LabOrder.objects.count(),
+        'pending_orders': counts['ordered'],
+        'in_progress': counts['progress'],
+        'completed_today': counts['completed'],
+        'total_orders': counts['total'],
         'recent_orders': LabOrder.objects.select_related('patient', 'ordered_by').order_by('-ordered_at')[:10],
     }
     return render(request, 'accounts/lab_dashboard.html', context)
@@ -0,0 +1,150 @@
+"""
+Lab worklist - live status counts and order changes for the lab screens
+
+The worklist's status counts (ordered, sample collected, in progress,
+completed today, urgent, total) are counters in the shared cache (Redis in
+production, so every worker moves and reads the same counters), moved by one
+``incr`` per counter a change touches instead of recounted on every page:
+
+- ``lab.signals`` reads an order's stored status/priority before it is saved
+  and, once the change commits, calls ``record_change(previous, current)``,
+  which moves the counters by the difference and broadcasts the change to
+  the ``lab_worklist`` group (``LabWorklistConsumer``) as one encoded
+  message, with the counts after it
+- ``counts()`` reads the counters; when any is missing (first use, expiry,
+  a new day) they are all rebuilt with one aggregate query. Counters expire
+  after ``LAB_WORKLIST_COUNT_TIMEOUT`` so a change lost between a rebuild's
+  query and its write doesn't stay wrong for long
+
+Orders changed with ``QuerySet.update`` bypass the signals; their counts
+catch up at the next rebuild.
+"""
+import json
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import LabOrder
+
+GROUP = 'lab_worklist'
+PREFIX = 'lab_worklist'
+
+# Counter -> status it counts
+STATUS_COUNTERS = {
+    'ordered': 'ORDERED',
+    'collected': 'SAMPLE_COLLECTED',
+    'progress': 'IN_PROGRESS',
+}
+COUNTERS = (*STATUS_COUNTERS, 'completed', 'urgent', 'total')
+
+# Fields read back before an order is saved or deleted
+STORED_FIELDS = ('status', 'priority', 'ordered_at')
+
+
+def stored_row(pk):
+    """The order as currently stored, or None for a new order"""
+    return LabOrder.objects.filter(pk=pk).values(*STORED_FIELDS).first()
+
+
+def order_row(order):
+    return {field: getattr(order, field) for field in STORED_FIELDS}
+
+
+def _key(counter, day):
+    # Completed counts orders of the day they were ordered on
+    if counter == 'completed':
+        return f'{PREFIX}:completed:{day:%Y%m%d}'
+    return f'{PREFIX}:{counter}'
+
+
+def contribution(row):
+    """Counters an order in ``row``'s state adds one to"""
+    if row is None:
+        return set()
+    keys = {_key('total', None)}
+    for counter, status in STATUS_COUNTERS.items():
+        if row['status'] == status:
+            keys.add(_key(counter, None))
+    if row['status'] == 'COMPLETED':
+        keys.add(_key('completed', timezone.localdate(row['ordered_at'])))
+    elif row['priority']:
+        keys.add(_key('urgent', None))
+    return keys
+
+
+def rebuild(today=None):
+    """Recount every counter - one query; returns the counts"""
+    today = today or timezone.localdate()
+    ordered_today = Q(ordered_at__date=today)
+    result = LabOrder.objects.aggregate(
+        **{counter: Count('id', filter=Q(status=status)) for counter, status in STATUS_COUNTERS.items()},
+        completed=Count('id', filter=Q(status='COMPLETED') & ordered_today),
+        urgent=Count('id', filter=Q(priority=True) & ~Q(status='COMPLETED')),
+        total=Count('id'),
+    )
+    cache.set_many(
+        {_key(counter, today): result[counter] for counter in COUNTERS},
+        settings.LAB_WORKLIST_COUNT_TIMEOUT,
+    )
+    return result
+
+
+def counts(today=None):
+    """{counter: count} - from the cache, rebuilt when any counter is missing"""
+    today = today or timezone.localdate()
+    keys = {counter: _key(counter, today) for counter in COUNTERS}
+    cached = cache.get_many(keys.values())
+    if len(cached) < len(keys):
+        return rebuild(today)
+    return {counter: cached[key] for counter, key in keys.items()}
+
+
+def move(previous, current):
+    """Move the counters from an order's previous state to its current one"""
+    before, after = contribution(previous), contribution(current)
+    for key, delta in [(key, -1) for key in before - after] + [(key, 1) for key in after - before]:
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # Not counted yet - the next counts() rebuilds it
+            pass
+
+
+def serialize_order(order, previous_status=None, deleted=False):
+    return {
+        'id': order.pk,
+        'order_number': order.order_number,
+        'status': order.status,
+        'status_display': order.get_status_display(),
+        'previous_status': previous_status,
+        'priority': order.priority,
+        'deleted': deleted,
+    }
+
+
+def broadcast(message):
+    """Send one encoded change to every lab screen"""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(GROUP, {'type': 'worklist.change', 'text': json.dumps(message)})
+    except Exception as e:
+        print(f"❌ Lab worklist broadcast error: {e}")
+
+
+def record_change(order, previous, deleted=False):
+    """Apply a committed save/delete of ``order`` (previous stored row or None)"""
+    current = None if deleted else order_row(order)
+    if previous == current:
+        return
+    move(previous, current)
+    broadcast({
+        'type': 'worklist_change',
+        'order': serialize_order(order, previous['status'] if previous else None, deleted),
+        'counts': counts(),
+    })
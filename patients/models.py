@@ -73,18 +73,11 @@ class Patient(models.Model):
         if not self.patient_id:
             # Generate patient ID: PAT + year + sequential number
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             year = timezone.now().year
-            last_patient = Patient.objects.filter(
-                patient_id__startswith=f'PAT{year}'
-            ).order_by('patient_id').last()
-            
-            if last_patient:
-                last_number = int(last_patient.patient_id[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.patient_id = f'PAT{year}{new_number:04d}'
+            self.patient_id = next_document_number(
+                Patient, 'patient_id', f'PAT{year}'
+            )
         
         super().save(*args, **kwargs)
     
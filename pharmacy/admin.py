@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import DrugCategory, Drug, PharmacySale, SaleItem, StockAdjustment
+from .models import (
+    DispenseCart, DispenseCartLine, DrugAlias, DrugCategory, Drug, DrugBatch, DrugForecast, PharmacySale,
+    PurchaseInvoice, SaleItem, StockAdjustment, StockMovement,
+)
 
 
 @admin.register(DrugCategory)
@@ -93,10 +96,115 @@ class StockAdjustmentAdmin(admin.ModelAdmin):
             'fields': ('drug', 'adjustment_type', 'quantity', 'unit_cost', 'reason')
         }),
         ('Purchase Info', {
-            'fields': ('supplier', 'invoice_number', 'batch_number'),
+            'fields': ('supplier', 'invoice_number', 'batch_number', 'expiry_date'),
             'classes': ('collapse',)
         }),
         ('Staff & Date', {
             'fields': ('adjusted_by', 'adjusted_at', 'expense_created')
         }),
     )
+
+
+class PurchaseInvoiceLineInline(admin.TabularInline):
+    model = StockAdjustment
+    fields = ['drug', 'quantity', 'unit_cost', 'batch_number', 'expiry_date']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(PurchaseInvoice)
+class PurchaseInvoiceAdmin(admin.ModelAdmin):
+    """Invoices are received through pharmacy:purchase_invoice_create"""
+    list_display = ['supplier', 'invoice_number', 'invoice_date', 'total_amount', 'received_by', 'received_at']
+    list_filter = ['invoice_date', 'received_at']
+    search_fields = ['supplier', 'invoice_number']
+    list_select_related = ['received_by']
+    readonly_fields = ['expense', 'total_amount', 'received_by', 'received_at']
+    inlines = [PurchaseInvoiceLineInline]
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(DrugBatch)
+class DrugBatchAdmin(admin.ModelAdmin):
+    """Batches are received and drawn down through the stock ledger"""
+    list_display = ['drug', 'batch_number', 'expiry_date', 'quantity', 'received_quantity', 'unit_cost', 'received_at']
+    list_filter = ['expiry_date', 'received_at']
+    search_fields = ['drug__brand_name', 'drug__drug_code', 'batch_number']
+    list_select_related = ['drug']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """Read-only view of the stock ledger"""
+    list_display = ['drug', 'kind', 'quantity', 'batch', 'sale_item', 'adjustment', 'created_by', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['drug__brand_name', 'drug__drug_code', 'note']
+    list_select_related = ['drug', 'created_by']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DrugForecast)
+class DrugForecastAdmin(admin.ModelAdmin):
+    """Forecasts are recomputed by manage.py forecast_reorders"""
+    list_display = ['drug', 'daily_demand', 'safety_stock', 'reorder_point', 'days_of_cover',
+                    'suggested_order', 'computed_at']
+    list_filter = ['computed_at']
+    search_fields = ['drug__brand_name', 'drug__drug_code']
+    list_select_related = ['drug']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DrugAlias)
+class DrugAliasAdmin(admin.ModelAdmin):
+    """Medicine names learned from dispensing; correct a wrong mapping here"""
+    list_display = ['text', 'drug', 'hits', 'updated_at']
+    search_fields = ['text', 'drug__brand_name', 'drug__generic_name']
+    list_select_related = ['drug']
+    autocomplete_fields = ['drug']
+
+
+class DispenseCartLineInline(admin.TabularInline):
+    model = DispenseCartLine
+    fields = ['medicine', 'drug', 'quantity', 'match']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(DispenseCart)
+class DispenseCartAdmin(admin.ModelAdmin):
+    """Carts are built by pharmacy.dispensing when prescriptions are written"""
+    list_display = ['prescription', 'status', 'matched_lines', 'total_lines', 'computed_at', 'dispensed_at']
+    list_filter = ['status', 'computed_at']
+    search_fields = ['prescription__prescription_number']
+    list_select_related = ['prescription']
+    readonly_fields = ['prescription', 'status', 'matched_lines', 'total_lines', 'sale', 'computed_at', 'dispensed_at']
+    inlines = [DispenseCartLineInline]
+    
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,208 @@
+"""
+Pharmacy sales analytics
+
+``DrugSalesRollup`` is a (day x drug) cube of units, revenue, cost and
+profit, with the drug's category on every row, so the profit reports read a
+few rows per drug and day instead of grouping ``SaleItem`` over its sales:
+
+- ``checkout`` adds each sale with ``record_items`` - two queries whatever
+  the number of lines: the missing buckets are inserted as zeros
+  (``ignore_conflicts``, so concurrent sales can't collide), then every
+  bucket is moved with one CASE/``F()`` UPDATE
+- sale lines saved or deleted one by one are applied by the signals in
+  ``pharmacy.signals``
+
+Figures are per line, as ``SaleItem.profit``: sale level discounts aren't
+spread over the lines. Bulk writes that bypass both paths (``QuerySet.update``
+of sale dates, imports) need ``manage.py rebuild_pharmacy_analytics``.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Trunc, TruncDate
+from django.utils import timezone
+
+from .models import Drug, DrugSalesRollup, SaleItem
+
+VALUE_FIELDS = ('units', 'revenue', 'cost', 'profit', 'lines')
+COUNT_FIELDS = ('units', 'lines')
+
+# Fields read back before a line is changed or deleted
+STORED_FIELDS = ('drug_id', 'drug__category_id', 'quantity', 'total_price', 'buy_price', 'profit', 'sale__sale_date')
+
+
+def sale_day(sale_date):
+    return timezone.localdate(sale_date) if timezone.is_aware(sale_date) else sale_date.date()
+
+
+def line_row(item, sale_date):
+    """What one sale line adds to the cube, as a dict of ``STORED_FIELDS``"""
+    return {
+        'drug_id': item.drug_id,
+        'drug__category_id': item.drug.category_id,
+        'quantity': item.quantity,
+        'total_price': item.total_price,
+        'buy_price': item.buy_price,
+        'profit': item.profit,
+        'sale__sale_date': sale_date,
+    }
+
+
+def stored_row(pk):
+    """The line as currently stored, or None for a new line"""
+    return SaleItem.objects.filter(pk=pk).values(*STORED_FIELDS).first()
+
+
+def add_rows(rows, sign=1):
+    """Add (or with sign=-1 subtract) sale line rows to the cube - two queries"""
+    buckets = defaultdict(lambda: dict.fromkeys(VALUE_FIELDS, 0))
+    categories = {}
+    for row in rows:
+        key = (sale_day(row['sale__sale_date']), row['drug_id'])
+        categories[key] = row['drug__category_id']
+        deltas = buckets[key]
+        deltas['units'] += sign * row['quantity']
+        deltas['revenue'] += sign * Decimal(row['total_price'])
+        deltas['cost'] += sign * Decimal(row['buy_price']) * row['quantity']
+        deltas['profit'] += sign * Decimal(row['profit'])
+        deltas['lines'] += sign
+    if not buckets:
+        return
+
+    with transaction.atomic():
+        DrugSalesRollup.objects.bulk_create(
+            [DrugSalesRollup(date=day, drug_id=drug_id, category_id=categories[day, drug_id])
+             for day, drug_id in buckets],
+            ignore_conflicts=True,
+        )
+        in_buckets = Q()
+        for day, drug_id in buckets:
+            in_buckets |= Q(date=day, drug_id=drug_id)
+        DrugSalesRollup.objects.filter(in_buckets).update(**{
+            field: F(field) + Case(
+                *[When(date=day, drug_id=drug_id, then=Value(deltas[field]))
+                  for (day, drug_id), deltas in buckets.items()],
+                default=Value(0),
+                output_field=IntegerField() if field in COUNT_FIELDS else DecimalField(max_digits=14, decimal_places=2),
+            )
+            for field in VALUE_FIELDS
+        })
+
+
+def record_items(items, sale_date):
+    """Add the lines of a sale made at ``sale_date``; lines need ``drug`` loaded"""
+    add_rows(line_row(item, sale_date) for item in items)
+
+
+def record_change(previous, current):
+    """Move a line's contribution from its stored row to its new one
+
+    Either side may be None (create/delete).
+    """
+    if previous:
+        add_rows([previous], sign=-1)
+    if current:
+        add_rows([current])
+
+
+def rebuild(date_from=None, date_to=None):
+    """Recompute the cube from the sale lines, optionally for a date range
+
+    Returns the number of rows written.
+    """
+    items = SaleItem.objects.annotate(day=TruncDate('sale__sale_date'))
+    rollups = DrugSalesRollup.objects.all()
+    if date_from:
+        items, rollups = items.filter(day__gte=date_from), rollups.filter(date__gte=date_from)
+    if date_to:
+        items, rollups = items.filter(day__lte=date_to), rollups.filter(date__lte=date_to)
+
+    rows = items.values('day', 'drug_id', 'drug__category_id').annotate(
+        units=Sum('quantity'),
+        revenue=Sum('total_price'),
+        cost=Sum(F('buy_price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        profit=Sum('profit'),
+        lines=Count('id'),
+    ).order_by()
+
+    cube = [
+        DrugSalesRollup(
+            date=row['day'], drug_id=row['drug_id'], category_id=row['drug__category_id'],
+            **{field: row[field] for field in VALUE_FIELDS},
+        )
+        for row in rows.iterator()
+    ]
+    with transaction.atomic():
+        rollups.delete()
+        DrugSalesRollup.objects.bulk_create(cube, batch_size=1000)
+    return len(cube)
+
+
+# ---------------------------------------------------------------------------
+# Reads
+# ---------------------------------------------------------------------------
+
+def _sum(field):
+    output_field = IntegerField() if field in COUNT_FIELDS else DecimalField(max_digits=14, decimal_places=2)
+    return Coalesce(Sum(field), Value(0), output_field=output_field)
+
+
+def margin(profit, revenue):
+    """Profit as a percentage of revenue, None without revenue"""
+    return round(profit * 100 / revenue, 1) if revenue else None
+
+
+def in_period(date_from=None, date_to=None):
+    rows = DrugSalesRollup.objects.all()
+    if date_from:
+        rows = rows.filter(date__gte=date_from)
+    if date_to:
+        rows = rows.filter(date__lte=date_to)
+    return rows
+
+
+def totals(date_from=None, date_to=None):
+    """Units, revenue, cost, profit and margin for a period - one query"""
+    result = in_period(date_from, date_to).aggregate(**{field: _sum(field) for field in VALUE_FIELDS})
+    result['margin'] = margin(result['profit'], result['revenue'])
+    return result
+
+
+def top_drugs(date_from=None, date_to=None, order_by='profit', limit=10):
+    """Drugs with the highest ``order_by`` (a value field) in a period - one query"""
+    rows = in_period(date_from, date_to).values('drug', 'drug__brand_name', 'drug__strength').annotate(
+        **{field: Sum(field) for field in VALUE_FIELDS}
+    ).order_by(f'-{order_by}', 'drug__brand_name')[:limit]
+    return [dict(row, margin=margin(row['profit'], row['revenue'])) for row in rows]
+
+
+def category_margins(date_from=None, date_to=None, period='month'):
+    """Revenue, profit and margin per category and period, oldest first - one query
+
+    ``period`` is ``day``, ``week`` or ``month``.
+    """
+    rows = in_period(date_from, date_to).annotate(period=Trunc('date', period)).values(
+        'period', 'category__name'
+    ).annotate(revenue=Sum('revenue'), profit=Sum('profit'), units=Sum('units')).order_by(
+        'period', 'category__name'
+    )
+    return [dict(row, margin=margin(row['profit'], row['revenue'])) for row in rows]
+
+
+def slow_movers(days=90, today=None, limit=20):
+    """Active drugs in stock that sold least over the last ``days`` - one query
+
+    Each has ``units_sold`` and ``stock_value``; the least sold and most
+    valuable stock first.
+    """
+    today = today or timezone.localdate()
+    recent = Q(sales_rollups__date__gt=today - timedelta(days=days), sales_rollups__date__lte=today)
+    return list(
+        Drug.objects.filter(is_active=True, quantity_in_stock__gt=0).annotate(
+            units_sold=Coalesce(Sum('sales_rollups__units', filter=recent), Value(0)),
+            stock_value=F('quantity_in_stock') * F('unit_price'),
+        ).order_by('units_sold', '-stock_value', 'brand_name')[:limit]
+    )
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PharmacyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pharmacy"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,140 @@
+"""
+Pharmacy checkout
+
+``checkout(cart)`` records a whole counter sale in one transaction with a
+fixed number of queries, whatever the number of lines:
+
+- the cart's drugs are locked with one ``select_for_update`` query
+- totals are computed in memory, so the sale is inserted once, final
+- the lines are inserted with one ``bulk_create``, their stock movements
+  with another; the batches are allocated first-expiry-first-out and the
+  batch quantities and stock counters moved with one UPDATE each
+- the sales analytics cube is moved with one insert and one UPDATE
+- the ``Income`` row is written in the same transaction
+
+Compare with the per-line path using ``manage.py benchmark_checkout``.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+
+from . import analytics, stock
+from .models import Drug, PharmacySale, SaleItem, StockMovement
+
+
+class CheckoutError(ValueError):
+    """The cart can't be sold as it is"""
+
+
+def cart_lines(cart):
+    """Normalize cart lines to (drug_id, quantity, unit_price or None, batch_number)
+
+    Lines are dicts with ``drug`` (a Drug or its id) and ``quantity``, and
+    optionally ``unit_price`` (default: the drug's selling price) and
+    ``batch_number``.
+    """
+    lines = []
+    for line in cart:
+        drug = line['drug']
+        quantity = int(line['quantity'])
+        if quantity <= 0:
+            raise CheckoutError(f'Quantity must be positive, got {quantity}')
+        unit_price = line.get('unit_price')
+        lines.append((
+            getattr(drug, 'pk', drug),
+            quantity,
+            Decimal(str(unit_price)) if unit_price is not None else None,
+            line.get('batch_number', ''),
+        ))
+    if not lines:
+        raise CheckoutError('The cart is empty')
+    return lines
+
+
+def checkout(cart, discount=0, tax=0, amount_paid=None, payment_method='CASH', served_by=None, **sale_fields):
+    """Sell a cart in one transaction; returns the saved ``PharmacySale``
+
+    ``amount_paid`` defaults to the total. Other keyword arguments
+    (``patient``, ``customer_name``, ``prescription``, ``notes``, ...) are set
+    on the sale. Raises ``CheckoutError`` for unknown or inactive drugs and
+    for lines that exceed the stock on hand.
+    """
+    from finance.models import Income
+
+    lines = cart_lines(cart)
+    discount, tax = Decimal(str(discount)), Decimal(str(tax))
+
+    with transaction.atomic():
+        drugs = Drug.objects.select_for_update().in_bulk({drug_id for drug_id, *_ in lines})
+
+        wanted = defaultdict(int)
+        for drug_id, quantity, *_ in lines:
+            wanted[drug_id] += quantity
+        for drug_id, quantity in wanted.items():
+            drug = drugs.get(drug_id)
+            if drug is None or not drug.is_active:
+                raise CheckoutError(f'Drug #{drug_id} is not available')
+            if quantity > drug.quantity_in_stock:
+                raise CheckoutError(
+                    f'Only {drug.quantity_in_stock} of {drug.brand_name} in stock, {quantity} requested'
+                )
+
+        items = []
+        for drug_id, quantity, unit_price, batch_number in lines:
+            drug = drugs[drug_id]
+            unit_price = drug.selling_price if unit_price is None else unit_price
+            items.append(SaleItem(
+                drug=drug,
+                quantity=quantity,
+                buy_price=drug.buy_price,
+                unit_price=unit_price,
+                total_price=quantity * unit_price,
+                profit=(unit_price - drug.buy_price) * quantity,
+                batch_number=batch_number,
+            ))
+
+        subtotal = sum((item.total_price for item in items), Decimal('0'))
+        total_amount = subtotal - discount + tax
+        amount_paid = total_amount if amount_paid is None else Decimal(str(amount_paid))
+
+        sale = PharmacySale(
+            subtotal=subtotal,
+            discount=discount,
+            tax=tax,
+            total_amount=total_amount,
+            total_profit=sum((item.profit for item in items), Decimal('0')),
+            payment_method=payment_method,
+            amount_paid=amount_paid,
+            change_returned=max(amount_paid - total_amount, Decimal('0')),
+            served_by=served_by,
+            # The income below is written in this same transaction
+            income_created=True,
+            **sale_fields,
+        )
+        sale.save()
+
+        for item in items:
+            item.sale = sale
+        SaleItem.objects.bulk_create(items)
+
+        stock.record_movements([
+            StockMovement(
+                drug_id=item.drug_id, kind=StockMovement.KIND_SALE, quantity=-item.quantity,
+                sale_item=item, created_by=served_by,
+            )
+            for item in items
+        ])
+        analytics.record_items(items, sale.sale_date)
+
+        Income.objects.create(
+            source='PHARMACY',
+            amount=total_amount,
+            date=sale.sale_date.date(),
+            description=f"Pharmacy Sale: {sale.sale_number}",
+            reference_number=sale.sale_number,
+            payment_method=payment_method,
+            recorded_by=served_by,
+        )
+
+    return sale
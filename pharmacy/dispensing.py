@@ -0,0 +1,237 @@
+"""
+Prescription dispensing
+
+``build_cart(prescription_id)`` resolves every prescribed ``Medicine`` to a
+``Drug`` and stores the result as the prescription's ``DispenseCart``:
+
+- the medicine's normalized name (``lookup_key``) is looked up in the
+  learned ``DrugAlias`` table first - one query for all lines
+- names without an alias fall back to the drug search index
+  (``pharmacy.search``), which matches brand or generic names and tolerates
+  typos; the best candidate in stock is picked and the others kept
+- the quantity is the daily doses (``1+0+1``, ``BD``) times the days
+  (``7 days``, ``2 weeks``) for tablets and capsules, one pack otherwise
+
+Carts are built when the doctor saves the prescription, so the pharmacy
+queue opens with them filled; ``cart_for`` builds one on demand for
+prescriptions written elsewhere. ``dispense()`` sells a cart through
+``checkout`` and ``learn()``s the drugs the pharmacist dispensed, so the
+next prescription naming the same medicine resolves from the alias table.
+"""
+import math
+import re
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import search
+from .checkout import CheckoutError, checkout
+from .models import DispenseCart, DispenseCartLine, Drug, DrugAlias
+
+# Search candidates kept per line for the pharmacist to switch to
+CANDIDATES = 5
+
+# Forms dispensed per dose; anything else is dispensed as one pack
+COUNTED_FORMS = {'TABLET', 'CAPSULE'}
+
+# Words written around a medicine name that no drug is indexed by
+FORM_WORDS = {
+    'tab', 'tabs', 'tablet', 'tablets', 'cap', 'caps', 'capsule', 'capsules', 'syp', 'syrup', 'susp',
+    'suspension', 'inj', 'injection', 'oint', 'ointment', 'cream', 'gel', 'drop', 'drops', 'inh', 'inhaler',
+}
+
+STRENGTH_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(mg|mcg|g|ml|iu)\b', re.IGNORECASE)
+DOSE_SCHEDULE_RE = re.compile(r'\d+(?:\.\d+)?(?:\s*[+-]\s*\d+(?:\.\d+)?)+')
+DURATION_RE = re.compile(r'(\d+)\s*(day|week|month)?', re.IGNORECASE)
+
+DAILY_DOSE_WORDS = {
+    'od': 1, 'once': 1, 'hs': 1, 'daily': 1,
+    'bd': 2, 'bid': 2, 'twice': 2,
+    'tds': 3, 'tid': 3, 'thrice': 3,
+    'qds': 4, 'qid': 4,
+}
+DURATION_DAYS = {'day': 1, 'week': 7, 'month': 30}
+
+
+def lookup_key(medicine):
+    """Normalized medicine name plus any strength given as the dosage
+
+    ``"Tab. Napa"`` with dosage ``"500 mg"`` -> ``"napa 500mg"``.
+    """
+    name = STRENGTH_RE.sub(r'\1\2', medicine.medicine_name.lower())
+    key = [word for word in search.words(name) if word not in FORM_WORDS]
+    for amount, unit in STRENGTH_RE.findall(medicine.dosage or ''):
+        strength = f'{amount}{unit.lower()}'
+        if strength not in key:
+            key.append(strength)
+    return ' '.join(key)
+
+
+def daily_doses(frequency):
+    """Doses a day from ``1+0+1``, ``1-1-1`` or ``BD``; 1 when not given"""
+    frequency = (frequency or '').lower()
+    schedule = DOSE_SCHEDULE_RE.search(frequency)
+    if schedule:
+        return sum(float(dose) for dose in re.split(r'\s*[+-]\s*', schedule.group()))
+    for word in search.words(frequency):
+        if word in DAILY_DOSE_WORDS:
+            return DAILY_DOSE_WORDS[word]
+    return 1
+
+
+def duration_days(duration):
+    """Days from ``7 days``, ``2 weeks`` or ``7``; None when not a number"""
+    match = DURATION_RE.search(duration or '')
+    if not match:
+        return None
+    return int(match.group(1)) * DURATION_DAYS.get((match.group(2) or 'day').lower(), 1)
+
+
+def quantity(medicine, form):
+    if form not in COUNTED_FORMS:
+        return 1
+    return max(math.ceil(daily_doses(medicine.frequency) * (duration_days(medicine.duration) or 1)), 1)
+
+
+def resolve(keys):
+    """{key: (drug ids best first, match)} - one query, then the search index"""
+    keys = set(keys)
+    aliases = dict(
+        DrugAlias.objects.filter(text__in=keys, drug__is_active=True).values_list('text', 'drug')
+    )
+
+    resolved = {}
+    for key in keys:
+        if key in aliases:
+            resolved[key] = ([aliases[key]], DispenseCartLine.MATCH_ALIAS)
+            continue
+        rows = search.search(key, limit=CANDIDATES)
+        if not rows and STRENGTH_RE.search(key):
+            # A strength written differently from the catalog's shouldn't hide the drug
+            rows = search.search(STRENGTH_RE.sub('', key), limit=CANDIDATES)
+        if rows:
+            resolved[key] = ([row['id'] for row in rows], DispenseCartLine.MATCH_FUZZY)
+        else:
+            resolved[key] = ([], DispenseCartLine.MATCH_NONE)
+    return resolved
+
+
+def build_cart(prescription_id):
+    """(Re)build the cart of a prescription; returns it
+
+    A dispensed cart is left as it is.
+    """
+    from appointments.models import Medicine
+
+    medicines = list(Medicine.objects.filter(prescription_id=prescription_id))
+    keys = {medicine.pk: lookup_key(medicine) for medicine in medicines}
+    resolved = resolve(keys.values())
+    drugs = {
+        row['id']: row
+        for row in Drug.objects.filter(pk__in={drug_id for ids, _ in resolved.values() for drug_id in ids})
+        .values('id', 'form', 'quantity_in_stock')
+    }
+
+    lines = []
+    for medicine in medicines:
+        ids, match = resolved[keys[medicine.pk]]
+        ids = [drug_id for drug_id in ids if drug_id in drugs]
+        in_stock = [drug_id for drug_id in ids if drugs[drug_id]['quantity_in_stock'] > 0]
+        drug_id = (in_stock or ids or [None])[0]
+        lines.append(DispenseCartLine(
+            medicine=medicine,
+            drug_id=drug_id,
+            quantity=quantity(medicine, drugs[drug_id]['form']) if drug_id else 1,
+            match=match if drug_id else DispenseCartLine.MATCH_NONE,
+            candidates=[candidate for candidate in ids if candidate != drug_id],
+        ))
+
+    with transaction.atomic():
+        cart = DispenseCart.objects.select_for_update().filter(pk=prescription_id).first()
+        if cart is not None and cart.status == DispenseCart.STATUS_DISPENSED:
+            return cart
+        cart = cart or DispenseCart(prescription_id=prescription_id)
+        cart.total_lines = len(lines)
+        cart.matched_lines = sum(1 for line in lines if line.drug_id)
+        cart.computed_at = timezone.now()
+        cart.save()
+
+        cart.lines.all().delete()
+        for line in lines:
+            line.cart = cart
+        DispenseCartLine.objects.bulk_create(lines)
+    return cart
+
+
+def cart_for(prescription):
+    """The prescription's cart, built now if it's missing or its medicines changed"""
+    cart = DispenseCart.objects.filter(pk=prescription.pk).first()
+    if cart is None or (
+        cart.status == DispenseCart.STATUS_PENDING
+        and set(prescription.medicines.values_list('pk', flat=True))
+        != set(cart.lines.values_list('medicine_id', flat=True))
+    ):
+        cart = build_cart(prescription.pk)
+    return cart
+
+
+def learn(choices):
+    """Remember the drugs dispensed for medicine names
+
+    ``choices`` are (lookup key, drug id) pairs; a mapping confirmed again
+    counts a hit, a different drug replaces it.
+    """
+    choices = dict(choices)
+    current = {
+        text: (drug_id, hits)
+        for text, drug_id, hits in DrugAlias.objects.filter(text__in=choices).values_list('text', 'drug', 'hits')
+    }
+    DrugAlias.objects.bulk_create(
+        [
+            DrugAlias(
+                text=text, drug_id=drug_id,
+                hits=current[text][1] + 1 if current.get(text, (None,))[0] == drug_id else 1,
+            )
+            for text, drug_id in choices.items() if text
+        ],
+        update_conflicts=True, unique_fields=['text'], update_fields=['drug', 'hits', 'updated_at'],
+    )
+
+
+def dispense(prescription, choices=None, served_by=None, **sale_fields):
+    """Sell a prescription's cart; returns the ``PharmacySale``
+
+    ``choices`` maps medicine ids to (drug id, quantity) as the pharmacist
+    confirmed them; lines left out or with no drug or quantity aren't sold.
+    Without ``choices`` the matched lines are sold as built. Other keyword
+    arguments go to ``checkout``, which raises ``CheckoutError``.
+    """
+    cart = cart_for(prescription)
+    lines = list(cart.lines.select_related('medicine'))
+    if choices is None:
+        choices = {line.medicine_id: (line.drug_id, line.quantity) for line in lines if line.drug_id}
+
+    sold = []
+    for line in lines:
+        drug_id, count = choices.get(line.medicine_id, (None, 0))
+        if drug_id and count:
+            line.drug_id, line.quantity = int(drug_id), int(count)
+            sold.append(line)
+
+    with transaction.atomic():
+        cart = DispenseCart.objects.select_for_update().get(pk=cart.pk)
+        if cart.status == DispenseCart.STATUS_DISPENSED:
+            raise CheckoutError(f'Prescription {prescription.prescription_number} was already dispensed')
+
+        sale = checkout(
+            [{'drug': line.drug_id, 'quantity': line.quantity} for line in sold],
+            served_by=served_by, patient=prescription.patient, prescription=prescription, **sale_fields
+        )
+        learn((lookup_key(line.medicine), line.drug_id) for line in sold)
+        DispenseCartLine.objects.bulk_update(sold, ['drug', 'quantity'])
+
+        cart.status = DispenseCart.STATUS_DISPENSED
+        cart.sale = sale
+        cart.dispensed_at = timezone.now()
+        cart.save(update_fields=['status', 'sale', 'dispensed_at'])
+    return sale
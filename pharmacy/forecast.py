@@ -0,0 +1,171 @@
+"""
+Reorder forecasting from sales velocity
+
+``run()`` (``manage.py forecast_reorders``, nightly) replaces the static
+``reorder_level`` comparison with a demand forecast per drug:
+
+- daily units sold per drug over the last ``LOOKBACK_DAYS`` come from one
+  grouped ``SaleItem`` query, into a (drugs x days) NumPy array
+- ``compute()`` smooths every drug's demand at once - exponential smoothing
+  unrolled into one weight vector, so the level and deviation are two
+  matrix-vector products - and derives safety stock, reorder point, days of
+  cover and the quantity to order to last ``LEAD_TIME_DAYS`` +
+  ``REVIEW_DAYS``
+- the results are upserted into ``DrugForecast`` for the dashboards to read
+
+``compute()`` handles 10,000 drugs x 365 days in well under a second; the
+grouped query dominates the run time.
+"""
+import math
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Drug, DrugForecast, SaleItem
+
+LOOKBACK_DAYS = 365
+SMOOTHING_ALPHA = 0.1
+LEAD_TIME_DAYS = 7
+REVIEW_DAYS = 14
+# z-score of the wanted service level, 1.65 ~ 95% of lead times without a stock-out
+SERVICE_LEVEL_Z = 1.65
+
+FORECAST_FIELDS = [
+    'daily_demand', 'demand_deviation', 'safety_stock', 'reorder_point', 'days_of_cover', 'suggested_order',
+]
+
+
+def smoothing_weights(days, alpha):
+    """Weights turning a day series (oldest first) into its smoothed level
+
+    ``level_t = alpha * x_t + (1 - alpha) * level_t-1`` started at
+    ``level_0 = x_0``, unrolled; the weights sum to 1.
+    """
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=float)
+    weights[0] = (1 - alpha) ** (days - 1)
+    return weights
+
+
+def compute(demand, stock, alpha=SMOOTHING_ALPHA, lead_time=LEAD_TIME_DAYS, review_days=REVIEW_DAYS,
+            z=SERVICE_LEVEL_Z):
+    """Forecast every drug at once
+
+    ``demand`` is a (drugs x days) array of units sold, oldest day first, and
+    ``stock`` the drugs' current stock. Returns a dict of arrays keyed by
+    ``FORECAST_FIELDS``; ``days_of_cover`` is NaN for drugs without demand.
+    """
+    demand = np.asarray(demand, dtype=float)
+    stock = np.asarray(stock, dtype=float)
+    weights = smoothing_weights(demand.shape[1], alpha)
+
+    # Rounded so float noise (4.000000000000001) doesn't ceil up a unit
+    level = np.round(demand @ weights, 6)
+    deviation = np.round(np.sqrt(((demand - level[:, None]) ** 2) @ weights), 6)
+
+    safety_stock = np.ceil(z * deviation * math.sqrt(lead_time))
+    reorder_point = np.ceil(level * lead_time + safety_stock)
+    order_up_to = np.ceil(level * (lead_time + review_days) + safety_stock)
+
+    selling = level > 0
+    days_of_cover = np.full_like(level, np.nan)
+    np.divide(stock, level, out=days_of_cover, where=selling)
+    suggested_order = np.where(selling & (stock <= reorder_point), np.maximum(order_up_to - stock, 0), 0)
+
+    return {
+        'daily_demand': level,
+        'demand_deviation': deviation,
+        'safety_stock': safety_stock,
+        'reorder_point': reorder_point,
+        'days_of_cover': days_of_cover,
+        'suggested_order': suggested_order,
+    }
+
+
+def load_demand(drug_ids, start, days):
+    """(drugs x days) units sold from ``start``, rows in ``drug_ids`` order - one query"""
+    row_of = {drug_id: row for row, drug_id in enumerate(drug_ids)}
+    since = timezone.make_aware(datetime.combine(start, datetime.min.time()))
+    sales = (
+        SaleItem.objects.filter(sale__sale_date__gte=since, sale__sale_date__lt=since + timedelta(days=days))
+        .values('drug', day=TruncDate('sale__sale_date'))
+        .annotate(units=Sum('quantity'))
+        .values_list('drug', 'day', 'units')
+        .order_by()
+    )
+
+    rows, columns, units = [], [], []
+    for drug_id, day, quantity in sales:
+        row = row_of.get(drug_id)
+        if row is not None:
+            rows.append(row)
+            columns.append((day - start).days)
+            units.append(quantity)
+
+    demand = np.zeros((len(drug_ids), days))
+    if rows:
+        np.add.at(demand, (np.array(rows), np.array(columns)), np.array(units, dtype=float))
+    return demand
+
+
+def store(drug_ids, forecast, computed_at):
+    """Upsert the forecasts and drop those of inactive drugs"""
+    columns = {field: forecast[field].tolist() for field in FORECAST_FIELDS}
+    forecasts = []
+    for index, drug_id in enumerate(drug_ids):
+        cover = columns['days_of_cover'][index]
+        forecasts.append(DrugForecast(
+            drug_id=drug_id,
+            daily_demand=round(columns['daily_demand'][index], 4),
+            demand_deviation=round(columns['demand_deviation'][index], 4),
+            safety_stock=int(columns['safety_stock'][index]),
+            reorder_point=int(columns['reorder_point'][index]),
+            days_of_cover=None if math.isnan(cover) else round(cover, 1),
+            suggested_order=int(columns['suggested_order'][index]),
+            computed_at=computed_at,
+        ))
+
+    with transaction.atomic():
+        DrugForecast.objects.exclude(drug__is_active=True).delete()
+        DrugForecast.objects.bulk_create(
+            forecasts, batch_size=1000,
+            update_conflicts=True, unique_fields=['drug'], update_fields=FORECAST_FIELDS + ['computed_at'],
+        )
+
+
+def run(today=None, days=LOOKBACK_DAYS, **params):
+    """Forecast all active drugs from the ``days`` before ``today``; returns a summary
+
+    ``params`` are passed on to ``compute()``.
+    """
+    from accounts import dashboard_cache
+
+    today = today or timezone.localdate()
+    start = today - timedelta(days=days)
+    timings = {}
+
+    started = time.perf_counter()
+    drugs = list(Drug.objects.filter(is_active=True).order_by('pk').values_list('pk', 'quantity_in_stock'))
+    drug_ids = [drug_id for drug_id, _ in drugs]
+    demand = load_demand(drug_ids, start, days)
+    timings['load_ms'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    forecast = compute(demand, [quantity for _, quantity in drugs], **params)
+    timings['compute_ms'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    store(drug_ids, forecast, timezone.now())
+    timings['store_ms'] = (time.perf_counter() - started) * 1000
+
+    dashboard_cache.invalidate('pharmacy.DrugForecast')
+    return {
+        'drugs': len(drug_ids),
+        'days': days,
+        'to_order': int(np.count_nonzero(forecast['suggested_order'])),
+        **timings,
+    }
@@ -0,0 +1,85 @@
+"""
+Compare the per-line sale path with ``pharmacy.checkout.checkout``
+
+Run: python manage.py benchmark_checkout --lines 1,5,15 --rounds 20
+
+The per-line path is how a sale is recorded through the models: create the
+sale, create each ``SaleItem``, then ``calculate_totals()`` (which also writes
+the income). Both paths run against throwaway drugs inside a transaction
+that is rolled back, so the database is left as it was.
+"""
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from pharmacy.checkout import checkout
+from pharmacy.models import Drug, PharmacySale, SaleItem
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark queries and latency of per-line sales vs checkout()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', default='1,5,15', help='Comma separated cart sizes')
+        parser.add_argument('--rounds', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['lines'].split(',')]
+        try:
+            with transaction.atomic():
+                drugs = self.create_drugs(max(sizes), options['rounds'])
+                for size in sizes:
+                    cart = [{'drug': drug, 'quantity': 2} for drug in drugs[:size]]
+                    legacy = self.measure(lambda: self.per_line_sale(cart), options['rounds'])
+                    bulk = self.measure(lambda: checkout(cart), options['rounds'])
+                    self.report(size, legacy, bulk)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_drugs(self, count, rounds):
+        return [
+            Drug.objects.create(
+                drug_code=f'BENCH-{index}', generic_name=f'Benchmark {index}', brand_name=f'Benchmark {index}',
+                form='TABLET', strength='1mg', manufacturer='Benchmark',
+                quantity_in_stock=rounds * 100, unit_price=Decimal('1.00'),
+                buy_price=Decimal('1.00'), selling_price=Decimal('1.50'),
+            )
+            for index in range(count)
+        ]
+
+    @staticmethod
+    def per_line_sale(cart):
+        sale = PharmacySale.objects.create(payment_method='CASH')
+        for line in cart:
+            SaleItem.objects.create(
+                sale=sale, drug=line['drug'], quantity=line['quantity'], unit_price=line['drug'].selling_price,
+            )
+        sale.calculate_totals()
+        return sale
+
+    @staticmethod
+    def measure(run, rounds):
+        timings, queries = [], []
+        for _ in range(rounds):
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                run()
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(captured))
+        return statistics.median(timings), max(queries)
+
+    def report(self, size, legacy, bulk):
+        self.stdout.write(f'\n{size} line(s)')
+        self.stdout.write(f'  per-line: {legacy[0]:7.2f} ms  {legacy[1]:3d} queries')
+        self.stdout.write(f'  checkout: {bulk[0]:7.2f} ms  {bulk[1]:3d} queries')
+        if bulk[0]:
+            self.stdout.write(self.style.SUCCESS(f'  {legacy[0] / bulk[0]:.1f}x faster'))
@@ -0,0 +1,39 @@
+"""
+Recompute every drug's demand forecast and reorder suggestion
+
+Run: python manage.py forecast_reorders
+     python manage.py forecast_reorders --days 180 --lead-time 10
+
+Meant to run nightly (cron); the dashboards read the stored DrugForecast rows.
+"""
+from django.core.management.base import BaseCommand
+
+from pharmacy import forecast
+
+
+class Command(BaseCommand):
+    help = 'Forecast drug demand from sales history and store reorder suggestions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=forecast.LOOKBACK_DAYS,
+                            help='Days of sales history to use')
+        parser.add_argument('--alpha', type=float, default=forecast.SMOOTHING_ALPHA,
+                            help='Exponential smoothing factor, 0-1')
+        parser.add_argument('--lead-time', type=int, default=forecast.LEAD_TIME_DAYS,
+                            help='Days between ordering and receiving stock')
+        parser.add_argument('--review-days', type=int, default=forecast.REVIEW_DAYS,
+                            help='Days an order should last beyond the lead time')
+
+    def handle(self, *args, **options):
+        summary = forecast.run(
+            days=options['days'],
+            alpha=options['alpha'],
+            lead_time=options['lead_time'],
+            review_days=options['review_days'],
+        )
+        self.stdout.write(
+            f"{summary['drugs']} drug(s) x {summary['days']} day(s): "
+            f"load {summary['load_ms']:.0f} ms, compute {summary['compute_ms']:.0f} ms, "
+            f"store {summary['store_ms']:.0f} ms"
+        )
+        self.stdout.write(self.style.SUCCESS(f"{summary['to_order']} drug(s) to reorder"))
@@ -0,0 +1,69 @@
+"""
+Rebuild the pharmacy sales cube from the sale lines
+
+Run: python manage.py rebuild_pharmacy_analytics
+     python manage.py rebuild_pharmacy_analytics --from 2025-01-01 --to 2025-01-31
+
+Needed after bulk imports or QuerySet.update() calls on sales, which bypass
+checkout() and the signals that keep DrugSalesRollup current. --check only
+reports days whose cube disagrees with the sale lines.
+"""
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+from pharmacy import analytics
+from pharmacy.models import SaleItem
+
+
+class Command(BaseCommand):
+    help = 'Recompute DrugSalesRollup from pharmacy sale lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat, default=None)
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat, default=None)
+        parser.add_argument('--check', action='store_true',
+                            help='Only report mismatching days, change nothing')
+
+    def handle(self, *args, **options):
+        date_from, date_to = options['date_from'], options['date_to']
+
+        if options['check']:
+            mismatches = self.check_days(date_from, date_to)
+            for day, expected, actual in mismatches:
+                self.stdout.write(self.style.WARNING(f'{day}: sale lines {expected} != cube {actual}'))
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f'{len(mismatches)} mismatching day(s)'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Cube matches sale lines'))
+            return
+
+        written = analytics.rebuild(date_from=date_from, date_to=date_to)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} cube row(s)'))
+
+    def check_days(self, date_from, date_to):
+        items = SaleItem.objects.annotate(day=TruncDate('sale__sale_date'))
+        if date_from:
+            items = items.filter(day__gte=date_from)
+        if date_to:
+            items = items.filter(day__lte=date_to)
+        expected = {
+            day: (units, revenue)
+            for day, units, revenue in items.values('day').annotate(
+                units=Sum('quantity'), revenue=Sum('total_price')
+            ).values_list('day', 'units', 'revenue').order_by()
+        }
+        actual = {
+            day: (units, revenue)
+            for day, units, revenue in analytics.in_period(date_from, date_to).values('date').annotate(
+                units=Sum('units'), revenue=Sum('revenue')
+            ).values_list('date', 'units', 'revenue').order_by()
+            if units or revenue
+        }
+        return [
+            (day, expected.get(day, (0, 0)), actual.get(day, (0, 0)))
+            for day in sorted(set(expected) | set(actual))
+            if expected.get(day, (0, 0)) != actual.get(day, (0, 0))
+        ]
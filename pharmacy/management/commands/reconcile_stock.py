@@ -0,0 +1,35 @@
+"""
+Check Drug.quantity_in_stock against the stock ledger
+
+Run: python manage.py reconcile_stock
+     python manage.py reconcile_stock --check
+
+Counters drift from the ledger only when stock is written around it (raw SQL,
+QuerySet.update on Drug). By default drifted counters are reset to the ledger
+sum; --check only reports them.
+"""
+from django.core.management.base import BaseCommand
+
+from pharmacy import stock
+
+
+class Command(BaseCommand):
+    help = 'Recompute drug stock levels from the StockMovement ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Only report mismatching drugs, change nothing')
+
+    def handle(self, *args, **options):
+        mismatches = stock.reconcile(fix=not options['check'])
+        for row in mismatches:
+            self.stdout.write(self.style.WARNING(
+                f"{row['brand_name']} (#{row['id']}): stock {row['quantity_in_stock']} != ledger {row['ledger']}"
+            ))
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Stock matches the ledger'))
+        elif options['check']:
+            self.stdout.write(self.style.ERROR(f'{len(mismatches)} mismatching drug(s)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Reset {len(mismatches)} drug(s) to the ledger'))
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def opening_balances(apps, schema_editor):
+    """Start the ledger at each drug's current stock level"""
+    Drug = apps.get_model('pharmacy', 'Drug')
+    StockMovement = apps.get_model('pharmacy', 'StockMovement')
+    StockMovement.objects.bulk_create(
+        [
+            StockMovement(drug_id=drug_id, kind='OPENING', quantity=quantity, note='Opening balance')
+            for drug_id, quantity in Drug.objects.exclude(quantity_in_stock=0).values_list('id', 'quantity_in_stock')
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('OPENING', 'Opening Stock'), ('SALE', 'Sale'), ('RETURN', 'Sale Return'), ('ADJUSTMENT', 'Stock Adjustment'), ('CORRECTION', 'Stock Correction')], max_length=20)),
+                ('quantity', models.IntegerField(help_text='Positive for additions, negative for removals')),
+                ('note', models.CharField(blank=True, max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('adjustment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='pharmacy.stockadjustment')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='pharmacy.drug')),
+                ('sale_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='pharmacy.saleitem')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['drug', 'created_at'], name='pharmacy_st_drug_id_57faa4_idx')],
+            },
+        ),
+        migrations.RunPython(opening_balances, migrations.RunPython.noop),
+    ]
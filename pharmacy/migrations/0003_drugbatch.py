@@ -0,0 +1,72 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def opening_batches(apps, schema_editor):
+    """Hold each drug's current stock as one batch with the drug's expiry"""
+    Drug = apps.get_model('pharmacy', 'Drug')
+    DrugBatch = apps.get_model('pharmacy', 'DrugBatch')
+    DrugBatch.objects.bulk_create(
+        [
+            DrugBatch(
+                drug_id=drug_id, quantity=quantity, received_quantity=quantity,
+                expiry_date=expiry_date, unit_cost=buy_price or unit_price,
+            )
+            for drug_id, quantity, expiry_date, buy_price, unit_price in Drug.objects.filter(
+                quantity_in_stock__gt=0
+            ).values_list('id', 'quantity_in_stock', 'expiry_date', 'buy_price', 'unit_price')
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0002_stockmovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockadjustment',
+            name='expiry_date',
+            field=models.DateField(blank=True, help_text='Expiry of the purchased batch', null=True),
+        ),
+        migrations.CreateModel(
+            name='DrugBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(blank=True, max_length=50)),
+                ('expiry_date', models.DateField(blank=True, null=True)),
+                ('quantity', models.IntegerField(default=0, help_text='Units left in this batch')),
+                ('received_quantity', models.IntegerField(default=0)),
+                ('unit_cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='pharmacy.drug')),
+            ],
+            options={
+                'verbose_name_plural': 'Drug Batches',
+                'ordering': ['drug', models.OrderBy(models.F('expiry_date'), nulls_last=True), 'received_at', 'id'],
+            },
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='batch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='pharmacy.drugbatch'),
+        ),
+        migrations.AddIndex(
+            model_name='drugbatch',
+            index=models.Index(fields=['expiry_date', 'drug'], name='pharmacy_dr_expiry__cdb4dd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='drugbatch',
+            index=models.Index(fields=['drug', 'expiry_date'], name='pharmacy_dr_drug_id_6f57c2_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='drugbatch',
+            constraint=models.CheckConstraint(condition=models.Q(('quantity__gte', 0)), name='drugbatch_quantity_not_negative'),
+        ),
+        migrations.RunPython(opening_batches, migrations.RunPython.noop),
+    ]
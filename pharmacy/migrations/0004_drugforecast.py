@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0003_drugbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugForecast',
+            fields=[
+                ('drug', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='forecast', serialize=False, to='pharmacy.drug')),
+                ('daily_demand', models.FloatField(help_text='Smoothed units sold per day')),
+                ('demand_deviation', models.FloatField(help_text='Smoothed standard deviation of daily sales')),
+                ('safety_stock', models.IntegerField()),
+                ('reorder_point', models.IntegerField(help_text='Order when stock falls to this level')),
+                ('days_of_cover', models.FloatField(blank=True, help_text='Days the stock lasts; empty without demand', null=True)),
+                ('suggested_order', models.IntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'ordering': [models.OrderBy(models.F('days_of_cover'), nulls_last=True)],
+                'indexes': [models.Index(fields=['suggested_order', 'days_of_cover'], name='pharmacy_dr_suggest_a84ca2_idx')],
+            },
+        ),
+    ]
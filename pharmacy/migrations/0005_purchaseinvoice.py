@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0002_financedailyrollup'),
+        ('pharmacy', '0004_drugforecast'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseInvoice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('supplier', models.CharField(max_length=200)),
+                ('invoice_number', models.CharField(blank=True, max_length=50)),
+                ('invoice_date', models.DateField()),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('notes', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('expense', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='purchase_invoices', to='finance.expense')),
+                ('received_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-received_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='stockadjustment',
+            name='invoice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lines', to='pharmacy.purchaseinvoice'),
+        ),
+        migrations.AddConstraint(
+            model_name='purchaseinvoice',
+            constraint=models.UniqueConstraint(condition=models.Q(('invoice_number', ''), _negated=True), fields=('supplier', 'invoice_number'), name='purchaseinvoice_unique_number'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_appointment_is_online_booking_and_more'),
+        ('pharmacy', '0005_purchaseinvoice'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DispenseCart',
+            fields=[
+                ('prescription', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='dispense_cart', serialize=False, to='appointments.prescription')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('DISPENSED', 'Dispensed')], default='PENDING', max_length=20)),
+                ('total_lines', models.PositiveIntegerField(default=0)),
+                ('matched_lines', models.PositiveIntegerField(default=0)),
+                ('computed_at', models.DateTimeField()),
+                ('dispensed_at', models.DateTimeField(blank=True, null=True)),
+                ('sale', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='dispense_carts', to='pharmacy.pharmacysale')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DispenseCartLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('match', models.CharField(choices=[('ALIAS', 'Learned'), ('FUZZY', 'Suggested'), ('NONE', 'Not Found')], default='NONE', max_length=10)),
+                ('candidates', models.JSONField(blank=True, default=list, help_text='Ids of other likely drugs, best first')),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='pharmacy.dispensecart')),
+                ('drug', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='pharmacy.drug')),
+                ('medicine', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dispense_line', to='appointments.medicine')),
+            ],
+            options={
+                'ordering': ['medicine_id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DrugAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=255, unique=True)),
+                ('hits', models.PositiveIntegerField(default=1, help_text='Times this mapping was dispensed')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aliases', to='pharmacy.drug')),
+            ],
+            options={
+                'verbose_name_plural': 'Drug Aliases',
+                'ordering': ['text'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='dispensecart',
+            index=models.Index(fields=['status', 'computed_at'], name='pharmacy_di_status_1784eb_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Build the cube from existing sales (same as rebuild_pharmacy_analytics)"""
+    from django.db.models import Count, DecimalField, F, Sum
+    from django.db.models.functions import TruncDate
+
+    SaleItem = apps.get_model('pharmacy', 'SaleItem')
+    DrugSalesRollup = apps.get_model('pharmacy', 'DrugSalesRollup')
+
+    rows = SaleItem.objects.annotate(day=TruncDate('sale__sale_date')).values(
+        'day', 'drug_id', 'drug__category_id'
+    ).annotate(
+        units=Sum('quantity'),
+        revenue=Sum('total_price'),
+        cost=Sum(F('buy_price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+        profit=Sum('profit'),
+        lines=Count('id'),
+    ).order_by()
+    DrugSalesRollup.objects.bulk_create(
+        [
+            DrugSalesRollup(
+                date=row['day'], drug_id=row['drug_id'], category_id=row['drug__category_id'],
+                units=row['units'], revenue=row['revenue'], cost=row['cost'], profit=row['profit'],
+                lines=row['lines'],
+            )
+            for row in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pharmacy', '0006_dispensecart'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrugSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('profit', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('lines', models.IntegerField(default=0, help_text='Sale lines counted')),
+                ('category', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='pharmacy.drugcategory')),
+                ('drug', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='pharmacy.drug')),
+            ],
+            options={
+                'ordering': ['-date', 'drug'],
+                'indexes': [models.Index(fields=['drug', 'date'], name='pharmacy_rollup_drug_date'), models.Index(fields=['category', 'date'], name='pharmacy_rollup_category_date')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'drug'), name='pharmacy_rollup_unique_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
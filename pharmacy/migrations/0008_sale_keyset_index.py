@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_list_keyset_indexes'),
+        ('patients', '0001_initial'),
+        ('pharmacy', '0007_drugsalesrollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pharmacysale',
+            index=models.Index(fields=['sale_date', 'id'], name='pharmacy_sale_date_id'),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from patients.models import Patient
 from appointments.models import Prescription
@@ -75,6 +75,56 @@ class Drug(models.Model):
     def __str__(self):
         return f"{self.brand_name} ({self.generic_name}) - {self.strength}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Stock level as loaded, to tell a deliberate change from a stale copy
+        instance._loaded_quantity = instance.__dict__.get('quantity_in_stock')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        """Save the drug; ``quantity_in_stock`` only changes through the ledger
+        
+        The counter is moved with F() updates by ``pharmacy.stock``, so a
+        saved instance may hold a stale level. It is written only when it was
+        changed on this instance, and then as a CORRECTION movement.
+        """
+        from . import stock
+        
+        if self._state.adding:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                if self.quantity_in_stock:
+                    stock.record_movement(
+                        self.pk, self.quantity_in_stock, StockMovement.KIND_OPENING,
+                        update_counter=False,
+                        batch=DrugBatch(
+                            expiry_date=self.expiry_date,
+                            unit_cost=self.buy_price or self.unit_price,
+                        ),
+                    )
+            self._loaded_quantity = self.quantity_in_stock
+            return
+        
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            update_fields = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in self.get_deferred_fields()
+            ]
+        other_fields = [field for field in update_fields if field != 'quantity_in_stock']
+        changed = (
+            'quantity_in_stock' in update_fields
+            and self.quantity_in_stock != getattr(self, '_loaded_quantity', None)
+        )
+        
+        with transaction.atomic():
+            if changed:
+                self.quantity_in_stock = stock.set_level(self.pk, int(self.quantity_in_stock))
+                self._loaded_quantity = self.quantity_in_stock
+            if other_fields:
+                super().save(*args, update_fields=other_fields, **kwargs)
+    
     @property
     def is_low_stock(self):
         return self.quantity_in_stock <= self.reorder_level
@@ -177,6 +227,10 @@ class PharmacySale(models.Model):
     
     class Meta:
         ordering = ['-sale_date']
+        indexes = [
+            # Keyset pages of the sale list (diagcenter.pagination) and date range reads
+            models.Index(fields=['sale_date', 'id'], name='pharmacy_sale_date_id'),
+        ]
     
     def __str__(self):
         return f"{self.sale_number} - {self.total_amount}"
@@ -184,18 +238,11 @@ class PharmacySale(models.Model):
     def save(self, *args, **kwargs):
         if not self.sale_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_sale = PharmacySale.objects.filter(
-                sale_number__startswith=f'PH{date_str}'
-            ).order_by('sale_number').last()
-            
-            if last_sale:
-                last_number = int(last_sale.sale_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.sale_number = f'PH{date_str}{new_number:04d}'
+            self.sale_number = next_document_number(
+                PharmacySale, 'sale_number', f'PH{date_str}'
+            )
         
         super().save(*args, **kwargs)
     
@@ -254,16 +301,61 @@ class SaleItem(models.Model):
         return f"{self.drug.brand_name} x {self.quantity}"
     
     def save(self, *args, **kwargs):
+        from . import stock
+        
         self.total_price = self.quantity * self.unit_price
         self.buy_price = self.drug.buy_price
         self.profit = (self.unit_price - self.buy_price) * self.quantity
         
-        super().save(*args, **kwargs)
-        
-        # Update drug stock
-        if self.pk is None:  # New item only
-            self.drug.quantity_in_stock -= self.quantity
-            self.drug.save()
+        with transaction.atomic():
+            previous = stock.stored_line(SaleItem, self.pk, sign=-1)
+            super().save(*args, **kwargs)
+            # Take the quantity out of stock - on edits only the difference
+            stock.move_line(previous, self.drug_id, -self.quantity, StockMovement.KIND_SALE, sale_item=self)
+
+
+class PurchaseInvoice(models.Model):
+    """A supplier invoice received into stock in one go
+    
+    Its lines are ``StockAdjustment`` rows (PURCHASE); the whole invoice is
+    booked as a single expense. Created by ``pharmacy.purchasing.receive``.
+    """
+    
+    supplier = models.CharField(max_length=200)
+    invoice_number = models.CharField(max_length=50, blank=True)
+    invoice_date = models.DateField()
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    notes = models.TextField(blank=True)
+    
+    expense = models.ForeignKey(
+        'finance.Expense',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='purchase_invoices'
+    )
+    received_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-received_at']
+        constraints = [
+            # The same invoice can't be received twice
+            models.UniqueConstraint(
+                fields=['supplier', 'invoice_number'],
+                condition=~models.Q(invoice_number=''),
+                name='purchaseinvoice_unique_number',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.supplier} - {self.invoice_number or self.invoice_date}"
 
 
 class StockAdjustment(models.Model):
@@ -295,6 +387,14 @@ class StockAdjustment(models.Model):
     supplier = models.CharField(max_length=200, blank=True)
     invoice_number = models.CharField(max_length=50, blank=True)
     batch_number = models.CharField(max_length=50, blank=True)
+    expiry_date = models.DateField(null=True, blank=True, help_text="Expiry of the purchased batch")
+    invoice = models.ForeignKey(
+        PurchaseInvoice,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='lines'
+    )
     
     # Auto-generated expense
     expense_created = models.BooleanField(default=False)
@@ -306,12 +406,25 @@ class StockAdjustment(models.Model):
         return f"{self.drug.brand_name} - {self.adjustment_type} ({self.quantity})"
     
     def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
+        from . import stock
         
-        # Update drug stock
-        self.drug.quantity_in_stock += self.quantity
-        self.drug.save()
+        is_new = self.pk is None
+        with transaction.atomic():
+            previous = stock.stored_line(StockAdjustment, self.pk)
+            super().save(*args, **kwargs)
+            # A new addition is received as its own batch
+            batch = None
+            if is_new and self.quantity > 0:
+                batch = DrugBatch(
+                    batch_number=self.batch_number,
+                    expiry_date=self.expiry_date,
+                    unit_cost=self.unit_cost,
+                )
+            # Update drug stock by what changed - re-saves add nothing
+            stock.move_line(
+                previous, self.drug_id, self.quantity, StockMovement.KIND_ADJUSTMENT,
+                batch=batch, adjustment=self, created_by=self.adjusted_by,
+            )
         
         # Create expense for purchases
         if is_new and self.adjustment_type == 'PURCHASE' and not self.expense_created:
@@ -339,3 +452,291 @@ class StockAdjustment(models.Model):
         except Exception as e:
             print(f"Error creating expense: {e}")
             return None
+
+
+class DrugBatch(models.Model):
+    """A received lot of a drug with its own expiry date
+    
+    ``quantity`` is what is left of the lot. Sales and removals are taken
+    from the batch that expires first (FEFO) by ``pharmacy.stock``, so the
+    batches of a drug add up to its ``quantity_in_stock``.
+    """
+    
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='batches')
+    batch_number = models.CharField(max_length=50, blank=True)
+    expiry_date = models.DateField(null=True, blank=True)
+    
+    quantity = models.IntegerField(default=0, help_text="Units left in this batch")
+    received_quantity = models.IntegerField(default=0)
+    unit_cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    received_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['drug', models.F('expiry_date').asc(nulls_last=True), 'received_at', 'id']
+        verbose_name_plural = "Drug Batches"
+        indexes = [
+            # Expiry range scans across all drugs
+            models.Index(fields=['expiry_date', 'drug']),
+            # FEFO allocation within a drug
+            models.Index(fields=['drug', 'expiry_date']),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(quantity__gte=0), name='drugbatch_quantity_not_negative'),
+        ]
+    
+    def __str__(self):
+        return f"{self.drug.brand_name} - {self.batch_number or 'no batch'} ({self.quantity})"
+    
+    @property
+    def name(self):
+        return self.drug.brand_name
+    
+    @property
+    def days_to_expiry(self):
+        if not self.expiry_date:
+            return None
+        from django.utils import timezone
+        return (self.expiry_date - timezone.now().date()).days
+    
+    @property
+    def is_expired(self):
+        days = self.days_to_expiry
+        return days is not None and days < 0
+    
+    @property
+    def is_expiring_soon(self):
+        days = self.days_to_expiry
+        return days is not None and 0 <= days <= 90
+
+
+class StockMovement(models.Model):
+    """Append-only stock ledger - one row per change to a drug's stock
+    
+    ``Drug.quantity_in_stock`` is the running sum of a drug's movements,
+    kept in step by ``pharmacy.stock`` in the same transaction.
+    """
+    
+    KIND_OPENING = 'OPENING'
+    KIND_SALE = 'SALE'
+    KIND_RETURN = 'RETURN'
+    KIND_ADJUSTMENT = 'ADJUSTMENT'
+    KIND_CORRECTION = 'CORRECTION'
+    KIND_CHOICES = [
+        (KIND_OPENING, 'Opening Stock'),
+        (KIND_SALE, 'Sale'),
+        (KIND_RETURN, 'Sale Return'),
+        (KIND_ADJUSTMENT, 'Stock Adjustment'),
+        (KIND_CORRECTION, 'Stock Correction'),
+    ]
+    
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='stock_movements')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    quantity = models.IntegerField(help_text="Positive for additions, negative for removals")
+    
+    # Source of the movement
+    sale_item = models.ForeignKey(
+        SaleItem,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    adjustment = models.ForeignKey(
+        StockAdjustment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    batch = models.ForeignKey(
+        DrugBatch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='stock_movements'
+    )
+    note = models.CharField(max_length=200, blank=True)
+    
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['drug', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.drug.brand_name} - {self.kind} ({self.quantity:+d})"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Stock movements are append-only; record a new movement instead")
+        super().save(*args, **kwargs)
+
+
+class DrugForecast(models.Model):
+    """Demand forecast and reorder suggestion of a drug
+    
+    Recomputed for all drugs at once by ``manage.py forecast_reorders``
+    (``pharmacy.forecast``); pages read these rows instead of forecasting.
+    """
+    
+    drug = models.OneToOneField(Drug, on_delete=models.CASCADE, primary_key=True, related_name='forecast')
+    
+    daily_demand = models.FloatField(help_text="Smoothed units sold per day")
+    demand_deviation = models.FloatField(help_text="Smoothed standard deviation of daily sales")
+    safety_stock = models.IntegerField()
+    reorder_point = models.IntegerField(help_text="Order when stock falls to this level")
+    days_of_cover = models.FloatField(null=True, blank=True, help_text="Days the stock lasts; empty without demand")
+    suggested_order = models.IntegerField(default=0)
+    
+    computed_at = models.DateTimeField()
+    
+    class Meta:
+        ordering = [models.F('days_of_cover').asc(nulls_last=True)]
+        indexes = [
+            models.Index(fields=['suggested_order', 'days_of_cover']),
+        ]
+    
+    def __str__(self):
+        return f"{self.drug.brand_name} - order {self.suggested_order}"
+
+
+class DrugAlias(models.Model):
+    """A prescribed medicine name and the drug the pharmacy dispenses for it
+    
+    Learned from the pharmacist's choices when prescriptions are dispensed
+    (``pharmacy.dispensing.learn``); ``text`` is the normalized name.
+    """
+    
+    text = models.CharField(max_length=255, unique=True)
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='aliases')
+    hits = models.PositiveIntegerField(default=1, help_text="Times this mapping was dispensed")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = "Drug Aliases"
+        ordering = ['text']
+    
+    def __str__(self):
+        return f"{self.text} -> {self.drug.brand_name}"
+
+
+class DispenseCart(models.Model):
+    """The drugs to dispense for a prescription, resolved when it is written
+    
+    Built by ``pharmacy.dispensing.build_cart``; the pharmacy queue opens
+    with these lines instead of matching medicine names by hand.
+    """
+    
+    STATUS_PENDING = 'PENDING'
+    STATUS_DISPENSED = 'DISPENSED'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_DISPENSED, 'Dispensed'),
+    ]
+    
+    prescription = models.OneToOneField(
+        Prescription,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='dispense_cart'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    
+    # Denormalized so the queue doesn't count lines per prescription
+    total_lines = models.PositiveIntegerField(default=0)
+    matched_lines = models.PositiveIntegerField(default=0)
+    
+    sale = models.ForeignKey(
+        PharmacySale,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='dispense_carts'
+    )
+    computed_at = models.DateTimeField()
+    dispensed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'computed_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.prescription_id} - {self.matched_lines}/{self.total_lines} matched"
+
+
+class DispenseCartLine(models.Model):
+    """One prescribed medicine and the drug matched to it"""
+    
+    MATCH_ALIAS = 'ALIAS'
+    MATCH_FUZZY = 'FUZZY'
+    MATCH_NONE = 'NONE'
+    MATCH_CHOICES = [
+        (MATCH_ALIAS, 'Learned'),
+        (MATCH_FUZZY, 'Suggested'),
+        (MATCH_NONE, 'Not Found'),
+    ]
+    
+    cart = models.ForeignKey(DispenseCart, on_delete=models.CASCADE, related_name='lines')
+    medicine = models.OneToOneField(
+        'appointments.Medicine',
+        on_delete=models.CASCADE,
+        related_name='dispense_line'
+    )
+    drug = models.ForeignKey(Drug, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    quantity = models.PositiveIntegerField(default=1)
+    match = models.CharField(max_length=10, choices=MATCH_CHOICES, default=MATCH_NONE)
+    candidates = models.JSONField(default=list, blank=True, help_text="Ids of other likely drugs, best first")
+    
+    class Meta:
+        ordering = ['medicine_id']
+    
+    def __str__(self):
+        return f"{self.medicine_id} -> {self.drug_id or '?'} x {self.quantity}"
+
+
+class DrugSalesRollup(models.Model):
+    """Per-day sales of a drug maintained by pharmacy.analytics
+    
+    One row per (date, drug), carrying the drug's category so the cube can
+    be sliced by day, drug or category without scanning ``SaleItem``.
+    Updated incrementally as sales are recorded; ``manage.py
+    rebuild_pharmacy_analytics`` recomputes it from the sale lines.
+    """
+    
+    date = models.DateField()
+    drug = models.ForeignKey(Drug, on_delete=models.CASCADE, related_name='sales_rollups')
+    # No DB constraint - a deleted category leaves its rows to the rebuild
+    # instead of failing the delete
+    category = models.ForeignKey(
+        DrugCategory, on_delete=models.DO_NOTHING, db_constraint=False,
+        null=True, blank=True, related_name='+'
+    )
+    
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    profit = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    lines = models.IntegerField(default=0, help_text="Sale lines counted")
+    
+    class Meta:
+        ordering = ['-date', 'drug']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'drug'], name='pharmacy_rollup_unique_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['drug', 'date'], name='pharmacy_rollup_drug_date'),
+            models.Index(fields=['category', 'date'], name='pharmacy_rollup_category_date'),
+        ]
+    
+    def __str__(self):
+        return f"{self.date} {self.drug_id} - {self.units} units"
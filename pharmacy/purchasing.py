@@ -0,0 +1,211 @@
+"""
+Supplier invoice intake
+
+``receive(lines, supplier, ...)`` books a whole purchase invoice in one
+transaction with a fixed number of queries, however many lines it has:
+
+- the drugs are looked up with one query (by id or ``drug_code``)
+- one ``Expense`` is posted for the invoice total
+- the lines are inserted as PURCHASE ``StockAdjustment`` rows with one
+  ``bulk_create``, and received through ``stock.record_movements`` - one
+  batch per line, the stock counters moved with a single CASE UPDATE
+
+The per-line path (``StockAdjustment.objects.create``) saves each line,
+moves its stock and posts its own expense, which re-saves the line.
+
+Lines can also come from a CSV upload - see ``parse_csv``.
+"""
+import csv
+import io
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts import dashboard_cache
+
+from . import stock
+from .models import Drug, DrugBatch, PurchaseInvoice, StockAdjustment, StockMovement
+
+CSV_COLUMNS = ('drug_code', 'quantity', 'unit_cost', 'batch_number', 'expiry_date')
+
+
+class PurchaseError(ValueError):
+    """The invoice can't be received as it is"""
+
+
+def parse_csv(upload):
+    """Invoice lines from a CSV file with a header row of ``CSV_COLUMNS``
+
+    ``batch_number`` and ``expiry_date`` (YYYY-MM-DD) may be left empty.
+    Raises ``PurchaseError`` naming the first bad row.
+    """
+    content = upload.read()
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise PurchaseError('CSV must be UTF-8 encoded')
+    reader = csv.DictReader(io.StringIO(content))
+    missing = {'drug_code', 'quantity', 'unit_cost'} - set(reader.fieldnames or ())
+    if missing:
+        raise PurchaseError(f"CSV is missing column(s): {', '.join(sorted(missing))}")
+
+    lines = []
+    for number, row in enumerate(reader, start=2):
+        if not any((value or '').strip() for value in row.values()):
+            continue
+        try:
+            expiry = (row.get('expiry_date') or '').strip()
+            lines.append({
+                'drug_code': row['drug_code'].strip(),
+                'quantity': row['quantity'].strip(),
+                'unit_cost': row['unit_cost'].strip(),
+                'batch_number': (row.get('batch_number') or '').strip(),
+                'expiry_date': date.fromisoformat(expiry) if expiry else None,
+            })
+        except ValueError as exc:
+            raise PurchaseError(f'Row {number}: {exc}')
+    return lines
+
+
+def invoice_lines(lines):
+    """Normalize lines to dicts with a drug key, int quantity and Decimal unit cost
+
+    Lines name the drug by ``drug`` (a Drug or its id) or ``drug_code``.
+    """
+    normalized = []
+    for number, line in enumerate(lines, start=1):
+        drug = line.get('drug')
+        try:
+            if drug not in (None, ''):
+                key = ('pk', int(getattr(drug, 'pk', drug)))
+            else:
+                key = ('drug_code', (line.get('drug_code') or '').strip())
+            quantity = int(line['quantity'])
+            unit_cost = Decimal(str(line.get('unit_cost') or 0))
+            expiry_date = line.get('expiry_date') or None
+            if isinstance(expiry_date, str):
+                expiry_date = date.fromisoformat(expiry_date)
+        except (TypeError, ValueError, InvalidOperation):
+            raise PurchaseError(f'Line {number}: drug, quantity, unit cost or expiry date is not valid')
+        if quantity <= 0 or unit_cost < 0:
+            raise PurchaseError(f'Line {number}: quantity must be positive and unit cost not negative')
+        if not key[1]:
+            raise PurchaseError(f'Line {number}: no drug given')
+        normalized.append({
+            'key': key,
+            'quantity': quantity,
+            'unit_cost': unit_cost,
+            'batch_number': line.get('batch_number') or '',
+            'expiry_date': expiry_date,
+        })
+    if not normalized:
+        raise PurchaseError('The invoice has no lines')
+    return normalized
+
+
+def resolve_drugs(lines):
+    """{('pk'|'drug_code', value): drug id} for the lines' drugs - one query"""
+    keys = {line['key'] for line in lines}
+    pks = {value for field, value in keys if field == 'pk'}
+    codes = {value for field, value in keys if field == 'drug_code'}
+    found = {}
+    for pk, drug_code in Drug.objects.filter(Q(pk__in=pks) | Q(drug_code__in=codes)).values_list('pk', 'drug_code'):
+        found[('pk', pk)] = pk
+        found[('drug_code', drug_code)] = pk
+
+    unknown = sorted(str(value) for key in keys - found.keys() for value in key[1:])
+    if unknown:
+        raise PurchaseError(f"Unknown drug(s): {', '.join(unknown)}")
+    return found
+
+
+def receive(lines, supplier, invoice_number='', invoice_date=None, received_by=None, notes=''):
+    """Receive a supplier invoice into stock; returns the saved ``PurchaseInvoice``
+
+    Raises ``PurchaseError`` for bad lines, unknown drugs and invoices
+    already received.
+    """
+    from finance.models import Expense
+
+    lines = invoice_lines(lines)
+    drug_ids = resolve_drugs(lines)
+    if isinstance(invoice_date, str):
+        try:
+            invoice_date = date.fromisoformat(invoice_date)
+        except ValueError:
+            raise PurchaseError(f'Invoice date {invoice_date} is not a valid date')
+    invoice_date = invoice_date or timezone.localdate()
+    supplier = supplier.strip() or 'Pharmacy Supplier'
+    if invoice_number and PurchaseInvoice.objects.filter(supplier=supplier, invoice_number=invoice_number).exists():
+        raise PurchaseError(f'Invoice {invoice_number} from {supplier} was already received')
+
+    total = sum((line['quantity'] * line['unit_cost'] for line in lines), Decimal('0'))
+    units = sum(line['quantity'] for line in lines)
+    reason = f'Invoice {invoice_number}' if invoice_number else f'Purchase from {supplier}'
+
+    try:
+        with transaction.atomic():
+            expense = Expense.objects.create(
+                expense_type='SUPPLIES',
+                amount=total,
+                date=invoice_date,
+                description=f"Medicine Purchase: {supplier} - {len(lines)} lines, {units} units",
+                vendor=supplier,
+                invoice_number=invoice_number,
+                recorded_by=received_by,
+                is_approved=True,
+            )
+            invoice = PurchaseInvoice.objects.create(
+                supplier=supplier,
+                invoice_number=invoice_number,
+                invoice_date=invoice_date,
+                total_amount=total,
+                notes=notes,
+                expense=expense,
+                received_by=received_by,
+            )
+
+            adjustments = StockAdjustment.objects.bulk_create([
+                StockAdjustment(
+                    drug_id=drug_ids[line['key']],
+                    adjustment_type='PURCHASE',
+                    quantity=line['quantity'],
+                    unit_cost=line['unit_cost'],
+                    reason=reason,
+                    adjusted_by=received_by,
+                    supplier=supplier,
+                    invoice_number=invoice_number,
+                    batch_number=line['batch_number'],
+                    expiry_date=line['expiry_date'],
+                    # Booked once for the whole invoice above
+                    expense_created=True,
+                    invoice=invoice,
+                )
+                for line in lines
+            ])
+
+            stock.record_movements([
+                StockMovement(
+                    drug_id=adjustment.drug_id, kind=StockMovement.KIND_ADJUSTMENT, quantity=adjustment.quantity,
+                    adjustment=adjustment, created_by=received_by,
+                    batch=DrugBatch(
+                        batch_number=adjustment.batch_number,
+                        expiry_date=adjustment.expiry_date,
+                        unit_cost=adjustment.unit_cost,
+                    ),
+                )
+                for adjustment in adjustments
+            ])
+            # The adjustments are bulk-created - no post_save for the dashboards
+            dashboard_cache.invalidate_on_commit('pharmacy.StockAdjustment')
+    except IntegrityError:
+        # The same invoice submitted twice at once - the check above let both through
+        if invoice_number and PurchaseInvoice.objects.filter(supplier=supplier, invoice_number=invoice_number).exists():
+            raise PurchaseError(f'Invoice {invoice_number} from {supplier} was already received') from None
+        raise
+
+    return invoice
@@ -0,0 +1,201 @@
+"""
+Pharmacy stock report
+
+The figures of ``stock_report`` are computed in the database: status counts
+and expiry buckets are single conditional aggregates, stock values are
+``Sum(quantity * price)`` and the top drugs an ordered, sliced query. Nothing
+loads the catalog into Python.
+
+The export streams the filtered report as CSV or XLSX. Rows are read with
+``.iterator(chunk_size=EXPORT_CHUNK_SIZE)`` and written out as they come, so
+memory stays flat whatever the catalog size. The XLSX is a minimal workbook
+(one sheet, inline strings) written through ``zipfile`` without a third
+party dependency.
+"""
+import csv
+import zipfile
+from datetime import timedelta
+from xml.sax.saxutils import escape
+
+from django.db.models import Count, F, Q, Sum
+
+from diagcenter.streaming import Echo, ZipSink
+
+from . import search, stock
+from .models import Drug
+
+EXPORT_CHUNK_SIZE = 2000
+
+# Upper bounds (days from today) of the "expiring" buckets
+EXPIRY_BUCKETS = (30, 60, 90)
+
+EXPORT_COLUMNS = [
+    ('Code', 'drug_code'),
+    ('Brand Name', 'brand_name'),
+    ('Generic Name', 'generic_name'),
+    ('Category', 'category__name'),
+    ('Form', 'form'),
+    ('Strength', 'strength'),
+    ('Quantity', 'quantity_in_stock'),
+    ('Reorder Level', 'reorder_level'),
+    ('Unit Price', 'unit_price'),
+    ('Selling Price', 'selling_price'),
+    ('Stock Value', 'stock_value'),
+    ('Expiry Date', 'expiry_date'),
+]
+
+
+def filter_drugs(params):
+    """Active drugs matching the report's search/category/stock_status filters"""
+    drugs = Drug.objects.filter(is_active=True)
+
+    query = params.get('search')
+    if query:
+        drugs = drugs.filter(pk__in=search.matching_ids(query))
+
+    category = params.get('category')
+    if category:
+        drugs = drugs.filter(category__name=category)
+
+    stock_status = params.get('stock_status')
+    if stock_status == 'low_stock':
+        drugs = drugs.filter(quantity_in_stock__lte=F('reorder_level'), quantity_in_stock__gt=0)
+    elif stock_status == 'out_of_stock':
+        drugs = drugs.filter(quantity_in_stock=0)
+    elif stock_status == 'in_stock':
+        drugs = drugs.filter(quantity_in_stock__gt=F('reorder_level'))
+
+    return drugs.annotate(stock_value=F('quantity_in_stock') * F('unit_price'))
+
+
+def stock_counts():
+    """Active drugs by stock status - one query"""
+    return Drug.objects.filter(is_active=True).aggregate(
+        total=Count('id'),
+        in_stock=Count('id', filter=Q(quantity_in_stock__gt=F('reorder_level'))),
+        low_stock=Count('id', filter=Q(quantity_in_stock__gt=0, quantity_in_stock__lte=F('reorder_level'))),
+        out_of_stock=Count('id', filter=Q(quantity_in_stock=0)),
+    )
+
+
+def expiry_buckets(today):
+    """Batches in stock that are expired or expire within ``EXPIRY_BUCKETS`` - one query
+
+    Returns a list of dicts (label, batches, quantity, value at cost).
+    """
+    ranges = [('Expired', None, today - timedelta(days=1))]
+    start = today
+    for days in EXPIRY_BUCKETS:
+        ranges.append((f'{(start - today).days}-{days} days', start, today + timedelta(days=days)))
+        start = today + timedelta(days=days + 1)
+
+    aggregates = {}
+    for index, (_, first, last) in enumerate(ranges):
+        in_range = Q(expiry_date__lte=last) & (Q(expiry_date__gte=first) if first else Q())
+        aggregates[f'batches_{index}'] = Count('id', filter=in_range)
+        aggregates[f'quantity_{index}'] = Sum('quantity', filter=in_range)
+        aggregates[f'value_{index}'] = Sum(stock.batch_value('unit_cost'), filter=in_range)
+    totals = stock.expiring(end=ranges[-1][2]).aggregate(**aggregates)
+
+    return [
+        {
+            'label': label,
+            'batches': totals[f'batches_{index}'],
+            'quantity': totals[f'quantity_{index}'] or 0,
+            'value': totals[f'value_{index}'] or 0,
+        }
+        for index, (label, _, _) in enumerate(ranges)
+    ]
+
+
+def top_drugs_by_value(limit=10):
+    """(brand name, stock value at cost) of the most valuable drugs in stock"""
+    return list(
+        stock.batches_in_stock().values('drug__brand_name').annotate(
+            stock_value=Sum(stock.batch_value('unit_cost'))
+        ).order_by('-stock_value').values_list('drug__brand_name', 'stock_value')[:limit]
+    )
+
+
+def export_rows(drugs):
+    """Header then one list per drug, read in chunks"""
+    yield [header for header, _ in EXPORT_COLUMNS]
+    rows = drugs.order_by('brand_name', 'pk').values_list(*[field for _, field in EXPORT_COLUMNS])
+    for row in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield ['' if value is None else value for value in row]
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Stock Report" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def xlsx_cell(value):
+    if isinstance(value, (int, float)) or hasattr(value, 'as_tuple'):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>'
+
+
+def stream_xlsx(rows):
+    sink = ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        yield sink.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w') as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            for number, row in enumerate(rows, start=1):
+                sheet.write(f'<row>{"".join(xlsx_cell(value) for value in row)}</row>'.encode())
+                if number % EXPORT_CHUNK_SIZE == 0:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+# ?export= value -> (stream, content type, file extension)
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv', 'csv'),
+    'excel': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
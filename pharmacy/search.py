@@ -0,0 +1,215 @@
+"""
+Drug search
+
+A per-process index over active drugs (brand, generic, strength,
+manufacturer and code) for the autocomplete endpoint and the drug list
+search, so a keystroke doesn't cost an ``icontains`` scan of the catalog.
+
+Every word is split into trigrams (``"  pa", " pa", "par", ...`` - the
+leading pad makes prefixes match); a query word matches a drug when the word
+is a prefix of one of the drug's words or shares enough trigrams with them,
+which also tolerates typos ("paracitamol"). Results are ranked by how well
+every query word matched, brand name matches first.
+
+The index is built on first use and kept current incrementally: ``Drug``
+saves and deletes in this process are applied as they commit, and bump a
+version in the cache so other processes re-read the drugs changed since they
+last synced. A full rebuild every ``DRUG_SEARCH_REBUILD_SECONDS`` catches
+writes that bypass ``save()``.
+"""
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import Drug
+
+VERSION_KEY = 'drug_search:version'
+
+# A query word must share this share of its trigrams with a drug word
+MIN_SIMILARITY = 0.5
+
+INDEX_FIELDS = (
+    'id', 'drug_code', 'brand_name', 'generic_name', 'strength', 'form', 'manufacturer', 'selling_price',
+)
+
+# How doctors write the form in front of a medicine name
+FORM_PREFIXES = {
+    'TABLET': 'Tab.',
+    'CAPSULE': 'Cap.',
+    'SYRUP': 'Syp.',
+    'INJECTION': 'Inj.',
+    'CREAM': 'Oint.',
+    'DROPS': 'Drops',
+    'INHALER': 'Inh.',
+}
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def words(text):
+    return WORD_RE.findall(str(text).lower())
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def label(row):
+    """Medicine name as written on a prescription, e.g. ``Tab. Napa 500mg``"""
+    prefix = FORM_PREFIXES.get(row['form'], '')
+    return ' '.join(part for part in (prefix, row['brand_name'], row['strength']) if part)
+
+
+class Entry:
+    __slots__ = ('row', 'brand_words', 'words', 'grams')
+
+    def __init__(self, row):
+        self.row = row
+        self.brand_words = words(row['brand_name'])
+        self.words = set(self.brand_words)
+        for field in ('generic_name', 'strength', 'manufacturer', 'drug_code'):
+            self.words.update(words(row[field]))
+        self.grams = set()
+        for word in self.words:
+            self.grams |= trigrams(word)
+
+    def score(self, word, shared, grams):
+        """How well one query word matches; 0 when it doesn't"""
+        if any(brand_word.startswith(word) for brand_word in self.brand_words):
+            return 3.0 if word in self.brand_words else 2.5
+        if any(own.startswith(word) for own in self.words):
+            return 2.0
+        similarity = shared / len(grams)
+        return similarity if similarity >= MIN_SIMILARITY else 0
+
+
+class DrugSearchIndex:
+    """Trigram/prefix index of the active drugs"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._postings = defaultdict(set)
+        self._built_at = None
+        self._synced_at = None
+        self._version = None
+
+    def _add(self, row):
+        self._discard(row['id'])
+        entry = self._entries[row['id']] = Entry(row)
+        for gram in entry.grams:
+            self._postings[gram].add(row['id'])
+
+    def _discard(self, drug_id):
+        entry = self._entries.pop(drug_id, None)
+        if entry is not None:
+            for gram in entry.grams:
+                self._postings[gram].discard(drug_id)
+
+    def build(self):
+        """Read all active drugs - one query"""
+        now = timezone.now()
+        rows = list(Drug.objects.filter(is_active=True).values(*INDEX_FIELDS))
+        with self._lock:
+            self._entries.clear()
+            self._postings.clear()
+            for row in rows:
+                self._add(row)
+            self._built_at = time.monotonic()
+            self._synced_at = now
+            self._version = cache.get(VERSION_KEY)
+
+    def sync(self):
+        """Build, rebuild or catch up with changes made by other processes"""
+        if self._built_at is None or time.monotonic() - self._built_at > settings.DRUG_SEARCH_REBUILD_SECONDS:
+            self.build()
+            return
+        version = cache.get(VERSION_KEY)
+        if version == self._version:
+            return
+        now = timezone.now()
+        # A little overlap for clock skew between processes; re-adding is harmless
+        since = self._synced_at - timedelta(seconds=1)
+        rows = Drug.objects.filter(updated_at__gte=since).values('is_active', *INDEX_FIELDS)
+        with self._lock:
+            for row in rows:
+                self.update(row)
+            self._synced_at = now
+            self._version = version
+
+    def update(self, row):
+        """Apply one drug (a ``Drug`` or a values() row)"""
+        if isinstance(row, Drug):
+            row = {field: getattr(row, field) for field in ('is_active',) + INDEX_FIELDS}
+        with self._lock:
+            if row.get('is_active', True):
+                self._add({field: row[field] for field in INDEX_FIELDS})
+            else:
+                self._discard(row['id'])
+
+    def discard(self, drug_id):
+        with self._lock:
+            self._discard(drug_id)
+
+    def search(self, query, limit=None):
+        """Rows of the matching drugs, best first"""
+        query_words = words(query)
+        if not query_words:
+            return []
+
+        with self._lock:
+            scores = None
+            for word in query_words:
+                grams = trigrams(word)
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._postings.get(gram, ()))
+                # A prefix shares all but the closing trigram, so this only
+                # drops drugs that can't match either way
+                needed = MIN_SIMILARITY * len(grams)
+                word_scores = {}
+                for drug_id, count in shared.items():
+                    if count < needed or (scores is not None and drug_id not in scores):
+                        continue
+                    score = self._entries[drug_id].score(word, count, grams)
+                    if score:
+                        word_scores[drug_id] = (scores or {}).get(drug_id, 0) + score
+                scores = word_scores
+                if not scores:
+                    return []
+
+            ranked = sorted(scores, key=lambda drug_id: (-scores[drug_id], self._entries[drug_id].row['brand_name']))
+            return [self._entries[drug_id].row for drug_id in ranked[:limit]]
+
+
+index = DrugSearchIndex()
+
+
+def search(query, limit=10):
+    """Best matching active drugs as dicts of ``INDEX_FIELDS`` plus ``label``"""
+    index.sync()
+    return [dict(row, label=label(row)) for row in index.search(query, limit)]
+
+
+def matching_ids(query):
+    """Ids of all active drugs matching ``query``, best first"""
+    index.sync()
+    return [row['id'] for row in index.search(query)]
+
+
+def drug_saved(drug):
+    index.update(drug)
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def drug_deleted(drug_id):
+    index.discard(drug_id)
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
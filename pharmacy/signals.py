@@ -0,0 +1,81 @@
+"""
+Return stock for sale lines that are removed, keep the sales analytics cube
+and the drug search index in step with sale line and drug changes
+"""
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import analytics, search, stock
+from .models import Drug, SaleItem, StockMovement
+
+
+@receiver(pre_delete, sender=SaleItem)
+def sale_item_deleting(sender, instance, **kwargs):
+    # Remember which batches the line was taken from before its movements
+    # lose their link to it
+    instance._batch_allocation = list(
+        StockMovement.objects.filter(sale_item=instance, batch__isnull=False)
+        .order_by().values('batch').annotate(taken=-Sum('quantity'))
+        .values_list('batch', 'taken')
+    )
+
+
+@receiver(post_delete, sender=SaleItem)
+def sale_item_deleted(sender, instance, **kwargs):
+    # The line is gone, so the movement can't point at it
+    note = f'Sale item #{instance.pk} removed'
+    movements = []
+    remaining = instance.quantity
+    for batch_id, taken in getattr(instance, '_batch_allocation', []):
+        taken = min(taken, remaining)
+        if taken > 0:
+            movements.append(StockMovement(
+                drug_id=instance.drug_id, kind=StockMovement.KIND_RETURN, quantity=taken,
+                batch_id=batch_id, note=note,
+            ))
+            remaining -= taken
+    if remaining > 0:
+        movements.append(StockMovement(
+            drug_id=instance.drug_id, kind=StockMovement.KIND_RETURN, quantity=remaining, note=note,
+        ))
+    stock.record_movements(movements)
+
+
+@receiver(pre_save, sender=SaleItem)
+@receiver(pre_delete, sender=SaleItem)
+def remember_sales_row(sender, instance, raw=False, **kwargs):
+    # What the stored line contributes to the cube, before it changes
+    if raw or instance.pk is None:
+        instance._sales_row = None
+    else:
+        instance._sales_row = analytics.stored_row(instance.pk)
+
+
+@receiver(post_save, sender=SaleItem)
+def update_sales_rollup_on_save(sender, instance, raw=False, **kwargs):
+    # checkout() bulk-creates its lines and records them itself
+    if raw:
+        return
+    analytics.record_change(
+        getattr(instance, '_sales_row', None), analytics.line_row(instance, instance.sale.sale_date)
+    )
+    instance._sales_row = None
+
+
+@receiver(post_delete, sender=SaleItem)
+def update_sales_rollup_on_delete(sender, instance, **kwargs):
+    analytics.record_change(getattr(instance, '_sales_row', None), None)
+
+
+@receiver(post_save, sender=Drug)
+def drug_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: search.drug_saved(instance))
+
+
+@receiver(post_delete, sender=Drug)
+def drug_deleted(sender, instance, **kwargs):
+    drug_id = instance.pk
+    transaction.on_commit(lambda: search.drug_deleted(drug_id))
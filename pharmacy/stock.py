@@ -0,0 +1,269 @@
+"""
+Pharmacy stock ledger
+
+Every change to a drug's stock is a ``StockMovement`` row, and
+``Drug.quantity_in_stock`` is moved by the same amount with an
+``F('quantity_in_stock') + n`` UPDATE in the same transaction. Concurrent
+sales of one drug therefore queue on the row lock instead of overwriting
+each other's read-modify-write.
+
+Stock is also held per ``DrugBatch``: additions are received as batches and
+removals are taken from the batch that expires first (FEFO). Each drug's
+``expiry_date`` follows its earliest batch in stock, so expiry reports are
+index range scans over ``DrugBatch(expiry_date, drug)`` - see ``expiring``
+and ``stock_value``.
+
+``reconcile()`` (``manage.py reconcile_stock``) compares the counters with
+the ledger sums in one grouped query, and can reset drifted counters.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    Case, DecimalField, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Coalesce
+
+from accounts import dashboard_cache
+
+from .models import Drug, DrugBatch, StockMovement
+
+
+def record_movement(drug_id, quantity, kind, update_counter=True, **fields):
+    """Append a movement and move the drug's counter by ``quantity``
+
+    Returns the movements written - a removal spanning several batches is
+    split into one movement per batch.
+    """
+    return record_movements(
+        [StockMovement(drug_id=drug_id, kind=kind, quantity=quantity, **fields)],
+        update_counter=update_counter,
+    )
+
+
+def record_movements(movements, update_counter=True):
+    """Append several unsaved movements in a fixed number of queries
+
+    Movements are matched to batches first:
+
+    - an addition with an unsaved ``DrugBatch`` receives that batch
+    - any other addition without a batch becomes a new undated batch
+    - a removal without a batch is taken from the drug's batches in FEFO
+      order (earliest expiry first, undated last), split per batch
+
+    Then the batch quantities and the drug counters are each moved with one
+    UPDATE, the movements inserted with one INSERT, and each touched drug's
+    ``expiry_date`` reset to its earliest batch still in stock.
+    """
+    with transaction.atomic():
+        received = []
+        for movement in movements:
+            if movement.batch_id is not None or movement.quantity <= 0:
+                continue
+            batch = movement.batch or DrugBatch()
+            batch.drug_id = movement.drug_id
+            batch.quantity = batch.received_quantity = movement.quantity
+            received.append((movement, batch))
+        if received:
+            DrugBatch.objects.bulk_create([batch for _, batch in received])
+            for movement, batch in received:
+                movement.batch = batch
+        received_ids = {batch.pk for _, batch in received}
+
+        movements = allocate(movements)
+
+        batch_deltas = defaultdict(int)
+        for movement in movements:
+            if movement.batch_id is not None and movement.batch_id not in received_ids:
+                batch_deltas[movement.batch_id] += movement.quantity
+        add_deltas(DrugBatch.objects, 'quantity', batch_deltas)
+
+        if update_counter:
+            deltas = defaultdict(int)
+            for movement in movements:
+                deltas[movement.drug_id] += movement.quantity
+            add_deltas(Drug.objects, 'quantity_in_stock', deltas)
+
+        movements = StockMovement.objects.bulk_create(movements)
+        refresh_expiry({movement.drug_id for movement in movements})
+        # Counters moved with UPDATEs - no post_save for the dashboards
+        dashboard_cache.invalidate_on_commit('pharmacy.Drug')
+        return movements
+
+
+def allocate(movements):
+    """Split unbatched removals over the drugs' batches, earliest expiry first
+
+    The batches are locked with one ``select_for_update`` query. A removal
+    larger than the batches hold keeps its remainder unbatched.
+    """
+    wanted = {movement.drug_id for movement in movements if movement.batch_id is None and movement.quantity < 0}
+    if not wanted:
+        return movements
+
+    available = defaultdict(list)
+    batches = DrugBatch.objects.select_for_update().filter(drug_id__in=wanted, quantity__gt=0).order_by(
+        'drug_id', F('expiry_date').asc(nulls_last=True), 'received_at', 'id'
+    ).values_list('drug_id', 'pk', 'quantity')
+    for drug_id, batch_id, quantity in batches:
+        available[drug_id].append([batch_id, quantity])
+
+    allocated = []
+    for movement in movements:
+        if movement.batch_id is not None or movement.quantity >= 0:
+            allocated.append(movement)
+            continue
+        needed = -movement.quantity
+        for batch in available[movement.drug_id]:
+            if not needed:
+                break
+            take = min(needed, batch[1])
+            if not take:
+                continue
+            batch[1] -= take
+            needed -= take
+            allocated.append(split(movement, -take, batch[0]))
+        if needed:
+            allocated.append(split(movement, -needed, None))
+    return allocated
+
+
+def split(movement, quantity, batch_id):
+    """Copy of an unsaved movement for part of its quantity"""
+    part = StockMovement(
+        **{field.attname: getattr(movement, field.attname) for field in StockMovement._meta.concrete_fields}
+    )
+    part.quantity = quantity
+    part.batch_id = batch_id
+    return part
+
+
+def add_deltas(queryset, field, deltas):
+    """Add ``deltas`` ({pk: n}) to ``field`` with a single UPDATE"""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        queryset.filter(pk__in=deltas).update(**{
+            field: F(field) + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in deltas.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+        })
+
+
+def refresh_expiry(drug_ids):
+    """Set each drug's ``expiry_date`` to its earliest dated batch in stock
+
+    A drug with no dated stock left keeps its last expiry date.
+    """
+    if not drug_ids:
+        return
+    earliest = DrugBatch.objects.filter(
+        drug=OuterRef('pk'), quantity__gt=0, expiry_date__isnull=False
+    ).order_by('expiry_date').values('expiry_date')[:1]
+    Drug.objects.filter(pk__in=drug_ids).update(
+        expiry_date=Coalesce(Subquery(earliest), F('expiry_date'))
+    )
+
+
+def stored_line(model, pk, sign=1):
+    """(drug_id, stock effect) of a stored SaleItem/StockAdjustment, (None, 0) if new"""
+    if pk is None:
+        return None, 0
+    row = model.objects.filter(pk=pk).values_list('drug_id', 'quantity').first()
+    if row is None:
+        return None, 0
+    return row[0], sign * row[1]
+
+
+def move_line(previous, drug_id, effect, kind, batch=None, **fields):
+    """Record the difference between a line's stored and new stock effect
+
+    ``previous`` is the ``stored_line`` result; a line moved to another drug
+    gives its old effect back first. ``batch`` (an unsaved ``DrugBatch``)
+    receives the stock of a new line.
+    """
+    old_drug_id, old_effect = previous
+    if old_drug_id is not None and old_drug_id != drug_id:
+        record_movement(old_drug_id, -old_effect, kind, **fields)
+        old_effect = 0
+    if effect != old_effect:
+        record_movement(drug_id, effect - old_effect, kind, batch=batch, **fields)
+
+
+def set_level(drug_id, level, **fields):
+    """Set a drug's stock to ``level`` with a CORRECTION movement; returns it"""
+    with transaction.atomic():
+        current = Drug.objects.select_for_update().filter(pk=drug_id).values_list(
+            'quantity_in_stock', flat=True
+        ).get()
+        if level != current:
+            record_movement(drug_id, level - current, StockMovement.KIND_CORRECTION, **fields)
+    return level
+
+
+def batches_in_stock():
+    """Batches of active drugs that still hold stock"""
+    return DrugBatch.objects.filter(quantity__gt=0, drug__is_active=True)
+
+
+def expiring(start=None, end=None):
+    """Batches in stock expiring between ``start`` and ``end`` (inclusive)
+
+    A range scan on the ``(expiry_date, drug)`` index; either bound may be
+    left open.
+    """
+    batches = batches_in_stock().filter(expiry_date__isnull=False)
+    if start is not None:
+        batches = batches.filter(expiry_date__gte=start)
+    if end is not None:
+        batches = batches.filter(expiry_date__lte=end)
+    return batches.select_related('drug').order_by('expiry_date', 'drug_id')
+
+
+def batch_value(price):
+    """``quantity * price`` of a batch as a Decimal expression"""
+    return ExpressionWrapper(F('quantity') * F(price), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def stock_value(batches=None):
+    """Value of the stock on hand at cost and at selling price - one aggregate
+
+    Returns a dict with ``cost`` and ``retail``.
+    """
+    batches = batches_in_stock() if batches is None else batches
+    zero = Value(Decimal('0'), output_field=DecimalField(max_digits=14, decimal_places=2))
+    return batches.aggregate(
+        cost=Coalesce(Sum(batch_value('unit_cost')), zero),
+        retail=Coalesce(Sum(batch_value('drug__selling_price')), zero),
+    )
+
+
+def ledger_total():
+    """Sum of a drug's movements, for use in a Drug query"""
+    return Coalesce(Sum('stock_movements__quantity'), Value(0), output_field=IntegerField())
+
+
+def reconcile(fix=False):
+    """Drugs whose counter disagrees with their ledger - one grouped query
+
+    Returns a list of dicts (id, brand_name, quantity_in_stock, ledger). With
+    ``fix`` the counters are reset to the ledger sum in a single UPDATE.
+    """
+    mismatches = list(
+        Drug.objects.order_by()
+        .annotate(ledger=ledger_total())
+        .filter(~Q(quantity_in_stock=F('ledger')))
+        .values('id', 'brand_name', 'quantity_in_stock', 'ledger')
+        .order_by('brand_name')
+    )
+    if fix and mismatches:
+        ledger = StockMovement.objects.filter(drug=OuterRef('pk')).order_by().values('drug').annotate(
+            total=Sum('quantity')
+        ).values('total')
+        Drug.objects.filter(pk__in=[row['id'] for row in mismatches]).update(
+            quantity_in_stock=Coalesce(Subquery(ledger), Value(0))
+        )
+        dashboard_cache.invalidate_on_commit('pharmacy.Drug')
+    return mismatches
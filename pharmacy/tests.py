@@ -1,14 +1,31 @@
 """
 Comprehensive tests for Pharmacy module views and endpoints
 """
-from django.test import TestCase, Client
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.query import QuerySet
+from django.test import TestCase, TransactionTestCase, Client, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from decimal import Decimal
+from io import StringIO
+import csv
 import json
+import threading
+import zipfile
+from io import BytesIO
+from unittest import mock
 
-from .models import Drug, DrugCategory, PharmacySale, SaleItem, StockAdjustment
+from finance.models import Expense, Income
+from . import analytics, dispensing, forecast, purchasing, reports, search, stock
+from .checkout import CheckoutError, checkout
+from .models import (
+    DispenseCart, Drug, DrugAlias, DrugBatch, DrugCategory, DrugForecast, DrugSalesRollup, PharmacySale,
+    PurchaseInvoice, SaleItem, StockAdjustment, StockMovement,
+)
 from patients.models import Patient
 
 User = get_user_model()
@@ -335,3 +352,760 @@ class PharmacyInventoryTestCase(TestCase):
         self.drug.refresh_from_db()
         self.assertEqual(self.drug.quantity_in_stock, 0)
 
+
+
+class StockLedgerTestCase(TestCase):
+    """Test stock changes go through the StockMovement ledger"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pharmacist', password='testpass123')
+        self.drug = Drug.objects.create(
+            drug_code='LED001', generic_name='Paracetamol', brand_name='Napa',
+            form='TABLET', strength='500mg', manufacturer='Beximco',
+            quantity_in_stock=100, unit_price=Decimal('1.00'), selling_price=Decimal('2.00'),
+        )
+
+    def sell(self, quantity, drug=None):
+        sale = PharmacySale.objects.create(customer_name='Walk-in', served_by=self.user)
+        return SaleItem.objects.create(
+            sale=sale, drug=drug or self.drug, quantity=quantity, unit_price=Decimal('2.00'),
+        )
+
+    def stock(self):
+        self.drug.refresh_from_db(fields=['quantity_in_stock'])
+        return self.drug.quantity_in_stock
+
+    def test_opening_balance(self):
+        movement = StockMovement.objects.get(drug=self.drug)
+        self.assertEqual((movement.kind, movement.quantity), (StockMovement.KIND_OPENING, 100))
+
+    def test_sale_decrements_once(self):
+        item = self.sell(5)
+        self.assertEqual(self.stock(), 95)
+
+        item.save()
+        self.assertEqual(self.stock(), 95)
+
+        item.quantity = 7
+        item.save()
+        self.assertEqual(self.stock(), 93)
+        self.assertEqual(item.stock_movements.count(), 2)
+
+    def test_deleted_sale_item_returns_stock(self):
+        item = self.sell(5)
+        item.sale.delete()
+        self.assertEqual(self.stock(), 100)
+        self.assertTrue(StockMovement.objects.filter(drug=self.drug, kind=StockMovement.KIND_RETURN).exists())
+
+    def test_purchase_counted_once(self):
+        """Test the expense re-save doesn't add the purchase again"""
+        adjustment = StockAdjustment.objects.create(
+            drug=self.drug, adjustment_type='PURCHASE', quantity=50,
+            unit_cost=Decimal('1.00'), reason='Restock', adjusted_by=self.user,
+        )
+        self.assertTrue(adjustment.expense_created)
+        self.assertEqual(self.stock(), 150)
+
+    def test_stale_instance_keeps_counter(self):
+        stale = Drug.objects.get(pk=self.drug.pk)
+        self.sell(10)
+        stale.selling_price = Decimal('2.50')
+        stale.save()
+        self.assertEqual(self.stock(), 90)
+        self.assertEqual(Drug.objects.get(pk=self.drug.pk).selling_price, Decimal('2.50'))
+
+    def test_edited_level_is_a_correction(self):
+        drug = Drug.objects.get(pk=self.drug.pk)
+        drug.quantity_in_stock = 80
+        drug.save()
+        self.assertEqual(self.stock(), 80)
+        correction = StockMovement.objects.get(drug=self.drug, kind=StockMovement.KIND_CORRECTION)
+        self.assertEqual(correction.quantity, -20)
+
+    def test_reconcile(self):
+        self.sell(10)
+        self.assertEqual(stock.reconcile(), [])
+
+        Drug.objects.filter(pk=self.drug.pk).update(quantity_in_stock=7)
+        with self.assertNumQueries(1):
+            mismatches = stock.reconcile()
+        self.assertEqual([(row['quantity_in_stock'], row['ledger']) for row in mismatches], [(7, 90)])
+
+        call_command('reconcile_stock', stdout=StringIO())
+        self.assertEqual(self.stock(), 90)
+
+
+class StockLedgerConcurrencyTestCase(TransactionTestCase):
+    """Test parallel checkouts of one drug don't lose stock updates"""
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_parallel_checkouts(self):
+        drug = Drug.objects.create(
+            drug_code='LED002', generic_name='Omeprazole', brand_name='Seclo',
+            form='CAPSULE', strength='20mg', manufacturer='Square',
+            quantity_in_stock=100, unit_price=Decimal('4.00'), selling_price=Decimal('6.00'),
+        )
+        errors = []
+
+        def checkout():
+            try:
+                sale = PharmacySale.objects.create(customer_name='Walk-in')
+                SaleItem.objects.create(sale=sale, drug=Drug.objects.get(pk=drug.pk), quantity=2,
+                                        unit_price=Decimal('6.00'))
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        drug.refresh_from_db()
+        self.assertEqual(drug.quantity_in_stock, 60)
+        self.assertEqual(stock.reconcile(), [])
+
+
+class CheckoutTestCase(TestCase):
+    """Test the single-transaction checkout service"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pharmacist', password='testpass123')
+        self.drugs = [
+            Drug.objects.create(
+                drug_code=f'CHK{index:03d}', generic_name=f'Generic {index}', brand_name=f'Brand {index}',
+                form='TABLET', strength='10mg', manufacturer='Square', quantity_in_stock=50,
+                buy_price=Decimal('3.00'), unit_price=Decimal('3.00'), selling_price=Decimal('5.00'),
+            )
+            for index in range(15)
+        ]
+
+    def test_checkout(self):
+        sale = checkout(
+            [{'drug': self.drugs[0], 'quantity': 2}, {'drug': self.drugs[1].pk, 'quantity': 1, 'unit_price': '4.50'}],
+            discount='1.00', served_by=self.user, customer_name='Walk-in',
+        )
+        sale.refresh_from_db()
+        self.assertEqual(sale.subtotal, Decimal('14.50'))
+        self.assertEqual(sale.total_amount, Decimal('13.50'))
+        self.assertEqual(sale.total_profit, Decimal('5.50'))
+        self.assertEqual(sale.amount_paid, Decimal('13.50'))
+        self.assertEqual(sale.items.count(), 2)
+        self.assertTrue(Income.objects.filter(reference_number=sale.sale_number, amount=Decimal('13.50')).exists())
+
+        self.drugs[0].refresh_from_db()
+        self.assertEqual(self.drugs[0].quantity_in_stock, 48)
+        self.assertEqual(stock.reconcile(), [])
+
+    def test_constant_query_count(self):
+        """Test a 15-line sale costs the same queries as a 1-line sale"""
+        checkout([{'drug': self.drugs[0], 'quantity': 1}])  # First sale of the day seeds sequences
+
+        with CaptureQueriesContext(connection) as one_line:
+            checkout([{'drug': self.drugs[0], 'quantity': 1}])
+        with CaptureQueriesContext(connection) as fifteen_lines:
+            checkout([{'drug': drug, 'quantity': 1} for drug in self.drugs])
+        self.assertEqual(len(fifteen_lines), len(one_line))
+
+    def test_insufficient_stock(self):
+        with self.assertRaises(CheckoutError):
+            checkout([{'drug': self.drugs[0], 'quantity': 30}, {'drug': self.drugs[0], 'quantity': 30}])
+        self.assertFalse(PharmacySale.objects.exists())
+        self.drugs[0].refresh_from_db()
+        self.assertEqual(self.drugs[0].quantity_in_stock, 50)
+
+    def test_inactive_drug(self):
+        Drug.objects.filter(pk=self.drugs[0].pk).update(is_active=False)
+        with self.assertRaises(CheckoutError):
+            checkout([{'drug': self.drugs[0], 'quantity': 1}])
+
+
+class DrugBatchTestCase(TestCase):
+    """Test batch expiry tracking and first-expiry-first-out allocation"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pharmacist', password='testpass123')
+        self.today = timezone.now().date()
+        self.drug = Drug.objects.create(
+            drug_code='BAT001', generic_name='Amoxicillin', brand_name='Moxacil',
+            form='CAPSULE', strength='500mg', manufacturer='Square', quantity_in_stock=10,
+            buy_price=Decimal('4.00'), unit_price=Decimal('4.00'), selling_price=Decimal('6.00'),
+            expiry_date=self.today + timezone.timedelta(days=200),
+        )
+        self.opening = DrugBatch.objects.get(drug=self.drug)
+        self.purchase = StockAdjustment.objects.create(
+            drug=self.drug, adjustment_type='PURCHASE', quantity=20, unit_cost=Decimal('5.00'),
+            reason='Restock', batch_number='B-30', expiry_date=self.today + timezone.timedelta(days=30),
+            adjusted_by=self.user,
+        )
+        self.purchased = DrugBatch.objects.get(batch_number='B-30')
+
+    def quantities(self):
+        return [batch.quantity for batch in DrugBatch.objects.filter(pk__in=[self.opening.pk, self.purchased.pk])
+                .order_by('pk')]
+
+    def test_batches_received(self):
+        self.assertEqual((self.opening.quantity, self.opening.unit_cost), (10, Decimal('4.00')))
+        self.assertEqual((self.purchased.quantity, self.purchased.unit_cost), (20, Decimal('5.00')))
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.expiry_date, self.purchased.expiry_date)
+
+    def test_sale_takes_first_expiring_batch(self):
+        sale = checkout([{'drug': self.drug, 'quantity': 25}])
+        self.assertEqual(self.quantities(), [5, 0])
+
+        movements = StockMovement.objects.filter(sale_item__sale=sale).order_by('quantity')
+        self.assertEqual([(m.batch_id, m.quantity) for m in movements],
+                         [(self.purchased.pk, -20), (self.opening.pk, -5)])
+
+        # The calendar moves on to the batch still in stock
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.expiry_date, self.opening.expiry_date)
+
+    def test_deleted_sale_returns_to_its_batches(self):
+        sale = checkout([{'drug': self.drug, 'quantity': 25}])
+        sale.delete()
+        self.assertEqual(self.quantities(), [10, 20])
+        self.drug.refresh_from_db()
+        self.assertEqual(self.drug.quantity_in_stock, 30)
+
+    def test_expiring_and_stock_value(self):
+        with self.assertNumQueries(1):
+            soon = list(stock.expiring(self.today, self.today + timezone.timedelta(days=90)))
+        self.assertEqual(soon, [self.purchased])
+
+        with self.assertNumQueries(1):
+            value = stock.stock_value()
+        self.assertEqual(value, {'cost': Decimal('140.00'), 'retail': Decimal('180.00')})
+
+
+class StockReportTestCase(TestCase):
+    """Test the database-side stock report and its streaming export"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pharmacist', password='testpass123', role='PHARMACY')
+        self.client = Client()
+        self.client.login(username='pharmacist', password='testpass123')
+        today = timezone.now().date()
+        for index, (quantity, days) in enumerate([(0, 400), (5, -3), (50, 20), (80, 75)]):
+            Drug.objects.create(
+                drug_code=f'REP{index:03d}', generic_name=f'Generic {index}', brand_name=f'Brand {index}',
+                form='TABLET', strength='10mg', manufacturer='Square', quantity_in_stock=quantity,
+                buy_price=Decimal('2.00'), unit_price=Decimal('2.00'), selling_price=Decimal('3.00'),
+                expiry_date=today + timezone.timedelta(days=days),
+            )
+
+    def test_stock_counts(self):
+        with self.assertNumQueries(1):
+            counts = reports.stock_counts()
+        self.assertEqual(counts, {'total': 4, 'in_stock': 2, 'low_stock': 1, 'out_of_stock': 1})
+
+    def test_expiry_buckets(self):
+        with self.assertNumQueries(1):
+            buckets = reports.expiry_buckets(timezone.now().date())
+        self.assertEqual(
+            [(bucket['label'], bucket['quantity']) for bucket in buckets],
+            [('Expired', 5), ('0-30 days', 50), ('31-60 days', 0), ('61-90 days', 80)],
+        )
+        self.assertEqual(buckets[2]['value'], 0)
+        self.assertEqual(buckets[3]['value'], Decimal('160.00'))
+
+    def test_report_view(self):
+        response = self.client.get(reverse('pharmacy:stock_report'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['low_stock_count'], 1)
+        self.assertEqual(response.context['page_total_value'], Decimal('270.00'))
+        self.assertEqual(json.loads(response.context['top_drugs_labels'])[0], 'Brand 3')
+
+    def test_csv_export(self):
+        response = self.client.get(reverse('pharmacy:stock_report') + '?export=csv&stock_status=in_stock')
+        self.assertTrue(response.streaming)
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:2], ['Code', 'Brand Name'])
+        self.assertEqual([row[1] for row in rows[1:]], ['Brand 2', 'Brand 3'])
+
+    def test_xlsx_export(self):
+        response = self.client.get(reverse('pharmacy:stock_report') + '?export=excel')
+        self.assertTrue(response.streaming)
+        self.assertIn('.xlsx', response['Content-Disposition'])
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as workbook:
+            self.assertIn('xl/workbook.xml', workbook.namelist())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 5)
+        self.assertIn('<t>Brand 3</t>', sheet)
+
+
+class DrugSearchTestCase(TestCase):
+    """Test the in-memory drug search index and the autocomplete endpoint"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.napa = self.create('SRC001', 'Napa', 'Paracetamol', '500mg', 'Beximco')
+        self.ace = self.create('SRC002', 'Ace', 'Paracetamol', '120mg/5ml', 'Square', form='SYRUP')
+        self.seclo = self.create('SRC003', 'Seclo', 'Omeprazole', '20mg', 'Square', form='CAPSULE')
+        search.index.build()
+
+    def create(self, code, brand, generic, strength, manufacturer, form='TABLET'):
+        return Drug.objects.create(
+            drug_code=code, brand_name=brand, generic_name=generic, strength=strength,
+            manufacturer=manufacturer, form=form, quantity_in_stock=25,
+            unit_price=Decimal('1.00'), selling_price=Decimal('2.00'),
+        )
+
+    def names(self, query):
+        return [row['brand_name'] for row in search.search(query)]
+
+    def test_prefix_match(self):
+        self.assertEqual(self.names('nap'), ['Napa'])
+        self.assertEqual(self.names('sq'), ['Ace', 'Seclo'])
+
+    def test_brand_ranks_first(self):
+        self.create('SRC004', 'Omep', 'Omeprazole', '20mg', 'Incepta')
+        search.index.build()
+        self.assertEqual(self.names('omep'), ['Omep', 'Seclo'])
+
+    def test_typo_and_several_words(self):
+        self.assertEqual(self.names('paracitamol'), ['Ace', 'Napa'])
+        self.assertEqual(self.names('paracetamol 500'), ['Napa'])
+        self.assertEqual(self.names('xyz'), [])
+
+    def test_saved_drug_applied_incrementally(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            zimax = self.create('SRC005', 'Zimax', 'Azithromycin', '500mg', 'Square')
+        self.assertEqual([row['id'] for row in search.index.search('zimax')], [zimax.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            zimax.is_active = False
+            zimax.save()
+        self.assertEqual(search.index.search('zimax'), [])
+
+    def test_changes_from_other_processes(self):
+        Drug.objects.filter(pk=self.seclo.pk).update(brand_name='Losectil', updated_at=timezone.now())
+        self.assertEqual(self.names('losectil'), [])
+        cache.set(search.VERSION_KEY, 'changed-elsewhere')
+        self.assertEqual(self.names('losectil'), ['Losectil'])
+
+    def test_autocomplete_endpoint(self):
+        self.client.login(username='doctor', password='testpass123')
+        response = self.client.get(reverse('pharmacy:drug_autocomplete'), {'q': 'napa'})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()['results'][0]
+        self.assertEqual((result['label'], result['quantity']), ('Tab. Napa 500mg', 25))
+
+
+class ForecastTestCase(TestCase):
+    """Test the sales-velocity reorder forecast"""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.drugs = [
+            Drug.objects.create(
+                drug_code=f'FC{index:03d}', generic_name=f'Generic {index}', brand_name=f'Brand {index}',
+                form='TABLET', strength='10mg', manufacturer='Square', quantity_in_stock=stock_level,
+                unit_price=Decimal('1.00'), selling_price=Decimal('2.00'),
+            )
+            for index, stock_level in enumerate([200, 60, 50])
+        ]
+
+    def sell(self, drug, quantity, days_ago):
+        sale = checkout([{'drug': drug, 'quantity': quantity}])
+        PharmacySale.objects.filter(pk=sale.pk).update(
+            sale_date=timezone.now() - timezone.timedelta(days=days_ago)
+        )
+
+    def test_compute(self):
+        demand = [[4] * 30, [0] * 30]
+        result = forecast.compute(demand, [20, 5], lead_time=7, review_days=14)
+        self.assertEqual(result['daily_demand'].tolist(), [4.0, 0.0])
+        self.assertEqual(result['safety_stock'].tolist(), [0.0, 0.0])
+        self.assertEqual(result['reorder_point'].tolist(), [28.0, 0.0])
+        self.assertEqual(result['days_of_cover'][0], 5.0)
+        self.assertTrue(forecast.np.isnan(result['days_of_cover'][1]))
+        # Enough for lead time + review period at 4 a day
+        self.assertEqual(result['suggested_order'].tolist(), [64.0, 0.0])
+
+    def test_recent_sales_weigh_more(self):
+        steady = [[2] * 60]
+        rising = [[1] * 30 + [3] * 30]
+        self.assertGreater(forecast.compute(rising, [0])['daily_demand'][0],
+                           forecast.compute(steady, [0])['daily_demand'][0])
+
+    def test_run(self):
+        for days_ago in range(1, 11):
+            self.sell(self.drugs[0], 2, days_ago)
+            self.sell(self.drugs[1], 4, days_ago)
+
+        with self.assertNumQueries(6):
+            summary = forecast.run(today=self.today, days=30)
+        self.assertEqual((summary['drugs'], summary['to_order']), (3, 1))
+
+        busy, idle = DrugForecast.objects.get(drug=self.drugs[1]), DrugForecast.objects.get(drug=self.drugs[2])
+        self.assertGreater(busy.suggested_order, 0)
+        self.assertIsNone(idle.days_of_cover)
+        self.assertEqual(idle.suggested_order, 0)
+
+        # A second run updates the rows in place
+        Drug.objects.filter(pk=self.drugs[2].pk).update(is_active=False)
+        forecast.run(today=self.today, days=30)
+        self.assertEqual(DrugForecast.objects.count(), 2)
+
+    def test_low_stock_page_reads_forecast(self):
+        User.objects.create_user(username='pharmacist', password='testpass123')
+        self.client.login(username='pharmacist', password='testpass123')
+        computed_at = timezone.now()
+        for drug, suggested_order in zip(self.drugs[:2], [40, 0]):
+            DrugForecast.objects.create(
+                drug=drug, daily_demand=4, demand_deviation=1, safety_stock=5, reorder_point=300,
+                days_of_cover=drug.quantity_in_stock / 4, suggested_order=suggested_order, computed_at=computed_at,
+            )
+        Drug.objects.filter(pk=self.drugs[2].pk).update(reorder_level=100)
+
+        response = self.client.get(reverse('pharmacy:low_stock_alert'))
+        self.assertEqual(response.status_code, 200)
+        # Well above its static reorder level, but selling out within the lead time
+        self.assertEqual([row.drug for row in response.context['forecasts']], [self.drugs[0]])
+        self.assertEqual(list(response.context['unforecast']), [self.drugs[2]])
+        self.assertContains(response, '<span class="badge bg-primary">40</span>', html=True)
+
+
+class PurchaseInvoiceTestCase(TestCase):
+    """Test receiving a supplier invoice in one transaction"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='pharmacist', password='testpass123')
+        self.client = Client()
+        self.client.login(username='pharmacist', password='testpass123')
+        self.today = timezone.localdate()
+        self.drugs = [
+            Drug.objects.create(
+                drug_code=f'PUR{index:03d}', generic_name=f'Generic {index}', brand_name=f'Brand {index}',
+                form='TABLET', strength='10mg', manufacturer='Square', quantity_in_stock=10,
+                buy_price=Decimal('2.00'), unit_price=Decimal('2.00'), selling_price=Decimal('3.00'),
+            )
+            for index in range(50)
+        ]
+
+    def lines(self, drugs, quantity=10):
+        return [{'drug': drug, 'quantity': quantity, 'unit_cost': '2.50'} for drug in drugs]
+
+    def test_receive(self):
+        expiry = self.today + timezone.timedelta(days=400)
+        invoice = purchasing.receive(
+            [{'drug': self.drugs[0].pk, 'quantity': 20, 'unit_cost': '2.50', 'batch_number': 'L1',
+              'expiry_date': expiry.isoformat()},
+             {'drug_code': 'PUR001', 'quantity': 5, 'unit_cost': '4.00'}],
+            supplier='Acme Pharma', invoice_number='INV-1', received_by=self.user,
+        )
+        self.assertEqual(invoice.total_amount, Decimal('70.00'))
+        self.assertEqual(invoice.lines.count(), 2)
+
+        # One expense for the whole invoice
+        expense = Expense.objects.get()
+        self.assertEqual((expense.amount, expense.invoice_number), (Decimal('70.00'), 'INV-1'))
+        self.assertEqual(invoice.expense, expense)
+
+        self.drugs[0].refresh_from_db()
+        self.assertEqual(self.drugs[0].quantity_in_stock, 30)
+        batch = DrugBatch.objects.get(batch_number='L1')
+        self.assertEqual((batch.quantity, batch.expiry_date, batch.unit_cost), (20, expiry, Decimal('2.50')))
+        self.assertEqual(stock.reconcile(), [])
+
+    def test_constant_query_count(self):
+        """Test a 50-line invoice costs the same queries as a 1-line invoice"""
+        # First expense of the day seeds the sequence and rollup rows
+        purchasing.receive(self.lines(self.drugs[:1]), supplier='Acme Pharma', invoice_number='INV-0')
+
+        with CaptureQueriesContext(connection) as one_line:
+            purchasing.receive(self.lines(self.drugs[:1]), supplier='Acme Pharma', invoice_number='INV-1')
+        with CaptureQueriesContext(connection) as fifty_lines:
+            purchasing.receive(self.lines(self.drugs), supplier='Acme Pharma', invoice_number='INV-2')
+        self.assertEqual(len(fifty_lines), len(one_line))
+
+        self.drugs[1].refresh_from_db()
+        self.assertEqual(self.drugs[1].quantity_in_stock, 20)
+        self.assertEqual(Expense.objects.count(), 3)
+
+    def test_rejected_invoices(self):
+        purchasing.receive(self.lines(self.drugs[:1]), supplier='Acme Pharma', invoice_number='INV-1')
+        with self.assertRaises(purchasing.PurchaseError):
+            purchasing.receive(self.lines(self.drugs[:1]), supplier='Acme Pharma', invoice_number='INV-1')
+        with self.assertRaises(purchasing.PurchaseError):
+            purchasing.receive([{'drug_code': 'NOPE', 'quantity': 1, 'unit_cost': 1}], supplier='Acme Pharma')
+        with self.assertRaises(purchasing.PurchaseError):
+            purchasing.receive(self.lines(self.drugs[:1], quantity=0), supplier='Acme Pharma')
+
+        self.assertEqual(PurchaseInvoice.objects.count(), 1)
+        self.drugs[0].refresh_from_db()
+        self.assertEqual(self.drugs[0].quantity_in_stock, 20)
+
+    def test_concurrent_duplicate_invoice(self):
+        """Test an invoice received meanwhile fails as a duplicate, not with the constraint"""
+        purchasing.receive(self.lines(self.drugs[:1]), supplier='Acme Pharma', invoice_number='INV-1')
+        exists = QuerySet.exists
+        checks = []
+
+        def racing(queryset):
+            # The duplicate check runs before the other submission commits
+            checks.append(queryset)
+            return False if len(checks) == 1 else exists(queryset)
+
+        with mock.patch.object(QuerySet, 'exists', racing):
+            with self.assertRaisesMessage(purchasing.PurchaseError, 'already received'):
+                purchasing.receive(self.lines(self.drugs[:1]), supplier='Acme Pharma', invoice_number='INV-1')
+        self.assertEqual(PurchaseInvoice.objects.count(), 1)
+        self.assertEqual(Expense.objects.count(), 1)
+
+    def test_parse_csv(self):
+        upload = BytesIO(
+            b'\xef\xbb\xbfdrug_code,quantity,unit_cost,batch_number,expiry_date\r\n'
+            b'PUR000,12,2.50,L1,2030-01-31\r\n'
+            b',,,,\r\n'
+            b'PUR001,3,1.00,,\r\n'
+        )
+        lines = purchasing.parse_csv(upload)
+        self.assertEqual([line['drug_code'] for line in lines], ['PUR000', 'PUR001'])
+        self.assertEqual(lines[0]['expiry_date'], timezone.datetime(2030, 1, 31).date())
+        self.assertIsNone(lines[1]['expiry_date'])
+
+        with self.assertRaises(purchasing.PurchaseError):
+            purchasing.parse_csv(BytesIO(b'drug_code,quantity\r\nPUR000,1\r\n'))
+
+    def test_upload_view(self):
+        upload = BytesIO(b'drug_code,quantity,unit_cost\r\nPUR000,12,2.50\r\nPUR001,3,1.00\r\n')
+        upload.name = 'invoice.csv'
+        response = self.client.post(reverse('pharmacy:purchase_invoice_create'), {
+            'supplier': 'Acme Pharma', 'invoice_number': 'INV-9', 'invoice_date': self.today.isoformat(),
+            'lines_csv': upload,
+        })
+        invoice = PurchaseInvoice.objects.get()
+        self.assertRedirects(response, reverse('pharmacy:purchase_invoice_detail', args=[invoice.pk]))
+        self.assertEqual(invoice.total_amount, Decimal('33.00'))
+
+        response = self.client.get(reverse('pharmacy:purchase_invoice_detail', args=[invoice.pk]))
+        self.assertContains(response, 'INV-9')
+
+    def test_form_view(self):
+        response = self.client.get(reverse('pharmacy:purchase_invoice_create'))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(reverse('pharmacy:purchase_invoice_create'), {
+            'supplier': 'Acme Pharma',
+            'drug[]': [self.drugs[0].pk, ''], 'quantity[]': ['4', ''], 'unit_cost[]': ['2.00', ''],
+            'batch_number[]': ['', ''], 'expiry_date[]': ['', ''],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.drugs[0].refresh_from_db()
+        self.assertEqual(self.drugs[0].quantity_in_stock, 14)
+
+        # Errors are shown on the form, nothing is received
+        response = self.client.post(reverse('pharmacy:purchase_invoice_create'), {'supplier': 'Acme Pharma'})
+        self.assertContains(response, 'The invoice has no lines')
+
+
+class DispensingTestCase(TestCase):
+    """Test matching prescribed medicines to drugs and dispensing the cart"""
+
+    def setUp(self):
+        from datetime import date
+        from appointments.models import Appointment
+
+        cache.clear()
+        search.index = search.DrugSearchIndex()
+        self.doctor = User.objects.create_user(username='doctor', password='testpass123', role='DOCTOR')
+        self.user = User.objects.create_user(username='pharmacist', password='testpass123')
+        self.client = Client()
+        self.client.login(username='pharmacist', password='testpass123')
+        self.patient = Patient.objects.create(
+            first_name='Rahim', last_name='Uddin', date_of_birth=date(1990, 1, 1),
+            gender='M', phone='01700000001', address='Nazipur', city='Nazipur',
+            emergency_contact_name='', emergency_contact_phone='', emergency_contact_relation='',
+        )
+        self.appointment = Appointment.objects.create(
+            patient=self.patient, doctor=self.doctor, appointment_date=timezone.localdate(),
+        )
+        self.napa = Drug.objects.create(
+            drug_code='NAP500', generic_name='Paracetamol', brand_name='Napa', form='TABLET', strength='500mg',
+            manufacturer='Beximco', quantity_in_stock=100, buy_price=Decimal('0.80'), unit_price=Decimal('0.80'),
+            selling_price=Decimal('1.00'),
+        )
+        self.ace = Drug.objects.create(
+            drug_code='ACE500', generic_name='Paracetamol', brand_name='Ace', form='TABLET', strength='500mg',
+            manufacturer='Square', quantity_in_stock=100, buy_price=Decimal('0.80'), unit_price=Decimal('0.80'),
+            selling_price=Decimal('1.10'),
+        )
+        self.syrup = Drug.objects.create(
+            drug_code='NAPSYP', generic_name='Paracetamol', brand_name='Napa', form='SYRUP', strength='120mg',
+            manufacturer='Beximco', quantity_in_stock=10, buy_price=Decimal('30.00'), unit_price=Decimal('30.00'),
+            selling_price=Decimal('35.00'),
+        )
+
+    def prescribe(self, *medicines):
+        from appointments.models import Medicine, Prescription
+
+        prescription = Prescription.objects.create(
+            appointment=self.appointment, patient=self.patient, doctor=self.doctor, diagnosis='Fever',
+        )
+        for name, dosage, frequency, duration in medicines:
+            Medicine.objects.create(
+                prescription=prescription, medicine_name=name, dosage=dosage, frequency=frequency, duration=duration,
+            )
+        return prescription
+
+    def test_parsing(self):
+        from appointments.models import Medicine
+
+        self.assertEqual(dispensing.lookup_key(Medicine(medicine_name='Tab. Napa', dosage='500 mg')), 'napa 500mg')
+        self.assertEqual(dispensing.daily_doses('1+0+1'), 2)
+        self.assertEqual(dispensing.daily_doses('1 - 1 - 1'), 3)
+        self.assertEqual(dispensing.daily_doses('BD'), 2)
+        self.assertEqual(dispensing.daily_doses(''), 1)
+        self.assertEqual(dispensing.duration_days('7 days'), 7)
+        self.assertEqual(dispensing.duration_days('2 weeks'), 14)
+        self.assertIsNone(dispensing.duration_days('continue'))
+
+    def test_build_cart(self):
+        prescription = self.prescribe(
+            ('Tab. Napa', '500mg', '1+0+1', '5 days'),
+            ('Syp. Napa', '120mg', '1+1+1', '3 days'),
+            ('Xyzzy', '', '', ''),
+        )
+        cart = dispensing.build_cart(prescription.pk)
+        self.assertEqual((cart.matched_lines, cart.total_lines), (2, 3))
+
+        tablet, syrup, unknown = cart.lines.all()
+        self.assertEqual((tablet.drug, tablet.quantity, tablet.match), (self.napa, 10, 'FUZZY'))
+        self.assertEqual((syrup.drug, syrup.quantity), (self.syrup, 1))
+        self.assertEqual((unknown.drug, unknown.match), (None, 'NONE'))
+
+    def test_dispense_learns_the_choice(self):
+        prescription = self.prescribe(('Tab. Napa', '500mg', '1+0+1', '5 days'))
+        medicine = prescription.medicines.get()
+        sale = dispensing.dispense(prescription, {medicine.pk: (self.ace.pk, 6)}, served_by=self.user)
+
+        self.assertEqual((sale.prescription, sale.total_amount), (prescription, Decimal('6.60')))
+        self.ace.refresh_from_db()
+        self.assertEqual(self.ace.quantity_in_stock, 94)
+        self.assertEqual(DispenseCart.objects.get(pk=prescription.pk).status, 'DISPENSED')
+        with self.assertRaises(CheckoutError):
+            dispensing.dispense(prescription, served_by=self.user)
+
+        # The next prescription for the same medicine resolves to the learned drug
+        line = dispensing.build_cart(self.prescribe(('TAB NAPA', '500 mg', 'BD', '7 days')).pk).lines.get()
+        self.assertEqual((line.drug, line.quantity, line.match), (self.ace, 14, 'ALIAS'))
+        self.assertEqual(DrugAlias.objects.get(text='napa 500mg').hits, 1)
+
+    def test_cart_for_rebuilds_stale_carts(self):
+        from appointments.models import Medicine
+
+        prescription = self.prescribe(('Napa', '500mg', '1+0+1', '5 days'))
+        dispensing.build_cart(prescription.pk)
+        Medicine.objects.create(prescription=prescription, medicine_name='Ace', dosage='500mg')
+        self.assertEqual(dispensing.cart_for(prescription).total_lines, 2)
+
+    def test_views(self):
+        prescription = self.prescribe(('Tab. Napa', '500mg', '1+0+1', '5 days'))
+        medicine = prescription.medicines.get()
+        dispensing.build_cart(prescription.pk)
+
+        response = self.client.get(reverse('pharmacy:prescription_list'))
+        self.assertContains(response, '1/1 matched')
+
+        url = reverse('pharmacy:prescription_process', args=[prescription.pk])
+        response = self.client.get(url)
+        self.assertContains(response, 'Napa 500mg')
+
+        response = self.client.post(url, {
+            f'dispense_{medicine.pk}': '1', f'drug_{medicine.pk}': self.napa.pk, f'quantity_{medicine.pk}': '10',
+            'payment_method': 'CASH', 'discount': '0',
+        })
+        self.assertRedirects(response, reverse('pharmacy:prescription_list'))
+        self.napa.refresh_from_db()
+        self.assertEqual(self.napa.quantity_in_stock, 90)
+
+        response = self.client.post(reverse('pharmacy:prescription_dispense', args=[prescription.pk]))
+        self.assertEqual(response.status_code, 400)
+
+
+class SalesAnalyticsTestCase(TestCase):
+    """Test the per-day sales cube follows sales and answers the profit reports"""
+
+    def setUp(self):
+        self.today = timezone.localdate()
+        self.analgesic = DrugCategory.objects.create(name='Analgesic')
+        self.antibiotic = DrugCategory.objects.create(name='Antibiotic')
+        self.napa = self.drug('NAP', 'Napa', self.analgesic, buy='0.80', sell='1.00')
+        self.moxacil = self.drug('MOX', 'Moxacil', self.antibiotic, buy='4.00', sell='6.00')
+        self.idle = self.drug('IDL', 'Idle', self.antibiotic, buy='10.00', sell='12.00')
+
+    def drug(self, code, name, category, buy, sell):
+        return Drug.objects.create(
+            drug_code=code, generic_name=name, brand_name=name, category=category, form='TABLET',
+            strength='500mg', manufacturer='Square', quantity_in_stock=100,
+            buy_price=Decimal(buy), unit_price=Decimal(buy), selling_price=Decimal(sell),
+        )
+
+    def assertMatchesRebuild(self):
+        """Incremental rows must equal a full recompute"""
+        fields = ('date', 'drug_id', 'category_id', 'units', 'revenue', 'cost', 'profit', 'lines')
+        incremental = set(DrugSalesRollup.objects.filter(lines__gt=0).values_list(*fields))
+        analytics.rebuild()
+        self.assertEqual(incremental, set(DrugSalesRollup.objects.values_list(*fields)))
+
+    def test_checkout_adds_to_cube(self):
+        checkout([{'drug': self.napa, 'quantity': 10}, {'drug': self.moxacil, 'quantity': 2}])
+        checkout([{'drug': self.napa, 'quantity': 5}])
+
+        napa = DrugSalesRollup.objects.get(drug=self.napa, date=self.today)
+        self.assertEqual((napa.units, napa.revenue, napa.cost, napa.profit, napa.lines),
+                         (15, Decimal('15.00'), Decimal('12.00'), Decimal('3.00'), 2))
+        self.assertEqual(napa.category, self.analgesic)
+        self.assertMatchesRebuild()
+
+    def test_line_edits_and_deletes(self):
+        sale = checkout([{'drug': self.napa, 'quantity': 10}])
+        item = SaleItem.objects.create(sale=sale, drug=self.moxacil, quantity=3, unit_price=Decimal('6.00'))
+        item.quantity = 4
+        item.save()
+        self.assertEqual(DrugSalesRollup.objects.get(drug=self.moxacil).units, 4)
+        self.assertMatchesRebuild()
+
+        sale.delete()
+        self.assertFalse(DrugSalesRollup.objects.filter(lines__gt=0).exists())
+
+    def test_reports(self):
+        checkout([{'drug': self.napa, 'quantity': 60}, {'drug': self.moxacil, 'quantity': 5}])
+
+        with self.assertNumQueries(1):
+            top = analytics.top_drugs(self.today, self.today)
+        self.assertEqual([(row['drug'], row['profit']) for row in top],
+                         [(self.napa.pk, Decimal('12')), (self.moxacil.pk, Decimal('10'))])
+        self.assertEqual(top[1]['margin'], Decimal('33.3'))
+
+        with self.assertNumQueries(1):
+            trend = analytics.category_margins(self.today, self.today, period='day')
+        self.assertEqual([(row['category__name'], row['margin']) for row in trend],
+                         [('Analgesic', Decimal('20.0')), ('Antibiotic', Decimal('33.3'))])
+
+        with self.assertNumQueries(1):
+            slow = analytics.slow_movers(days=30, today=self.today)
+        self.assertEqual([(drug, drug.units_sold) for drug in slow][0], (self.idle, 0))
+
+        totals = analytics.totals(self.today, self.today)
+        self.assertEqual((totals['units'], totals['profit']), (65, Decimal('22.00')))
+
+    def test_rebuild_command(self):
+        sale = checkout([{'drug': self.napa, 'quantity': 10}])
+        # Moving a sale with QuerySet.update bypasses the cube
+        PharmacySale.objects.filter(pk=sale.pk).update(sale_date=timezone.now() - timezone.timedelta(days=3))
+
+        out = StringIO()
+        call_command('rebuild_pharmacy_analytics', '--check', stdout=out)
+        self.assertIn('2 mismatching day(s)', out.getvalue())
+
+        call_command('rebuild_pharmacy_analytics', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_pharmacy_analytics', '--check', stdout=out)
+        self.assertIn('Cube matches sale lines', out.getvalue())
@@ -11,6 +11,7 @@ urlpatterns = [
     # Drug Management
     path('drugs/', views.DrugListView.as_view(), name='drug_list'),
     path('drugs/create/', views.DrugCreateView.as_view(), name='drug_create'),
+    path('drugs/autocomplete/', views.drug_autocomplete, name='drug_autocomplete'),
     path('drugs/<int:pk>/', views.drug_detail, name='drug_detail'),
     path('drugs/<int:pk>/update/', views.DrugUpdateView.as_view(), name='drug_update'),
     path('drugs/<int:pk>/edit/', views.DrugUpdateView.as_view(), name='drug_edit'),
@@ -22,7 +23,9 @@ urlpatterns = [
     path('stock-adjust/', views.stock_adjust, name='stock_adjust'),
     path('stock-adjust-history/', views.stock_adjust_history, name='stock_adjust_history'),
     path('inventory/', views.stock_report, name='inventory_report'),
-    path('low-stock/', views.stock_report, name='low_stock_alert'),
+    path('low-stock/', views.low_stock_alert, name='low_stock_alert'),
+    path('purchase-invoices/new/', views.purchase_invoice_create, name='purchase_invoice_create'),
+    path('purchase-invoice/<int:pk>/', views.purchase_invoice_detail, name='purchase_invoice_detail'),
     
     # Prescription Processing
     path('prescriptions/', views.prescription_list, name='prescription_list'),
@@ -2,17 +2,22 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from django.db.models import Sum, Count, Q, F
+from django.db import transaction
+from django.db.models import Sum, Count, Q, F, DecimalField, ExpressionWrapper
 from django.utils import timezone
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.generic import ListView, CreateView, UpdateView, DetailView
 from django.urls import reverse_lazy
 from datetime import timedelta, datetime
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
 import json
 
-from .models import Drug, DrugCategory, PharmacySale
+from . import dispensing, purchasing, reports, search, stock
+from .checkout import CheckoutError
+from .models import Drug, DrugCategory, DrugForecast, PharmacySale, PurchaseInvoice, StockMovement
 from appointments.models import Prescription
+from diagcenter.instrumentation import query_budget
+from diagcenter.pagination import keyset_page
 from patients.models import Patient
 
 
@@ -28,14 +33,10 @@ class DrugListView(LoginRequiredMixin, ListView):
     def get_queryset(self):
         queryset = Drug.objects.select_related('category').filter(is_active=True)
         
-        # Search
-        search = self.request.GET.get('search')
-        if search:
-            queryset = queryset.filter(
-                Q(brand_name__icontains=search) |
-                Q(generic_name__icontains=search) |
-                Q(drug_code__icontains=search)
-            )
+        # Search - through the in-memory index rather than icontains scans
+        query = self.request.GET.get('search')
+        if query:
+            queryset = queryset.filter(pk__in=search.matching_ids(query))
         
         # Filter by category
         category = self.request.GET.get('category')
@@ -140,6 +141,36 @@ def drug_detail(request, pk):
     return JsonResponse(data)
 
 
+@login_required
+@query_budget(5)
+def drug_autocomplete(request):
+    """Ranked drug suggestions for ``?q=`` as JSON, with current stock"""
+    try:
+        limit = min(int(request.GET.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    results = search.search(request.GET.get('q', ''), limit)
+    # Stock moves too often to live in the index - read it fresh by pk
+    in_stock = dict(
+        Drug.objects.filter(pk__in=[row['id'] for row in results]).values_list('pk', 'quantity_in_stock')
+    ) if results else {}
+    return JsonResponse({
+        'results': [
+            {
+                'id': row['id'],
+                'label': row['label'],
+                'brand_name': row['brand_name'],
+                'generic_name': row['generic_name'],
+                'strength': row['strength'],
+                'form': row['form'],
+                'price': float(row['selling_price']),
+                'quantity': in_stock.get(row['id'], 0),
+            }
+            for row in results
+        ]
+    })
+
+
 @login_required
 def drug_adjust_stock(request, pk):
     """Adjust drug stock"""
@@ -151,16 +182,22 @@ def drug_adjust_stock(request, pk):
         quantity = int(data.get('quantity', 0))
         reason = data.get('reason', '')
         
+        # Recorded in the stock ledger as corrections
+        note = reason[:200]
         if adjust_type == 'add':
-            drug.quantity_in_stock += quantity
+            stock.record_movement(
+                drug.pk, quantity, StockMovement.KIND_CORRECTION, note=note, created_by=request.user
+            )
         elif adjust_type == 'reduce':
-            drug.quantity_in_stock = max(0, drug.quantity_in_stock - quantity)
+            with transaction.atomic():
+                current = Drug.objects.select_for_update().values_list(
+                    'quantity_in_stock', flat=True
+                ).get(pk=drug.pk)
+                stock.set_level(drug.pk, max(0, current - quantity), note=note, created_by=request.user)
         elif adjust_type == 'set':
-            drug.quantity_in_stock = quantity
+            stock.set_level(drug.pk, quantity, note=note, created_by=request.user)
         
-        drug.save()
-        
-        # Log the adjustment (you could create a StockAdjustment model)
+        drug.refresh_from_db(fields=['quantity_in_stock'])
         messages.success(request, f'Stock adjusted for {drug.brand_name}')
         return JsonResponse({'status': 'success', 'new_quantity': drug.quantity_in_stock})
     
@@ -171,95 +208,62 @@ def drug_adjust_stock(request, pk):
 
 @login_required
 def stock_report(request):
-    """Comprehensive stock report"""
-    # Get all active drugs
-    drugs = Drug.objects.filter(is_active=True).select_related('category')
+    """Comprehensive stock report; ``?export=csv|excel`` streams the filtered rows"""
+    drugs = reports.filter_drugs(request.GET)
     
-    # Apply filters
-    search = request.GET.get('search')
-    if search:
-        drugs = drugs.filter(
-            Q(brand_name__icontains=search) |
-            Q(generic_name__icontains=search)
+    export = reports.EXPORT_FORMATS.get(request.GET.get('export'))
+    if export:
+        stream, content_type, extension = export
+        response = StreamingHttpResponse(stream(reports.export_rows(drugs)), content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="stock-report-{timezone.localdate():%Y%m%d}.{extension}"'
         )
-    
-    category = request.GET.get('category')
-    if category:
-        drugs = drugs.filter(category__name=category)
-    
-    stock_status = request.GET.get('stock_status')
-    if stock_status == 'low_stock':
-        drugs = drugs.filter(quantity_in_stock__lte=F('reorder_level'), quantity_in_stock__gt=0)
-    elif stock_status == 'out_of_stock':
-        drugs = drugs.filter(quantity_in_stock=0)
-    elif stock_status == 'in_stock':
-        drugs = drugs.filter(quantity_in_stock__gt=F('reorder_level'))
+        return response
     
     # Statistics
-    all_drugs = Drug.objects.filter(is_active=True)
-    total_drugs = all_drugs.count()
-    in_stock_count = all_drugs.filter(quantity_in_stock__gt=F('reorder_level')).count()
-    low_stock_count = all_drugs.filter(
-        quantity_in_stock__gt=0,
-        quantity_in_stock__lte=F('reorder_level')
-    ).count()
-    out_of_stock_count = all_drugs.filter(quantity_in_stock=0).count()
+    counts = reports.stock_counts()
     
-    # Calculate values
-    total_inventory_value = sum(
-        drug.quantity_in_stock * drug.unit_price
-        for drug in all_drugs
-    )
-    potential_revenue = sum(
-        drug.quantity_in_stock * drug.selling_price
-        for drug in all_drugs
-    )
+    # Values of the stock on hand, from the batches
+    values = stock.stock_value()
+    total_inventory_value = values['cost']
+    potential_revenue = values['retail']
     profit_margin = potential_revenue - total_inventory_value
     profit_percentage = (profit_margin / total_inventory_value * 100) if total_inventory_value > 0 else 0
     
-    # Expiry alerts
+    # Expiry alerts - range scans over the batch expiry index
     today = timezone.now().date()
     three_months_later = today + timedelta(days=90)
     
-    expired_drugs = all_drugs.filter(expiry_date__lt=today)
-    expiring_soon = all_drugs.filter(expiry_date__gte=today, expiry_date__lte=three_months_later)
-    
-    # Annotate days to expiry
-    for drug in expiring_soon:
-        drug.days_to_expiry = (drug.expiry_date - today).days
-    
-    # Top drugs by value
-    drugs_with_value = list(all_drugs)
-    for drug in drugs_with_value:
-        drug.stock_value = drug.quantity_in_stock * drug.unit_price
-    
-    drugs_with_value.sort(key=lambda x: x.stock_value, reverse=True)
-    top_10_drugs = drugs_with_value[:10]
+    expired_drugs = stock.expiring(end=today - timedelta(days=1))
+    expiring_soon = stock.expiring(today, three_months_later)
     
     # Chart data
-    top_drugs_labels = [drug.brand_name[:20] for drug in top_10_drugs]
-    top_drugs_values = [float(drug.stock_value) for drug in top_10_drugs]
+    top_10_drugs = reports.top_drugs_by_value(10)
+    top_drugs_labels = [name[:20] for name, _ in top_10_drugs]
+    top_drugs_values = [float(value) for _, value in top_10_drugs]
     
     # Page total value
-    page_total_value = sum(drug.quantity_in_stock * drug.unit_price for drug in drugs)
+    page_total_value = drugs.aggregate(total=Sum('stock_value'))['total'] or 0
     
     context = {
-        'drugs': drugs,
-        'total_drugs': total_drugs,
-        'in_stock_count': in_stock_count,
-        'low_stock_count': low_stock_count,
-        'out_of_stock_count': out_of_stock_count,
+        'drugs': drugs.select_related('category'),
+        'total_drugs': counts['total'],
+        'in_stock_count': counts['in_stock'],
+        'low_stock_count': counts['low_stock'],
+        'out_of_stock_count': counts['out_of_stock'],
         'total_inventory_value': total_inventory_value,
         'potential_revenue': potential_revenue,
         'profit_margin': profit_margin,
         'profit_percentage': profit_percentage,
         'expired_drugs': expired_drugs,
         'expiring_soon': expiring_soon,
+        'expiry_buckets': reports.expiry_buckets(today),
         'categories': DrugCategory.objects.all().values_list('name', flat=True).distinct(),
         'top_drugs_labels': json.dumps(top_drugs_labels),
         'top_drugs_values': json.dumps(top_drugs_values),
         'page_total_value': page_total_value,
         'today': today,
+        'generated_at': timezone.now(),
     }
     
     return render(request, 'pharmacy/stock_report.html', context)
@@ -269,48 +273,77 @@ def stock_report(request):
 
 @login_required
 def prescription_process(request, pk):
-    """Process prescription and dispense medicines"""
-    prescription = get_object_or_404(Prescription, pk=pk)
+    """Dispense a prescription from its precomputed cart"""
+    prescription = get_object_or_404(Prescription.objects.select_related('patient', 'doctor'), pk=pk)
+    cart = dispensing.cart_for(prescription)
     
     if request.method == 'POST':
-        # Process dispensing
-        messages.success(request, 'Prescription processed successfully!')
-        return redirect('pharmacy:prescription_list')
+        choices = {}
+        for line in cart.lines.all():
+            if request.POST.get(f'dispense_{line.medicine_id}'):
+                choices[line.medicine_id] = (
+                    request.POST.get(f'drug_{line.medicine_id}'),
+                    request.POST.get(f'quantity_{line.medicine_id}') or 0,
+                )
+        try:
+            sale = dispensing.dispense(
+                prescription, choices, served_by=request.user,
+                discount=request.POST.get('discount') or 0,
+                payment_method=request.POST.get('payment_method', 'CASH'),
+                notes=request.POST.get('pharmacy_notes', ''),
+            )
+        except (ValueError, InvalidOperation) as exc:
+            # CheckoutError, or a quantity/discount that isn't a number
+            messages.error(request, str(exc))
+        else:
+            messages.success(request, f'Prescription dispensed: {sale.sale_number}, total {sale.total_amount}')
+            return redirect('pharmacy:prescription_list')
+    
+    lines = list(cart.lines.select_related('medicine'))
+    drugs = Drug.objects.filter(
+        pk__in={drug_id for line in lines for drug_id in [line.drug_id, *line.candidates] if drug_id}
+    ).in_bulk()
+    for line in lines:
+        line.options = [drugs[drug_id] for drug_id in [line.drug_id, *line.candidates] if drug_id in drugs]
     
     context = {
         'prescription': prescription,
-        'patient': prescription.appointment.patient,
-        'available_drugs': Drug.objects.filter(is_active=True, quantity_in_stock__gt=0),
+        'patient': prescription.patient,
+        'cart': cart,
+        'lines': lines,
+        'payment_methods': PharmacySale.PAYMENT_METHOD_CHOICES,
     }
     return render(request, 'pharmacy/prescription_process.html', context)
 
 
 @login_required
 def prescription_list(request):
-    """List prescriptions to be filled"""
-    prescriptions = Prescription.objects.select_related(
-        'appointment__patient', 'appointment__doctor'
-    ).order_by('-appointment__scheduled_time')[:50]
+    """Prescriptions to be filled, with their carts"""
+    prescriptions = Prescription.objects.select_related('patient', 'dispense_cart').only(
+        'prescription_number', 'created_at', 'patient__first_name', 'patient__last_name',
+        'dispense_cart__status', 'dispense_cart__matched_lines', 'dispense_cart__total_lines',
+    )
+    page = keyset_page(prescriptions, ('-created_at', '-id'), request, per_page=50)
     
     return render(request, 'pharmacy/prescription_list.html', {
-        'prescriptions': prescriptions
+        'prescriptions': page,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
     })
 
 
 @login_required
 def prescription_dispense(request, pk):
-    """Mark prescription as dispensed - AJAX endpoint"""
+    """Dispense a prescription's cart as matched - AJAX endpoint"""
     if request.method == 'POST':
-        prescription = get_object_or_404(Prescription, pk=pk)
-        
-        # Update prescription status if model has status field
-        # prescription.status = 'DISPENSED'
-        # prescription.dispensed_at = timezone.now()
-        # prescription.dispensed_by = request.user
-        # prescription.save()
+        prescription = get_object_or_404(Prescription.objects.select_related('patient'), pk=pk)
+        try:
+            sale = dispensing.dispense(prescription, served_by=request.user)
+        except CheckoutError as exc:
+            return JsonResponse({'status': 'error', 'message': str(exc)}, status=400)
         
         messages.success(request, f'Prescription dispensed successfully!')
-        return JsonResponse({'status': 'success'})
+        return JsonResponse({'status': 'success', 'sale_number': sale.sale_number})
     return JsonResponse({'status': 'error'}, status=400)
 
 
@@ -449,6 +482,7 @@ def quick_adjust_modal(request, pk):
             reason=reason,
             adjusted_by=request.user,
         )
+        drug.refresh_from_db(fields=['quantity_in_stock'])
         
         return JsonResponse({
             'status': 'success',
@@ -457,6 +491,63 @@ def quick_adjust_modal(request, pk):
     return JsonResponse({'status': 'error'}, status=400)
 
 
+# ========== PURCHASE INVOICES ==========
+
+@login_required
+def purchase_invoice_create(request):
+    """Receive a supplier invoice - lines entered in the form or uploaded as CSV"""
+    if request.method == 'POST':
+        upload = request.FILES.get('lines_csv')
+        try:
+            if upload:
+                lines = purchasing.parse_csv(upload)
+            else:
+                lines = [
+                    {'drug': drug, 'quantity': quantity, 'unit_cost': unit_cost,
+                     'batch_number': batch_number, 'expiry_date': expiry_date}
+                    for drug, quantity, unit_cost, batch_number, expiry_date in zip(
+                        request.POST.getlist('drug[]'),
+                        request.POST.getlist('quantity[]'),
+                        request.POST.getlist('unit_cost[]'),
+                        request.POST.getlist('batch_number[]'),
+                        request.POST.getlist('expiry_date[]'),
+                    )
+                    if drug
+                ]
+            invoice = purchasing.receive(
+                lines,
+                supplier=request.POST.get('supplier', ''),
+                invoice_number=request.POST.get('invoice_number', '').strip(),
+                invoice_date=request.POST.get('invoice_date') or None,
+                received_by=request.user,
+                notes=request.POST.get('notes', ''),
+            )
+        except purchasing.PurchaseError as exc:
+            messages.error(request, str(exc))
+        else:
+            messages.success(
+                request, f'Invoice received: {invoice.lines.count()} lines, total {invoice.total_amount}'
+            )
+            return redirect('pharmacy:purchase_invoice_detail', pk=invoice.pk)
+
+    drugs = Drug.objects.filter(is_active=True).order_by('brand_name').values('id', 'brand_name', 'strength', 'buy_price')
+    return render(request, 'pharmacy/purchase_invoice_form.html', {
+        'drugs': drugs,
+        'csv_columns': purchasing.CSV_COLUMNS,
+        'today': timezone.localdate(),
+    })
+
+
+@login_required
+def purchase_invoice_detail(request, pk):
+    """A received invoice and its lines"""
+    invoice = get_object_or_404(PurchaseInvoice.objects.select_related('expense', 'received_by'), pk=pk)
+    lines = invoice.lines.select_related('drug').annotate(
+        amount=ExpressionWrapper(F('quantity') * F('unit_cost'), output_field=DecimalField())
+    ).order_by('pk')
+    return render(request, 'pharmacy/purchase_invoice_detail.html', {'invoice': invoice, 'lines': lines})
+
+
 # ========== PHARMACY DASHBOARD ==========
 
 @login_required
@@ -471,11 +562,7 @@ def pharmacy_dashboard(request):
             is_active=True
         ).count(),
         'out_of_stock': Drug.objects.filter(quantity_in_stock=0, is_active=True).count(),
-        'expiring_soon': Drug.objects.filter(
-            expiry_date__lte=today + timedelta(days=90),
-            expiry_date__gte=today,
-            is_active=True
-        ).count(),
+        'expiring_soon': stock.expiring(today, today + timedelta(days=90)).order_by().values('drug').distinct().count(),
     }
     return render(request, 'accounts/pharmacy_dashboard.html', context)
 
@@ -503,9 +590,17 @@ def drug_detail(request, pk):
 
 @login_required
 def sale_list(request):
-    """List pharmacy sales"""
-    sales = PharmacySale.objects.all().order_by('-sale_date')
-    return render(request, 'pharmacy/sale_list.html', {'sales': sales})
+    """List pharmacy sales, newest first - keyset paged"""
+    sales = PharmacySale.objects.select_related('patient').only(
+        'sale_number', 'sale_date', 'total_amount', 'payment_method', 'customer_name',
+        'patient__first_name', 'patient__last_name',
+    )
+    page = keyset_page(sales, ('-sale_date', '-id'), request)
+    return render(request, 'pharmacy/sale_list.html', {
+        'sales': page,
+        'page_obj': page,
+        'is_paginated': page.has_other_pages(),
+    })
 
 @login_required
 def sale_create(request):
@@ -530,6 +625,18 @@ def inventory_report(request):
 
 @login_required
 def low_stock_alert(request):
-    """Low stock alerts"""
-    low_stock = Drug.objects.filter(quantity_in_stock__lte=F('reorder_level'))
-    return render(request, 'pharmacy/low_stock_alert.html', {'drugs': low_stock})
+    """Low stock alerts from the nightly sales forecast (forecast_reorders)
+    
+    Drugs the forecast says to reorder, fewest days of cover first; drugs
+    without a forecast yet fall back to the static ``reorder_level``.
+    """
+    forecasts = DrugForecast.objects.filter(
+        suggested_order__gt=0, drug__is_active=True
+    ).select_related('drug', 'drug__category')
+    unforecast = Drug.objects.filter(
+        is_active=True, forecast__isnull=True, quantity_in_stock__lte=F('reorder_level')
+    ).select_related('category').order_by('quantity_in_stock')
+    return render(request, 'pharmacy/low_stock_alert.html', {
+        'forecasts': forecasts,
+        'unforecast': unforecast,
+    })
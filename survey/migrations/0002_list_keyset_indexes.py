@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0001_initial'),
+        ('survey', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feedbacksurvey',
+            index=models.Index(fields=['submitted_at', 'id'], name='feedback_submitted_id'),
+        ),
+    ]
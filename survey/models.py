@@ -75,18 +75,11 @@ class CanteenSale(models.Model):
     def save(self, *args, **kwargs):
         if not self.sale_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_sale = CanteenSale.objects.filter(
-                sale_number__startswith=f'CNT{date_str}'
-            ).order_by('sale_number').last()
-            
-            if last_sale:
-                last_number = int(last_sale.sale_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.sale_number = f'CNT{date_str}{new_number:04d}'
+            self.sale_number = next_document_number(
+                CanteenSale, 'sale_number', f'CNT{date_str}'
+            )
         
         super().save(*args, **kwargs)
     
@@ -156,6 +149,10 @@ class FeedbackSurvey(models.Model):
     
     class Meta:
         ordering = ['-submitted_at']
+        indexes = [
+            # Keyset pages of the feedback list (diagcenter.pagination)
+            models.Index(fields=['submitted_at', 'id'], name='feedback_submitted_id'),
+        ]
         verbose_name_plural = "Feedback Surveys"
     
     def __str__(self):
@@ -164,18 +161,11 @@ class FeedbackSurvey(models.Model):
     def save(self, *args, **kwargs):
         if not self.survey_number:
             from django.utils import timezone
+            from accounts.sequences import next_document_number
             date_str = timezone.now().strftime('%Y%m%d')
-            last_survey = FeedbackSurvey.objects.filter(
-                survey_number__startswith=f'SUR{date_str}'
-            ).order_by('survey_number').last()
-            
-            if last_survey:
-                last_number = int(last_survey.survey_number[-4:])
-                new_number = last_number + 1
-            else:
-                new_number = 1
-            
-            self.survey_number = f'SUR{date_str}{new_number:04d}'
+            self.survey_number = next_document_number(
+                FeedbackSurvey, 'survey_number', f'SUR{date_str}'
+            )
         
         super().save(*args, **kwargs)
     
@@ -14,6 +14,7 @@ from .models import (
     FeedbackSurvey, Announcement
 )
 from patients.models import Patient
+from diagcenter.pagination import KeysetPaginationMixin
 
 
 # ========== CANTEEN VIEWS ==========
@@ -221,12 +222,13 @@ def canteen_item_detail(request, pk):
 
 # ========== FEEDBACK/SURVEY VIEWS ==========
 
-class FeedbackListView(LoginRequiredMixin, ListView):
+class FeedbackListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """List all feedback surveys"""
     model = FeedbackSurvey
     template_name = 'survey/feedback_list.html'
     context_object_name = 'feedbacks'
     paginate_by = 20
+    keyset = ('-submitted_at', '-id')
     
     def get_queryset(self):
         queryset = FeedbackSurvey.objects.select_related('patient')
@@ -241,7 +243,7 @@ class FeedbackListView(LoginRequiredMixin, ListView):
         if date_from:
             queryset = queryset.filter(submitted_at__date__gte=date_from)
         
-        return queryset.order_by('-submitted_at')
+        return queryset
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)